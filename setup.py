@@ -97,9 +97,12 @@ setup(name=PACKAGE_NAME,
       package_data={PACKAGE_NAME: [
             'backend_plugins/gnucash_backend_BOKEEP_BACKEND_PLUGIN',
             'backend_plugins/gnucash_backend_config.glade',
+            'backend_plugins/multiplex_backend_BOKEEP_BACKEND_PLUGIN',
             'backend_plugins/null_BOKEEP_BACKEND_PLUGIN',
             'backend_plugins/serialfile_BOKEEP_BACKEND_PLUGIN',
             'backend_plugins/serialfile_backend_config.glade',
+            'backend_plugins/sqlite_backend_BOKEEP_BACKEND_PLUGIN',
+            'backend_plugins/sqlite_backend_config.glade',
             'gui/bokeep_main_window.glade',
             'gui/bo-keep.svg',
             'plugins/memberfee/memberfee.glade',
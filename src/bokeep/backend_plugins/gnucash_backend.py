@@ -22,38 +22,59 @@
 from decimal import Decimal 
 from datetime import date
 from glob import glob
-from os import remove, kill, system, name
-from os.path import exists
-from signal import SIGTERM
-from time import sleep
+from os.path import exists, getmtime, getsize, splitext
+from time import sleep, time
+from sqlite3 import connect as sqlite3_connect, Error as SQLite3Error
 
 # bokeep imports
 from plugin import BoKeepBackendException, \
     BoKeepBackendResetException
+from robust_backend_plugin import \
+    BackendTransactionMismatch, MISSING_TRANSACTION_MISMATCH
 from session_based_robust_backend_plugin import \
     SessionBasedRobustBackendPlugin
 from bokeep.util import attribute_or_blank
-from bokeep.gtkutil import gtk_error_message
+from bokeep.gtkutil import gtk_error_message, gtk_yes_no_dialog
 from bokeep.backend_plugins.gnucash_backend_config import GnuCashConfigDialog
 
 # gnucash imports
 from gnucash import Session, Split, GncNumeric, GUID, Transaction, \
     GnuCashBackendException, Account
 from gnucash.gnucash_core_c import \
-        ERR_FILEIO_BACKUP_ERROR, \
+        ERR_FILEIO_BACKUP_ERROR, ERR_BACKEND_LOCKED, \
         string_to_guid, \
         guid_to_string # NOTE, this is deprecated and non thread safe
                        # it is probably a very bad idea to be using this
+try:
+    # newer python bindings open sessions in a mode
+    from gnucash import SessionOpenMode
+    SESSION_BREAK_LOCK = SessionOpenMode.SESSION_BREAK_LOCK
+except ImportError:
+    # older ones do the same thing with ignore_lock=True
+    SESSION_BREAK_LOCK = None
+try:
+    from gnucash.gnucash_core_c import qof_event_suspend, qof_event_resume
+except ImportError:
+    # not wrapped by every version of the python bindings, bulk loads
+    # just go without
+    qof_event_suspend = qof_event_resume = None
 # gtk imports
 from gtk import \
     RESPONSE_OK, RESPONSE_CANCEL, ListStore, \
     FILE_CHOOSER_ACTION_OPEN, FileChooserDialog, Dialog, Entry, \
     STOCK_CANCEL, STOCK_OPEN, STOCK_OK, DIALOG_MODAL, EntryCompletion, \
-    ComboBoxEntry, MessageDialog, MESSAGE_QUESTION, Button, VBox
+    ComboBoxEntry
 
 SQLITE3 = 'sqlite3'
 XML = 'xml'
 PROTOCOL_SUFFIX = '://'
+FILE_PROTOCOLS = (XML, SQLITE3)
+# what every sqlite 3 database file starts with
+SQLITE3_FILE_HEADER = 'SQLite format 3\0'
+
+# see GnuCash.get_session_error_code
+(SESSION_ERROR_NONE, SESSION_ERROR_NO_FILE, SESSION_ERROR_WAITING_FOR_LOCK,
+ SESSION_ERROR_OTHER) = range(4)
 
 # there should be some fairly serrious unit testing for this
 def gnc_numeric_from_decimal(decimal_value):
@@ -115,7 +136,40 @@ def account_from_path(gnucash_book, top_account, account_path,
     else:
         return account
 
-def get_account_from_trans_line(gnucash_book, trans_line):
+def account_from_path_cached(gnucash_book, account_path, account_cache,
+                             create_account_if_missing=False):
+    """Same as account_from_path starting from the root account, but
+    accounts already found (or created) are remembered in account_cache,
+    a dict keyed by account path tuple, and so are the ones found (or
+    created) along the way. Only the part of the path past the longest
+    prefix in the cache is looked up.
+    """
+    if not isinstance(account_path, tuple):
+        raise BoKeepBackendException(
+            "account %s is not a tuple" % str(account_path) )
+    if account_path in account_cache:
+        return account_cache[account_path]
+    for known_len in xrange(len(account_path)-1, 0, -1):
+        if account_path[:known_len] in account_cache:
+            account = account_cache[account_path[:known_len]]
+            break
+    else:
+        known_len = 0
+        account = gnucash_book.get_root_account()
+    # one level at a time, so every account along the way gets cached
+    for i in xrange(known_len, len(account_path)):
+        account = account_from_path(
+            gnucash_book, account, account_path[i:i+1], account_path,
+            create_account_if_missing)
+        account_cache[account_path[:i+1]] = account
+    return account
+
+def get_account_from_trans_line(gnucash_book, trans_line,
+                                account_cache=None):
+    """Look up (or create, see create_account_if_missing in
+    bokeep.book_transaction) the account for the account_spec of trans_line,
+    with account_from_path_cached if an account_cache is provided.
+    """
     if not hasattr(trans_line, "account_spec"):
         raise BoKeepBackendException("the gnucash backend needs the "
                                      "optional attribute account_spec "
@@ -124,12 +178,16 @@ def get_account_from_trans_line(gnucash_book, trans_line):
     create_account_if_missing = (
         False if not hasattr(trans_line, 'create_account_if_missing')
         else trans_line.create_account_if_missing )
-        
+
+    if account_cache != None:
+        return account_from_path_cached(
+            gnucash_book, trans_line.account_spec, account_cache,
+            create_account_if_missing)
     return account_from_path(gnucash_book, gnucash_book.get_root_account(),
                              trans_line.account_spec,
                              create_account_if_missing=create_account_if_missing)
 
-def make_new_split(book, amount, account, trans, currency):
+def check_split_amount_account_and_currency(amount, account, currency):
     # the fraction tests used to be !=, but it was realized that
     # there isn't a reason to be concerned if the amount denominator is
     # smaller or equal to the currency fraction,
@@ -162,7 +220,64 @@ def make_new_split(book, amount, account, trans, currency):
             currency.get_namespace() != account_commodity.get_namespace():
         raise BoKeepBackendException(
             "transaction currency and account don't match")
-    
+
+def decimal_from_gnc_numeric(numeric):
+    return Decimal(numeric.num()) / Decimal(numeric.denom())
+
+def account_path_of_account(account):
+    """The account_spec style tuple of account names from the top level
+    down to account
+    """
+    path = []
+    parent = account.get_parent()
+    # the root account is the one without a parent
+    while parent != None and parent.get_instance() != None:
+        path.insert(0, account.GetName())
+        account = parent
+        parent = account.get_parent()
+    return tuple(path)
+
+def date_of_gnucash_transaction(trans):
+    return date.fromtimestamp(trans.GetDate())
+
+def gnucash_transaction_mismatches(trans, fin_trans):
+    """A list of BackendTransactionMismatch for each way the gnucash
+    Transaction trans differs from what create_backend_transaction would
+    have made from fin_trans
+    """
+    mismatches = []
+    def check(attribute, expected, found):
+        if expected != found:
+            mismatches.append(
+                BackendTransactionMismatch(attribute, expected, found) )
+
+    check('description', attribute_or_blank(fin_trans, "description"),
+          trans.GetDescription() )
+    check('chequenum', str(attribute_or_blank(fin_trans, "chequenum")),
+          trans.GetNum() )
+    check('currency',
+          fin_trans.currency if hasattr(fin_trans, "currency") else "CAD",
+          trans.GetCurrency().get_mnemonic() )
+    trans_date = attribute_or_blank(fin_trans, "trans_date")
+    if not isinstance(trans_date, str):
+        if hasattr(trans_date, 'date'): # a datetime
+            trans_date = trans_date.date()
+        check('trans_date', trans_date, date_of_gnucash_transaction(trans))
+
+    # splits are compared without regard to order, gnucash doesn't
+    # promise to keep them in the order they were added
+    check('lines',
+          sorted( (trans_line.account_spec, trans_line.amount,
+                   attribute_or_blank(trans_line, "line_memo") )
+                  for trans_line in fin_trans.lines ),
+          sorted( (account_path_of_account(split.GetAccount()),
+                   decimal_from_gnc_numeric(split.GetValue()),
+                   split.GetMemo() )
+                  for split in trans.GetSplitList() ) )
+    return mismatches
+
+def make_new_split(book, amount, account, trans, currency):
+    check_split_amount_account_and_currency(amount, account, currency)
     return_value = Split(book)
     return_value.SetValue(amount)
     return_value.SetAmount(amount)
@@ -188,28 +303,332 @@ def call_catch_qofbackend_exception_reraise_important(call_me):
         else:
             break # break while
 
+def gnucash_url_protocol(gnucash_url):
+    """The part of a gnucash url before ://, e.g. xml or sqlite3, or
+    None if there isn't one
+    """
+    if gnucash_url == None or PROTOCOL_SUFFIX not in gnucash_url:
+        return None
+    return gnucash_url.split(PROTOCOL_SUFFIX, 1)[0]
+
+def gnucash_file_path_from_url(gnucash_url):
+    """The file system path in a xml:// or sqlite3:// url, None for
+    anything else
+    """
+    if gnucash_url_protocol(gnucash_url) not in FILE_PROTOCOLS:
+        return None
+    return gnucash_url.split(PROTOCOL_SUFFIX, 1)[1]
+
+def gnucash_file_is_sqlite3(file_path):
+    try:
+        f = open(file_path, 'rb')
+    except IOError:
+        return False
+    try:
+        return f.read(len(SQLITE3_FILE_HEADER)) == SQLITE3_FILE_HEADER
+    finally:
+        f.close()
+
+def gnucash_url_for_file(file_path):
+    """A sqlite3:// url if file_path is a sqlite3 database, xml:// otherwise
+    """
+    if gnucash_file_is_sqlite3(file_path):
+        protocol = SQLITE3
+    else:
+        protocol = XML
+    return protocol + PROTOCOL_SUFFIX + file_path
+
+def gnucash_book_is_locked(gnucash_url):
+    """True if gnucash (or anything else using the gnucash libraries) has
+    the book at gnucash_url open. This only knows how to check xml and
+    sqlite3 books, anything else is reported as unlocked.
+    """
+    file_path = gnucash_file_path_from_url(gnucash_url)
+    if file_path == None or not exists(file_path):
+        return False
+    if gnucash_url_protocol(gnucash_url) == XML:
+        return exists(file_path + '.LCK')
+    # sql books keep thier lock in the gnclock table
+    try:
+        con = sqlite3_connect(file_path)
+        try:
+            return con.execute("SELECT count(*) FROM gnclock").fetchone()[0]>0
+        finally:
+            con.close()
+    except SQLite3Error:
+        # no gnclock table (or trouble reading), opening the session
+        # will tell us if there's a real problem
+        return False
+
+def open_gnucash_session_breaking_lock(gnucash_url):
+    """Opens the book at gnucash_url, taking the lock from whoever has it"""
+    if SESSION_BREAK_LOCK != None:
+        return Session(gnucash_url, SESSION_BREAK_LOCK)
+    return Session(gnucash_url, ignore_lock=True)
+
+def sqlite3_file_path_for_xml_file(xml_file_path):
+    """Where convert_gnucash_xml_to_sqlite3 should put the sqlite3 version of
+    xml_file_path if you don't have a better idea
+    """
+    return splitext(xml_file_path)[0] + '.sqlite3.gnucash'
+
+def convert_gnucash_xml_to_sqlite3(xml_file_path, sqlite3_file_path):
+    """Writes a copy of the gnucash xml book at xml_file_path to a new
+    sqlite3 book at sqlite3_file_path.
+
+    Everything in the book, including the GUIDs of transactions (which
+    the GnuCash backend plugin uses to identify them) comes along, so a
+    GnuCash backend plugin can just be pointed at the new one.
+
+    The xml book must not be open elsewhere, a GnuCashBackendException is
+    raised if it is or sqlite3_file_path already exists.
+    """
+    if exists(sqlite3_file_path):
+        raise GnuCashBackendException(
+            "%s already exists" % sqlite3_file_path, [] )
+    xml_session = Session(XML + PROTOCOL_SUFFIX + xml_file_path,
+                          is_new=False)
+    try:
+        sqlite3_session = Session(SQLITE3 + PROTOCOL_SUFFIX + sqlite3_file_path,
+                                  is_new=True)
+        try:
+            sqlite3_session.swap_data(xml_session)
+            # a new sql book has to be saved in full once, after that
+            # changes are written as they're made
+            sqlite3_session.save()
+            # give the xml session its book back before ending it
+            sqlite3_session.swap_data(xml_session)
+        finally:
+            sqlite3_session.end()
+            sqlite3_session.destroy()
+    finally:
+        xml_session.end()
+        xml_session.destroy()
+
 class GnuCash(SessionBasedRobustBackendPlugin):
+    # accounts and currencies are looked up once per session and remembered
+    # after that, there's no need to ever turn this off except to measure
+    # the difference, see tests/benchmark_gnucash_lookups.py
+    use_lookup_caches = True
+
+    # see SessionBasedRobustBackendPlugin, opening a gnucash file means
+    # loading the whole thing, so we hang on to it between flushes, but
+    # not so long that the user can't get at it with gnucash
+    session_idle_timeout = 5*60
+    session_max_hold_time = 60*60
+
+    # seconds to wait before each try at opening a book someone else has
+    # locked, the last one is used from then on
+    lock_retry_backoff = (5, 15, 30, 60, 2*60, 5*60)
+
+    # flush_backend() goes into bulk load mode (see begin_bulk_load) on its
+    # own when there are at least this many dirty transactions
+    bulk_load_threshold = 1000
+
     def __init__(self):
         SessionBasedRobustBackendPlugin.__init__(self)
         self.gnucash_file = None
         self.current_session_error = None
+        self.current_session_error_code = SESSION_ERROR_NONE
 
     def can_write(self):
         return SessionBasedRobustBackendPlugin.can_write(self) and \
             self.current_session_error == None
 
+    def get_gnucash_file_path(self):
+        """The file system path of gnucash_file, None if there isn't
+        a file set or it's not a file based (xml or sqlite3) url
+        """
+        return gnucash_file_path_from_url(self.gnucash_file)
+
+    def get_gnucash_protocol(self):
+        return gnucash_url_protocol(self.gnucash_file)
+
+    def uses_sql_backend(self):
+        """True when gnucash_file is a sql (sqlite3) book, which gnucash
+        writes to one object at a time as they're changed instead of all at
+        once on save
+        """
+        return self.get_gnucash_protocol() == SQLITE3
+
+    def session_resource_signature(self):
+        path = self.get_gnucash_file_path()
+        if path == None or not exists(path):
+            return None
+        return (getmtime(path), getsize(path))
+
+    def __lookup_backend_transaction(self, backend_ident):
+        guid = GUID()
+        result = string_to_guid(backend_ident, guid.get_instance())
+        assert(result)
+        return guid.TransLookup(self._v_session_active.book)
+
+    def __lookup_currency(self, fin_trans):
+        mnemonic = (fin_trans.currency if hasattr(fin_trans, "currency")
+                    else "CAD")
+        if self.use_lookup_caches and mnemonic in self.__currency_cache():
+            return self.__currency_cache()[mnemonic]
+        commod_table = self._v_session_active.book.get_table()
+        currency = commod_table.lookup("ISO4217", mnemonic)
+        if self.use_lookup_caches:
+            self.__currency_cache()[mnemonic] = currency
+        return currency
+
+    def __lookup_account(self, trans_line):
+        return get_account_from_trans_line(
+            self._v_session_active.book, trans_line,
+            self.__account_cache() if self.use_lookup_caches else None )
+
+    # The caches are only good for the session they were filled from,
+    # drop_lookup_caches() is called whenever a session is opened or ends
+    def __account_cache(self):
+        if not hasattr(self, '_v_account_cache'):
+            self._v_account_cache = {}
+        return self._v_account_cache
+
+    def __currency_cache(self):
+        if not hasattr(self, '_v_currency_cache'):
+            self._v_currency_cache = {}
+        return self._v_currency_cache
+
+    def drop_lookup_caches(self):
+        for attr in ('_v_account_cache', '_v_currency_cache'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
     def remove_backend_transaction(self, backend_ident):
         assert( self.can_write() )
         if self.can_write():
-            guid = GUID()
-            result = string_to_guid(backend_ident, guid.get_instance())
-            assert(result)
-            trans = guid.TransLookup(self._v_session_active.book)
+            trans = self.__lookup_backend_transaction(backend_ident)
             trans.Destroy()
 
-    # this should be overridden with code that actually does a comparision
-    #def verify_backend_transaction(self, backend_ident):
-    #    return True
+    def can_update_backend_transactions(self):
+        return True
+
+    def update_backend_transaction(self, backend_ident, old_fin_trans,
+                                   new_fin_trans):
+        assert( self.can_write() )
+        trans = self.__lookup_backend_transaction(backend_ident)
+        if trans == None or trans.get_instance() == None:
+            raise BoKeepBackendException(
+                "transaction %s to be updated isn't in the gnucash book" %
+                backend_ident )
+
+        currency = self.__lookup_currency(new_fin_trans)
+        # look everything up and check it before touching the transaction,
+        # that way there's nothing to undo when there's a problem
+        # fetching an account, a currency mismatch with an account,
+        # or currency precisions mismatching
+        amounts_and_accounts = []
+        for trans_line in new_fin_trans.lines:
+            amount = get_amount_from_trans_line(trans_line)
+            account = self.__lookup_account(trans_line)
+            check_split_amount_account_and_currency(amount, account, currency)
+            amounts_and_accounts.append( (amount, account) )
+
+        trans.BeginEdit()
+        # re-use the existing splits as far as they go, add new ones
+        # if there are more lines than before and get rid of the extras
+        # if there are fewer
+        old_splits = trans.GetSplitList()
+        for i, (amount, account) in enumerate(amounts_and_accounts):
+            if i < len(old_splits):
+                split_line = old_splits[i]
+            else:
+                split_line = Split(self._v_session_active.book)
+                split_line.SetParent(trans)
+            split_line.SetValue(amount)
+            split_line.SetAmount(amount)
+            split_line.SetAccount(account)
+            split_line.SetMemo( attribute_or_blank(new_fin_trans.lines[i],
+                                                   "line_memo" ) )
+        for split_line in old_splits[len(amounts_and_accounts):]:
+            split_line.Destroy()
+
+        trans.SetCurrency(currency)
+
+        if trans.GetImbalanceValue().num() != 0:
+            trans.RollbackEdit() # undo what we have done
+            raise BoKeepBackendException(
+                "transaction doesn't balance")
+
+        trans.SetDescription(
+            attribute_or_blank(new_fin_trans, "description") )
+        trans.SetNum(
+            str( attribute_or_blank(new_fin_trans, "chequenum") ) )
+        trans_date = attribute_or_blank(new_fin_trans, "trans_date")
+        if not isinstance(trans_date, str):
+            trans.SetDatePostedTS(trans_date)
+        trans.CommitEdit()
+
+    def verify_backend_transaction(self, backend_ident, fin_trans):
+        return len(self.find_backend_transaction_mismatches(
+                backend_ident, fin_trans) ) == 0
+
+    def find_backend_transaction_mismatches(self, backend_ident, fin_trans):
+        if not self.can_write():
+            raise BoKeepBackendException(
+                "gnucash transaction can't be checked without a session")
+        trans = self.__lookup_backend_transaction(backend_ident)
+        if trans == None or trans.get_instance() == None:
+            return [ BackendTransactionMismatch(
+                    MISSING_TRANSACTION_MISMATCH, backend_ident, None) ]
+        return gnucash_transaction_mismatches(trans, fin_trans)
+
+    def bulk_loading(self):
+        return hasattr(self, '_v_bulk_load_defers_saves')
+
+    def begin_bulk_load(self, defer_saves=True):
+        """Until end_bulk_load, transactions are created in batches and
+        gnucash (QOF) events are suspended. With defer_saves, save() waits
+        for end_bulk_load.
+        """
+        if self.bulk_loading():
+            return
+        self._v_bulk_load_defers_saves = defer_saves
+        self._v_bulk_load_save_needed = False
+        self._v_bulk_load_lost = False
+        if qof_event_suspend != None:
+            qof_event_suspend()
+
+    def end_bulk_load(self, successful=True):
+        if not self.bulk_loading():
+            return
+        if qof_event_resume != None:
+            qof_event_resume()
+        save_needed = self._v_bulk_load_save_needed
+        lost = self._v_bulk_load_lost
+        for attr in ('_v_bulk_load_defers_saves', '_v_bulk_load_save_needed',
+                     '_v_bulk_load_lost'):
+            delattr(self, attr)
+        if not successful:
+            # the caller is undoing what was done, so whatever didn't get
+            # saved shouldn't be either
+            if save_needed:
+                self.close('reset because a bulk load failed')
+        elif lost:
+            raise BoKeepBackendResetException(
+                "the gnucash session ended during a bulk load before it "
+                "could be saved")
+        elif save_needed:
+            self.save()
+
+    def flush_backend(self, max_items=None, time_budget=None):
+        self.ensure_transaction_containers()
+        if max_items == None and time_budget == None and \
+                not self.bulk_loading() and \
+                len(self.dirty_transaction_set) >= self.bulk_load_threshold:
+            # flush_backend saves once at the end anyway
+            self.begin_bulk_load(defer_saves=False)
+            try:
+                return SessionBasedRobustBackendPlugin.flush_backend(self)
+            finally:
+                self.end_bulk_load()
+        return SessionBasedRobustBackendPlugin.flush_backend(
+            self, max_items, time_budget)
+
+    def can_batch_backend_transactions(self):
+        return self.bulk_loading()
 
     def create_backend_transaction(self, fin_trans):
         description = attribute_or_blank(fin_trans, "description")
@@ -219,11 +638,7 @@ class GnuCash(SessionBasedRobustBackendPlugin):
         trans = Transaction(self._v_session_active.book)
         trans.BeginEdit()
         
-        commod_table = self._v_session_active.book.get_table()
-        if hasattr(fin_trans, "currency"):
-            currency = commod_table.lookup("ISO4217", fin_trans.currency)
-        else:
-            currency = commod_table.lookup("ISO4217","CAD")
+        currency = self.__lookup_currency(fin_trans)
 
         # create a list of GnuCash splits, set the amount, account,
         # and parent them with the Transaction
@@ -233,9 +648,7 @@ class GnuCash(SessionBasedRobustBackendPlugin):
                 lines.append( make_new_split(
                         self._v_session_active.book,
                         get_amount_from_trans_line(trans_line),
-                        get_account_from_trans_line(
-                            self._v_session_active.book,
-                            trans_line ),
+                        self.__lookup_account(trans_line),
                         trans,
                         currency ) )
             # catch problems fetching the account, currency mismatch
@@ -295,106 +708,129 @@ class GnuCash(SessionBasedRobustBackendPlugin):
         # by checking for this and refusing right away to open the
         # session, we no longer rely on Session.save() later to tell
         # us that None is a stupid value
+        self.drop_lookup_caches()
         if self.gnucash_file == None:
-            self.current_session_error = "no gnucash file selected"
+            self.__set_session_error(SESSION_ERROR_NO_FILE,
+                                     "no gnucash file selected")
             return None
         
-        # If the GnuCash books are locked...
-        gnucash_lock = self.gnucash_file[6:] + '.LCK'
-        if exists(gnucash_lock):
-            if name == 'posix':
-                # Attempt to get GnuCash's process ID.
-                pid_file = '/tmp/gnucashpid'
-                system('pidof gnucash > ' + pid_file)
-                f = open(pid_file, 'r')
-                line = f.readline()
-                # If there are multiple GnuCash instances, "pidof gnucash" will
-                # return something like "9000 9001".
-                multiple_gnucash_instances = line.find(' ') >= 0
-                if line == '' or multiple_gnucash_instances:
-                    pid = 0
-                else: # If there's exactly one instance of GnuCash running...
-                    pid = int(line)
-                f.close()
-                remove(pid_file)
-                
-                if pid == 0:
-                    OTHER_PROGRAM = 'another accounting program'
-                    OTHER_PROGRAM2 = 'the other accounting program'
-                    DANGEROUS_OPTION = 'Risk corruption of the accounting ' + \
-                        'resource by having BoKeep use it in parallel!'
-                else:
-                    OTHER_PROGRAM = 'GnuCash'
-                    OTHER_PROGRAM2 = OTHER_PROGRAM
-                    DANGEROUS_OPTION = 'Terminating GnuCash and lose its ' + \
-                                       'unsaved changes!'
-                    
-                md = MessageDialog(type = MESSAGE_QUESTION,
-                    message_format = "BoKeep is waiting to save double " +
-                    "entry accounting transactions because " + OTHER_PROGRAM +
-                    " is busy with the accounting " +
-                    "resource.  It's unsafe for two programs to work " +
-                    "with the accounting resource in parallel!  " +
-                    "How do you wish to proceed?")
-                
-                # Add some response buttons in the standard way,
-                # which also sets up non-obtrusive signals.
-                save_later_button = Button(
-                    "I've closed " + OTHER_PROGRAM2 + " or wish to " +
-                    "have BoKeep update the accounting resource later.")
-                RESPONSE_SAVE_LATER = 1
-                md.add_action_widget(save_later_button, RESPONSE_SAVE_LATER)
-                save_now_button = Button(DANGEROUS_OPTION)
-                RESPONSE_SAVE_NOW = 2
-                md.add_action_widget(save_now_button, RESPONSE_SAVE_NOW)
-                
-                # Reparent the buttons to a vbox so that their layout is
-                # vertical instead of the standard horizontal.
-                # (Horizontal action buttons aren't suited to the complexity of
-                # the user's response.  Sure the response could first be
-                # summarised in the above paragraph and the user provided Yes/No
-                # buttons, but that's more lingually complicated for the user
-                # and the situation demands a clear understanding.)
-                vbox = VBox()
-                SPACING_BETWEEN_BUTTONS = 8
-                vbox.set_spacing(SPACING_BETWEEN_BUTTONS)
-                md.action_area.pack_start(vbox)
-                save_later_button.reparent(vbox)
-                save_now_button.reparent(vbox)
-                
-                md.show_all()
-                r = md.run()
-                md.destroy()
-                if r == RESPONSE_SAVE_NOW:
-                    if pid != 0:
-                        # As of GnuCash 2.4.6, GnuCash seems to not handle
-                        # signals so it can't be expected to save changes upon
-                        # exit.
-                        kill(pid, SIGTERM)
-                    
-                    # As of GnuCash 2.4.6, GnuCash doesn't remove locks
-                    # when terminated by signal.
-                    remove(gnucash_lock)
+        # someone else (e.g. gnucash on someone's desktop) has the book,
+        # we'll wait for them without doing anything that blocks, the dirty
+        # transactions stay dirty until we get in. see seconds_until_retry()
+        # Unless we've been told to break the lock, (see break_lock())
+        # that's only tried once
+        break_lock = self.lock_break_requested()
+        if break_lock:
+            self.break_lock_requested = False
+        elif self.__lock_retry_pending():
+            return None
+        elif gnucash_book_is_locked(self.gnucash_file):
+            self.__lock_found()
+            return None
 
         # but this try/except is fine for other bogus values
         # of self.gnucash_file/book_uri
         try:
-            session = Session(self.gnucash_file, is_new=False)
-            self.current_session_error = None
+            if break_lock:
+                session = open_gnucash_session_breaking_lock(
+                    self.gnucash_file)
+            else:
+                session = Session(self.gnucash_file, is_new=False)
         except GnuCashBackendException, e:
-            session = None
-            self.current_session_error = str(e)
+            # locked in a way gnucash_book_is_locked couldn't tell
+            if ERR_BACKEND_LOCKED in e.errors:
+                self.__lock_found()
+            else:
+                self.__set_session_error(SESSION_ERROR_OTHER, str(e))
+            return None
+        self.__set_session_error(SESSION_ERROR_NONE, None)
+        self.__lock_gone()
         return session
 
+    def __set_session_error(self, error_code, error_msg):
+        self.current_session_error_code = error_code
+        self.current_session_error = error_msg
+
+    def get_session_error_code(self):
+        """One of the SESSION_ERROR_ constants, SESSION_ERROR_NONE if the
+        last attempt to open or save the gnucash book went fine, and
+        SESSION_ERROR_WAITING_FOR_LOCK while someone else has it
+        """
+        # plugins from before there were error codes only have the message
+        return getattr(self, 'current_session_error_code',
+                       SESSION_ERROR_NONE if self.current_session_error == None
+                       else SESSION_ERROR_OTHER )
+
+    def waiting_for_lock(self):
+        return self.get_session_error_code() == SESSION_ERROR_WAITING_FOR_LOCK
+
+    def break_lock(self):
+        """Have the next attempt at opening the book (the next flush) take
+        the lock from whoever has it instead of waiting for them, for when
+        that's a gnucash that crashed and left its lock behind. Nothing is
+        opened here, so this doesn't block and is fine to call from the
+        gui while the BackendChangeThread does the flushing.
+        """
+        self.break_lock_requested = True
+        # try right away instead of waiting for the next retry
+        self.__lock_gone()
+
+    def lock_break_requested(self):
+        # plugins from before break_lock() don't have the attribute
+        return getattr(self, 'break_lock_requested', False)
+
+    def __lock_found(self):
+        self.__set_session_error(
+            SESSION_ERROR_WAITING_FOR_LOCK,
+            "waiting for %s to be unlocked, another program is using it" %
+            self.gnucash_file )
+        retry_count = getattr(self, '_v_lock_retry_count', 0)
+        self._v_next_lock_retry_time = time() + self.lock_retry_backoff[
+            min(retry_count, len(self.lock_retry_backoff)-1) ]
+        self._v_lock_retry_count = retry_count + 1
+        self._v_locked_gnucash_file = self.gnucash_file
+
+    def __lock_gone(self):
+        for attr in ('_v_lock_retry_count', '_v_next_lock_retry_time',
+                     '_v_locked_gnucash_file'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+    def __lock_retry_pending(self):
+        # a different file than the one that was locked gets tried right away
+        return self.waiting_for_lock() and \
+            getattr(self, '_v_locked_gnucash_file', None) == \
+            self.gnucash_file and \
+            time() < self._v_next_lock_retry_time
+
+    def seconds_until_retry(self):
+        if not self.waiting_for_lock():
+            return None
+        self.ensure_transaction_containers()
+        if len(self.dirty_transaction_set) == 0:
+            return None
+        return max(0, getattr(self, '_v_next_lock_retry_time', 0) - time())
+
     def save(self):
+        if self.bulk_loading() and self._v_bulk_load_defers_saves:
+            self._v_bulk_load_save_needed = True
+            return None
         try:
-            call_catch_qofbackend_exception_reraise_important(
-                self._v_session_active.save)
+            if self.uses_sql_backend():
+                # each transaction went into the database when it was
+                # commited (CommitEdit), Session.save() would rewrite the
+                # whole book, so we just find out if any of that failed
+                self._v_session_active.raise_backend_errors(
+                    "GnuCash.save")
+            else:
+                call_catch_qofbackend_exception_reraise_important(
+                    self._v_session_active.save)
         # this should be a little more refined, the session isn't neccesarilly
         # dead... or had end() not be callable, we already ignore the
         # couldn't make a backup exception
         except GnuCashBackendException, e:
-            self.current_session_error = str(e)
+            self.__set_session_error(SESSION_ERROR_OTHER, str(e))
+            self.drop_lookup_caches()
             if hasattr(self, '_v_session_active'):
                 self._v_session_active.destroy()
                 del self._v_session_active
@@ -403,25 +839,72 @@ class GnuCash(SessionBasedRobustBackendPlugin):
         return None
 
     def close(self, close_reason='reset because close() was called'):
-        if self.can_write():
-            #if self.has_active_session_attr():
-            self._v_session_active.end()
-            self._v_session_active.destroy()
+        if self.bulk_loading() and self._v_bulk_load_save_needed:
+            self._v_bulk_load_lost = True
+            self._v_bulk_load_save_needed = False
+        self.drop_lookup_caches()
         if self.current_session_error != None:
             close_reason = "close() called because gnucash session failed " + \
                 self.current_session_error 
         SessionBasedRobustBackendPlugin.close(self, close_reason)
 
+    def end_session(self, session):
+        # ending the session is what lets go of the lock on the book
+        session.end()
+        session.destroy()
+
     def configure_backend(self, parent_window=None):
         cd = GnuCashConfigDialog()
         # At least when a new account is created and a backend immediately
         # selected, self.gnucash_file is of type None.
         if isinstance(self.gnucash_file, str):
-            gnucash_filename = self.gnucash_file[6:]
+            gnucash_filename = self.get_gnucash_file_path()
             cd.set_book_filename(gnucash_filename)
         cd.run()
         gnucash_filename = cd.get_book_filename()
-        self.setattr('gnucash_file', 'xml' + '://' + gnucash_filename)
+        if gnucash_filename == None:
+            return
+        gnucash_url = gnucash_url_for_file(gnucash_filename)
+        if cd.get_convert_to_sqlite3() and \
+                gnucash_url_protocol(gnucash_url) == XML:
+            self.convert_to_sqlite3(
+                sqlite3_file_path_for_xml_file(gnucash_filename),
+                gnucash_filename, parent_window)
+        else:
+            self.setattr('gnucash_file', gnucash_url)
+        if gnucash_book_is_locked(self.gnucash_file) and \
+                gtk_yes_no_dialog(
+            "%s is locked, another program is using it or was using it "
+            "and crashed.\nIf you're sure nothing else has it open, the "
+            "lock can be broken the next time the book is saved to.\n"
+            "Break the lock?" % self.gnucash_file, parent_window):
+            self.break_lock()
+
+    def convert_to_sqlite3(self, sqlite3_file_path, xml_file_path=None,
+                           parent_window=None):
+        """Converts a xml book (by default, the one we're using) to a
+        sqlite3 one at sqlite3_file_path (see convert_gnucash_xml_to_sqlite3)
+        and switches over to it.
+
+        Returns True on success, shows an error and returns False otherwise.
+        """
+        if xml_file_path == None:
+            if self.get_gnucash_protocol() != XML:
+                gtk_error_message("%s isn't a GnuCash XML book" %
+                                  self.gnucash_file, parent_window)
+                return False
+            xml_file_path = self.get_gnucash_file_path()
+        # the conversion needs the xml book to itself
+        self.close()
+        try:
+            convert_gnucash_xml_to_sqlite3(xml_file_path, sqlite3_file_path)
+        except GnuCashBackendException, e:
+            gtk_error_message("couldn't convert %s to SQLite, %s" % (
+                    xml_file_path, str(e) ), parent_window)
+            return False
+        self.setattr('gnucash_file', SQLITE3 + PROTOCOL_SUFFIX +
+                     sqlite3_file_path)
+        return True
 
     def get_account_names(self, account, names = None, prefix = ''):
         # Initialise the default value of names.
@@ -27,6 +27,7 @@ from bokeep.gui.gladesupport.glade_util import \
 class GnuCashConfigDialog(object):
     def __init__(self):
         self.set_book_filename(None)
+        self.convert_to_sqlite3 = False
     
     def run(self):
         # Load the view into this class.
@@ -45,6 +46,8 @@ class GnuCashConfigDialog(object):
         filter = FileFilter()
         filter.set_name("GnuCash Book")
         filter.add_pattern("*.gnucash")
+        filter.add_pattern("*.sqlite3")
+        filter.add_pattern("*.sqlite")
         self.book_browser.add_filter(filter)
         
         # Populate defaults.
@@ -56,6 +59,8 @@ class GnuCashConfigDialog(object):
         r = self.gnucash_config_dialog.run()
         if r == RESPONSE_OK:
             self.set_book_filename(self.book_browser.get_filename())
+            self.convert_to_sqlite3 = \
+                self.convert_to_sqlite3_check.get_active()
         
         self.gnucash_config_dialog.destroy()
         
@@ -64,6 +69,10 @@ class GnuCashConfigDialog(object):
         
     def get_book_filename(self):
         return self.book_filename
+
+    def get_convert_to_sqlite3(self):
+        """True if the user asked for an XML book to be converted to SQLite"""
+        return self.convert_to_sqlite3
     
     def on_book_browser_selection_changed(self, *args):
         self.__update_acceptableness()
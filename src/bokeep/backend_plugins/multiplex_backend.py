@@ -0,0 +1,504 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from sys import exc_info
+from threading import Event
+
+# zodb imports
+import transaction
+from persistent.list import PersistentList
+
+# bokeep imports
+from plugin import BackendPlugin, BoKeepBackendException
+from bokeep.book import BoKeepDBHandle
+from bokeep.util import \
+    ends_with_commit, commit_unless_in_unit_of_work, in_unit_of_work, \
+    UnitOfWork, MessageRecievingThread, ThreadCallbackMessage, waitlistappend
+
+# gtk imports
+from gtk import \
+    RESPONSE_OK, RESPONSE_CANCEL, Dialog, Entry, Label, \
+    STOCK_CANCEL, STOCK_OK, DIALOG_MODAL
+
+# how the backend plugin module names are seperated in the
+# configure_backend dialog
+MODULE_NAME_SEPARATOR = ','
+
+# how often (in seconds) a MultiplexBackendPlugin waiting on a
+# ChildBackendThread checks that the thread is still around
+CHILD_THREAD_CHECK_INTERVAL = 0.1
+
+class ChildCallRequest(ThreadCallbackMessage):
+    """A call to a function of the child of a ChildBackendThread, once
+    done is set result is what it returned, or exception_info is the
+    sys.exc_info() of what it raised
+    """
+    callback_function = 'handle_call_request'
+
+    def __init__(self, running_thread, function_name, args):
+        ThreadCallbackMessage.__init__(self, running_thread)
+        self.function_name = function_name
+        self.args = args
+        self.done = Event()
+        self.result = None
+        self.exception_info = None
+
+class ChildBackendThread(MessageRecievingThread):
+    """Calls the functions of one child of a MultiplexBackendPlugin from a
+    thread of its own, so the children can all be flushed at once.
+
+    Like BackendChangeThread, this opens its own connection to the
+    database and only ever uses the child through it, commiting after each
+    call. Whatever sessions the child keeps open between flushes (e.g. a
+    SQLite connection) belong to this thread, and are let go of when it ends.
+    """
+    def __init__(self, db, child_oid):
+        MessageRecievingThread.__init__(self)
+        # never hold up the program on its way out
+        self.setDaemon(True)
+        self.db = db
+        self.child_oid = child_oid
+        self.dbhandle = None
+
+    def run(self):
+        self.dbhandle = BoKeepDBHandle(self.db.open())
+        try:
+            MessageRecievingThread.run(self)
+        finally:
+            transaction.get().abort()
+            # lets go of the child's sessions without touching anything
+            # persistent, (see SessionBasedRobustBackendPlugin._p_invalidate)
+            # closing is left to the multiplexer's copy of the child
+            self.get_child()._p_invalidate()
+            self.dbhandle.close()
+
+    def get_child(self):
+        return self.dbhandle.dbcon.get(self.child_oid)
+
+    @waitlistappend
+    def __request_call(self, call_request):
+        return call_request
+
+    def request_call(self, function_name, *args):
+        """Has this thread call function_name with args on the child,
+        returns a ChildCallRequest that's done when that is
+        """
+        call_request = ChildCallRequest(self, function_name, args)
+        self.__request_call(call_request)
+        return call_request
+
+    def wait_for_call(self, call_request):
+        """Waits for call_request to be done and returns what the call did,
+        raising what it raised
+        """
+        while not call_request.done.is_set() and self.is_alive():
+            call_request.done.wait(CHILD_THREAD_CHECK_INTERVAL)
+        if not call_request.done.is_set():
+            raise BoKeepBackendException(
+                "the thread for a multiplexed backend plugin is gone")
+        if call_request.exception_info != None:
+            exc_type, exc_value, exc_traceback = call_request.exception_info
+            raise exc_type, exc_value, exc_traceback
+        return call_request.result
+
+    def message_block_begin(self):
+        # pick up whatever other connections have commited since
+        # the last block, such as the multiplexer's dirty marks
+        self.dbhandle.dbcon.sync()
+
+    def handle_call_request(self, message):
+        try:
+            message.result = getattr(self.get_child(), message.function_name)(
+                *message.args)
+            transaction.get().commit()
+        except Exception:
+            transaction.get().abort()
+            message.exception_info = exc_info()
+        message.done.set()
+
+class MultiplexBackendPlugin(BackendPlugin):
+    """Passes everything on to several other backend plugins (children),
+    such as a GnuCash book and an audit file that should both have the same
+    transactions.
+
+    Each child keeps its own state for each transaction, so one backend
+    being unavailable or out of sync doesn't hold up the others. A
+    transaction is only clean when it's clean in every child, and
+    reason_transaction_is_dirty says which children it isn't clean in and
+    why. A mark_transaction_* call only raises an exception if every child
+    refused it.
+
+    flush_backend flushes all the children at once, so a flush takes as
+    long as the slowest child rather than all of them added up. Each child
+    gets a ChildBackendThread with its own database connection that keeps
+    whatever sessions the child opens (some, like a SQLite connection, only
+    work in the thread that opened them) from one flush to the next.
+    seconds_until_retry, release_backend_if_idle and
+    check_backend_consistency go through those threads too, close() ends
+    them. The threads only see what's commited, so flush_backend commits
+    before it starts them and syncs with what they did after.
+
+    A flush in a UnitOfWork has to be rolled back with it, so there the
+    threads are ended and the children are flushed one after the other in
+    the calling thread's transaction, as they are when we're not in a
+    database yet.
+
+    Children are added with add_backend_plugin or configure_backend. A child
+    added after transactions have gone out to the others doesn't have them,
+    marking every transaction dirty again will write them to the new child,
+    the others skip the ones that haven't changed.
+    """
+    def __init__(self):
+        BackendPlugin.__init__(self)
+        # (backend plugin module name, backend plugin) pairs
+        self.backend_plugins = PersistentList()
+
+    def get_backend_plugins(self):
+        """The child backend plugins, in the order they were added"""
+        return [ backend_plugin
+                 for module_name, backend_plugin in self.backend_plugins ]
+
+    def get_backend_plugin_names(self):
+        return [ module_name
+                 for module_name, backend_plugin in self.backend_plugins ]
+
+    @ends_with_commit
+    def add_backend_plugin(self, backend_plugin_name):
+        """Adds a new instance of the backend plugin in the module
+        backend_plugin_name as a child, returns it.
+
+        ImportError is raised if the module can't be imported
+        """
+        backend_plugin = __import__(
+            backend_plugin_name, globals(), locals(), [""] ).\
+            get_plugin_class()()
+        assert( isinstance(backend_plugin, BackendPlugin) )
+        # the threads are started again for the new set of children
+        # on the next flush
+        self.__end_child_threads()
+        self.backend_plugins.append( (backend_plugin_name, backend_plugin) )
+        return backend_plugin
+
+    @ends_with_commit
+    def remove_backend_plugin(self, backend_plugin):
+        """Takes backend_plugin out of the children (after closing it),
+        whatever it wrote to its backend stays there
+        """
+        for i, (module_name, child) in enumerate(self.backend_plugins):
+            if child is backend_plugin:
+                self.__end_child_threads()
+                child.close()
+                del self.backend_plugins[i]
+                return
+        raise BoKeepBackendException(
+            "%s isn't one of the multiplexed backend plugins" %
+            backend_plugin)
+
+    def __for_each_child(self, function_name, *args):
+        """Calls function_name with args on every child, the first
+        BoKeepBackendException is only raised if every child raised one
+        """
+        first_exception = None
+        successes = 0
+        for backend_plugin in self.get_backend_plugins():
+            try:
+                getattr(backend_plugin, function_name)(*args)
+            except BoKeepBackendException, e:
+                if first_exception == None:
+                    first_exception = e
+            else:
+                successes += 1
+        if successes == 0 and first_exception != None:
+            raise first_exception
+
+    def mark_transaction_dirty(self, trans_id, transaction):
+        with UnitOfWork():
+            self.__for_each_child(
+                'mark_transaction_dirty', trans_id, transaction)
+
+    def mark_transactions_dirty(self, trans_id_and_transaction_pairs):
+        trans_id_and_transaction_pairs = list(trans_id_and_transaction_pairs)
+        with UnitOfWork():
+            self.__for_each_child(
+                'mark_transactions_dirty', trans_id_and_transaction_pairs)
+
+    def mark_transaction_for_verification(self, trans_id):
+        with UnitOfWork():
+            self.__for_each_child('mark_transaction_for_verification',
+                                  trans_id)
+
+    def mark_transaction_for_hold(self, trans_id):
+        with UnitOfWork():
+            self.__for_each_child('mark_transaction_for_hold', trans_id)
+
+    def mark_transaction_for_removal(self, trans_id):
+        with UnitOfWork():
+            self.__for_each_child('mark_transaction_for_removal', trans_id)
+
+    def mark_transaction_for_forced_remove(self, trans_id):
+        # children that aren't holding the transaction refuse this
+        with UnitOfWork():
+            self.__for_each_child('mark_transaction_for_forced_remove',
+                                  trans_id)
+
+    @ends_with_commit
+    def remove_trans_flush_check_and_close(self, trans_id):
+        self.mark_transaction_for_removal(trans_id)
+        self.flush_backend()
+        is_gone = all(
+            trans_id not in getattr(backend_plugin, 'dirty_transaction_set', ())
+            for backend_plugin in self.get_backend_plugins() )
+        self.close()
+        return is_gone
+
+    def transaction_is_clean(self, trans_id):
+        return all( backend_plugin.transaction_is_clean(trans_id)
+                    for backend_plugin in self.get_backend_plugins() )
+
+    def reason_transaction_is_dirty(self, trans_id):
+        reasons = [
+            "%s: %s" % (module_name,
+                        backend_plugin.reason_transaction_is_dirty(trans_id) )
+            for module_name, backend_plugin in self.backend_plugins
+            if not backend_plugin.transaction_is_clean(trans_id) ]
+        if len(reasons) == 0:
+            raise BoKeepBackendException("the transaction isn't dirty")
+        return '\n'.join(reasons)
+
+    def __child_threads_running(self):
+        # looking in __dict__ doesn't bring a ghost back to life
+        return '_v_child_threads' in self.__dict__
+
+    def __get_child_threads(self):
+        """A ChildBackendThread for each child, in order, started if
+        need be. The threads of children that are gone are ended.
+        """
+        if not self.__child_threads_running():
+            self._v_child_threads = {}
+        child_threads = self._v_child_threads
+        backend_plugins = self.get_backend_plugins()
+        child_oids = set( backend_plugin._p_oid
+                          for backend_plugin in backend_plugins )
+        for child_oid in child_threads.keys():
+            if child_oid not in child_oids:
+                child_threads.pop(child_oid).end_thread_and_join()
+        for backend_plugin in backend_plugins:
+            if backend_plugin._p_oid not in child_threads:
+                child_thread = ChildBackendThread(
+                    self._p_jar.db(), backend_plugin._p_oid)
+                child_thread.start()
+                child_threads[backend_plugin._p_oid] = child_thread
+        return [ child_threads[backend_plugin._p_oid]
+                 for backend_plugin in backend_plugins ]
+
+    def __end_child_threads(self):
+        for child_thread in self.__dict__.pop(
+            '_v_child_threads', {}).itervalues():
+            child_thread.end_thread_and_join()
+
+    def __call_children(self, function_name, *args):
+        """Calls function_name with args on every child that has it, in
+        its ChildBackendThread if they're running, otherwise here. Returns
+        a (return value, sys.exc_info() or None) pair for each child,
+        (None, None) for the ones without function_name. Every child gets
+        called even if others raise an exception.
+        """
+        backend_plugins = self.get_backend_plugins()
+        # (function, arguments) for each child
+        if self.__child_threads_running():
+            # they're all started before any is waited on
+            calls = [
+                (child_thread.wait_for_call,
+                 (child_thread.request_call(function_name, *args),) )
+                if hasattr(backend_plugin, function_name) else None
+                for backend_plugin, child_thread in
+                zip(backend_plugins, self.__get_child_threads()) ]
+        else:
+            calls = [ (getattr(backend_plugin, function_name), args)
+                      if hasattr(backend_plugin, function_name) else None
+                      for backend_plugin in backend_plugins ]
+        results = []
+        for call in calls:
+            if call == None:
+                results.append( (None, None) )
+                continue
+            function, function_args = call
+            try:
+                results.append( (function(*function_args), None) )
+            except Exception:
+                results.append( (None, exc_info()) )
+        return results
+
+    def __raise_first_exception(self, results):
+        for result, exception_info in results:
+            if exception_info != None:
+                exc_type, exc_value, exc_traceback = exception_info
+                raise exc_type, exc_value, exc_traceback
+
+    def flush_backend(self, max_items=None, time_budget=None):
+        """Flushes every child, returns the most dirty transactions any
+        of them have left to get to, or None if there's nothing left in
+        the ones that could be written to and one couldn't be.
+
+        If a child's flush_backend raises an exception, the others still
+        get flushed and it's raised here after.
+        """
+        if self._p_jar == None or in_unit_of_work():
+            self.__end_child_threads()
+            self._v_children_flushed_here = True
+            results = self.__call_children(
+                'flush_backend', max_items, time_budget)
+            commit_unless_in_unit_of_work()
+        else:
+            if self.__dict__.pop('_v_children_flushed_here', False):
+                # the sessions they opened here would be in the way of the
+                # ones the threads open
+                for backend_plugin in self.get_backend_plugins():
+                    backend_plugin.close()
+            # the threads only see what's been commited
+            transaction.get().commit()
+            self.__get_child_threads()
+            results = self.__call_children(
+                'flush_backend', max_items, time_budget)
+            # and we see what they commited
+            self._p_jar.sync()
+
+        self.__raise_first_exception(results)
+        results = [ remaining for remaining, exception_info in results ]
+        still_to_do = [ remaining for remaining in results
+                        if remaining != None ]
+        # the children that could be written to come first, a call back
+        # for what they've got left gets the others another try too
+        if len(still_to_do) > 0 and max(still_to_do) > 0:
+            return max(still_to_do)
+        elif None in results:
+            return None
+        return 0
+
+    def close(self, close_reason='reset because close() was called'):
+        self.__end_child_threads()
+        self.__dict__.pop('_v_children_flushed_here', None)
+        for backend_plugin in self.get_backend_plugins():
+            backend_plugin.close(close_reason)
+
+    def _p_deactivate(self):
+        # only an object that's in a database and unchanged really becomes
+        # a ghost, the threads would be lost with our volatile attributes
+        if self._p_jar != None and self._p_changed == False:
+            self.__end_child_threads()
+        BackendPlugin._p_deactivate(self)
+
+    def _p_invalidate(self):
+        self.__end_child_threads()
+        BackendPlugin._p_invalidate(self)
+
+    def begin_bulk_load(self, defer_saves=True):
+        for backend_plugin in self.get_backend_plugins():
+            backend_plugin.begin_bulk_load(defer_saves)
+
+    def end_bulk_load(self, successful=True):
+        # every child gets to finish, the first exception is raised after
+        first_exception = None
+        for backend_plugin in self.get_backend_plugins():
+            try:
+                backend_plugin.end_bulk_load(successful)
+            except Exception, e:
+                if first_exception == None:
+                    first_exception = e
+        if first_exception != None:
+            raise first_exception
+
+    def seconds_until_retry(self):
+        results = self.__call_children('seconds_until_retry')
+        self.__raise_first_exception(results)
+        delays = [ delay for delay, exception_info in results
+                   if delay != None ]
+        return min(delays) if len(delays) > 0 else None
+
+    def release_backend_if_idle(self):
+        results = self.__call_children('release_backend_if_idle')
+        self.__raise_first_exception(results)
+        return any( released for released, exception_info in results )
+
+    def check_backend_consistency(self, trans_ids=None):
+        """RobustBackendPlugin.check_backend_consistency for each child that
+        has it, the backend identifiers in the result are
+        (backend plugin module name, backend identifier) pairs
+        """
+        results = {}
+        child_results = self.__call_children(
+            'check_backend_consistency', trans_ids)
+        self.__raise_first_exception(child_results)
+        for module_name, (child_result, exception_info) in zip(
+            self.get_backend_plugin_names(), child_results):
+            if child_result == None:
+                continue
+            for trans_id, mismatch_pairs in child_result.iteritems():
+                results.setdefault(trans_id, []).extend(
+                    ( (module_name, backend_ident), mismatches)
+                    for backend_ident, mismatches in mismatch_pairs )
+        return results
+
+    def backend_account_dialog(self, parent_window=None):
+        # account_spec is backend plugin specific, the first child
+        # gets to say what it is
+        backend_plugins = self.get_backend_plugins()
+        if len(backend_plugins) == 0:
+            return None, ''
+        return backend_plugins[0].backend_account_dialog(parent_window)
+
+    def configure_backend(self, parent_window=None):
+        dia = Dialog("Multiplexed backend plugins",
+                     parent_window, DIALOG_MODAL,
+                     (STOCK_OK, RESPONSE_OK,
+                      STOCK_CANCEL, RESPONSE_CANCEL ) )
+        dia.vbox.pack_start(Label(
+                "Backend plugin modules, seperated by %s" %
+                MODULE_NAME_SEPARATOR ) )
+        module_names_entry = Entry()
+        module_names_entry.set_width_chars(60)
+        module_names_entry.set_text(
+            MODULE_NAME_SEPARATOR.join(self.get_backend_plugin_names()) )
+        dia.vbox.pack_start(module_names_entry)
+        dia.vbox.show_all()
+        result = dia.run()
+        module_names = [
+            module_name.strip() for module_name in
+            module_names_entry.get_text().split(MODULE_NAME_SEPARATOR)
+            if module_name.strip() != '' ]
+        dia.destroy()
+        if result != RESPONSE_OK:
+            return
+
+        with UnitOfWork():
+            # children that are gone are removed, new ones added, the
+            # ones that stay keep thier state
+            for module_name, backend_plugin in list(self.backend_plugins):
+                if module_name not in module_names:
+                    self.remove_backend_plugin(backend_plugin)
+            existing_names = self.get_backend_plugin_names()
+            for module_name in module_names:
+                if module_name not in existing_names:
+                    self.add_backend_plugin(module_name)
+        for backend_plugin in self.get_backend_plugins():
+            backend_plugin.configure_backend(parent_window)
+
+def get_plugin_class():
+    return MultiplexBackendPlugin
@@ -17,7 +17,10 @@
 #
 # Author: Mark Jenkins <mark@parit.ca>
 
+from threading import Timer, Lock, Event
+
 from persistent import Persistent
+from ZODB.POSException import ConflictError
 
 from bokeep.book_transaction import \
     BoKeepTransactionNotMappableToFinancialTransaction
@@ -26,10 +29,25 @@ from bokeep.util import \
     ChangeMessageRecievingThread, EntityChangeManager, entitymod, \
     ends_with_commit, FunctionAndDataDrivenStateMachine, \
     state_machine_do_nothing, state_machine_always_true, \
-    StateMachineMinChangeDataStore
+    StateMachineMinChangeDataStore, ThreadCallbackMessage, \
+    changelock, waitlistappend, UnitOfWork
 
 import transaction
 
+# how many times BackendChangeThread tries a flush that keeps running into
+# ZODB conflicts with other connections before giving up until next time
+BACKEND_THREAD_CONFLICT_RETRIES = 3
+
+# BackendChangeThread flushes this many dirty transactions at a time, for no
+# more than this many seconds, before seeing if there are other requests
+# (e.g. other books) to get to, the rest of the flush is requested again
+BACKEND_THREAD_FLUSH_SLICE = 50
+BACKEND_THREAD_FLUSH_TIME_BUDGET = 1.0
+
+# how often (in seconds) BackendChangeThread.pause_with_backend_closed checks
+# that the thread is still around while it waits for it to pause
+BACKEND_THREAD_PAUSE_CHECK_INTERVAL = 0.1
+
 class BackendChangeManager(EntityChangeManager):
     def __init__(self, running_thread, entity_identifier):
         EntityChangeManager.__init__(self, running_thread, entity_identifier)
@@ -42,28 +60,318 @@ class BackendChangeManager(EntityChangeManager):
         return_value = self.transaction_dirty_count
         self.transaction_dirty_count = 0
         return return_value
- 
+
+class BackendIdleCheckRequest(ThreadCallbackMessage):
+    callback_function = 'handle_idle_check_request'
+
+class BackendFlushRequest(ThreadCallbackMessage):
+    callback_function = 'handle_flush_request'
+
+    def __init__(self, running_thread, book_name, close_backend=False):
+        ThreadCallbackMessage.__init__(self, running_thread)
+        self.book_name = book_name
+        self.close_backend = close_backend
+
+class BackendPauseRequest(ThreadCallbackMessage):
+    """Returned by BackendChangeThread.pause_with_backend_closed, call
+    resume() to let the thread carry on
+    """
+    callback_function = 'handle_pause_request'
+
+    def __init__(self, running_thread, book_name):
+        ThreadCallbackMessage.__init__(self, running_thread)
+        self.book_name = book_name
+        self.paused = Event()
+        self.resumed = Event()
+
+    def wait_for_resume(self):
+        # called from the BackendChangeThread
+        self.paused.set()
+        self.resumed.wait()
+
+    def resume(self):
+        self.resumed.set()
+
+def ignore_change_ready(entity_identifier):
+    pass
 
 class BackendChangeThread(ChangeMessageRecievingThread):
-    
+    """Marks transactions dirty in the backend plugins of a BoKeepBookSet
+    and calls flush_backend() from a thread of its own, so a slow backend
+    doesn't hold up the thread asking for that work. (the gtk main loop)
+
+    ZODB connections aren't to be shared between threads, so this thread
+    opens its own with bookset.get_new_dbhandle() and only ever touches
+    the books through it. Callers have to commit their changes to a
+    transaction before asking for it to be marked dirty here,
+    otherwise this thread won't see them.
+
+    Repeated calls to mark_transaction_dirty() for the same transaction
+    that come in before this thread gets to them are handled as one.
+    That goes for removals too, so that a backend plugin's state is only
+    ever changed from this thread's connection and never conflicts with
+    the caller's.
+
+    Anything else that has to change a backend plugin from another
+    connection, such as configure_backend from a gui, should do so between
+    pause_with_backend_closed and resume, and commit before resuming.
+
+    After each flush, status_callback (if provided) is called from this
+    thread with the book name and a list of the transaction ids that were
+    marked dirty for that flush. A gui should have that callback schedule
+    its widget updates on its own main loop, (e.g. gobject.idle_add) and
+    commit or abort in its own connection to see the changes.
+    """
+    def __init__(self, bookset, status_callback=None):
+        ChangeMessageRecievingThread.__init__(self)
+        self.bookset = bookset
+        self.status_callback = status_callback
+        self.dbhandle = None
+        self.__trans_ids_marked = {}
+        self.__books_to_flush = set()
+        self.__books_to_close = set()
+        self.__idle_check_requested = False
+        # book name to threading.Timer for flushes to retry later,
+        # see BackendPlugin.seconds_until_retry, the timers change this
+        # from thier own threads
+        self.__retry_timers = {}
+        self.__retry_timers_lock = Lock()
+        self.__pause_requests = []
+
+    def run(self):
+        self.dbhandle = self.bookset.get_new_dbhandle()
+        try:
+            ChangeMessageRecievingThread.run(self)
+        finally:
+            self.__retry_timers_lock.acquire()
+            try:
+                for timer in self.__retry_timers.values():
+                    timer.cancel()
+            finally:
+                self.__retry_timers_lock.release()
+            transaction.get().abort()
+            self.dbhandle.close()
+
+    @changelock
+    def mark_transaction_dirty(self, book_name, trans_id):
+        """Have this thread call mark_transaction_dirty and flush_backend
+        on the backend plugin of the book named book_name for
+        the transaction identified by trans_id
+
+        If the transaction has been removed from the book by the time this
+        thread gets to it, mark_transaction_for_removal is called instead,
+        so commit the removal (with the backend plugin left alone, see
+        BoKeepBook.remove_transaction) and then call this.
+        """
+        entity_identifier = (book_name, trans_id)
+        # trackers are left in place once added, so this only happens
+        # the first time around for a particular transaction
+        if entity_identifier not in self.waiting_changes:
+            self.add_change_tracker(entity_identifier, ignore_change_ready)
+        self.__increment_dirty_count(entity_identifier)
+
     @entitymod
-    def mark_transaction_dirty(self, change_manager, entity_identifier):
+    def __increment_dirty_count(self, change_manager):
         change_manager.increment()
 
+    @waitlistappend
+    def request_flush(self, book_name, close_backend=False):
+        """Have this thread call flush_backend on the backend plugin of
+        the book named book_name, and close() after that if close_backend
+        is set
+        """
+        return BackendFlushRequest(self, book_name, close_backend)
+
+    @waitlistappend
+    def __request_pause(self, pause_request):
+        return pause_request
+
+    def pause_with_backend_closed(self, book_name):
+        """Has this thread flush and close the backend plugin of the book
+        named book_name, (which lets go of any session it's kept open) and
+        then wait without touching any backend plugin. Returns a
+        BackendPauseRequest once the thread is waiting, call its resume()
+        to let the thread carry on.
+
+        Requests that come in while the thread is paused wait for it
+        to resume.
+        """
+        pause_request = BackendPauseRequest(self, book_name)
+        self.__request_pause(pause_request)
+        while not pause_request.paused.is_set() and self.is_alive():
+            pause_request.paused.wait(BACKEND_THREAD_PAUSE_CHECK_INTERVAL)
+        return pause_request
+
+    @waitlistappend
+    def request_idle_check(self):
+        """Have this thread call release_backend_if_idle on the backend
+        plugins of all the books, the caller is expected to do this
+        every so often.
+        """
+        return BackendIdleCheckRequest(self)
+
+    def new_entity_change_manager(self, entity_identifier):
+        return BackendChangeManager(self, entity_identifier)
+
     def get_entity_from_identifier(self, entity_identifier):
-        pass
+        # bokeep.book imports this module
+        from bokeep.book import BOOKS_SUB_DB_KEY
+        book_name, trans_id = entity_identifier
+        return self.dbhandle.get_sub_database(BOOKS_SUB_DB_KEY)[book_name]
 
     def handle_entity_change(self, change_message, entity):
-        # change required, only do this if backend is co-operative, if it
-        # is locked or something ,imform other that it is still dirty
-        # I wonder if we can avoid this...
-        count_down = change_message.send_to_zero()
-        
-        # put representation of entity identified by
-        # change_message.entity_identifier, and old backend id
-        # to backend, receie returned backenend id and store
-        #
-        # send count_down back to the backend plugin dirty db, or nothing
+        # several dirty marks for this transaction may of come in since
+        # the last time, they're all taken care of at once
+        if change_message.send_to_zero() > 0:
+            book_name, trans_id = change_message.entity_identifier
+            self.__trans_ids_marked.setdefault(book_name, []).append(
+                trans_id)
+            self.__books_to_flush.add(book_name)
+
+    def handle_idle_check_request(self, message):
+        self.__idle_check_requested = True
+
+    def handle_pause_request(self, message):
+        self.__books_to_flush.add(message.book_name)
+        self.__books_to_close.add(message.book_name)
+        self.__pause_requests.append(message)
+
+    def handle_flush_request(self, message):
+        self.__books_to_flush.add(message.book_name)
+        if message.close_backend:
+            self.__books_to_close.add(message.book_name)
+
+    def __mark_transactions_dirty(self, book, backend_plugin, trans_ids):
+        # transactions that have been removed from the book are marked
+        # for removal instead, (see mark_transaction_dirty)
+        trans_id_and_transaction_pairs = [
+            (trans_id, book.get_transaction(trans_id))
+            for trans_id in trans_ids
+            if book.has_transaction(trans_id) ]
+        for trans_id in trans_ids:
+            if not book.has_transaction(trans_id):
+                # the backend plugin won't of heard of a transaction
+                # that was removed before it was ever marked dirty
+                try:
+                    with UnitOfWork():
+                        backend_plugin.mark_transaction_for_removal(trans_id)
+                except BoKeepBackendException:
+                    pass
+        # the inner units of work give us something to roll back to
+        try:
+            with UnitOfWork():
+                backend_plugin.mark_transactions_dirty(
+                    trans_id_and_transaction_pairs)
+        # some may be held, if so, go through them one at a time and leave
+        # those alone
+        except BoKeepBackendException:
+            for trans_id, trans in trans_id_and_transaction_pairs:
+                try:
+                    with UnitOfWork():
+                        backend_plugin.mark_transaction_dirty(trans_id, trans)
+                except BoKeepBackendException:
+                    pass
+
+    def __schedule_retry_if_needed(self, book_name, book):
+        retry_delay = book.get_backend_plugin().seconds_until_retry()
+        if retry_delay == None or not self.continue_running():
+            return
+        self.__retry_timers_lock.acquire()
+        try:
+            if book_name not in self.__retry_timers:
+                timer = Timer(retry_delay, self.__retry_flush, (book_name,))
+                timer.setDaemon(True)
+                self.__retry_timers[book_name] = timer
+                timer.start()
+        finally:
+            self.__retry_timers_lock.release()
+
+    def __retry_flush(self, book_name):
+        # called from the Timer's thread
+        self.__retry_timers_lock.acquire()
+        try:
+            self.__retry_timers.pop(book_name, None)
+        finally:
+            self.__retry_timers_lock.release()
+        self.request_flush(book_name)
+
+    def message_block_begin(self):
+        # pick up whatever other connections have commited since
+        # the last block
+        self.dbhandle.dbcon.sync()
+
+    def message_block_end(self):
+        # bokeep.book imports this module
+        from bokeep.book import BOOKS_SUB_DB_KEY
+        books = self.dbhandle.get_sub_database(BOOKS_SUB_DB_KEY)
+        for book_name in self.__books_to_flush:
+            trans_ids = self.__trans_ids_marked.pop(book_name, [])
+            if book_name not in books:
+                continue
+            book = books[book_name]
+            remaining = 0
+            trans_ids_to_mark = trans_ids
+            for i in xrange(BACKEND_THREAD_CONFLICT_RETRIES):
+                try:
+                    backend_plugin = book.get_backend_plugin()
+                    # one commit for the lot of the dirty marks
+                    with UnitOfWork():
+                        self.__mark_transactions_dirty(
+                            book, backend_plugin, trans_ids_to_mark)
+                    trans_ids_to_mark = []
+                    # flush_backend commits after each save, that's kept
+                    # out of the unit of work so a rollback can't forget
+                    # what's already in the backend
+                    #
+                    # everything has to go out before closing or
+                    # when this thread is on its way out
+                    if book_name in self.__books_to_close or \
+                            not self.continue_running():
+                        backend_plugin.flush_backend()
+                    else:
+                        remaining = backend_plugin.flush_backend(
+                            BACKEND_THREAD_FLUSH_SLICE,
+                            BACKEND_THREAD_FLUSH_TIME_BUDGET)
+                    if book_name in self.__books_to_close:
+                        backend_plugin.close()
+                except ConflictError:
+                    # someone else changed the same objects, start
+                    # over with what they did
+                    self.dbhandle.dbcon.sync()
+                else:
+                    break # for i
+            if len(trans_ids_to_mark) > 0:
+                # every try ran into a conflict before the dirty marks
+                # were commited, they're kept for another go
+                self.__trans_ids_marked.setdefault(book_name, []).extend(
+                    trans_ids_to_mark)
+                self.request_flush(book_name)
+            # None is a backend that can't be written to, the retry
+            # schedule (if any) takes care of that
+            elif remaining != None and remaining > 0:
+                self.request_flush(book_name)
+            else:
+                self.__schedule_retry_if_needed(book_name, book)
+            if self.status_callback != None:
+                self.status_callback(book_name, trans_ids)
+        self.__books_to_flush.clear()
+        self.__books_to_close.clear()
+
+        # the backend plugins of these have just been closed, they're left
+        # to whoever asked for the pause until they resume
+        for pause_request in self.__pause_requests:
+            pause_request.wait_for_resume()
+        del self.__pause_requests[:]
+
+        if self.__idle_check_requested:
+            self.__idle_check_requested = False
+            for book_name, book in books.iteritems():
+                try:
+                    with UnitOfWork():
+                        book.get_backend_plugin().release_backend_if_idle()
+                except ConflictError:
+                    # we'll get another chance next time around
+                    self.dbhandle.dbcon.sync()
 
 class BackendPlugin(Persistent):
     """Illustrates the Bo-Keep backend plugin API
@@ -71,7 +379,8 @@ class BackendPlugin(Persistent):
     A Bo-Keep backend plugin does not need to be a subclass of
     bokeep.backend_plugins.plugin.BackendPlugin, but it must implement the
     following functions shown here:
-    mark_transaction_dirty, mark_transaction_for_removal,
+    mark_transaction_dirty, mark_transactions_dirty,
+    mark_transaction_for_removal,
     mark_transaction_for_verification, mark_transaction_for_hold,
     mark_transaction_for_forced_remove, transaction_is_clean,
     reason_transaction_is_dirty, flush_backend, close
@@ -169,6 +478,18 @@ class BackendPlugin(Persistent):
         """
         pass
 
+    @ends_with_commit
+    def mark_transactions_dirty(self, trans_id_and_transaction_pairs):
+        """Bulk equivilent of mark_transaction_dirty, takes an iterable of
+        (trans_id, transaction) pairs.
+
+        This implementation just calls mark_transaction_dirty for each pair,
+        subclasses should override it if they can do the work with a
+        single commit at the end. (as RobustBackendPlugin does)
+        """
+        for trans_id, transaction in trans_id_and_transaction_pairs:
+            self.mark_transaction_dirty(trans_id, transaction)
+
     def mark_transaction_for_verification(self, trans_id):
         """Indicate a bo-keep transaction should be compared against the backend
 
@@ -220,15 +541,23 @@ class BackendPlugin(Persistent):
         """
         raise BoKeepBackendException("the transaction isn't dirty")
 
-    def flush_backend(self):
+    def flush_backend(self, max_items=None, time_budget=None):
         """Take all transactions that are dirty or marked for removal
         writes them out / removes them out if possible.
 
+        A plugin that can do this a bit at a time should do no more than
+        max_items transactions between saves and start no more of those
+        once time_budget seconds have passed, (see RobustBackendPlugin)
+        and return how many dirty transactions are left to get to.
+        Plugins that can't just do everything and return 0. None means
+        the backend couldn't be written to at all, the dirty transactions
+        are still waiting.
+
         When this is done, it does a zopedb transaction commit, if you're
         sharing a zopedb thread with this you'll want to be sure your data
         is in a state you're comfortable having commited
         """
-        pass
+        return 0
 
     def close(self, close_reason='reset because close() was called'):
         """Instructs the plugin to release any resources being used to
@@ -240,6 +569,38 @@ class BackendPlugin(Persistent):
         """
         pass
 
+    def begin_bulk_load(self, defer_saves=True):
+        """Called before a large number of transactions are written in one
+        go, such as the first push of a whole book, plugins can get ready
+        to do that more cheaply.
+
+        With defer_saves, plugins may put off saving until end_bulk_load,
+        so callers have to be able to undo everything done to the zodb in
+        between if end_bulk_load raises an exception. (e.g. with UnitOfWork)
+        """
+        pass
+
+    def end_bulk_load(self, successful=True):
+        """Called after begin_bulk_load once the writing is done, or with
+        successful=False if it was cut short by an exception.
+        """
+        pass
+
+    def seconds_until_retry(self):
+        """Plugins that can't write to the backend right now for a reason
+        that should pass on its own (e.g. someone else has it locked) can
+        return how many seconds to wait before flush_backend is worth
+        trying again, None means there's no need to.
+        """
+        return None
+
+    def release_backend_if_idle(self):
+        """Plugins that hang on to resources (such as an open file) between
+        flushes can let go of them here if they haven't been used for a
+        while, returns True if that happened.
+        """
+        return False
+
     def configure_backend(self, parent_window=None):
         """Instructs the plugin to create a configuration dialog
         provide the parent window or None
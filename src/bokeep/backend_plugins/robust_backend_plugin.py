@@ -18,24 +18,73 @@
 # Author: Mark Jenkins <mark@parit.ca>
 
 from decimal import Decimal
+from itertools import islice
+from time import time
 
 from persistent import Persistent
+from BTrees.IOBTree import IOBTree
+from BTrees.IIBTree import IIBTree, IITreeSet
 
 from bokeep.book_transaction import \
     FinancialTransaction, FinancialTransactionLine, \
-    BoKeepTransactionNotMappableToFinancialTransaction
+    BoKeepTransactionNotMappableToFinancialTransaction, \
+    financial_transaction_fingerprint
 
 from bokeep.util import \
     ChangeMessageRecievingThread, EntityChangeManager, entitymod, \
     ends_with_commit, FunctionAndDataDrivenStateMachine, \
     state_machine_do_nothing, state_machine_always_true, \
-    StateMachineMinChangeDataStore
+    StateMachineMinChangeDataStore, commit_unless_in_unit_of_work
 
 import transaction
 
 from plugin import \
     BackendPlugin, BoKeepBackendException, BoKeepBackendResetException
 
+# kinds of work a state machine can have for the backend that can be
+# collected up and dispatched in batches, see
+# RobustBackendPlugin.can_batch_backend_transactions
+BATCHABLE_BACKEND_WORK = (VERIFY_WORK, REMOVE_WORK, CREATE_WORK) = range(3)
+
+# how many dirty transactions RobustBackendPlugin.flush_backend does between
+# saves when given a time_budget but no max_items
+DEFAULT_FLUSH_SLICE_SIZE = 100
+
+# what BackendTransactionMismatch.attribute is when the backend transaction
+# couldn't be found at all, or couldn't be checked
+MISSING_TRANSACTION_MISMATCH = 'transaction'
+BACKEND_ERROR_MISMATCH = 'backend error'
+
+class BackendTransactionMismatch(object):
+    """One way in which a backend transaction differs from the
+    FinancialTransaction it was created from, see
+    RobustBackendPlugin.find_backend_transaction_mismatches
+
+    attribute names what's different (e.g. 'description', or
+    MISSING_TRANSACTION_MISMATCH), expected is what the FinancialTransaction
+    says and found is what the backend has
+    """
+    def __init__(self, attribute, expected, found):
+        self.attribute = attribute
+        self.expected = expected
+        self.found = found
+
+    def __eq__(self, other):
+        return isinstance(other, BackendTransactionMismatch) and \
+            (self.attribute, self.expected, self.found) == \
+            (other.attribute, other.expected, other.found)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "BackendTransactionMismatch(%r, %r, %r)" % (
+            self.attribute, self.expected, self.found)
+
+    def __str__(self):
+        return "%s is %s in the backend instead of %s" % (
+            self.attribute, self.found, self.expected)
+
 def error_in_state_machine_data_is(error_code=None):
     if error_code == None:
         def check_for_any_error(state_machine, next_state):
@@ -53,6 +102,86 @@ def particular_input_state_machine(input):
             state_machine.data.get_value('front_end_id')] == input
     return command_check
 
+def get_backend_ids_to_fingerprints(state_machine,
+                                    key='backend_ids_to_fingerprints'):
+    # state machines created before fingerprints were introduced
+    # don't have any
+    if state_machine.data.has_value(key):
+        return state_machine.data.get_value(key)
+    else:
+        return {}
+
+def get_well_formed_financial_transactions(state_machine):
+    """Returns the list of financial transactions from the BoKeep transaction
+    of a state machine, or None if there's anything wrong with them.
+
+    Finding out what is wrong and recording it as an error is left to
+    the regular path of re-creating backend transactions
+    """
+    try:
+        fin_trans_list = list(state_machine.data.get_value(
+                'bo_keep_trans').get_financial_transactions() )
+    except (BoKeepTransactionNotMappableToFinancialTransaction, TypeError):
+        return None
+    if all( isinstance(fin_trans, FinancialTransaction) and
+            all( isinstance(fin_trans_line, FinancialTransactionLine)
+                 for fin_trans_line in fin_trans.lines )
+            for fin_trans in fin_trans_list ):
+        return fin_trans_list
+    else:
+        return None
+
+def financial_transactions_unchanged_state_machine(state_machine, next_state):
+    """Checks if a transaction marked dirty for re-creation still
+    has the same financial transactions as the ones in the backend by
+    comparing their fingerprints with the ones recorded on creation
+    """
+    if not particular_input_state_machine(
+        BackendDataStateMachine.BACKEND_RECREATE)(state_machine, next_state):
+        return False
+
+    backend_ids_to_fingerprints = \
+        get_backend_ids_to_fingerprints(state_machine)
+    try:
+        old_fingerprints = sorted(
+            backend_ids_to_fingerprints[backend_id]
+            for backend_id in state_machine.data.get_value(
+                'backend_ids_to_fin_trans').iterkeys() )
+    except KeyError:
+        # no fingerprint on record for some backend transaction
+        return False
+
+    fin_trans_list = get_well_formed_financial_transactions(state_machine)
+    if fin_trans_list == None:
+        return False
+    new_fingerprints = sorted(
+        financial_transaction_fingerprint(fin_trans)
+        for fin_trans in fin_trans_list )
+
+    return old_fingerprints == new_fingerprints
+
+def backend_update_possible_state_machine(state_machine, next_state):
+    """Checks if a transaction marked dirty for re-creation can have its
+    backend transactions updated in place instead of being removed and
+    created again.
+
+    That's possible if the backend plugin can_update_backend_transactions()
+    and there are as many financial transactions as there are backend
+    transactions
+    """
+    if not particular_input_state_machine(
+        BackendDataStateMachine.BACKEND_RECREATE)(state_machine, next_state):
+        return False
+    if not state_machine.backend_plugin.can_update_backend_transactions():
+        return False
+    backend_ids_to_fin_trans = state_machine.data.get_value(
+        'backend_ids_to_fin_trans')
+    if len(backend_ids_to_fin_trans) == 0:
+        return False
+    fin_trans_list = get_well_formed_financial_transactions(state_machine)
+    return fin_trans_list != None and \
+        len(fin_trans_list) == len(backend_ids_to_fin_trans)
+
 class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
     def __init__(self, init_data, backend_plugin):
         FunctionAndDataDrivenStateMachine.__init__(
@@ -88,6 +217,25 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
         # check that self.get_table() now is returning the original table
         assert( BackendDataStateMachine.__backend_rule_table ==
                 self.get_table() )
+
+    def predict_backend_work(self):
+        """Returns a list of (work_key, argument) pairs for the backend work
+        the next call to advance_state_machine() will ask for.
+
+        work_key is a tuple starting with one of BATCHABLE_BACKEND_WORK,
+        the same key is used by RobustBackendPlugin to hand back the
+        result of that work when the transition asks for it
+        """
+        for condition_func, transition_func, next_state in \
+                self.get_table()[self.state]:
+            if condition_func(self, next_state):
+                predictor = BackendDataStateMachine.__work_predictors.get(
+                    transition_func)
+                if predictor == None:
+                    return []
+                else:
+                    return predictor(self)
+        return []
         
 
     def __remove_transaction_state_machine(state_machine, next_state):
@@ -119,6 +267,8 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
         
         backend_ids_to_fin_trans = state_machine.data.get_value(
             'backend_ids_to_fin_trans')
+        backend_ids_to_fingerprints = \
+            get_backend_ids_to_fingerprints(state_machine)
         bo_keep_trans = state_machine.data.get_value('bo_keep_trans')
         error_code = state_machine.data.get_value('error_code')
         error_string = state_machine.data.get_value('error_string')
@@ -156,29 +306,43 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
             else:
                 try:
                     for fin_trans in fin_trans_list:
-                        # perhaps some day we should ensure
-                        # this is checked for all backend plugins
-                        if not all( isinstance(line.amount, Decimal)
-                                    for line in fin_trans.lines ):
-                            raise BoKeepBackendException(
-                                "not all of the financial transaction "
-                                "lines has an amount of type Decimal")
-
-                        new_backend_id = \
-                            state_machine.backend_plugin.\
-                            create_backend_transaction(fin_trans)
-                        backend_ids_to_fin_trans[new_backend_id] = \
-                            fin_trans
+                        # a failure on one financial transaction doesn't
+                        # stop the others from being tried, the ones that
+                        # are created get recorded and will be removed
+                        # on the next attempt
+                        try:
+                            # perhaps some day we should ensure
+                            # this is checked for all backend plugins
+                            if not all( isinstance(line.amount, Decimal)
+                                        for line in fin_trans.lines ):
+                                raise BoKeepBackendException(
+                                    "not all of the financial transaction "
+                                    "lines has an amount of type Decimal")
+
+                            new_backend_id = \
+                                state_machine.backend_plugin.\
+                                batched_create_backend_transaction(fin_trans)
+                        except BoKeepBackendResetException, reset_e:
+                            raise reset_e
+                        except BoKeepBackendException, e:
+                            if error_code == \
+                                    BackendDataStateMachine.ERROR_NONE:
+                                error_code = \
+                                    BackendDataStateMachine.ERROR_OTHER
+                                error_string = str(e)
+                        else:
+                            backend_ids_to_fin_trans[new_backend_id] = \
+                                fin_trans
+                            backend_ids_to_fingerprints[new_backend_id] = \
+                                financial_transaction_fingerprint(fin_trans)
 
                 except BoKeepBackendResetException, reset_e:
                     error_code = BackendDataStateMachine.ERROR_RESET
                     error_string = str(reset_e)
-                except BoKeepBackendException, e:
-                    error_code = BackendDataStateMachine.ERROR_OTHER
-                    error_string = str(e)
 
         return state_machine.data.duplicate_and_change(
             backend_ids_to_fin_trans=backend_ids_to_fin_trans,
+            backend_ids_to_fingerprints=backend_ids_to_fingerprints,
             error_code=error_code,
             error_string=error_string,
             )
@@ -201,7 +365,8 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
             state_machine.data.get_value('backend_ids_to_fin_trans')
         for backend_id, fin_trans in backend_ids_to_fin_trans.iteritems():
             try:
-                if not state_machine.backend_plugin.verify_backend_transaction(
+                if not state_machine.backend_plugin.\
+                        batched_verify_backend_transaction(
                     backend_id, fin_trans):
                     error_code = BackendDataStateMachine.ERROR_VERIFY_FAILED
                     break # for loop
@@ -233,19 +398,27 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
 
         removed_backend_ids = set()
         old_backend_ids_to_fin_trans = backend_ids_to_fin_trans.copy()
+        old_backend_ids_to_fingerprints = \
+            get_backend_ids_to_fingerprints(state_machine).copy()
         try:
             for backend_id in backend_ids_to_fin_trans.iterkeys():
-                state_machine.backend_plugin.remove_backend_transaction(
-                    backend_id)
-                removed_backend_ids.add(backend_id)
+                # a failure to remove one backend transaction doesn't stop
+                # the others from being tried
+                try:
+                    state_machine.backend_plugin.\
+                        batched_remove_backend_transaction(backend_id)
+                except BoKeepBackendResetException, reset_e:
+                    raise reset_e
+                except BoKeepBackendException, e:
+                    if error_code == BackendDataStateMachine.ERROR_NONE:
+                        error_code = \
+                            BackendDataStateMachine.ERROR_CAN_NOT_REMOVE
+                        error_string = str(e)
+                else:
+                    removed_backend_ids.add(backend_id)
         except BoKeepBackendResetException, reset_e:
             error_code = BackendDataStateMachine.ERROR_RESET
             error_string = str(reset_e)
-        except BoKeepBackendException, e:
-            error_code = BackendDataStateMachine.ERROR_CAN_NOT_REMOVE
-            error_string = str(e)
-            for backend_id in removed_backend_ids:
-                del backend_ids_to_fin_trans[backend_id]
         else:
             for backend_id in removed_backend_ids:
                 del backend_ids_to_fin_trans[backend_id]
@@ -253,19 +426,137 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
         return state_machine.data.duplicate_and_change(
             backend_ids_to_fin_trans=backend_ids_to_fin_trans,
             old_backend_ids_to_fin_trans=old_backend_ids_to_fin_trans,
+            old_backend_ids_to_fingerprints=old_backend_ids_to_fingerprints,
+            error_code=error_code,
+            error_string=error_string )
+
+    def __update_backend_transactions_state_machine(state_machine,
+                                                    next_state):
+        """Updates the backend transactions listed in the state machine
+        data in place with the current financial transactions
+
+        Backend transactions whose fingerprint matches one of the
+        current financial transactions are left alone, the rest are
+        paired up with the remaining financial transactions in backend id
+        order. backend_update_possible_state_machine has already checked
+        that the numbers match up.
+        """
+        # this function doesn't make sense to call when the error flag is up
+        assert(state_machine.data.get_value('error_code') ==
+               BackendDataStateMachine.ERROR_NONE)
+        error_code = state_machine.data.get_value('error_code')
+        error_string = state_machine.data.get_value('error_string')
+        old_backend_ids_to_fin_trans = \
+            state_machine.data.get_value('backend_ids_to_fin_trans').copy()
+        old_backend_ids_to_fingerprints = \
+            get_backend_ids_to_fingerprints(state_machine).copy()
+        backend_ids_to_fin_trans = old_backend_ids_to_fin_trans.copy()
+        backend_ids_to_fingerprints = old_backend_ids_to_fingerprints.copy()
+
+        fin_trans_list = get_well_formed_financial_transactions(state_machine)
+        assert( fin_trans_list != None and
+                len(fin_trans_list) == len(backend_ids_to_fin_trans) )
+
+        # pair up unchanged financial transactions with thier backend ids
+        # so they can be left alone
+        changed_backend_ids = sorted(backend_ids_to_fin_trans.iterkeys())
+        changed_fin_trans = []
+        for fin_trans in fin_trans_list:
+            fingerprint = financial_transaction_fingerprint(fin_trans)
+            for backend_id in changed_backend_ids:
+                if backend_ids_to_fingerprints.get(backend_id) == fingerprint:
+                    changed_backend_ids.remove(backend_id)
+                    backend_ids_to_fin_trans[backend_id] = fin_trans
+                    break # for backend_id
+            else:
+                changed_fin_trans.append(fin_trans)
+        assert( len(changed_backend_ids) == len(changed_fin_trans) )
+
+        try:
+            for backend_id, fin_trans in zip(changed_backend_ids,
+                                             changed_fin_trans):
+                if not all( isinstance(line.amount, Decimal)
+                            for line in fin_trans.lines ):
+                    raise BoKeepBackendException(
+                        "not all of the financial transaction "
+                        "lines has an amount of type Decimal")
+                state_machine.backend_plugin.update_backend_transaction(
+                    backend_id, backend_ids_to_fin_trans[backend_id],
+                    fin_trans)
+                backend_ids_to_fin_trans[backend_id] = fin_trans
+                backend_ids_to_fingerprints[backend_id] = \
+                    financial_transaction_fingerprint(fin_trans)
+        except BoKeepBackendResetException, reset_e:
+            error_code = BackendDataStateMachine.ERROR_RESET
+            error_string = str(reset_e)
+        except BoKeepBackendException, e:
+            error_code = BackendDataStateMachine.ERROR_OTHER
+            error_string = str(e)
+
+        return state_machine.data.duplicate_and_change(
+            backend_ids_to_fin_trans=backend_ids_to_fin_trans,
+            old_backend_ids_to_fin_trans=old_backend_ids_to_fin_trans,
+            backend_ids_to_fingerprints=backend_ids_to_fingerprints,
+            old_backend_ids_to_fingerprints=old_backend_ids_to_fingerprints,
             error_code=error_code,
             error_string=error_string )
 
     def __restore_old_backend_ids(state_machine, next_state):
+        if state_machine.data.has_value('old_backend_ids_to_fingerprints'):
+            backend_ids_to_fingerprints = state_machine.data.get_value(
+                'old_backend_ids_to_fingerprints').copy()
+        else:
+            backend_ids_to_fingerprints = \
+                get_backend_ids_to_fingerprints(state_machine)
         return state_machine.data.duplicate_and_change(
             backend_ids_to_fin_trans=state_machine.data.get_value(
-                'old_backend_ids_to_fin_trans') )
+                'old_backend_ids_to_fin_trans'),
+            backend_ids_to_fingerprints=backend_ids_to_fingerprints )
     
     def __lose_old_backend_ids(state_machine, next_state):
+        backend_ids_to_fin_trans = state_machine.data.get_value(
+            'backend_ids_to_fin_trans')
+        backend_ids_to_fingerprints = dict(
+            (backend_id, fingerprint)
+            for backend_id, fingerprint in \
+                get_backend_ids_to_fingerprints(state_machine).iteritems()
+            if backend_id in backend_ids_to_fin_trans )
         return state_machine.data.duplicate_and_change(
-            old_backend_ids_to_fin_trans=state_machine.data.get_value(
-                'backend_ids_to_fin_trans') )
-
+            old_backend_ids_to_fin_trans=backend_ids_to_fin_trans,
+            backend_ids_to_fingerprints=backend_ids_to_fingerprints,
+            old_backend_ids_to_fingerprints=backend_ids_to_fingerprints.copy())
+
+    # predictions of the backend work the transition functions above
+    # will ask for, these have to stay in step with them,
+    # see predict_backend_work
+
+    def __predict_create_work(state_machine):
+        fin_trans_list = get_well_formed_financial_transactions(state_machine)
+        if fin_trans_list == None:
+            return []
+        return [ ( (CREATE_WORK, financial_transaction_fingerprint(fin_trans)),
+                   fin_trans )
+                 for fin_trans in fin_trans_list
+                 if all( isinstance(line.amount, Decimal)
+                         for line in fin_trans.lines ) ]
+
+    def __predict_verify_work(state_machine):
+        return [ ( (VERIFY_WORK, backend_id,
+                    financial_transaction_fingerprint(fin_trans)),
+                   (backend_id, fin_trans) )
+                 for backend_id, fin_trans in state_machine.data.get_value(
+                'backend_ids_to_fin_trans').iteritems() ]
+
+    def __predict_remove_work(state_machine):
+        return [ ( (REMOVE_WORK, backend_id), backend_id )
+                 for backend_id in state_machine.data.get_value(
+                'backend_ids_to_fin_trans').iterkeys() ]
+
+    __work_predictors = {
+        __create_backend_transaction_state_machine: __predict_create_work,
+        __backend_data_verify_state_machine: __predict_verify_work,
+        __remove_backend_transactions_state_machine: __predict_remove_work,
+        }
 
     # state machine inputs
     # keep these syncronized with MACHINE_INPUT_STRINGS
@@ -331,9 +622,17 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
      # FIXME, differnet comment for each
      BACKEND_HELD_WAIT_SAVE, # 6
      BACKEND_HELD, # 7
-     ) = range(7+1)
-
-    # it's notable that only one state (BACKEND_OLD_TO_BE_REMOVED) is transient,
+     # the transaction was marked dirty, but its financial transactions
+     # turned out to be the same as the ones in the backend, so
+     # all that's left is to wait for the save to go back to BACKEND_SYNCED
+     BACKEND_UNCHANGED_WAIT_SAVE, # 8
+     # preparing to update old backend transactions in place,
+     # verification just took place on the way here
+     BACKEND_OLD_TO_BE_UPDATED, # 9
+     ) = range(9+1)
+
+    # it's notable that only two states (BACKEND_OLD_TO_BE_REMOVED and
+    # BACKEND_OLD_TO_BE_UPDATED) are transient,
     # all of the others can stop the state to state iteration
     __backend_rule_table = (
         # Rules for state NO_BACKEND_EXIST [0]
@@ -415,6 +714,14 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
           (particular_input_state_machine(
                     BACKEND_LEAVE_ALONE_REQUESTED),
            state_machine_do_nothing, BACKEND_HELD),
+          # if the financial transactions haven't actually changed,
+          # leave the backend alone
+          (financial_transactions_unchanged_state_machine,
+           state_machine_do_nothing, BACKEND_UNCHANGED_WAIT_SAVE),
+          # if the backend can update in place, verify before we do that
+          (backend_update_possible_state_machine,
+           __backend_data_verify_state_machine,
+           BACKEND_OLD_TO_BE_UPDATED),
           # otherwise, we're doing a verify followed by a remove
           # always check if backend data has changed
           (state_machine_always_true,
@@ -424,7 +731,7 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
         
         # Rules for state BACKEND_OLD_TO_BE_REMOVED [4]
         # if the verify failed, we're not going to do removal!
-        # This is the only transient state
+        # This is one of two transient states, see BACKEND_OLD_TO_BE_UPDATED
           # is this really fair if we got here from
           # BACKEND_SYNCED->BACKEND_OUT_OF_SYNC, if there was
           # never an error and just a reset, what's the big deal?
@@ -480,6 +787,34 @@ class BackendDataStateMachine(FunctionAndDataDrivenStateMachine):
            __clear_error_flag_and_msg_state_machine,
            BACKEND_OLD_TO_BE_REMOVED),
           ), # end rules for BACKEND_HELD        
+
+        # Rules for BACKEND_UNCHANGED_WAIT_SAVE [8]
+        ( (error_in_state_machine_data_is(ERROR_RESET),
+           __restore_old_backend_ids, BACKEND_OUT_OF_SYNC),
+          (error_in_state_machine_data_is(),
+           state_machine_do_nothing,
+           BACKEND_OUT_OF_SYNC),
+          (particular_input_state_machine(LAST_ACT_SAVE),
+           state_machine_do_nothing, BACKEND_SYNCED),
+          ), # end rules for BACKEND_UNCHANGED_WAIT_SAVE
+
+        # Rules for BACKEND_OLD_TO_BE_UPDATED [9]
+        # like BACKEND_OLD_TO_BE_REMOVED, if the verify failed we're
+        # not going to do the update
+        ( (error_in_state_machine_data_is(
+                    ERROR_VERIFY_FAILED),
+           state_machine_do_nothing, BACKEND_HELD_WAIT_SAVE),
+          (error_in_state_machine_data_is(ERROR_RESET),
+           __restore_old_backend_ids, BACKEND_OUT_OF_SYNC),
+          (error_in_state_machine_data_is(),
+           state_machine_do_nothing,
+           BACKEND_OUT_OF_SYNC),
+          # after the update we're in the same position as after a
+          # creation, waiting for the save
+          (state_machine_always_true,
+           __update_backend_transactions_state_machine,
+           BACKEND_CREATION_TRIED),
+          ), # end rules for BACKEND_OLD_TO_BE_UPDATED
         ) # end state list
         
 
@@ -489,7 +824,8 @@ class RobustBackendPlugin(BackendPlugin):
     A Bo-Keep backend plugin does not need to be a subclass of
     bokeep.backend_plugins.plugin.BackendPlugin, but it must implement the
     following functions shown here:
-    mark_transaction_dirty, mark_transaction_for_removal,
+    mark_transaction_dirty, mark_transactions_dirty,
+    mark_transaction_for_removal,
     mark_transaction_for_verification, mark_transaction_for_hold,
     mark_transaction_for_forced_remove, transaction_is_clean,
     reason_transaction_is_dirty, flush_backend, close
@@ -582,16 +918,21 @@ class RobustBackendPlugin(BackendPlugin):
         # backend transaction state machines
         #
         # perhaps this should be volitile?
-        self.__front_end_to_back = {}
+        #
+        # These are all BTrees so that a commit only has to write out
+        # the buckets that were touched instead of re-pickling an entry
+        # for every transaction in the book. (they were a dict, dict and
+        # set in older books, see ensure_transaction_containers)
+        self.__front_end_to_back = IOBTree()
 
         # mapping of front end transaction identifiers to an input
         # for that transaction's state machine
-        self.dirty_transaction_set = {}
+        self.dirty_transaction_set = IIBTree()
         # set of front end transaction identified that are dirty, but
         # but are considered impossible to syncronize and are thus being
         # held instead of subjected to failed attempt after failed
         # attempt to syncrhonize
-        self.held_transaction_set = set()
+        self.held_transaction_set = IITreeSet()
 
         # invarient, an active transaction identifier is always found in
         # the keys of __front_end_to_back, and may be in the keys of
@@ -600,6 +941,17 @@ class RobustBackendPlugin(BackendPlugin):
         # self.__transaction_invarient(trans_id) allows this last part
         # to be checked
 
+    def ensure_transaction_containers(self):
+        """Converts the dict and set containers used by books created
+        prior to the switch to BTrees, does nothing once that's done.
+        """
+        if not isinstance(self.__front_end_to_back, IOBTree):
+            self.__front_end_to_back = IOBTree(self.__front_end_to_back)
+        if not isinstance(self.dirty_transaction_set, IIBTree):
+            self.dirty_transaction_set = IIBTree(self.dirty_transaction_set)
+        if not isinstance(self.held_transaction_set, IITreeSet):
+            self.held_transaction_set = IITreeSet(self.held_transaction_set)
+
     # START MANDATORY BO-KEEP BACKEND PLUGIN API
         
     @ends_with_commit
@@ -612,6 +964,19 @@ class RobustBackendPlugin(BackendPlugin):
         trans_id -- Bo-keep identifier for the transaction
         transaction -- The actual bo-keep transaction
         """
+        self.__mark_transaction_dirty_without_commit(trans_id, transaction)
+
+    @ends_with_commit
+    def mark_transactions_dirty(self, trans_id_and_transaction_pairs):
+        """Bulk equivilent of mark_transaction_dirty, takes an iterable of
+        (trans_id, transaction) pairs and commits once at the end instead
+        of once per transaction.
+        """
+        for trans_id, transaction in trans_id_and_transaction_pairs:
+            self.__mark_transaction_dirty_without_commit(trans_id, transaction)
+
+    def __mark_transaction_dirty_without_commit(self, trans_id, transaction):
+        self.ensure_transaction_containers()
         self.__transaction_invarient(trans_id)
         self.__raise_if_held_state(trans_id)
 
@@ -634,7 +999,6 @@ class RobustBackendPlugin(BackendPlugin):
         else:
             self.__front_end_to_back[trans_id] = \
                 self.__create_new_state_machine(trans_id, transaction)
-        self._p_changed = True
 
     @ends_with_commit
     def mark_transaction_for_removal(self, trans_id):
@@ -645,6 +1009,7 @@ class RobustBackendPlugin(BackendPlugin):
 
         trans_id -- Bo-Keep transaction id
         """
+        self.ensure_transaction_containers()
         self.__transaction_invarient(trans_id)
         if trans_id not in self.__front_end_to_back:
             raise BoKeepBackendException("%s not a valid transaction id"
@@ -653,7 +1018,6 @@ class RobustBackendPlugin(BackendPlugin):
         self.dirty_transaction_set[trans_id] = \
             BackendDataStateMachine.BACKEND_SAFE_REMOVE_REQUESTED
         self.__transaction_invarient(trans_id)
-        self._p_changed = True
     
     @ends_with_commit
     def mark_transaction_for_verification(self, trans_id):
@@ -670,6 +1034,7 @@ class RobustBackendPlugin(BackendPlugin):
         transaction_is_clean . If you find it isn't clean, you can call
         reason_transaction_is_dirty to find out why.
         """
+        self.ensure_transaction_containers()
         self.__transaction_invarient(trans_id)
 
         if trans_id in self.dirty_transaction_set and \
@@ -688,10 +1053,10 @@ class RobustBackendPlugin(BackendPlugin):
         self.__remove_trans_id_from_held_set_if_there(trans_id)
         self.dirty_transaction_set[trans_id] = \
             BackendDataStateMachine.BACKEND_VERIFICATION_REQUESTED
-        self._p_changed = True
 
     @ends_with_commit
     def mark_transaction_for_hold(self, trans_id):
+        self.ensure_transaction_containers()
         self.__transaction_invarient(trans_id)
 
         if trans_id not in self.__front_end_to_back:
@@ -704,7 +1069,6 @@ class RobustBackendPlugin(BackendPlugin):
         if not self.__trans_id_in_held_set(trans_id):
             self.dirty_transaction_set[trans_id] = \
                 BackendDataStateMachine.BACKEND_LEAVE_ALONE_REQUESTED
-            self._p_changed = True
 
     @ends_with_commit
     def mark_transaction_for_forced_remove(self, trans_id):
@@ -713,6 +1077,7 @@ class RobustBackendPlugin(BackendPlugin):
         again after, you have to flush_backend() after this, and then call
         mark_transaction_as_dirty and flush_backend()
         """
+        self.ensure_transaction_containers()
         self.__transaction_invarient(trans_id)
         if self.__trans_id_in_held_set(trans_id):
             self.__transaction_invarient(trans_id)
@@ -720,7 +1085,6 @@ class RobustBackendPlugin(BackendPlugin):
             self.dirty_transaction_set[trans_id] = \
                 BackendDataStateMachine.BACKEND_BLOWOUT_REQUESTED
             self.__transaction_invarient(trans_id)
-            self._p_changed = True
         else:
             raise BoKeepBackendException(
                 "You can't request a forced remove unless a transaction has "
@@ -735,6 +1099,7 @@ class RobustBackendPlugin(BackendPlugin):
         """Returns True if a transaction is not dirty, marked for removal,
         or in any other state than the normal one
         """
+        self.ensure_transaction_containers()
         if trans_id not in self.__front_end_to_back:
             raise BoKeepBackendException(
                 "A transaction must exist to be considered clean")
@@ -758,6 +1123,7 @@ class RobustBackendPlugin(BackendPlugin):
         You will get an error if you call this when trans_id doesn't
         exist
         """
+        self.ensure_transaction_containers()
         error_code = self.__front_end_to_back[trans_id].data.get_value(
             'error_code')
         clean_status = self.transaction_is_clean(trans_id)
@@ -787,55 +1153,103 @@ class RobustBackendPlugin(BackendPlugin):
                 self.__front_end_to_back[trans_id].data.get_value(
                     'error_string') )
     
-    def flush_backend(self):
+    def flush_backend(self, max_items=None, time_budget=None):
         """Take all transactions that are dirty or marked for removal
         writes them out / removes them out if possible.
 
+        Dirty transactions are gone through in slices in order of trans_id,
+        each slice ends with a save() and a commit. With the default
+        arguments there's just the one slice with everything. max_items
+        alone does one slice of up to that many. With a time_budget (in
+        seconds) slices (of max_items or DEFAULT_FLUSH_SLICE_SIZE) keep
+        being done until they've all been through or the time is up. A
+        later call carries on from where the last one left off, so a caller
+        can keep flushing a bit at a time while it's got other things to do.
+
+        Returns how many dirty transactions are still waiting to be gotten
+        to, 0 means they've all been through (which isn't to say they're
+        all clean now). None means the backend can't be written to and
+        nothing was gotten to.
+
         When this is done, it does a zopedb transaction commit, if you're
         sharing a zopedb thread with this you'll want to be sure your data
-        is in a state you're comfortable having commited
+        is in a state you're comfortable having commited. In a
+        bokeep.util.UnitOfWork those commits are left for the end of it,
+        and a rollback of it would forget what was saved to the backend,
+        so don't call this in one.
         """
+        self.ensure_transaction_containers()
         # if we can write to the backend
-        if self.can_write():
-            dirty_set_copy = self.dirty_transaction_set.copy()
+        if not self.can_write():
+            return None
+        if time_budget == None:
+            return self.__flush_slice(max_items)
+        if max_items == None:
+            max_items = DEFAULT_FLUSH_SLICE_SIZE
+        start_time = time()
+        while True:
+            remaining = self.__flush_slice(max_items)
+            if remaining == 0 or time() - start_time >= time_budget:
+                return remaining
+
+    def __flush_slice(self, max_items):
+        # pick up after the last transaction of the last slice, unless the
+        # slice is everything
+        flush_cursor = getattr(self, '_v_flush_cursor', None)
+        if max_items == None or flush_cursor == None:
+            keys = self.dirty_transaction_set.keys()
+        else:
+            keys = self.dirty_transaction_set.keys(
+                min=flush_cursor, excludemin=True)
+        slice_keys = list(islice(keys, max_items))
+
+        dirty_set_copy = dict( (trans_id, self.dirty_transaction_set[trans_id])
+                               for trans_id in slice_keys )
+        try:
+            self.__advance_all_dirty_transaction_state_machine(
+                True, slice_keys)
+
+            # save, and let the dirty transactions change thier state
+            # with the knowledge that a save just took place
             try:
-                self.__advance_all_dirty_transaction_state_machine(True)
+                self.save()
+            except BoKeepBackendException, e:
+                # call close, which also triggers
+                # __set_all_transactions_to_reset_and_advance()
+                self.close('called close() because save failed ' + \
+                               str(e)) 
+            else:
+                for dirty_trans_id in slice_keys:
+                    self.dirty_transaction_set[dirty_trans_id] = \
+                        BackendDataStateMachine.LAST_ACT_SAVE
+                commit_unless_in_unit_of_work()
+                self.__advance_all_dirty_transaction_state_machine(
+                    keys=slice_keys)
+
+        except BoKeepBackendResetException, reset_except:
+            if str(reset_except) != '':
+                self.__set_all_transactions_to_reset_and_advance(
+                    str(reset_except))
+            else:
+                self.__set_all_transactions_to_reset_and_advance()
 
-                # save, and let all dirty transactions change thier state
-                # with the knowledge that a save just took place
-                try:
-                    self.save()
-                except BoKeepBackendException, e:
-                    # call close, which also triggers
-                    # __set_all_transactions_to_reset_and_advance()
-                    self.close('called close() because save failed ' + \
-                                   str(e)) 
-                else:
-                    for dirty_trans_id in self.dirty_transaction_set.iterkeys():
-                        self.dirty_transaction_set[dirty_trans_id] = \
-                            BackendDataStateMachine.LAST_ACT_SAVE
-                    self._p_changed = True
-                    transaction.get().commit()
-                    self.__advance_all_dirty_transaction_state_machine()
-
-            except BoKeepBackendResetException, reset_except:
-                if str(reset_except) != '':
-                    self.__set_all_transactions_to_reset_and_advance(
-                        str(reset_except))
-                else:
-                    self.__set_all_transactions_to_reset_and_advance()
+        commit_unless_in_unit_of_work()
 
-            self._p_changed = True
-            transaction.get().commit()
+        self.__update_dirty_and_held_transaction_sets(slice_keys)
+        for trans_id, original_input_value in \
+                dirty_set_copy.iteritems():
+            if trans_id in self.dirty_transaction_set:
+                self.dirty_transaction_set[trans_id] = \
+                    original_input_value
+        commit_unless_in_unit_of_work()
 
-            self.__update_dirty_and_held_transaction_sets()
-            for trans_id, original_input_value in \
-                    dirty_set_copy.iteritems():
-                if trans_id in self.dirty_transaction_set:
-                    self.dirty_transaction_set[trans_id] = \
-                        original_input_value
-            self._p_changed = True
-            transaction.get().commit()
+        if len(slice_keys) == 0:
+            remaining = 0
+        else:
+            remaining = len(self.dirty_transaction_set.keys(
+                    min=slice_keys[-1], excludemin=True))
+        self._v_flush_cursor = None if remaining == 0 else slice_keys[-1]
+        return remaining
 
     @ends_with_commit
     def close(self, close_reason='reset because close() was called'):
@@ -846,6 +1260,7 @@ class RobustBackendPlugin(BackendPlugin):
 
         Any other calls made since the last call to flush_backend may be lost()
         """
+        self.ensure_transaction_containers()
         self.__set_all_transactions_to_reset_and_advance(close_reason)
 
     @ends_with_commit
@@ -888,13 +1303,54 @@ class RobustBackendPlugin(BackendPlugin):
 
     # END MANDATORY BO-KEEP BACKEND PLUGIN API
 
+    def check_backend_consistency(self, trans_ids=None):
+        """Compares what's in the backend for every clean transaction
+        (or just the clean ones in trans_ids) to the financial transactions
+        it was created from, all in one call to
+        find_backend_transactions_mismatches.
+
+        Nothing is changed, this just reports. Returns a dictionary of
+        trans_id to a list of (backend_ident, BackendTransactionMismatch list)
+        pairs for the transactions that don't match.
+
+        Raises BoKeepBackendException if the backend can't be used right now
+        """
+        self.ensure_transaction_containers()
+        if not self.can_write():
+            raise BoKeepBackendException(
+                "the backend can't be checked because it isn't available")
+        if trans_ids == None:
+            trans_ids = self.__front_end_to_back.iterkeys()
+        trans_ids_and_pairs = [
+            (trans_id, backend_ident, fin_trans)
+            for trans_id in trans_ids
+            if trans_id in self.__front_end_to_back and
+            self.transaction_is_clean(trans_id)
+            for backend_ident, fin_trans in
+            self.__front_end_to_back[trans_id].data.get_value(
+                'backend_ids_to_fin_trans').iteritems()
+            ]
+        results = self.find_backend_transactions_mismatches(
+            [ (backend_ident, fin_trans)
+              for trans_id, backend_ident, fin_trans in trans_ids_and_pairs ] )
+        assert( len(results) == len(trans_ids_and_pairs) )
+        return_value = {}
+        for (trans_id, backend_ident, fin_trans), mismatches in \
+                zip(trans_ids_and_pairs, results):
+            if isinstance(mismatches, Exception):
+                mismatches = [ BackendTransactionMismatch(
+                        BACKEND_ERROR_MISMATCH, None, str(mismatches) ) ]
+            if len(mismatches) > 0:
+                return_value.setdefault(trans_id, []).append(
+                    (backend_ident, mismatches) )
+        return return_value
+
     def front_end_to_back_del(self, key):
         del self.__front_end_to_back[key]
 
     def __remove_trans_id_from_held_set_if_there(self, trans_id):
         if self.__trans_id_in_held_set(trans_id):
             self.held_transaction_set.remove(trans_id)
-        self._p_changed = True
 
     def __trans_id_in_held_set(self, trans_id):
         return trans_id in self.held_transaction_set
@@ -903,9 +1359,17 @@ class RobustBackendPlugin(BackendPlugin):
         assert( not (trans_id in self.held_transaction_set and
                      trans_id in self.dirty_transaction_set ) )
 
-    def __advance_all_dirty_transaction_state_machine(self, clear_error=False):
+    def __advance_all_dirty_transaction_state_machine(
+        self, clear_error=False, keys=None):
+        # keys limits this to some of the dirty transactions
+        if keys == None:
+            keys = list(self.dirty_transaction_set.iterkeys())
+        if self.can_batch_backend_transactions():
+            self.__advance_all_dirty_transaction_state_machine_batched(
+                clear_error, keys)
+            return
         # advance all diryt state machines
-        for key in self.dirty_transaction_set.iterkeys():
+        for key in keys:
             # but only ones that still exist..
             if key in self.__front_end_to_back:
                 if self.__front_end_to_back[key].state == \
@@ -922,6 +1386,123 @@ class RobustBackendPlugin(BackendPlugin):
                         self.__front_end_to_back[key].data.get_value(
                             'error_string') )
 
+    def __advance_all_dirty_transaction_state_machine_batched(
+        self, clear_error, keys):
+        # Same as __advance_all_dirty_transaction_state_machine, except
+        # that the state machines are advanced one step at a time together
+        # so that the backend work of each step can be collected up and
+        # dispatched in batches. The transition functions then pick up
+        # their results with the batched_*_backend_transaction functions
+        keys = [ key for key in keys if key in self.__front_end_to_back ]
+        if clear_error:
+            for key in keys:
+                if self.__front_end_to_back[key].state == \
+                        BackendDataStateMachine.BACKEND_OUT_OF_SYNC:
+                    self.__front_end_to_back[key].error_override(
+                        BackendDataStateMachine.ERROR_NONE, None)
+
+        while len(keys) > 0:
+            self.__dispatch_batched_backend_work(keys)
+            still_changing = []
+            try:
+                for key in keys:
+                    # state machines can remove themselves
+                    if key not in self.__front_end_to_back:
+                        continue
+                    state_machine = self.__front_end_to_back[key]
+                    old_state = state_machine.state
+                    state_machine.advance_state_machine()
+                    if old_state != state_machine.state:
+                        still_changing.append(key)
+                    elif key in self.__front_end_to_back and \
+                            state_machine.data.get_value('error_code') == \
+                            BackendDataStateMachine.ERROR_RESET:
+                        raise BoKeepBackendResetException(
+                            state_machine.data.get_value('error_string') )
+            finally:
+                self.__undo_unclaimed_batched_backend_work()
+            keys = still_changing
+
+    def __dispatch_batched_backend_work(self, keys):
+        work = dict( (work_type, []) for work_type in BATCHABLE_BACKEND_WORK )
+        for key in keys:
+            for work_key, argument in \
+                    self.__front_end_to_back[key].predict_backend_work():
+                work[work_key[0]].append( (work_key, argument) )
+
+        self._v_batch_results = {}
+        for work_type, batch_function in (
+            (VERIFY_WORK, self.verify_backend_transactions),
+            (REMOVE_WORK, self.remove_backend_transactions),
+            (CREATE_WORK, self.create_backend_transactions) ):
+            if len(work[work_type]) == 0:
+                continue
+            try:
+                results = batch_function(
+                    [ argument for work_key, argument in work[work_type] ] )
+            except BoKeepBackendResetException, reset_e:
+                # everything in the batch is lost to the reset
+                results = [reset_e] * len(work[work_type])
+            assert( len(results) == len(work[work_type]) )
+            for (work_key, argument), result in zip(work[work_type], results):
+                self._v_batch_results.setdefault(work_key, []).append(result)
+
+    def __undo_unclaimed_batched_backend_work(self):
+        # predictions should always be claimed by the transitions they were
+        # made for, but if get_financial_transactions() changes its mind
+        # between the prediction and the transition, we don't want to leave
+        # backend transactions around that nobody knows about
+        unclaimed_backend_ids = [
+            result
+            for work_key, results in self._v_batch_results.iteritems()
+            if work_key[0] == CREATE_WORK
+            for result in results
+            if not isinstance(result, Exception) ]
+        del self._v_batch_results
+        if len(unclaimed_backend_ids) > 0:
+            # if this fails, the backend has been reset and the created
+            # transactions are gone anyway
+            try:
+                self.remove_backend_transactions(unclaimed_backend_ids)
+            except BoKeepBackendException:
+                pass
+
+    def __batched_backend_work_result(self, work_key, call_me, *args):
+        if hasattr(self, '_v_batch_results') and \
+                len(self._v_batch_results.get(work_key, ())) > 0:
+            result = self._v_batch_results[work_key].pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        else:
+            return call_me(*args)
+
+    def batched_create_backend_transaction(self, fin_trans):
+        """Returns the result of create_backend_transaction(fin_trans) from
+        the current batch, or calls it if the work wasn't batched
+        """
+        return self.__batched_backend_work_result(
+            (CREATE_WORK, financial_transaction_fingerprint(fin_trans)),
+            self.create_backend_transaction, fin_trans)
+
+    def batched_remove_backend_transaction(self, backend_ident):
+        """Returns the result of remove_backend_transaction(backend_ident)
+        from the current batch, or calls it if the work wasn't batched
+        """
+        return self.__batched_backend_work_result(
+            (REMOVE_WORK, backend_ident),
+            self.remove_backend_transaction, backend_ident)
+
+    def batched_verify_backend_transaction(self, backend_ident, fin_trans):
+        """Returns the result of
+        verify_backend_transaction(backend_ident, fin_trans) from the
+        current batch, or calls it if the work wasn't batched
+        """
+        return self.__batched_backend_work_result(
+            (VERIFY_WORK, backend_ident,
+             financial_transaction_fingerprint(fin_trans) ),
+            self.verify_backend_transaction, backend_ident, fin_trans)
+
     def __set_all_transactions_to_reset_and_advance(
         self, reset_reason="reset"):
         # find all dirty transactions
@@ -933,48 +1514,39 @@ class RobustBackendPlugin(BackendPlugin):
                     reset_reason)
                 self.__front_end_to_back[key].run_until_steady_state()
        
-    def __update_dirty_and_held_transaction_sets(self):
-        # remove from the dirty set transactions that have been tottally
-        # wiped out
-        no_longer_here = set()
-        for trans_id in self.dirty_transaction_set.iterkeys():
+    def __update_dirty_and_held_transaction_sets(self, keys=None):
+        # in one pass over the dirty set (or just keys from it), find
+        # transactions that have been tottally wiped out, transactions
+        # slated for the held set, and transactions that are now clean
+        if keys == None:
+            keys = self.dirty_transaction_set.keys()
+        no_longer_dirty = []
+        new_for_held_set = []
+        for trans_id in keys:
             self.__transaction_invarient(trans_id)
             if trans_id not in self.__front_end_to_back:
-                no_longer_here.add(trans_id)
-        for trans_id in no_longer_here:
+                no_longer_dirty.append(trans_id)
+            else:
+                state = self.__front_end_to_back[trans_id].state
+                if state == BackendDataStateMachine.BACKEND_HELD:
+                    new_for_held_set.append(trans_id)
+                elif state == BackendDataStateMachine.BACKEND_SYNCED:
+                    no_longer_dirty.append(trans_id)
+
+        # BTrees can't be changed while being iterated, so the removals
+        # from the dirty set are done after
+        for trans_id in no_longer_dirty:
             del self.dirty_transaction_set[trans_id]
             self.__transaction_invarient(trans_id)
-
-        # remove from the dirty set transactions slated for the held set
-        new_for_held_set = set()
-        for trans_id in self.dirty_transaction_set.iterkeys():
-            self.__transaction_invarient(trans_id)
-            state_machine = self.__front_end_to_back[trans_id]
-            if state_machine.state == BackendDataStateMachine.BACKEND_HELD:
-                new_for_held_set.add(trans_id)
         for trans_id in new_for_held_set:
             del self.dirty_transaction_set[trans_id]
-            self.held_transaction_set.add(trans_id)
-            self.__transaction_invarient(trans_id)
-
-        # remove from the dirty set if clean
-        not_so_dirty = set()
-        for trans_id in self.dirty_transaction_set.iterkeys():
-            self.__transaction_invarient(trans_id)
-            state_machine = self.__front_end_to_back[trans_id]
-            if state_machine.state == BackendDataStateMachine.BACKEND_SYNCED:
-                not_so_dirty.add(trans_id)
-        for trans_id in not_so_dirty:
-            del self.dirty_transaction_set[trans_id]
+            self.held_transaction_set.insert(trans_id)
             self.__transaction_invarient(trans_id)
-
-        self._p_changed = True
             
     def __set_state_machine_for_backend_transaction(
         self, trans_id, state_machine):
         assert( trans_id not in self.__front_end_to_back )
         self.__front_end_to_back[trans_id] = state_machine
-        self._p_changed = True
 
     def __create_new_state_machine(self, trans_id, transaction):
         # When following this, it is very important to keep in mind the
@@ -999,6 +1571,8 @@ class RobustBackendPlugin(BackendPlugin):
                 bo_keep_trans=transaction,
                 backend_ids_to_fin_trans={},
                 old_backend_ids_to_fin_trans={},
+                backend_ids_to_fingerprints={},
+                old_backend_ids_to_fingerprints={},
                 error_code=BackendDataStateMachine.ERROR_NONE,
                 error_string=None,
                 ),
@@ -1026,6 +1600,35 @@ class RobustBackendPlugin(BackendPlugin):
     def verify_backend_transaction(self, backend_ident, fin_trans):
         return True
 
+    def find_backend_transaction_mismatches(self, backend_ident, fin_trans):
+        """Returns a list of BackendTransactionMismatch, one for each way
+        the transaction identified by backend_ident differs from fin_trans,
+        an empty list means they match.
+
+        This default can only go by verify_backend_transaction, backend
+        plugins that can say what's different should override this (and
+        verify_backend_transaction in terms of it)
+        """
+        if self.verify_backend_transaction(backend_ident, fin_trans):
+            return []
+        return [ BackendTransactionMismatch(
+                MISSING_TRANSACTION_MISMATCH, backend_ident, None) ]
+
+    def can_update_backend_transactions(self):
+        # Backend plugins that implement update_backend_transaction
+        # should return True here, otherwise changed transactions are
+        # removed and re-created
+        return False
+
+    def update_backend_transaction(self, backend_ident, old_fin_trans,
+                                   new_fin_trans):
+        """Change the transaction identified by backend_ident inside the
+        actual backend from old_fin_trans to new_fin_trans, the backend
+        identifier stays the same
+        """
+        raise Exception("backend plugins that can_update_backend_transactions "
+                        "must implement update_backend_transaction")
+
     def create_backend_transaction(self, fin_trans):
         """Create a transaction inside the actual backend based on fin_trans
         """
@@ -1033,3 +1636,81 @@ class RobustBackendPlugin(BackendPlugin):
                         "create_backend_transaction")
     def save(self):
         raise Exception("backend plugins must implement save()")
+
+    def can_batch_backend_transactions(self):
+        # Backend plugins that get something out of receiving a whole
+        # flush worth of work at once should return True here and override
+        # any of create_backend_transactions, remove_backend_transactions
+        # and verify_backend_transactions
+        return False
+
+    def create_backend_transactions(self, fin_trans_list):
+        """Create a transaction inside the actual backend for each
+        FinancialTransaction in fin_trans_list.
+
+        Returns a list with a backend identifier, or the
+        BoKeepBackendException that prevented creation, for each one.
+        Raising BoKeepBackendResetException means all of them were lost
+        """
+        results = []
+        for fin_trans in fin_trans_list:
+            try:
+                results.append(self.create_backend_transaction(fin_trans))
+            except BoKeepBackendResetException, reset_e:
+                raise reset_e
+            except BoKeepBackendException, e:
+                results.append(e)
+        return results
+
+    def remove_backend_transactions(self, backend_idents):
+        """Remove each of the transactions identified in backend_idents
+        from the actual backend.
+
+        Returns a list with None, or the BoKeepBackendException that
+        prevented removal, for each one.
+        """
+        results = []
+        for backend_ident in backend_idents:
+            try:
+                results.append(self.remove_backend_transaction(backend_ident))
+            except BoKeepBackendResetException, reset_e:
+                raise reset_e
+            except BoKeepBackendException, e:
+                results.append(e)
+        return results
+
+    def verify_backend_transactions(self, backend_ident_and_fin_trans_pairs):
+        """Verify each (backend_ident, fin_trans) pair.
+
+        Returns a list with the True/False verification result, or the
+        BoKeepBackendException that prevented verification, for each one.
+        """
+        results = []
+        for backend_ident, fin_trans in backend_ident_and_fin_trans_pairs:
+            try:
+                results.append(
+                    self.verify_backend_transaction(backend_ident, fin_trans) )
+            except BoKeepBackendResetException, reset_e:
+                raise reset_e
+            except BoKeepBackendException, e:
+                results.append(e)
+        return results
+
+    def find_backend_transactions_mismatches(
+        self, backend_ident_and_fin_trans_pairs):
+        """find_backend_transaction_mismatches for each
+        (backend_ident, fin_trans) pair.
+
+        Returns a list with the list of BackendTransactionMismatch, or the
+        BoKeepBackendException that prevented checking, for each one.
+        """
+        results = []
+        for backend_ident, fin_trans in backend_ident_and_fin_trans_pairs:
+            try:
+                results.append(self.find_backend_transaction_mismatches(
+                        backend_ident, fin_trans) )
+            except BoKeepBackendResetException, reset_e:
+                raise reset_e
+            except BoKeepBackendException, e:
+                results.append(e)
+        return results
@@ -25,8 +25,15 @@ from session_based_robust_backend_plugin import SessionBasedRobustBackendPlugin
 from bokeep.util import attribute_or_blank
 from bokeep.backend_plugins.serialfile_backend_config import \
     SerialFileConfigDialog
+from bokeep.backend_plugins.serialfile_records import \
+    RECORD_CREATE, RECORD_UPDATE, RECORD_REMOVE, LIVE_RECORD_OPS, \
+    SerialRecordIndex, record_fields_of_fin_trans, encode_record, \
+    decode_record, record_matches_fields, read_record_at, \
+    compact_serial_record_file
 from decimal import Decimal 
 from sys import stderr
+from os import fsync, SEEK_END
+from os.path import exists, getsize
 
 # gtk imports
 from gtk import \
@@ -36,16 +43,151 @@ from gtk import \
 
 ZERO = Decimal(0)
 
+# when SerialFilePlugin.save() does an fsync, see SerialFilePlugin.fsync_policy
+FSYNC_POLICIES = (FSYNC_EVERY_SAVE, FSYNC_EVERY_N_RECORDS, FSYNC_NEVER) = \
+    ('save', 'records', 'never')
+
+# how SerialFilePlugin writes records, see SerialFilePlugin.record_format
+RECORD_FORMATS = (RECORD_FORMAT_TEXT, RECORD_FORMAT_JSON) = ('text', 'json')
+
+CREATED_RECORD_PREFIX = "transaction with identifier "
+TAIL_READ_SIZE = 4096
+
+def serial_file_ends_cleanly(file_name):
+    """False if the last record in file_name was cut short (e.g. by a
+    crash while it was being written)
+    """
+    if not exists(file_name) or getsize(file_name) == 0:
+        return True
+    f = open(file_name, 'rb')
+    try:
+        f.seek(-1, SEEK_END)
+        return f.read(1) == '\n'
+    finally:
+        f.close()
+
+def last_created_identifier(file_name):
+    """The identifier of the last transaction created in the serial file
+    file_name, or None if there isn't one (or no file).
+
+    Only as much of the end of the file as it takes to find it is read.
+    """
+    try:
+        f = open(file_name, 'rb')
+    except IOError:
+        return None
+    try:
+        f.seek(0, SEEK_END)
+        position = f.tell()
+        tail = ''
+        while position > 0:
+            read_size = min(TAIL_READ_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            tail = f.read(read_size) + tail
+            lines = tail.split('\n')
+            # the first line may be cut off unless we're at the start
+            if position > 0:
+                lines = lines[1:]
+            for line in reversed(lines):
+                if line.startswith(CREATED_RECORD_PREFIX):
+                    try:
+                        return int(line[len(CREATED_RECORD_PREFIX):])
+                    except ValueError:
+                        # a record cut short by a crash
+                        continue
+        return None
+    finally:
+        f.close()
+
+def serial_text_of_fin_trans(fin_trans):
+    description = attribute_or_blank(fin_trans, "description")
+    chequenum = attribute_or_blank(fin_trans, "chequenum")
+    debits = []
+    credits = []
+    for trans_line in fin_trans.lines:
+        if trans_line.amount >= ZERO:
+            debits.append(trans_line)
+        else:
+            credits.append(trans_line)
+
+    def str_repr_of_line(line, reverse=False):
+        amount = line.amount
+        if reverse:
+            amount = -amount
+        return "%s %s" % (amount,
+                          attribute_or_blank(line, 'line_memo') )
+
+    return """%(description)s
+chequenum %(chequenum)s
+debits
+%(debit_list)s
+credits
+%(credit_list)s
+
+""" % { 'description': description,
+        'chequenum': chequenum,
+        'debit_list' : \
+            '\n'.join(
+                        str_repr_of_line(line)
+                        for line in debits
+                        ),
+        'credit_list': \
+            "\n".join( str_repr_of_line(line, True)
+                       for line in credits )
+        }
+
 class SerialFilePlugin(SessionBasedRobustBackendPlugin):
+    """Writes transactions out to a file, one record after another.
+
+    New serial files are written in RECORD_FORMAT_JSON, one JSON record
+    per line with an index beside the file (see
+    bokeep.backend_plugins.serialfile_records), so verify_backend_transaction
+    can look up and compare a single record, removes are tombstones, and
+    compact() rewrites the file without the dead records. Plugins created
+    before that stay with the free form RECORD_FORMAT_TEXT, where verifying
+    always succeeds and there's no compacting.
+
+    Records are held in a buffer until save(), which appends them all with
+    a single write. Whether that's followed by an fsync depends on
+    fsync_policy, FSYNC_EVERY_SAVE (the default), FSYNC_EVERY_N_RECORDS
+    (once at least fsync_record_interval records have been written since
+    the last one) or FSYNC_NEVER. These can be changed with setattr.
+
+    The record counter (count) is checked against the file each time it's
+    opened, so identifiers aren't re-used if the file got further than the
+    database did before a crash.
+    """
+    fsync_policy = FSYNC_EVERY_SAVE
+    fsync_record_interval = 100
+    # what instances from before there was a choice were writing
+    record_format = RECORD_FORMAT_TEXT
+
     def __init__(self):
         SessionBasedRobustBackendPlugin.__init__(self)
         self.count = 0
         self.accounting_file = "AccountingFile.txt"
+        self.record_format = RECORD_FORMAT_JSON
+
+    def uses_record_index(self):
+        return self.record_format == RECORD_FORMAT_JSON
 
     def open_session(self):
+        self.__discard_write_buffer()
+        self.__close_read_file()
         try:
+            if self.uses_record_index():
+                self._v_record_index = SerialRecordIndex(self.accounting_file)
+                last_identifier = self._v_record_index.max_ident()
+            else:
+                last_identifier = last_created_identifier(self.accounting_file)
+            if last_identifier != None and last_identifier >= self.count:
+                self.count = last_identifier + 1
+            # keep what we write from running into a partial record
+            if not serial_file_ends_cleanly(self.accounting_file):
+                self.write_to_file("\n")
             return open(self.accounting_file, 'a')
-        except IOError, e:
+        except (IOError, OSError), e:
             stderr.write("trouble opening %s %s" %
                          (self.accounting_file, str(e) ) )
             # its sufficient to return None here,
@@ -54,81 +196,175 @@ class SerialFilePlugin(SessionBasedRobustBackendPlugin):
             return None
 
     def write_to_file(self, msg):
-        try:
-            self._v_session_active.write(msg)
-        except IOError, e:
-            stderr.write(str(e))
-            raise BoKeepBackendException(str(e))
+        """Adds msg to what's written on the next save()"""
+        if not hasattr(self, '_v_write_buffer'):
+            self._v_write_buffer = []
+        self._v_write_buffer.append(msg)
+
+    def __write_record(self, op, ident, fields=None):
+        record_line = encode_record(op, ident, fields)
+        # remembered by position in the write buffer so save() can index
+        # it, and by identifier so it can be verified before then
+        if not hasattr(self, '_v_buffered_records'):
+            self._v_buffered_records = {}
+            self._v_pending_records = {}
+        self._v_buffered_records[
+            len(getattr(self, '_v_write_buffer', ()))] = (op, ident)
+        self._v_pending_records[ident] = decode_record(record_line)
+        self.write_to_file(record_line)
+
+    def __discard_write_buffer(self):
+        for attr in ('_v_write_buffer', '_v_buffered_records',
+                     '_v_pending_records'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+    def __read_file(self):
+        if not hasattr(self, '_v_read_file'):
+            self._v_read_file = open(self.accounting_file, 'rb')
+        return self._v_read_file
+
+    def __close_read_file(self):
+        if hasattr(self, '_v_read_file'):
+            self._v_read_file.close()
+            del self._v_read_file
+
+    def __fsync_due(self, records_written):
+        if self.fsync_policy == FSYNC_EVERY_SAVE:
+            return records_written > 0
+        elif self.fsync_policy == FSYNC_EVERY_N_RECORDS:
+            self._v_records_since_fsync = \
+                getattr(self, '_v_records_since_fsync', 0) + records_written
+            if self._v_records_since_fsync >= self.fsync_record_interval:
+                self._v_records_since_fsync = 0
+                return True
+        return False
 
     def remove_backend_transaction(self, backend_ident):
         assert( backend_ident < self.count )
-        self.write_to_file("remove transaction with identifier %s\n\n" % 
-                          backend_ident )
+        if self.uses_record_index():
+            self.__write_record(RECORD_REMOVE, backend_ident)
+        else:
+            self.write_to_file("remove transaction with identifier %s\n\n" %
+                               backend_ident )
         
     def create_backend_transaction(self, fin_trans):
-        description = attribute_or_blank(fin_trans, "description")
-        chequenum = attribute_or_blank(fin_trans, "chequenum")
-        debits = []
-        credits = []
-        for trans_line in fin_trans.lines:
-            if trans_line.amount >= ZERO:
-                debits.append(trans_line)
-            else:
-                credits.append(trans_line)
-
-        def str_repr_of_line(line, reverse=False):
-            amount = line.amount
-            if reverse:
-                amount = -amount
-            return "%s %s" % (amount,
-                              attribute_or_blank(line, 'line_memo') )
-
-        self.write_to_file( """transaction with identifier %(trans_id)s
-%(description)s
-chequenum %(chequenum)s
-debits
-%(debit_list)s
-credits
-%(credit_list)s
-
-""" % { 'trans_id': self.count,
-        'description': description,
-        'chequenum': chequenum,
-        'debit_list' : \
-            '\n'.join(
-                        str_repr_of_line(line)
-                        for line in debits
-                        ),
-        'credit_list': \
-            "\n".join( str_repr_of_line(line, True)
-                       for line in credits )
-        } )
-                      
+        if self.uses_record_index():
+            self.__write_record(RECORD_CREATE, self.count,
+                                record_fields_of_fin_trans(fin_trans) )
+        else:
+            self.write_to_file( "transaction with identifier %s\n%s" % (
+                    self.count, serial_text_of_fin_trans(fin_trans) ) )
         return_value = self.count
         self.count += 1
         return return_value
 
-    def close(self):
+    def can_update_backend_transactions(self):
+        return True
+
+    def update_backend_transaction(self, backend_ident, old_fin_trans,
+                                   new_fin_trans):
+        assert( backend_ident < self.count )
+        if self.uses_record_index():
+            self.__write_record(RECORD_UPDATE, backend_ident,
+                                record_fields_of_fin_trans(new_fin_trans) )
+        else:
+            self.write_to_file( "update transaction with identifier %s\n%s" %
+                                (backend_ident,
+                                 serial_text_of_fin_trans(new_fin_trans) ) )
+
+    def verify_backend_transaction(self, backend_ident, fin_trans):
+        """Looks up the latest record for backend_ident in the index (or
+        the ones not saved yet) and compares it to fin_trans. There's
+        nothing to compare to in RECORD_FORMAT_TEXT, so that's always True
+        """
+        if not self.uses_record_index():
+            return True
+        pending_records = getattr(self, '_v_pending_records', {})
+        if backend_ident in pending_records:
+            record = pending_records[backend_ident]
+        else:
+            offset = self._v_record_index.live_offset(backend_ident)
+            if offset == None:
+                return False
+            try:
+                record = read_record_at(self.__read_file(), offset)
+            except (IOError, OSError), e:
+                raise BoKeepBackendException(str(e))
+        return record != None and record['id'] == backend_ident and \
+            record['op'] in LIVE_RECORD_OPS and \
+            record_matches_fields(record, record_fields_of_fin_trans(fin_trans))
+
+    def compact(self):
+        """Rewrites the serial file without the records that have been
+        replaced by an update or removed, see
+        serialfile_records.compact_serial_record_file . Backend identifiers
+        stay the same. The session is closed first, so anything not
+        saved has to be saved (with flush_backend) before this.
+
+        Returns how many records were dropped.
+        """
+        if not self.uses_record_index():
+            raise BoKeepBackendException(
+                "only serial files in the %s record format can be "
+                "compacted" % RECORD_FORMAT_JSON )
+        if len(getattr(self, '_v_write_buffer', ())) > 0:
+            raise BoKeepBackendException(
+                "the serial file can't be compacted with unsaved records")
+        self.close('reset because the serial file was compacted')
         try:
-            if hasattr(self, '_v_session_active'):
-                self._v_session_active.close()
+            return compact_serial_record_file(self.accounting_file)
+        except (IOError, OSError), e:
+            stderr.write(str(e))
+            raise BoKeepBackendException(str(e))
+
+    def close(self, close_reason='reset because close() was called'):
+        # whatever hasn't been saved is lost, as promised by
+        # RobustBackendPlugin.close
+        self.__discard_write_buffer()
+        try:
+            self.__close_read_file()
+            if hasattr(self, '_v_record_index'):
+                del self._v_record_index
         except IOError:
-            # nothing to do here, super class close() will del
-            # self._v_session_active, callers of close are expecting
+            # nothing to do here, callers of close are expecting
             # us to silently catch exceptions
             pass
-        SessionBasedRobustBackendPlugin.close(self)
+        SessionBasedRobustBackendPlugin.close(self, close_reason)
+
+    def end_session(self, session_file):
+        try:
+            session_file.close()
+        except IOError:
+            # see close()
+            pass
 
     def save(self):
+        write_buffer = getattr(self, '_v_write_buffer', [])
+        buffered_records = getattr(self, '_v_buffered_records', {})
+        self.__discard_write_buffer()
+        session_file = self._v_session_active
         try:
-            self._v_session_active.close()
-        except IOError, e:
+            session_file.seek(0, SEEK_END)
+            offset = session_file.tell()
+            session_file.write(''.join(write_buffer))
+            session_file.flush()
+            do_fsync = self.__fsync_due(len(write_buffer))
+            if do_fsync:
+                fsync(session_file.fileno())
+            if self.uses_record_index():
+                # the index only ever gets entries for records that are
+                # already in the file
+                for i, record_line in enumerate(write_buffer):
+                    if i in buffered_records:
+                        op, ident = buffered_records[i]
+                        self._v_record_index.add(
+                            op, ident, offset, len(record_line) )
+                    offset += len(record_line)
+                self._v_record_index.write_pending(do_fsync)
+        except (IOError, OSError), e:
             stderr.write(str(e))
-            raise BoKeepBackendException(str(e.message))
-        finally:
-            del self._v_session_active
-                    
-        self.open_session_and_retain()
+            raise BoKeepBackendException(str(e))
 
     def configure_backend(self, parent_window=None):
         cd = SerialFileConfigDialog()
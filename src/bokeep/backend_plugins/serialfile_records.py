@@ -0,0 +1,240 @@
+# Copyright (C) 2010-2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+"""The machine readable record format of the serial file backend plugin
+(bokeep.backend_plugins.serialfile)
+
+Each record is one line with a JSON object on it, with 'op' (RECORD_CREATE,
+RECORD_UPDATE or RECORD_REMOVE) and 'id' (the backend identifier) keys, and
+for creates and updates, the financial transaction. (see
+record_fields_of_fin_trans) A remove is a tombstone, the records before it
+stay in the file until it's compacted. (compact_serial_record_file)
+
+Next to the serial file is an index (same name plus INDEX_SUFFIX) with a
+line for every record, "id op offset length", so the latest record for
+an identifier can be found with a seek instead of reading the whole file.
+The index is only ever appended to after the serial file, if it's behind
+(e.g. after a crash) SerialRecordIndex catches up from where it left off.
+"""
+
+# python imports
+from json import dumps, loads
+from os import fsync, rename, remove
+from os.path import exists, getsize
+
+# bokeep imports
+from bokeep.util import attribute_or_blank
+
+RECORD_CREATE, RECORD_UPDATE, RECORD_REMOVE = 'create', 'update', 'remove'
+LIVE_RECORD_OPS = (RECORD_CREATE, RECORD_UPDATE)
+INDEX_SUFFIX = '.idx'
+COMPACT_SUFFIX = '.compact'
+
+def record_fields_of_fin_trans(fin_trans):
+    """A dictionary of what a serial file record keeps of fin_trans, in
+    a form that survives being written out as JSON and read back in
+    """
+    trans_date = attribute_or_blank(fin_trans, "trans_date")
+    return {
+        'description': attribute_or_blank(fin_trans, "description"),
+        'chequenum': str(attribute_or_blank(fin_trans, "chequenum")),
+        'trans_date': None if trans_date == '' else str(trans_date),
+        'currency': attribute_or_blank(fin_trans, "currency"),
+        'lines': [
+            { 'amount': str(trans_line.amount),
+              'memo': attribute_or_blank(trans_line, "line_memo"),
+              'account': (list(trans_line.account_spec)
+                          if hasattr(trans_line, "account_spec") and
+                          trans_line.account_spec != None
+                          else None),
+              }
+            for trans_line in fin_trans.lines ],
+        }
+
+def encode_record(op, ident, fields=None):
+    record = {} if fields == None else dict(fields)
+    record['op'] = op
+    record['id'] = ident
+    return dumps(record, sort_keys=True) + '\n'
+
+def decode_record(line):
+    """The record dictionary on line, None if it isn't a (whole) record"""
+    if not line.endswith('\n'):
+        return None
+    try:
+        record = loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or 'op' not in record or \
+            'id' not in record:
+        return None
+    return record
+
+def record_matches_fields(record, fields):
+    """True if record has the same financial transaction as fields, from
+    record_fields_of_fin_trans
+    """
+    # a round trip through json makes the strings in fields unicode like
+    # the ones in record
+    expected = loads(dumps(fields))
+    return all( record.get(key) == value
+                for key, value in expected.iteritems() )
+
+def read_record_at(record_file, offset):
+    record_file.seek(offset)
+    return decode_record(record_file.readline())
+
+class SerialRecordIndex(object):
+    """The index of a serial file, see the module docstring.
+
+    Loading one brings the index file up to date with the serial file,
+    or builds it from scratch if it's missing or doesn't belong to the
+    serial file.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.index_file_name = file_name + INDEX_SUFFIX
+        # identifier to (op, offset, length) of the latest record
+        self.entries = {}
+        self.covered_end = 0
+        # including the ones that have been replaced by later records
+        self.record_count = 0
+        self.__pending_lines = []
+        self.__load()
+
+    def __load(self):
+        file_size = getsize(self.file_name) if exists(self.file_name) else 0
+        if exists(self.index_file_name):
+            index_file = open(self.index_file_name)
+            try:
+                for line in index_file:
+                    try:
+                        ident, op, offset, length = line.split()
+                        ident, offset, length = \
+                            int(ident), int(offset), int(length)
+                    except ValueError:
+                        # an entry cut short by a crash is the last one,
+                        # anything it was for gets picked up below
+                        break
+                    self.entries[ident] = (op, offset, length)
+                    self.covered_end = max(self.covered_end, offset + length)
+                    self.record_count += 1
+            finally:
+                index_file.close()
+        if self.covered_end > file_size:
+            # the index is for some other (longer) serial file, start over
+            self.entries = {}
+            self.covered_end = 0
+            self.record_count = 0
+            if exists(self.index_file_name):
+                remove(self.index_file_name)
+        self.__catch_up()
+        self.write_pending()
+
+    def __catch_up(self):
+        if not exists(self.file_name):
+            return
+        record_file = open(self.file_name, 'rb')
+        try:
+            record_file.seek(self.covered_end)
+            offset = self.covered_end
+            for line in record_file:
+                record = decode_record(line)
+                if record != None:
+                    self.add(record['op'], record['id'], offset, len(line))
+                offset += len(line)
+        finally:
+            record_file.close()
+
+    def add(self, op, ident, offset, length):
+        """Records that the record at offset, length bytes long, is the
+        latest for ident, it's written to the index file with
+        write_pending()
+        """
+        self.entries[ident] = (op, offset, length)
+        self.covered_end = max(self.covered_end, offset + length)
+        self.record_count += 1
+        self.__pending_lines.append(
+            "%s %s %s %s\n" % (ident, op, offset, length) )
+
+    def write_pending(self, do_fsync=False):
+        if len(self.__pending_lines) == 0:
+            return
+        index_file = open(self.index_file_name, 'a')
+        try:
+            index_file.write(''.join(self.__pending_lines))
+            index_file.flush()
+            if do_fsync:
+                fsync(index_file.fileno())
+        finally:
+            index_file.close()
+        self.__pending_lines = []
+
+    def live_offset(self, ident):
+        """Where the latest record for ident is, None if there isn't one
+        or ident has been removed
+        """
+        if ident not in self.entries:
+            return None
+        op, offset, length = self.entries[ident]
+        return offset if op in LIVE_RECORD_OPS else None
+
+    def is_removed(self, ident):
+        return ident in self.entries and \
+            self.entries[ident][0] == RECORD_REMOVE
+
+    def max_ident(self):
+        return max(self.entries.iterkeys()) if len(self.entries) > 0 else None
+
+    def live_idents(self):
+        return sorted( ident for ident in self.entries.iterkeys()
+                       if self.live_offset(ident) != None )
+
+def compact_serial_record_file(file_name):
+    """Rewrites the serial file file_name with just the latest record for
+    each identifier that hasn't been removed (as a create), in identifier
+    order, and builds a fresh index for it. Identifiers don't change.
+
+    The new file is written next to the old one and renamed over it, the
+    old index is removed first, so a crash part way through leaves either
+    the old file or the new one, and an index gets rebuilt when needed.
+
+    Returns how many records were dropped.
+    """
+    index = SerialRecordIndex(file_name)
+    compact_file_name = file_name + COMPACT_SUFFIX
+    live_idents = index.live_idents()
+    record_file = open(file_name, 'rb')
+    compact_file = open(compact_file_name, 'wb')
+    try:
+        for ident in live_idents:
+            record = read_record_at(record_file, index.live_offset(ident))
+            record['op'] = RECORD_CREATE
+            compact_file.write(dumps(record, sort_keys=True) + '\n')
+        compact_file.flush()
+        fsync(compact_file.fileno())
+    finally:
+        compact_file.close()
+        record_file.close()
+    dropped = index.record_count - len(live_idents)
+    remove(index.index_file_name)
+    rename(compact_file_name, file_name)
+    # builds the new index
+    SerialRecordIndex(file_name)
+    return dropped
@@ -17,6 +17,9 @@
 #
 # Author: Mark Jenkins <mark@parit.ca>
 
+# python imports
+from time import time
+
 from robust_backend_plugin import RobustBackendPlugin
 
 #from plugin import \
@@ -25,21 +28,116 @@ from robust_backend_plugin import RobustBackendPlugin
 import transaction
 
 class SessionBasedRobustBackendPlugin(RobustBackendPlugin):
+    """A RobustBackendPlugin that has to open a session (e.g. a file) to
+    work with the backend. The session is kept open from one flush to the
+    next instead of being opened each time, until one of these happens:
+     - close() is called, (e.g. when the book is closed or on shutdown)
+     - nothing has been flushed for session_idle_timeout seconds and
+       release_backend_if_idle() is called, (BackendChangeThread does this
+       for every book every so often)
+     - the session has been open for session_max_hold_time seconds, which
+       is checked at the start of each flush
+     - session_resource_signature() has changed since the session was
+       opened or last flushed, meaning some other program changed the
+       backend, also checked at the start of each flush
+
+    A timeout or hold time of None means there isn't one, which is the
+    default here, subclasses and instances can set thier own.
+
+    The session is also ended (see end_session) when this is turned into a
+    ghost, by the zopedb cache or because another database connection
+    changed it, as the session (kept in a _v_ attribute) is forgotten then.
+    """
+    session_idle_timeout = None
+    session_max_hold_time = None
+
     def open_session_and_retain(self):
         if not self.__has_active_session_attr():
             self._v_session_active = self.open_session()
+            self._v_session_opened_time = self._v_session_used_time = time()
+            self.__record_session_resource_signature()
 
-    def flush_backend(self):
+    def flush_backend(self, max_items=None, time_budget=None):
+        self.__release_stale_session()
         self.open_session_and_retain()
         if not self.can_write():
             self.close()
+            return None
         else:
-            RobustBackendPlugin.flush_backend(self)
+            return_value = RobustBackendPlugin.flush_backend(
+                self, max_items, time_budget)
+            self._v_session_used_time = time()
+            # what we just wrote isn't an outside change
+            self.__record_session_resource_signature()
+            return return_value
+
+    def check_backend_consistency(self, trans_ids=None):
+        self.__release_stale_session()
+        self.open_session_and_retain()
+        return_value = RobustBackendPlugin.check_backend_consistency(
+            self, trans_ids)
+        self._v_session_used_time = time()
+        return return_value
 
     def close(self, close_reason='reset because close() was called'):
+        self.end_retained_session()
         RobustBackendPlugin.close(self, close_reason)
-        if self.__has_active_session_attr():
-            del self._v_session_active
+
+    def end_retained_session(self):
+        """Ends the session kept open between flushes, if there is one.
+        Nothing persistent is touched, so this is safe to call when we're
+        about to become a ghost.
+        """
+        # looking in __dict__ doesn't bring a ghost back to life
+        session = self.__dict__.pop('_v_session_active', None)
+        if session != None:
+            self.end_session(session)
+
+    def _p_deactivate(self):
+        # only an object that's in a database and unchanged really becomes
+        # a ghost
+        if self._p_jar != None and self._p_changed == False:
+            self.end_retained_session()
+        RobustBackendPlugin._p_deactivate(self)
+
+    def _p_invalidate(self):
+        self.end_retained_session()
+        RobustBackendPlugin._p_invalidate(self)
+
+    def release_backend_if_idle(self):
+        """Closes the session if it hasn't been used for
+        session_idle_timeout seconds, returns True if it did.
+        """
+        if self.__has_active_session_attr() and \
+                self.session_idle_timeout != None and \
+                time() - self._v_session_used_time >= \
+                self.session_idle_timeout:
+            self.close('reset because the session was idle')
+            return True
+        return False
+
+    def session_resource_signature(self):
+        """Something that changes when the backend resource is changed,
+        such as the modification time and size of a file. Override this
+        to have the session re-opened when some other program changes the
+        resource, the default, None, means there's no way to tell.
+        """
+        return None
+
+    def __record_session_resource_signature(self):
+        self._v_session_resource_signature = self.session_resource_signature()
+
+    def __release_stale_session(self):
+        if not self.__has_active_session_attr():
+            return
+        if self.session_max_hold_time != None and \
+                time() - self._v_session_opened_time >= \
+                self.session_max_hold_time:
+            self.close('reset because the session was held open too long')
+        elif self.session_resource_signature() != \
+                self._v_session_resource_signature:
+            self.close('reset because the backend was changed by '
+                       'another program')
 
     def __has_active_session_attr(self):
         return hasattr(self, '_v_session_active')
@@ -48,6 +146,12 @@ class SessionBasedRobustBackendPlugin(RobustBackendPlugin):
         raise Exception("robust session based backend plugins must implement "
                         "open_session")
 
+    def end_session(self, session):
+        """Lets go of a session returned by open_session, anything not
+        saved is lost. This shouldn't raise exceptions or change anything
+        persistent. The default does nothing.
+        """
+        pass
+
     def can_write(self):
         return self.__has_active_session_attr() and self._v_session_active!=None
-    
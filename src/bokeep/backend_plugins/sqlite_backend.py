@@ -0,0 +1,335 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from decimal import Decimal
+from itertools import izip
+from sys import stderr
+from sqlite3 import connect as sqlite3_connect, Error as SQLite3Error
+
+# bokeep imports
+from plugin import BoKeepBackendException, BoKeepBackendResetException
+from robust_backend_plugin import \
+    BackendTransactionMismatch, MISSING_TRANSACTION_MISMATCH
+from session_based_robust_backend_plugin import \
+    SessionBasedRobustBackendPlugin
+from bokeep.util import attribute_or_blank
+from bokeep.backend_plugins.sqlite_backend_config import SQLiteConfigDialog
+
+# account_spec tuples are stored as one column, like GnuCash account names
+ACCOUNT_SEPARATOR = ':'
+
+# how many identifiers go into one "id IN (...)" lookup, sqlite's limit on
+# parameters in a statement is 999
+LOOKUP_CHUNK_SIZE = 500
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bokeep_transactions ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " trans_date TEXT,"
+    " description TEXT,"
+    " chequenum TEXT,"
+    " currency TEXT)",
+    # amounts are kept as the text of the Decimal so nothing is lost,
+    # CAST(amount AS NUMERIC) when doing arithmetic in a query
+    "CREATE TABLE IF NOT EXISTS bokeep_transaction_lines ("
+    " trans_id INTEGER NOT NULL REFERENCES bokeep_transactions (id),"
+    " line_num INTEGER NOT NULL,"
+    " amount TEXT NOT NULL,"
+    " memo TEXT,"
+    " account TEXT,"
+    " PRIMARY KEY (trans_id, line_num))",
+    "CREATE INDEX IF NOT EXISTS bokeep_transactions_by_date "
+    "ON bokeep_transactions (trans_date)",
+    "CREATE INDEX IF NOT EXISTS bokeep_transaction_lines_by_account "
+    "ON bokeep_transaction_lines (account)",
+    )
+
+CONNECTION_PRAGMAS = (
+    # readers (e.g. someone running reports) don't block our writes or
+    # the other way around
+    "PRAGMA journal_mode=WAL",
+    # with WAL this can only lose the last commit on a power failure,
+    # never corrupt the database
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    )
+
+# the sqlite3 module keeps statements it has prepared and re-uses them when
+# the same text comes around again, so these are only prepared once per
+# connection
+INSERT_TRANSACTION = \
+    "INSERT INTO bokeep_transactions " \
+    "(id, trans_date, description, chequenum, currency) " \
+    "VALUES (?, ?, ?, ?, ?)"
+INSERT_LINE = \
+    "INSERT INTO bokeep_transaction_lines " \
+    "(trans_id, line_num, amount, memo, account) VALUES (?, ?, ?, ?, ?)"
+DELETE_LINES = "DELETE FROM bokeep_transaction_lines WHERE trans_id = ?"
+DELETE_TRANSACTION = "DELETE FROM bokeep_transactions WHERE id = ?"
+LAST_IDENTIFIER = \
+    "SELECT seq FROM sqlite_sequence WHERE name = 'bokeep_transactions'"
+SELECT_TRANSACTIONS = \
+    "SELECT id, trans_date, description, chequenum, currency " \
+    "FROM bokeep_transactions WHERE id IN (%s)"
+SELECT_LINES = \
+    "SELECT trans_id, amount, memo, account " \
+    "FROM bokeep_transaction_lines WHERE trans_id IN (%s) " \
+    "ORDER BY trans_id, line_num"
+
+def sqlite_text(value):
+    """value as a byte string for a TEXT column, connections from
+    open_session have text_factory = str so this is what comes back
+    """
+    if value == None:
+        return None
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def account_text(account_spec):
+    if account_spec == None:
+        return None
+    elif isinstance(account_spec, (tuple, list)):
+        return ACCOUNT_SEPARATOR.join(
+            sqlite_text(name) for name in account_spec )
+    return sqlite_text(account_spec)
+
+def transaction_row(backend_ident, fin_trans):
+    trans_date = attribute_or_blank(fin_trans, "trans_date")
+    return (backend_ident,
+            None if trans_date == '' else str(trans_date),
+            sqlite_text(attribute_or_blank(fin_trans, "description")),
+            sqlite_text(attribute_or_blank(fin_trans, "chequenum")),
+            sqlite_text(attribute_or_blank(fin_trans, "currency")) )
+
+def transaction_line_rows(backend_ident, fin_trans):
+    return [ (backend_ident, line_num, str(trans_line.amount),
+              sqlite_text(attribute_or_blank(trans_line, "line_memo")),
+              account_text(getattr(trans_line, "account_spec", None)) )
+             for line_num, trans_line in enumerate(fin_trans.lines) ]
+
+def sqlite_transaction_mismatches(fin_trans, trans_row, line_rows):
+    """A list of BackendTransactionMismatch for each way trans_row (from
+    SELECT_TRANSACTIONS) and line_rows (from SELECT_LINES) differ from
+    what create_backend_transactions would have written for fin_trans
+    """
+    mismatches = []
+    expected_row = transaction_row(trans_row[0], fin_trans)
+    for attribute, expected, found in izip(
+        ('trans_date', 'description', 'chequenum', 'currency'),
+        expected_row[1:], trans_row[1:] ):
+        if expected != found:
+            mismatches.append(
+                BackendTransactionMismatch(attribute, expected, found) )
+
+    # amounts are compared as Decimal, so 2.00 and 2 are the same
+    expected_lines = [ (Decimal(amount), memo, account)
+                       for trans_id, line_num, amount, memo, account
+                       in transaction_line_rows(trans_row[0], fin_trans) ]
+    found_lines = [ (Decimal(amount), memo, account)
+                    for trans_id, amount, memo, account in line_rows ]
+    if expected_lines != found_lines:
+        mismatches.append(
+            BackendTransactionMismatch('lines', expected_lines, found_lines) )
+    return mismatches
+
+def chunks_of(items, chunk_size):
+    for i in xrange(0, len(items), chunk_size):
+        yield items[i:i+chunk_size]
+
+class SQLitePlugin(SessionBasedRobustBackendPlugin):
+    """Writes transactions to a SQLite database (sqlite_file), one row in
+    bokeep_transactions for each financial transaction and a row in
+    bokeep_transaction_lines for each of its lines, so the ledger can be
+    queried with SQL. The backend identifier is the bokeep_transactions id,
+    which is never re-used.
+
+    Work is done in batches (can_batch_backend_transactions) with
+    executemany, and only commited to the database by save(), so a flush
+    is one sqlite transaction. The database is in WAL mode, other
+    programs can read it while the session is open.
+    """
+    def __init__(self):
+        SessionBasedRobustBackendPlugin.__init__(self)
+        self.sqlite_file = "AccountingBook.sqlite"
+
+    def open_session(self):
+        try:
+            con = sqlite3_connect(self.sqlite_file)
+            con.text_factory = str
+            for statement in CONNECTION_PRAGMAS + SCHEMA:
+                con.execute(statement)
+            con.commit()
+            return con
+        except SQLite3Error, e:
+            stderr.write("trouble opening %s %s" %
+                         (self.sqlite_file, str(e) ) )
+            # SessionBasedRobustBackendPlugin takes None to mean no session
+            return None
+
+    def __reset_after_error(self, e):
+        """Rolls back everything since the last save and returns a
+        BoKeepBackendResetException saying so, for the caller to raise
+        """
+        try:
+            self._v_session_active.rollback()
+        except SQLite3Error:
+            pass
+        return BoKeepBackendResetException(
+            "sqlite backend rolled back after " + str(e) )
+
+    def __require_session(self):
+        if not self.can_write():
+            raise BoKeepBackendResetException(
+                "sqlite backend has no database open")
+
+    def can_batch_backend_transactions(self):
+        return True
+
+    def create_backend_transaction(self, fin_trans):
+        return self.create_backend_transactions( (fin_trans,) )[0]
+
+    def create_backend_transactions(self, fin_trans_list):
+        self.__require_session()
+        con = self._v_session_active
+        try:
+            # identifiers are handed out here instead of by sqlite so the
+            # whole batch can go in with one executemany per table
+            last_identifier = con.execute(LAST_IDENTIFIER).fetchone()
+            first_identifier = \
+                1 if last_identifier == None else last_identifier[0] + 1
+            backend_idents = range(first_identifier,
+                                   first_identifier + len(fin_trans_list) )
+            con.executemany(
+                INSERT_TRANSACTION,
+                ( transaction_row(backend_ident, fin_trans)
+                  for backend_ident, fin_trans
+                  in izip(backend_idents, fin_trans_list) ) )
+            con.executemany(
+                INSERT_LINE,
+                ( line_row
+                  for backend_ident, fin_trans
+                  in izip(backend_idents, fin_trans_list)
+                  for line_row in transaction_line_rows(
+                        backend_ident, fin_trans) ) )
+        except SQLite3Error, e:
+            raise self.__reset_after_error(e)
+        return backend_idents
+
+    def remove_backend_transaction(self, backend_ident):
+        return self.remove_backend_transactions( (backend_ident,) )[0]
+
+    def remove_backend_transactions(self, backend_idents):
+        self.__require_session()
+        con = self._v_session_active
+        params = [ (backend_ident,) for backend_ident in backend_idents ]
+        try:
+            con.executemany(DELETE_LINES, params)
+            con.executemany(DELETE_TRANSACTION, params)
+        except SQLite3Error, e:
+            raise self.__reset_after_error(e)
+        return [None] * len(params)
+
+    def verify_backend_transaction(self, backend_ident, fin_trans):
+        return len(self.find_backend_transaction_mismatches(
+                backend_ident, fin_trans) ) == 0
+
+    def verify_backend_transactions(self, backend_ident_and_fin_trans_pairs):
+        return [ mismatches if isinstance(mismatches, Exception)
+                 else len(mismatches) == 0
+                 for mismatches in self.find_backend_transactions_mismatches(
+                backend_ident_and_fin_trans_pairs) ]
+
+    def find_backend_transaction_mismatches(self, backend_ident, fin_trans):
+        return self.find_backend_transactions_mismatches(
+            ( (backend_ident, fin_trans), ) )[0]
+
+    def find_backend_transactions_mismatches(
+        self, backend_ident_and_fin_trans_pairs):
+        self.__require_session()
+        backend_ident_and_fin_trans_pairs = \
+            list(backend_ident_and_fin_trans_pairs)
+        try:
+            trans_rows, line_rows = self.__lookup_rows(
+                [ backend_ident for backend_ident, fin_trans
+                  in backend_ident_and_fin_trans_pairs ] )
+        except BoKeepBackendResetException, reset_e:
+            raise reset_e
+        except BoKeepBackendException, e:
+            # none of them could be checked
+            return [e] * len(backend_ident_and_fin_trans_pairs)
+        return [
+            [ BackendTransactionMismatch(
+                    MISSING_TRANSACTION_MISMATCH, backend_ident, None) ]
+            if backend_ident not in trans_rows
+            else sqlite_transaction_mismatches(
+                fin_trans, trans_rows[backend_ident],
+                line_rows.get(backend_ident, ()) )
+            for backend_ident, fin_trans in backend_ident_and_fin_trans_pairs ]
+
+    def __lookup_rows(self, backend_idents):
+        """Returns dictionaries from backend identifier to transaction row
+        and to a list of line rows, for all of backend_idents that exist
+        """
+        con = self._v_session_active
+        trans_rows = {}
+        line_rows = {}
+        try:
+            for chunk in chunks_of(sorted(set(backend_idents)),
+                                   LOOKUP_CHUNK_SIZE):
+                placeholders = ','.join('?' * len(chunk))
+                for trans_row in con.execute(
+                    SELECT_TRANSACTIONS % placeholders, chunk):
+                    trans_rows[trans_row[0]] = trans_row
+                for line_row in con.execute(
+                    SELECT_LINES % placeholders, chunk):
+                    line_rows.setdefault(line_row[0], []).append(line_row)
+        except SQLite3Error, e:
+            raise BoKeepBackendException(
+                "sqlite backend lookup failed " + str(e) )
+        return trans_rows, line_rows
+
+    def save(self):
+        try:
+            self._v_session_active.commit()
+        except SQLite3Error, e:
+            stderr.write(str(e))
+            raise BoKeepBackendException("sqlite commit failed " + str(e))
+
+    def end_session(self, con):
+        # whatever hasn't been saved is lost, as promised by
+        # RobustBackendPlugin.close
+        try:
+            con.rollback()
+            con.close()
+        except SQLite3Error:
+            # callers of close are expecting us to silently catch
+            # exceptions
+            pass
+
+    def configure_backend(self, parent_window=None):
+        cd = SQLiteConfigDialog()
+        cd.set_filename(self.sqlite_file)
+        cd.run()
+        if cd.get_filename() != None:
+            self.setattr('sqlite_file', cd.get_filename())
+
+def get_plugin_class():
+    return SQLitePlugin
@@ -18,16 +18,28 @@
 # Authors: Mark Jenkins <mark@parit.ca>
 #          Samuel Pauls <samuel@parit.ca>
 
+from time import time
+from itertools import islice
+
 from persistent import Persistent
 import transaction
 from BTrees.IOBTree import IOBTree
 
 from backend_plugins.plugin import BackendPlugin
+from util import UnitOfWork, commit_unless_in_unit_of_work
 
 DEFAULT_BACKEND_MODULE = "bokeep.backend_plugins.null"
 
 BOOKS_SUB_DB_KEY = 'books'
 
+# how many transactions BoKeepBook.insert_transactions registers with the
+# frontend and backend plugins between each commit
+DEFAULT_INSERT_CHUNK_SIZE = 1000
+
+# how many transactions BoKeepBook.continue_backend_migration marks dirty
+# and flushes to a new backend plugin between each commit
+DEFAULT_MIGRATION_CHUNK_SIZE = 100
+
 class BoKeepDBHandle(object):
     """Wrapper around ZODB database connection for the BoKeep database
     that adds the concept of sub databases
@@ -233,7 +245,27 @@ class BoKeepBook(Persistent):
                 return i, (code, cls, module)
         return None, (None, None, None)
 
-    def set_backend_plugin(self, backend_plugin_name):
+    def set_backend_plugin(self, backend_plugin_name,
+                           progress_callback=None, bulk_load=True):
+        """Switch this book to a new backend plugin and write all the
+        transactions out to it.
+
+        This is start_backend_migration followed by
+        continue_backend_migration, see those. progress_callback and
+        bulk_load are passed on to the latter, the first push to a new
+        backend plugin is a bulk load unless bulk_load is False.
+        """
+        self.start_backend_migration(backend_plugin_name)
+        self.continue_backend_migration(progress_callback=progress_callback,
+                                        bulk_load=bulk_load)
+
+    def start_backend_migration(self, backend_plugin_name):
+        """Switch this book to a new backend plugin, the transactions
+        aren't written to it until continue_backend_migration is called.
+
+        BackendPluginImportError is raised if the plugin can't be imported,
+        in which case the old one stays.
+        """
         if hasattr(self, '_BoKeepBook__backend_module_name'):
             old_backend_module_name = self.get_backend_plugin_name()
             old_backend_module = self.get_backend_plugin()
@@ -243,18 +275,101 @@ class BoKeepBook(Persistent):
               backend_plugin_name, globals(), locals(), [""] ).\
     	      get_plugin_class()()
             assert( isinstance(self.__backend_module, BackendPlugin) )
-            # because we have changed the backend module, all transactions
-            # are now dirty and must be re-written to the new backend module
-            for trans_ident, trans in self.trans_tree.iteritems():
-                self.__backend_module.mark_transaction_dirty(
-                    trans_ident, trans)
-            self.__backend_module.flush_backend()
         except ImportError:
             # this is in big trouble if old_backend_module_name isn't set
             # but that should only happen on book instantiation
             self.__backend_module_name = old_backend_module_name
             self.__backend_module = old_backend_module  
             raise BackendPluginImportError(backend_plugin_name)
+        # because we have changed the backend module, all transactions
+        # are now dirty and must be re-written to the new backend module,
+        # if the last migration never finished it doesn't matter anymore
+        self.backend_migration = BackendMigration(
+            backend_plugin_name, len(self.trans_tree) )
+
+    def get_backend_migration(self):
+        """Returns the BackendMigration in progress, or None"""
+        # older books don't have this attribute
+        return getattr(self, 'backend_migration', None)
+
+    def backend_migration_in_progress(self):
+        return self.get_backend_migration() != None
+
+    def continue_backend_migration(
+        self, chunk_size=DEFAULT_MIGRATION_CHUNK_SIZE, max_chunks=None,
+        progress_callback=None, bulk_load=False):
+        """Write transactions out to the backend plugin picked with
+        start_backend_migration, picking up where the last call left off.
+
+        Transactions are done chunk_size at a time in trans_id order, each
+        chunk is marked dirty and flushed, then a record of how far along
+        the migration is gets commited, so an interrupted migration
+        can be resumed by calling this again. (e.g. at the next startup)
+        A chunk that was flushed but not recorded is done again.
+        max_chunks limits how much is done in this call, by default
+        this carries on until the migration is done.
+
+        progress_callback, if provided, is called with the BackendMigration
+        after each chunk.
+
+        With bulk_load, the backend plugin is told to get ready for a lot of
+        transactions (see BackendPlugin.begin_bulk_load) and everything done
+        in this call is commited at once at the end instead of chunk by
+        chunk, which lets the plugin save once at the end. If that save
+        fails, it's as if this was never called.
+
+        Returns True if the migration is done (or there wasn't one).
+        """
+        assert( chunk_size > 0 )
+        if not bulk_load:
+            return self.__continue_backend_migration(
+                chunk_size, max_chunks, progress_callback)
+
+        backend_plugin = self.get_backend_plugin()
+        with UnitOfWork():
+            backend_plugin.begin_bulk_load()
+            try:
+                return_value = self.__continue_backend_migration(
+                    chunk_size, max_chunks, progress_callback)
+            except:
+                backend_plugin.end_bulk_load(False)
+                raise
+            backend_plugin.end_bulk_load()
+        return return_value
+
+    def __continue_backend_migration(
+        self, chunk_size, max_chunks, progress_callback):
+        chunks_done = 0
+        while self.backend_migration_in_progress():
+            if max_chunks != None and chunks_done >= max_chunks:
+                return False
+            migration = self.get_backend_migration()
+            if migration.last_trans_id == None:
+                keys = self.trans_tree.keys()
+            else:
+                keys = self.trans_tree.keys(
+                    min=migration.last_trans_id, excludemin=True)
+            chunk = [ (trans_id, self.trans_tree[trans_id])
+                      for trans_id in islice(keys, chunk_size) ]
+            if len(chunk) == 0:
+                # the next commit will include this, and if that doesn't
+                # happen, a later call ends up back here
+                self.backend_migration = None
+                return True
+            backend_plugin = self.get_backend_plugin()
+            with UnitOfWork():
+                backend_plugin.mark_transactions_dirty(chunk)
+            # the flush commits what it saved on its own, (see UnitOfWork)
+            # if we're interrupted before the progress is commited the
+            # chunk is done again, and the transactions in it that are
+            # already clean don't change
+            backend_plugin.flush_backend()
+            migration.add_chunk(chunk[-1][0], len(chunk))
+            commit_unless_in_unit_of_work()
+            chunks_done += 1
+            if progress_callback != None:
+                progress_callback(migration)
+        return True
 
     def get_backend_plugin(self):
         return self.__backend_module
@@ -267,6 +382,19 @@ class BoKeepBook(Persistent):
     def insert_transaction(self, trans):
         """Adds a transaction to this BoKeep book."""
         
+        key = self.reserve_transaction_keys(1)
+        result = self.trans_tree.insert(key, trans)
+        assert( result == 1 )
+        return key
+
+    def reserve_transaction_keys(self, count):
+        """Reserve a contiguous range of count transaction keys, returns
+        the first one.
+
+        Nothing is inserted into the book, the keys are just marked as
+        used in largest_key_ever so that insert_transaction won't hand
+        them out.
+        """
         if len(self.trans_tree) == 0:
             largest_in_current = -1
         else:
@@ -275,11 +403,54 @@ class BoKeepBook(Persistent):
         if not hasattr(self, 'largest_key_ever'):
             self.largest_key_ever = largest_in_current
 
-        key = max(largest_in_current, self.largest_key_ever) + 1
-        self.largest_key_ever = key
-        result = self.trans_tree.insert(key, trans)
-        assert( result == 1 )
-        return key
+        first_key = max(largest_in_current, self.largest_key_ever) + 1
+        self.largest_key_ever = first_key + count - 1
+        return first_key
+
+    def insert_transactions(self, transactions, frontend_plugin,
+                            chunk_size=DEFAULT_INSERT_CHUNK_SIZE,
+                            progress_callback=None):
+        """Adds many transactions to this BoKeep book, registers them
+        with frontend_plugin and marks them dirty in the backend plugin.
+
+        This is the bulk equivilent of what
+        bokeep.gui.state.instantiate_transaction_class_add_to_book_backend_and_plugin
+        does one transaction at a time. A contiguous range of keys is
+        reserved up front, and instead of a zopedb commit for every
+        transaction there is one commit every chunk_size transactions.
+        (and one at the end)
+
+        progress_callback, if provided, is called after each commit with
+        the TransactionInsertReport so far.
+
+        Returns a TransactionInsertReport, which has the new transaction
+        ids in the same order as transactions, and the throughput achieved.
+        """
+        assert( chunk_size > 0 )
+        transactions = list(transactions)
+        report = TransactionInsertReport()
+        first_key = self.reserve_transaction_keys(len(transactions))
+        backend_plugin = self.get_backend_plugin()
+
+        for chunk_start in xrange(0, len(transactions), chunk_size):
+            chunk = [ (first_key + i, transactions[i])
+                      for i in xrange(
+                    chunk_start,
+                    min(chunk_start + chunk_size, len(transactions)) ) ]
+            for trans_id, trans in chunk:
+                result = self.trans_tree.insert(trans_id, trans)
+                assert( result == 1 )
+            for trans_id, trans in chunk:
+                frontend_plugin.register_transaction(trans_id, trans)
+            backend_plugin.mark_transactions_dirty(chunk)
+            transaction.get().commit()
+
+            report.add_chunk(trans_id for trans_id, trans in chunk)
+            if progress_callback != None:
+                progress_callback(report)
+
+        report.finish()
+        return report
 
     def get_transaction_count(self):
         return len(self.trans_tree)
@@ -324,9 +495,74 @@ class BoKeepBook(Persistent):
         else:
             return self.trans_tree.maxKey()
 
-    def remove_transaction(self, trans_id):
+    def remove_transaction(self, trans_id, mark_backend_for_removal=True):
+        """Removes a transaction from this book, and from the backend plugin
+        unless mark_backend_for_removal is False, in which case the
+        caller is responsible for that (e.g. by having a
+        BackendChangeThread mark it after a commit)
+        """
         del self.trans_tree[trans_id]
-        self.backend_plugin.mark_transaction_for_removal(trans_id)
+        if mark_backend_for_removal:
+            self.backend_plugin.mark_transaction_for_removal(trans_id)
+
+class BackendMigration(Persistent):
+    """Records how far along BoKeepBook.continue_backend_migration is with
+    writing a book's transactions out to a new backend plugin.
+    """
+    def __init__(self, backend_plugin_name, transaction_count):
+        self.backend_plugin_name = backend_plugin_name
+        # how many transactions the book had when the migration started,
+        # transactions are added and removed in the meantime, so this
+        # is only good for progress reporting
+        self.transaction_count = transaction_count
+        self.migrated_count = 0
+        self.last_trans_id = None
+
+    def add_chunk(self, last_trans_id, count):
+        self.last_trans_id = last_trans_id
+        self.migrated_count += count
+
+    def get_fraction_done(self):
+        if self.transaction_count == 0:
+            return 1.0
+        return min(1.0,
+                   float(self.migrated_count) / self.transaction_count)
+
+class TransactionInsertReport(object):
+    """Tracks the progress and throughput of BoKeepBook.insert_transactions
+    """
+    def __init__(self):
+        self.trans_ids = []
+        self.chunk_count = 0
+        self.start_time = time()
+        self.end_time = None
+
+    def add_chunk(self, trans_ids):
+        self.trans_ids.extend(trans_ids)
+        self.chunk_count += 1
+
+    def finish(self):
+        self.end_time = time()
+
+    def get_transaction_count(self):
+        return len(self.trans_ids)
+
+    def get_elapsed_seconds(self):
+        end_time = self.end_time if self.end_time != None else time()
+        return end_time - self.start_time
+
+    def get_transactions_per_second(self):
+        elapsed = self.get_elapsed_seconds()
+        if elapsed <= 0:
+            return None
+        return self.get_transaction_count() / elapsed
+
+    def __str__(self):
+        rate = self.get_transactions_per_second()
+        return "%s transactions in %s commits, %.2f seconds%s" % (
+            self.get_transaction_count(), self.chunk_count,
+            self.get_elapsed_seconds(),
+            '' if rate == None else ", %.1f transactions/second" % rate )
 
 class FrontendPluginImportError(Exception):
     def __init__(self, plugin_name):
@@ -18,6 +18,8 @@
 # Authors: Mark Jenkins <mark@parit.ca>
 #          Samuel Pauls <samuel@parit.ca>
 
+from hashlib import sha1
+
 from persistent import Persistent
 
 class FinancialTransactionLine(object):
@@ -77,6 +79,32 @@ class FinancialTransaction(object):
     def __init__(self, lines):
         self.lines = lines
 
+# the attributes of FinancialTransaction and FinancialTransactionLine
+# that end up in a backend, see financial_transaction_fingerprint
+FIN_TRANS_FINGERPRINT_ATTRIBUTES = (
+    'trans_date', 'description', 'chequenum', 'currency')
+FIN_TRANS_LINE_FINGERPRINT_ATTRIBUTES = (
+    'amount', 'account_spec', 'line_memo')
+
+def financial_transaction_fingerprint(fin_trans):
+    """Returns a string that identifies the content of a FinancialTransaction,
+    two financial transactions with the same lines, amounts, account_spec s,
+    memos, date, description, chequenum and currency have the same
+    fingerprint.
+
+    Backend plugins can compare fingerprints to find out if a
+    FinancialTransaction has changed since it was written out without
+    having to keep a copy of the original around.
+    """
+    canonical_form = (
+        tuple( getattr(fin_trans, attr, None)
+               for attr in FIN_TRANS_FINGERPRINT_ATTRIBUTES ),
+        tuple( tuple( getattr(line, attr, None)
+                      for attr in FIN_TRANS_LINE_FINGERPRINT_ATTRIBUTES )
+               for line in fin_trans.lines )
+        )
+    return sha1(repr(canonical_form)).hexdigest()
+
 def make_trans_line_pair(amount, debit_account, credit_account,
                          debit_memo='', credit_memo=''):
     """Creates the lines of a financial transaction, but not the transaction
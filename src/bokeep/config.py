@@ -49,6 +49,12 @@ DEFAULT_BOOKS_ZCONFIG_FILE = 'bokeep_books.conf'
 PLUGIN_DIRECTORIES_SECTION = 'plugin_directories'
 PLUGIN_DIRECTORIES = 'directories'
 
+GUI_CONFIG_SECTION = 'gui'
+# milliseconds the default shell lets changes to a transaction pile up
+# before commiting them
+GUI_COMMIT_INTERVAL = 'commit_interval'
+DEFAULT_COMMIT_INTERVAL = 500
+
 DATABASE_VERSION_SUBDB_KEY = 'db_version'
 
 CURRENT_DATABASE_VERSION = '0.4.1'
@@ -73,6 +79,10 @@ def initialize_config(config):
     config.add_section(PLUGIN_DIRECTORIES_SECTION)
     config.set(PLUGIN_DIRECTORIES_SECTION, PLUGIN_DIRECTORIES, [])
 
+    config.add_section(GUI_CONFIG_SECTION)
+    config.set(GUI_CONFIG_SECTION, GUI_COMMIT_INTERVAL,
+               str(DEFAULT_COMMIT_INTERVAL) )
+
 def create_config_file(path):
     """Creates a configuration file at path.
 
@@ -131,6 +141,22 @@ def set_plugin_directories_in_config(config, config_path, plugin_directories):
     config.write(config_fp)
     config_fp.close()
 
+def get_commit_interval_from_config(config):
+    """Returns the number of milliseconds the default shell should wait
+    after a change to a transaction before commiting it.
+
+    Older config files don't have the gui section, and people make typos,
+    so DEFAULT_COMMIT_INTERVAL is returned if there isn't a usable value.
+    """
+
+    if config == None or \
+            not config.has_option(GUI_CONFIG_SECTION, GUI_COMMIT_INTERVAL):
+        return DEFAULT_COMMIT_INTERVAL
+    try:
+        return max(0, config.getint(GUI_CONFIG_SECTION, GUI_COMMIT_INTERVAL))
+    except ValueError:
+        return DEFAULT_COMMIT_INTERVAL
+
 def first_config_file_in_list_to_exist_and_parse(files):
     for i,config_file in enumerate(files):
         config = ConfigParser()
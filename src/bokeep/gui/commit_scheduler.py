@@ -0,0 +1,83 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+class CommitScheduler(object):
+    """Puts off calling commit_function until changes stop coming in.
+
+    Transaction editors call their change_register_function on just about
+    every keystroke, commiting on each of those is a lot of database writes
+    for what a user thinks of as one change. Instead, the first
+    change_happened() after a commit schedules commit_function to be called
+    interval milliseconds later (or as soon as gtk is idle if interval is 0)
+    and further changes in the meantime ride along with that.
+
+    flush() calls commit_function right away if anything is waiting, use it
+    whenever the changes need to be in the database before carrying on,
+    such as before switching transactions or books and before shutdown.
+
+    The scheduling is done with gobject's timeout_add, idle_add and
+    source_remove unless other functions that work the same way are
+    passed in. (the tests do that to get by without a main loop)
+    """
+
+    def __init__(self, commit_function, interval,
+                 timeout_add=None, idle_add=None, source_remove=None):
+        self.commit_function = commit_function
+        self.interval = interval
+        self.pending = False
+        self.source_id = None
+        if None in (timeout_add, idle_add, source_remove):
+            # gtk, only imported when needed so this can be tested without
+            import gobject
+            if timeout_add == None:
+                timeout_add = gobject.timeout_add
+            if idle_add == None:
+                idle_add = gobject.idle_add
+            if source_remove == None:
+                source_remove = gobject.source_remove
+        self.timeout_add = timeout_add
+        self.idle_add = idle_add
+        self.source_remove = source_remove
+
+    def change_happened(self):
+        self.pending = True
+        if self.source_id == None:
+            if self.interval == 0:
+                self.source_id = self.idle_add(self.__scheduled_commit)
+            else:
+                self.source_id = self.timeout_add(
+                    self.interval, self.__scheduled_commit)
+
+    def has_pending(self):
+        return self.pending
+
+    def flush(self):
+        if self.source_id != None:
+            self.source_remove(self.source_id)
+            self.source_id = None
+        if self.pending:
+            self.pending = False
+            self.commit_function()
+
+    def __scheduled_commit(self):
+        # gtk drops the source itself when we return False, so forget it
+        # before flush() tries to remove it
+        self.source_id = None
+        self.flush()
+        return False # don't call this again
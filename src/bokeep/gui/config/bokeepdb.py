@@ -40,7 +40,8 @@ from gtk import \
     FILE_CHOOSER_ACTION_SAVE, FileChooserDialog, \
     DIALOG_MODAL, MESSAGE_ERROR, BUTTONS_OK, MessageDialog, \
     STOCK_CANCEL, STOCK_SAVE, FILE_CHOOSER_ACTION_SELECT_FOLDER, \
-    Label, STOCK_OK, STOCK_OPEN, Dialog, Button, HBox
+    Label, STOCK_OK, STOCK_OPEN, Dialog, Button, HBox, \
+    events_pending, main_iteration
 
 # bokeep imports
 from bokeep.config import \
@@ -215,7 +216,8 @@ class BoKeepConfigDialog(object):
         self.selection_change_lock = True
 
         self.state = BoKeepConfigGuiState(
-            error_msg, self.__force_config_on_newly_created_plugin)
+            error_msg, self.__force_config_on_newly_created_plugin,
+            self.__show_backend_migration_progress)
         self.books_tv = TreeView(self.state.book_liststore)
         self.books_tv.append_column(
                 TreeViewColumn("Book", CellRendererText(), text=0 ) )
@@ -592,6 +594,19 @@ class BoKeepConfigDialog(object):
         if iter != None:
             remove_button.set_sensitive(True)
 
+    def __show_backend_migration_progress(self, migration):
+        """Called by BoKeepBook.set_backend_plugin after each chunk of
+        transactions is written to the new backend plugin
+        """
+        self.message_label.set_label(
+            "Writing transactions to %s, %s of %s done" % (
+                migration.backend_plugin_name, migration.migrated_count,
+                migration.transaction_count) )
+        # we're not going back to the gtk main loop until the migration is
+        # done, so give it a chance to show the above
+        while events_pending():
+            main_iteration(False)
+
     def __force_config_on_newly_created_plugin(self, book, is_backend, new_plugin):
         """Configures a newly added frontend plugin.
         
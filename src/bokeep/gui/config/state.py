@@ -55,7 +55,8 @@ class BoKeepConfigGuiState(FunctionAndDataDrivenStateMachine):
         BOOK_SELECTED,
     ) = range(NUM_STATES)
 
-    def __init__(self, db_error_msg=None, call_for_new_plugins=null_function):
+    def __init__(self, db_error_msg=None, call_for_new_plugins=null_function,
+                 backend_migration_progress=None):
         FunctionAndDataDrivenStateMachine.__init__(
             self,
             data=(None, None, None), # DB_PATH, BOOKSET, BOOK
@@ -64,6 +65,8 @@ class BoKeepConfigGuiState(FunctionAndDataDrivenStateMachine):
         self.book_liststore = ListStore(str)
         self.frontend_plugin_liststore = ListStore(str, bool)
         self.call_for_new_plugins = call_for_new_plugins
+        # progress callback for BoKeepBook.set_backend_plugin
+        self.backend_migration_progress = backend_migration_progress
         self.run_until_steady_state()
         assert(self.state == BoKeepConfigGuiState.NO_DATABASE)
 
@@ -284,7 +287,8 @@ class BoKeepConfigGuiState(FunctionAndDataDrivenStateMachine):
 
         if self.data[BOOK] != None and hasattr(self, '_v_backend_plugin'):
             try:
-                self.data[BOOK].set_backend_plugin(self._v_backend_plugin)
+                self.data[BOOK].set_backend_plugin(
+                    self._v_backend_plugin, self.backend_migration_progress)
                 
                 # Configure the newly added backend plugin.
                 book = self.data[BOOK]
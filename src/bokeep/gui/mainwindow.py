@@ -24,12 +24,14 @@ import sys
 
 # ZOPE
 import transaction
+from ZODB.POSException import ConflictError
 
 # Gtk
 from gtk import main_quit, ListStore, CellRendererText, AboutDialog, \
     MessageDialog, MESSAGE_ERROR, BUTTONS_OK
 from gtk.gdk import pixbuf_new_from_file_at_size
 import gtk
+from gobject import idle_add, threads_init, timeout_add_seconds
 
 # Bo-Keep
 from bokeep.gtkutil import gtk_yes_no_dialog
@@ -39,12 +41,19 @@ from state import \
 from bokeep.gui.gladesupport.glade_util import \
     load_glade_file_get_widgets_and_connect_signals
 from bokeep.config import get_bokeep_configuration, \
-    BoKeepConfigurationFileException
+    BoKeepConfigurationFileException, get_commit_interval_from_config
 from bokeep.gui.config.bokeepconfig import establish_bokeep_config
 from bokeep.gui.config.bokeepdb import \
     establish_bokeep_db
 from main_window_glade import get_main_window_glade_file
 from bokeep.shells import GUI_STATE_SUB_DB
+from bokeep.backend_plugins.plugin import \
+    BackendChangeThread, BACKEND_THREAD_CONFLICT_RETRIES
+from commit_scheduler import CommitScheduler
+
+# how often (seconds) we have the BackendChangeThread let go of backend
+# sessions that haven't been used in a while
+BACKEND_IDLE_CHECK_INTERVAL = 60
 
 COMBO_SELECTION_NONE = -1
 
@@ -52,6 +61,8 @@ def shell_startup(config_path, config, bookset, startup_callback,
                   cmdline_options, cmdline_args):
     """Start the BoKeep GUI that manages BoKeep transactions."""
     
+    # BackendChangeThread has to be able to run while gtk.main() does
+    threads_init()
     shell_window = MainWindow(config_path, config, bookset, startup_callback)
     gtk.main()
 
@@ -300,8 +311,14 @@ class MainWindow(object):
     def __init__(self, config_path, config, bookset, startup_callback):
         self.gui_built = False
         self.current_editor = None
+        # (book name, transaction id) pairs changed since the last commit
+        self.trans_waiting_for_commit = set()
+        self.commit_scheduler = CommitScheduler(
+            self.commit_and_mark_dirty, get_commit_interval_from_config(None))
         self.set_config_path_and_config(config_path, config)
         self.set_bookset(bookset)
+        timeout_add_seconds(BACKEND_IDLE_CHECK_INTERVAL,
+                            self.request_backend_idle_check)
         
         self.build_gui()
         self.programmatic_transcombo_index = False
@@ -318,31 +335,138 @@ class MainWindow(object):
     def set_config_path_and_config(self, config_path, config):
         self.__config_path = config_path
         self.__config = config
+        self.commit_scheduler.interval = get_commit_interval_from_config(config)
 
     def set_bookset(self, bookset):
-        """Sets the set of BoKeep books."""
+        """Sets the set of BoKeep books, and starts up a
+        BackendChangeThread for them.
+        """
         
+        self.stop_backend_thread()
         self.bookset = bookset
+        if bookset != None:
+            self.backend_thread = BackendChangeThread(
+                bookset, self.backend_status_changed)
+            self.backend_thread.start()
+
+    def stop_backend_thread(self):
+        """Waits for the BackendChangeThread to finish what it has
+        been asked to do and stops it.
+        """
+
+        if hasattr(self, 'backend_thread'):
+            self.backend_thread.end_thread_and_join()
+            del self.backend_thread
+
+    def request_backend_idle_check(self):
+        """Called every BACKEND_IDLE_CHECK_INTERVAL seconds from the gtk
+        main loop"""
+        if hasattr(self, 'backend_thread'):
+            self.backend_thread.request_idle_check()
+        return True # keep calling this
+
+    def backend_status_changed(self, book_name, trans_ids):
+        """Called from the BackendChangeThread after each flush,
+        hands things over to the gtk main loop.
+        """
+
+        idle_add(self.on_backend_status_changed, book_name, trans_ids)
+
+    def on_backend_status_changed(self, book_name, trans_ids):
+        # end our transaction so our connection picks up what the backend
+        # thread did
+        transaction.get().commit()
+        self.set_backend_error_indicator()
+        return False # don't call this again
+
+    def record_trans_dirty_in_backend(self):
+        """Note that the current transaction changed, self.commit_scheduler
+        will get around to commit_and_mark_dirty.
+
+        Passed to transaction editors as thier change_register_function
+        """
+
+        book = self.guistate.get_book()
+        trans_id = self.guistate.get_transaction_id()
+        if book != None and trans_id != None:
+            self.trans_waiting_for_commit.add( (book.book_name, trans_id) )
+        self.commit_scheduler.change_happened()
+
+    def commit_and_mark_dirty(self):
+        """Commit changes to transactions and have the BackendChangeThread
+        mark them dirty in the backend and flush them.
+
+        Called by self.commit_scheduler, once for each burst of changes.
+        """
+
+        transaction.get().commit()
+        for book_name, trans_id in self.trans_waiting_for_commit:
+            self.backend_thread.mark_transaction_dirty(book_name, trans_id)
+        self.trans_waiting_for_commit.clear()
+
+    def mark_dirty_by_backend_thread(self, book, trans_id):
+        """Passed to self.guistate.do_action for actions that add or remove
+        transactions, so the BackendChangeThread is the only one to change
+        the backend plugin. (see BackendChangeThread.mark_transaction_dirty)
+        """
+        self.backend_thread.mark_transaction_dirty(book.book_name, trans_id)
 
     def flush_book_backend(self, book):
-        """Save the BoKeep book."""
+        """Save the BoKeep book, this is done by the BackendChangeThread."""
         
-        book.get_backend_plugin().flush_backend()
+        self.commit_scheduler.flush()
         transaction.get().commit()
+        self.backend_thread.request_flush(book.book_name)
 
     def close_book_backend(self, book):
-        """Close the backend used for saving the BoKeep book."""
+        """Close the backend used for saving the BoKeep book, this is done
+        by the BackendChangeThread."""
         
-        book.get_backend_plugin().close()
+        self.commit_scheduler.flush()
         transaction.get().commit()
+        self.backend_thread.request_flush(book.book_name, True)
+
+    def change_backend_plugin(self, book, change_function):
+        """Calls change_function, which changes the backend plugin of book
+        (e.g. configure_backend) from this thread's connection, while the
+        BackendChangeThread is paused with that backend plugin closed, so
+        neither conflicts with the other or runs into a session the other
+        has open. Sessions change_function opened are closed again before
+        the thread carries on.
+
+        change_function is called again if the commit runs into a conflict
+        (someone else changed the same thing), the change is given up on
+        after BACKEND_THREAD_CONFLICT_RETRIES tries.
+        """
+        self.commit_scheduler.flush()
+        pause = self.backend_thread.pause_with_backend_closed(book.book_name)
+        try:
+            for i in xrange(BACKEND_THREAD_CONFLICT_RETRIES):
+                # start with what the thread just commited
+                transaction.get().abort()
+                change_function()
+                book.get_backend_plugin().close()
+                try:
+                    transaction.get().commit()
+                except ConflictError:
+                    pass
+                else:
+                    break # for i
+            else:
+                transaction.get().abort()
+        finally:
+            pause.resume()
 
     def application_shutdown(self):
+        self.commit_scheduler.flush()
         if hasattr(self, 'guistate'):
             self.guistate.do_action(CLOSE)
         if hasattr(self, 'bookset') and self.bookset != None:
+            transaction.get().commit()
             for bookname, book in self.bookset.iterbooks():
-                book.get_backend_plugin().flush_backend()
-                transaction.get().commit()
+                # close as well so backend sessions are let go of
+                self.backend_thread.request_flush(bookname, True)
+            self.stop_backend_thread()
             self.bookset.close()
             # or, should I be only doing
             # self.bookset.close_primary_connection() instead..?
@@ -503,6 +627,7 @@ class MainWindow(object):
         and clears out the books combo list and transaction type combo list
         """
         self.gui_built = False
+        self.commit_scheduler.flush()
         self.guistate.do_action(CLOSE)
         transaction.get().commit() # redundant
         self.books_combobox.set_active(COMBO_SELECTION_NONE)
@@ -623,7 +748,7 @@ class MainWindow(object):
 
         self.current_editor = editor_generator(
                 book.get_transaction(trans_id), trans_id, currmodule,
-                self.transaction_viewport, self.guistate.record_trans_dirty_in_backend,
+                self.transaction_viewport, self.record_trans_dirty_in_backend,
                 book)
 
     def hide_transaction(self):
@@ -693,7 +818,7 @@ class MainWindow(object):
         nothing if there isn't a book and transaction selected.
 
         Called by set_sensitivities_and_status, on_backend_flush_request,
-        and on_backend_close_request
+        on_backend_close_request, and on_backend_status_changed
         """
         
         # don't bother if the gui isn't built yet
@@ -780,12 +905,15 @@ class MainWindow(object):
         if not self.gui_built:
             return
 
+        self.commit_scheduler.flush()
         self.set_book_from_combo()
         self.refresh_trans_types_and_set_sensitivities_and_status()
         
     def new_button_clicked(self, *args):
         """Create a new BoKeep transaction."""
-        self.guistate.do_action(NEW)
+        self.commit_scheduler.flush()
+        self.guistate.do_action(
+            NEW, backend_change_function=self.mark_dirty_by_backend_thread)
         self.set_trans_type_combo_to_current_and_reset_view()
         self.set_sensitivities_and_status()
 
@@ -803,7 +931,10 @@ class MainWindow(object):
         if gtk_yes_no_dialog(
             """Are you sure you want to delete
 transaction number %s?""" % self.guistate.get_transaction_id() ):
-            self.guistate.do_action(DELETE)
+            self.commit_scheduler.flush()
+            self.guistate.do_action(
+                DELETE,
+                backend_change_function=self.mark_dirty_by_backend_thread)
             book = self.guistate.get_book()
             if self.guistate.get_transaction_id() == None:
                 self.set_transcombo_index(COMBO_SELECTION_NONE)
@@ -830,14 +961,17 @@ transaction number %s?""" % self.guistate.get_transaction_id() ):
             # the old type transaction seemed to remain in the state
             # stuff but was no longer available in the book. The
             # zodb transaction should of prevented this, what gives?
-            self.guistate.do_action(TYPE_CHANGE,
-                                    self.trans_type_combo.get_active())
+            self.commit_scheduler.flush()
+            self.guistate.do_action(
+                TYPE_CHANGE, self.trans_type_combo.get_active(),
+                self.mark_dirty_by_backend_thread)
             self.reset_trans_view()
             self.set_sensitivities_and_status()
 
     def on_forward_button_clicked(self, *args):
         """Go forward to next transaction."""
         
+        self.commit_scheduler.flush()
         self.guistate.do_action(FORWARD)
         self.set_trans_type_combo_to_current_and_reset_view()
         self.set_sensitivities_and_status()
@@ -845,6 +979,7 @@ transaction number %s?""" % self.guistate.get_transaction_id() ):
     def on_back_button_clicked(self, *args):
         """Go back to previous transaction."""
         
+        self.commit_scheduler.flush()
         self.guistate.do_action(BACKWARD)
         self.set_trans_type_combo_to_current_and_reset_view()
         self.set_sensitivities_and_status()
@@ -857,14 +992,15 @@ transaction number %s?""" % self.guistate.get_transaction_id() ):
         
         assert( self.gui_built )
         self.closedown_for_config()
+        self.stop_backend_thread()
         self.bookset.close()
         assert( not self.gui_built )
 
         # major flaw right now is that we don't want this to
         # re-open the same DB at the end, and we need to do something
         # the return value and seting bookset
-        self.bookset = \
-            establish_bokeep_db(self.mainwindow, self.__config_path, self.__config, None)
+        self.set_bookset(
+            establish_bokeep_db(self.mainwindow, self.__config_path, self.__config, None) )
 
         # if there's uncommited stuff, we need to ditch it because
         # the above function killed off and re-opened the db connecion
@@ -885,10 +1021,12 @@ transaction number %s?""" % self.guistate.get_transaction_id() ):
         
         book = self.guistate.get_book()
         if book != None:
-            backend = book.get_backend_plugin()
-            backend.close()
-            backend.configure_backend(self.mainwindow)
-            transaction.get().commit()
+            self.change_backend_plugin(
+                book, lambda: book.get_backend_plugin().configure_backend(
+                    self.mainwindow) )
+            # have what's waiting go out with the new settings (e.g. a
+            # lock to break) without waiting for the next change
+            self.backend_thread.request_flush(book.book_name)
 
     def on_configure_plugin1_activate(self, *args):
         """Configure the current front end plugin."""
@@ -905,10 +1043,12 @@ transaction number %s?""" % self.guistate.get_transaction_id() ):
         currmodule = self.trans_type_combo.get_model().get_value(
             currindex,2)
 
-        currmodule.run_configuration_interface(
-            self.mainwindow, self.guistate.get_book().get_backend_plugin(
-                ).backend_account_dialog,
-            self.guistate.get_book())
+        # backend_account_dialog opens a session of its own
+        book = self.guistate.get_book()
+        self.change_backend_plugin(
+            book, lambda: currmodule.run_configuration_interface(
+                self.mainwindow, book.get_backend_plugin(
+                    ).backend_account_dialog, book) )
         self.reset_trans_view()
         transaction.get().commit()
 
@@ -29,12 +29,14 @@ from bokeep.util import \
 (BOOK, TRANS) = range(2)
 
 def instantiate_transaction_class_add_to_book_backend_and_plugin(
-    cls, frontend_plugin, book):
+    cls, frontend_plugin, book, mark_backend_dirty=True):
     """Instantiates a bokeep.book_transaction.Transaction class, registers
     it in the right places.
 
     The right places being, the book, a frontend_plugin from that book,
-    and the backend plugin used by the book.
+    and the backend plugin used by the book. With mark_backend_dirty False
+    the backend plugin is left to the caller (e.g. to have a
+    BackendChangeThread mark it dirty after a commit)
 
     Returns the transaction id (from the BoKeepBook) and the Transaction
     instance itself in that order in a tuple
@@ -45,8 +47,9 @@ def instantiate_transaction_class_add_to_book_backend_and_plugin(
         new_transaction_instance)
     frontend_plugin.register_transaction(
         new_transaction_id, new_transaction_instance)
-    book.get_backend_plugin().mark_transaction_dirty(
-        new_transaction_id, new_transaction_instance )
+    if mark_backend_dirty:
+        book.get_backend_plugin().mark_transaction_dirty(
+            new_transaction_id, new_transaction_instance )
     return new_transaction_id, new_transaction_instance
 
 class BoKeepGuiState(FunctionAndDataDrivenStateMachine):
@@ -278,7 +281,8 @@ class BoKeepGuiState(FunctionAndDataDrivenStateMachine):
                     self.__get_code_classs_module_for_index(0)
         transaction_id, transaction = \
             instantiate_transaction_class_add_to_book_backend_and_plugin(
-            cls, module, self.get_book() )
+            cls, module, self.get_book(), self.__marks_backend() )
+        self.__backend_change(transaction_id)
         return (self.data[BOOK], transaction_id)
     
     def __purge_current_transaction(self, next_state):
@@ -301,7 +305,9 @@ class BoKeepGuiState(FunctionAndDataDrivenStateMachine):
         # backend.mark_transaction_dirty
         #
         # This is kind of inconsistent, eh?
-        self.data[BOOK].remove_transaction(self.data[TRANS])
+        self.data[BOOK].remove_transaction(self.data[TRANS],
+                                           self.__marks_backend() )
+        self.__backend_change(self.data[TRANS])
         return (self.data[BOOK], None)
 
     def __type_change(self, next_state):
@@ -311,7 +317,8 @@ class BoKeepGuiState(FunctionAndDataDrivenStateMachine):
             self._v_action_arg)
         transaction_id, transaction = \
             instantiate_transaction_class_add_to_book_backend_and_plugin(
-            cls, module, self.get_book() )
+            cls, module, self.get_book(), self.__marks_backend() )
+        self.__backend_change(transaction_id)
         return (self.data[BOOK], transaction_id)
 
     def __go_backward(self, next_state):
@@ -324,16 +331,45 @@ class BoKeepGuiState(FunctionAndDataDrivenStateMachine):
         assert(trans_id != None)
         return (self.data[BOOK], trans_id)
 
+    def __marks_backend(self):
+        return self._v_backend_changes == None
+
+    def __backend_change(self, trans_id):
+        if not self.__marks_backend():
+            self._v_backend_changes.append( (self.data[BOOK], trans_id) )
+
     # public api for use by mainwindow.py, or any other multi transaction
     # shell
 
+    def do_action(self, action, arg=None, backend_change_function=None):
+        """Carry out action and commit.
+
+        Transactions the action adds to or removes from the book are marked
+        dirty or marked for removal in the book's backend plugin. If
+        backend_change_function is provided the backend plugin is left
+        alone, instead it's called with the book and transaction id of each
+        of them after the commit. MainWindow uses this to have its
+        BackendChangeThread do the marking, so the backend plugin is only
+        ever changed from that thread's database connection.
+        """
+        backend_changes = self.__do_action(
+            action, arg, backend_change_function != None)
+        if backend_change_function != None:
+            for book, trans_id in backend_changes:
+                backend_change_function(book, trans_id)
+
     @ends_with_commit
-    def do_action(self, action, arg=None):
+    def __do_action(self, action, arg, defer_backend_changes):
         assert( self.action_allowed(action) )
         self._v_action_arg = arg
         self._v_last_action = action
+        self._v_backend_changes = [] if defer_backend_changes else None
         self.run_until_steady_state()
         delattr(self, '_v_action_arg')
+        # taken off before the commit, which can turn this into a ghost
+        backend_changes = self._v_backend_changes
+        delattr(self, '_v_backend_changes')
+        return backend_changes
 
     def action_allowed(self, action):
         assert(self.state != BoKeepGuiState.TMP_GOTO_NO_TRANS_OR_BROWSE)
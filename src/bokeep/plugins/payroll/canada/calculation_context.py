@@ -0,0 +1,125 @@
+# calculation_context.py
+# Copyright (C) 2011 ParIT Worker Co-operative <paritinfo@parit.ca>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author(s): Mark Jenkins <mark@parit.ca>
+
+"""Memoization of paystub calculations.
+
+Paystub line values and the income tax terms (T1, T2, K1-K4, A...) call
+each other over and over, calculating the income tax alone works out
+projected_annual_taxable_income_A and the CPP and EI deductions several
+times. Functions decorated with memoize_calculation remember what they
+returned in the active CalculationContext, so each is only worked out once.
+
+A CalculationContext is started for the outermost memoized call if there
+isn't one already and ends when it returns, wrap several calls in
+"with CalculationContext():" to have them share one. Anything that can
+change a result, setting an attribute of an Employee, Paystub or
+PaystubLine (which includes set_value, overrides, freezing and adding
+lines) or a payday's dates, calls invalidate_calculations() to forget
+everything remembered. Changing a dictionary attribute in place (e.g.
+employee.fed_tax_credits[...] = ...) isn't noticed, don't do that inside
+a CalculationContext you've started yourself.
+"""
+
+from threading import local
+
+# set to False to turn memoization off, for comparison
+MEMOIZE_CALCULATIONS = True
+
+_calculation_contexts = local()
+
+def get_active_calculation_context():
+    return getattr(_calculation_contexts, 'active', None)
+
+def memoizing_calculations():
+    return MEMOIZE_CALCULATIONS
+
+class CalculationContext(object):
+    def __init__(self):
+        self.results = {}
+        # goes up each time the results are forgotten
+        self.generation = 0
+        self.outer_context = None
+
+    def __enter__(self):
+        # a context inside another just uses the outer one
+        self.outer_context = get_active_calculation_context()
+        if self.outer_context == None:
+            _calculation_contexts.active = self
+        return get_active_calculation_context()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer_context == None:
+            _calculation_contexts.active = None
+        return False
+
+    def invalidate(self):
+        self.results.clear()
+        self.generation += 1
+
+def invalidate_calculations():
+    context = get_active_calculation_context()
+    if context != None:
+        context.invalidate()
+
+def invalidate_calculations_for_attribute(attribute_name, value):
+    """For __setattr__, calls invalidate_calculations() if setting
+    attribute_name could change a calculation. The persistence machinery's
+    own _p_ and _v_ attributes don't, except for setting _p_changed, which
+    is how a change to a list kept in an attribute is recorded.
+
+    Most attributes are set with no CalculationContext active, that's
+    checked first so they cost as little as possible
+    """
+    context = getattr(_calculation_contexts, 'active', None)
+    if context == None:
+        return
+    if attribute_name == '_p_changed':
+        if value:
+            context.invalidate()
+    elif not (attribute_name.startswith('_p_') or
+              attribute_name.startswith('_v_') ):
+        context.invalidate()
+
+def memoize_calculation(function):
+    """Decorates a function (or method) whose result depends only on its
+    arguments and the payroll objects they lead to, the arguments have to
+    be hashable
+    """
+    def memoized_function(*args, **kargs):
+        if not MEMOIZE_CALCULATIONS:
+            return function(*args, **kargs)
+        context = get_active_calculation_context()
+        if context == None:
+            with CalculationContext():
+                return memoized_function(*args, **kargs)
+        if len(kargs) == 0:
+            key = (function, args)
+        else:
+            key = (function, args, tuple(sorted(kargs.iteritems())))
+        if key in context.results:
+            return context.results[key]
+        generation = context.generation
+        result = function(*args, **kargs)
+        # if something changed while working it out, (e.g. an employee
+        # upgrading itself) it's not safe to keep
+        if context.generation == generation:
+            context.results[key] = result
+        return result
+    memoized_function.__name__ = function.__name__
+    memoized_function.__doc__ = function.__doc__
+    return memoized_function
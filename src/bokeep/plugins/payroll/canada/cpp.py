@@ -28,6 +28,7 @@ from functions import neg2zero, \
     decimal_truncate_two_places
     
 from decimal import Decimal
+from calculation_context import memoize_calculation
 
 from payroll_rule_period import \
      JUL_2006, JAN_2007, JAN_2008, JAN_2009, APR_2009, JAN_2010, JAN_2011, \
@@ -95,6 +96,7 @@ def get_cpp_basic_exemption(paystub):
     return CPP_BASIC_EXEMPTION_TABLE[
         get_payroll_rule_period_for_paystub(paystub) ]
 
+@memoize_calculation
 def calculate_cpp_deduction(paystub):
     employee = paystub.employee
 
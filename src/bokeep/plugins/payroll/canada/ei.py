@@ -31,6 +31,7 @@ from functions import decimal_round_two_place_using_third_digit, \
     convert_dict_of_string_to_dict_of_decimals_in_place
 
 from decimal import Decimal
+from calculation_context import memoize_calculation
 
 # EI constants
 
@@ -75,6 +76,7 @@ def get_ei_rate(paystub):
 def get_max_ei_premium(paystub):
     return MAX_EI_PREMIUM_TABLE[ get_payroll_rule_period_for_paystub(paystub) ]
 
+@memoize_calculation
 def calculate_ei_deduction(paystub):
     ei_rate = get_ei_rate(paystub)
     max_ei_premium = get_max_ei_premium(paystub)
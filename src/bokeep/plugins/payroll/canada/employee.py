@@ -28,7 +28,10 @@ from timesheet import Timesheet
 
 from provinces import Manitoba
 from paystub import Paystub
+from paystub_index import PaystubIndex
 from paystub_line import PaystubWageLine, sum_paystub_lines
+from calculation_context import memoize_calculation, \
+    invalidate_calculations, invalidate_calculations_for_attribute
 from functions import iterate_until_value, ZERO, \
     convert_dict_of_string_to_dict_of_decimals_in_place, \
     decimal_round_two_place_using_third_digit
@@ -88,12 +91,17 @@ START_OF_PERIOD, END_OF_PERIOD = range(2)
 
 NO_ROE_END_DATE = None
 
+# the key used by Employee.verify_paystub_accumulators when the paystubs
+# that aren't frozen don't match
+UNFROZEN_PAYSTUBS = 'unfrozen paystubs'
+
 class Employee(Persistent):
     """An employee is a person remunerated via payroll.
 
     Atributes:
 
-    paystubs -- A list of Paystubs associated with this employee
+    paystubs -- The Paystubs associated with this employee, in order of
+    paydate, a PaystubIndex (see paystub_index.py) that can be used like a list
 
     calcuated_paystub_line_functions -- A list of functions that are called
     to create new paystub lines. Each function is passed a paystub,
@@ -188,8 +196,9 @@ class Employee(Persistent):
         ]
 
     def __init__(self, name=None):
-        self.paystubs = []
+        self.paystubs = PaystubIndex()
         self.__init_timesheets()
+        self.__init_paystub_accumulators()
         self.archived_paystubs = None
         self.auto_add_lines = list(self.auto_add_lines)
 
@@ -210,16 +219,183 @@ class Employee(Persistent):
         self.init_roe_work_periods()
         self._p_changed = True
 
+    def __setattr__(self, name, value):
+        Persistent.__setattr__(self, name, value)
+        invalidate_calculations_for_attribute(name, value)
+
     def get_rate(self):
         if hasattr(self, 'rate'):
             return self.rate 
         else:
             return self.default_rate
 
+    def __init_paystub_index(self):
+        # earlier versions kept the paystubs in a plain list, in the order
+        # they were added
+        if not isinstance(self.paystubs, PaystubIndex):
+            self.paystubs = PaystubIndex(self.paystubs)
+
     def add_paystub(self, paystub):
-        self.paystubs.append(paystub)
+        self.__init_paystub_accumulators()
+        self.paystubs.add(paystub)
+        invalidate_calculations()
+        if not paystub.frozen:
+            self.unfrozen_paystubs.append(paystub)
+            self._p_changed = True
+
+    def reindex_paystub(self, paystub):
+        """Payday.set_paydate calls this when a paystub's paydate changes,
+        so it's in the right place among this employee's paystubs
+        """
+        self.__init_paystub_index()
+        self.paystubs.reindex(paystub)
+        invalidate_calculations()
+
+    def remove_paystubs(self, paystubs_to_remove):
+        """Drops any of paystubs_to_remove that belong to this employee,
+        and takes them out of the year to date and all time sums
+        """
+        self.__init_paystub_accumulators()
+        removed_paystubs = [ paystub for paystub in paystubs_to_remove
+                             if paystub in self.paystubs ]
+        if len(removed_paystubs) == 0:
+            return
+        for paystub in removed_paystubs:
+            self.paystubs.remove(paystub)
+            if paystub in self.unfrozen_paystubs:
+                self.unfrozen_paystubs.remove(paystub)
+            else:
+                self.__accumulate_paystub(paystub, remove=True)
         self._p_changed = True
 
+    def remove_paystub(self, paystub):
+        self.remove_paystubs( (paystub,) )
+
+    def __init_paystub_accumulators(self):
+        # earlier versions added up every paystub each time, see
+        # rebuild_paystub_accumulators
+        self.__init_paystub_index()
+        if not hasattr(self, 'paystub_line_class_totals'):
+            self.rebuild_paystub_accumulators(True)
+
+    def __rescan_paystub_accumulators(self):
+        """Adds up the frozen paystubs from scratch, returns the all time
+        and year totals and the list of paystubs that aren't frozen
+        """
+        totals = {}
+        year_totals = {}
+        unfrozen_paystubs = []
+        for paystub in self.paystubs:
+            if not paystub.frozen:
+                unfrozen_paystubs.append(paystub)
+                continue
+            year = paystub.get_paydate_year()
+            for paystub_line_class, value in \
+                    paystub.get_sums_by_paystub_line_class().iteritems():
+                totals[paystub_line_class] = \
+                    totals.get(paystub_line_class, ZERO) + value
+                year_key = (year, paystub_line_class)
+                year_totals[year_key] = year_totals.get(year_key, ZERO) + value
+        return totals, year_totals, unfrozen_paystubs
+
+    def rebuild_paystub_accumulators(self, include_legacy_frozen=False):
+        """Throws away the year to date and all time sums of the frozen
+        paystubs and adds them up again from the paystubs.
+
+        With include_legacy_frozen, paystubs with all of thier calculated
+        lines frozen (which plain_text_payroll has always done) are frozen
+        too, that's how employees from before the sums were kept get them.
+        """
+        self.paystub_line_class_totals = {}
+        self.paystub_line_class_year_totals = {}
+        self.latest_frozen_paydates = {}
+        self.unfrozen_paystubs = []
+        for paystub in self.paystubs:
+            if paystub.frozen or (include_legacy_frozen and
+                                  paystub.calculated_lines_frozen()):
+                paystub.frozen = True
+                self.__store_paystub_sums(paystub)
+                self.__accumulate_paystub(paystub)
+            else:
+                self.unfrozen_paystubs.append(paystub)
+        self._p_changed = True
+
+    def __store_paystub_sums(self, paystub):
+        # what was added to the sums, so it can be taken back out even if
+        # the paystub changes
+        paystub.accumulated_line_class_sums = \
+            paystub.get_sums_by_paystub_line_class()
+        paystub.accumulated_paydate = paystub.payday.paydate
+        paystub.accumulated_paydate_year = paystub.get_paydate_year()
+
+    def __accumulate_paystub(self, paystub, remove=False):
+        year = paystub.accumulated_paydate_year
+        for paystub_line_class, value in \
+                paystub.accumulated_line_class_sums.iteritems():
+            if remove:
+                value = -value
+            self.paystub_line_class_totals[paystub_line_class] = \
+                self.paystub_line_class_totals.get(paystub_line_class, ZERO) \
+                + value
+            year_key = (year, paystub_line_class)
+            self.paystub_line_class_year_totals[year_key] = \
+                self.paystub_line_class_year_totals.get(year_key, ZERO) + value
+        # on removal the latest paydate is left alone, too late only means
+        # get_YTD_sum_of_paystub_line_class does a full scan more often
+        paydate = paystub.accumulated_paydate
+        if not remove and paydate != None and \
+                paydate > self.latest_frozen_paydates.get(year, date.min):
+            self.latest_frozen_paydates[year] = paydate
+        self._p_changed = True
+
+    def accumulate_paystub(self, paystub):
+        """Adds a frozen paystub's lines to the year to date and all time
+        sums, or updates them if they were already added. Paystub.freeze
+        calls this, call it yourself if you change a line on a frozen
+        paystub.
+        """
+        assert( paystub.frozen )
+        self.__init_paystub_accumulators()
+        if paystub in self.unfrozen_paystubs:
+            self.unfrozen_paystubs.remove(paystub)
+        else:
+            # already added, take out what was added before
+            self.__accumulate_paystub(paystub, remove=True)
+        self.__store_paystub_sums(paystub)
+        self.__accumulate_paystub(paystub)
+
+    def verify_paystub_accumulators(self):
+        """Cross-checks the year to date and all time sums against adding
+        up all of the frozen paystubs again.
+
+        Returns a list of (key, accumulated value, rescanned value) for
+        each sum that's off, empty if they're all right. The key is a
+        paystub line class for the all time sums, and a (year, paystub line
+        class) pair for the year ones. If the list of paystubs that aren't
+        frozen is off, the key is UNFROZEN_PAYSTUBS and the values are the
+        number of them. rebuild_paystub_accumulators fixes these.
+        """
+        self.__init_paystub_accumulators()
+        totals, year_totals, unfrozen_paystubs = \
+            self.__rescan_paystub_accumulators()
+        mismatches = []
+        for accumulated, rescanned in \
+                ( (self.paystub_line_class_totals, totals),
+                  (self.paystub_line_class_year_totals, year_totals) ):
+            for key in set(accumulated).union(rescanned):
+                accumulated_value = accumulated.get(key, ZERO)
+                rescanned_value = rescanned.get(key, ZERO)
+                if accumulated_value != rescanned_value:
+                    mismatches.append(
+                        (key, accumulated_value, rescanned_value) )
+        if len(unfrozen_paystubs) != len(self.unfrozen_paystubs) or \
+                any( paystub not in self.unfrozen_paystubs
+                     for paystub in unfrozen_paystubs ):
+            mismatches.append( (UNFROZEN_PAYSTUBS,
+                                len(self.unfrozen_paystubs),
+                                len(unfrozen_paystubs) ) )
+        return mismatches
+
     def __init_timesheets(self):
         # earlier versions didn't have the timesheets array, add if needed
         if not hasattr(self, 'timesheets'):
@@ -321,41 +497,98 @@ class Employee(Persistent):
     def get_bounded_paystubs(self, startdate, enddate,
                              stop_at_paystub=None,
                              include_final_paystub=True):
-        for paystub in self.paystubs:
-            if paystub.payday.paydate >= startdate and \
-                    paystub.payday.paydate <= enddate:
-                # if we've reached the final paystub, and if we're not
-                # including it, stop
-                if paystub == stop_at_paystub and \
-                        not include_final_paystub:
-                    break
-                # current paystub
-                yield paystub
-                # stop if we just yielded the last one
-                if paystub == stop_at_paystub:
-                    break
-                
+        self.__init_paystub_index()
+        for paystub in self.paystubs.gen_paystubs_between(startdate, enddate):
+            # if we've reached the final paystub, and if we're not
+            # including it, stop
+            if paystub == stop_at_paystub and \
+                    not include_final_paystub:
+                break
+            # current paystub
+            yield paystub
+            # stop if we just yielded the last one
+            if paystub == stop_at_paystub:
+                break
+
+    def get_last_paystub_before(self, a_date):
+        """The latest paystub with a paydate before a_date, None if there
+        isn't one
+        """
+        self.__init_paystub_index()
+        return self.paystubs.get_last_paystub_before(a_date)
 
     def get_all_paystubs(self, stop_at_paystub, include_final_paystub=False):
         """Provides a generator that gives access to all paystubs associated
         with this employee, except for
         ones listed in the argument except (which is a tuple or list)
         """
+        self.__init_paystub_index()
         return iterate_until_value(self.paystubs, stop_at_paystub,
                                    include_final_paystub)
 
+    def __sum_of_paystub_line_class_using_accumulators(
+        self, paystub_line_class, stop_at_paystub, include_final_paystub,
+        totals, year=None, start_date=None):
+        """Same result as adding up the lines from the paystubs before
+        stop_at_paystub, but for the frozen paystubs the sums in totals
+        (with year, the ones for that year) are used instead.
+        """
+        # the paystubs after stop_at_paystub (and it unless
+        # include_final_paystub) aren't included, like iterate_until_value,
+        # everything is if stop_at_paystub isn't one of ours
+        if stop_at_paystub in self.paystubs:
+            excluded_paystubs = list(self.paystubs.gen_paystubs_after(
+                    stop_at_paystub, not include_final_paystub) )
+        else:
+            excluded_paystubs = []
+
+        total = ZERO
+        for (key, value) in totals.iteritems():
+            key_class = key if year == None else key[1]
+            if (year == None or key[0] == year) and \
+                    issubclass(key_class, paystub_line_class):
+                total += value
+        for paystub in excluded_paystubs:
+            if paystub.frozen and \
+                    (year == None or paystub.accumulated_paydate_year == year):
+                for key_class, value in \
+                        paystub.accumulated_line_class_sums.iteritems():
+                    if issubclass(key_class, paystub_line_class):
+                        total -= value
+        for paystub in self.unfrozen_paystubs:
+            if paystub in excluded_paystubs or \
+                    ( year != None and
+                      not (start_date <= paystub.payday.paydate <=
+                           stop_at_paystub.payday.paydate) ):
+                continue
+            for paystub_line in \
+                    paystub.get_paystub_lines_of_class(paystub_line_class):
+                total += paystub_line.get_value()
+        return decimal_round_two_place_using_third_digit(total)
+
+    @memoize_calculation
     def get_sum_of_all_paystub_line_class(self, paystub_line_class,
                                           stop_at_paystub,
                                           include_final_paystub=False):
-        return sum_paystub_lines(
-            self.get_all_paystub_lines_of_class(paystub_line_class,
-                                                stop_at_paystub,
-                                                include_final_paystub) )
+        self.__init_paystub_accumulators()
+        return self.__sum_of_paystub_line_class_using_accumulators(
+            paystub_line_class, stop_at_paystub, include_final_paystub,
+            self.paystub_line_class_totals)
 
+    @memoize_calculation
     def get_YTD_sum_of_paystub_line_class(self, paystub_line_class,
                                           stop_at_paystub,
                                           include_final_paystub=False):
+        self.__init_paystub_accumulators()
         last_date  = stop_at_paystub.payday.paydate
+        year = last_date.year
+        # the year's sums can only be used if none of the frozen paystubs
+        # from this year are after stop_at_paystub's paydate
+        if self.latest_frozen_paydates.get(year, last_date) <= last_date:
+            return self.__sum_of_paystub_line_class_using_accumulators(
+                paystub_line_class, stop_at_paystub, include_final_paystub,
+                self.paystub_line_class_year_totals, year,
+                start_of_year(last_date) )
         return self.get_bounded_sum_of_paystub_line_class(
             paystub_line_class,
             start_of_year(stop_at_paystub.payday.paydate), last_date,
@@ -597,6 +830,7 @@ class Employee(Persistent):
             raise RoeWorkPeriodNotExist()
 
     def first_paydate_by_paystub(self, answer_for_none=None):
+        self.__init_paystub_index()
         return (
             answer_for_none if len(self.paystubs) == 0
             else self.paystubs[0].payday.paydate )
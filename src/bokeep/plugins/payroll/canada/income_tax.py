@@ -31,6 +31,7 @@ from functions import neg2zero, range_table_lookup, ZERO, \
     decimal_round_two_place_using_third_digit
 
 from decimal import Decimal
+from calculation_context import memoize_calculation
 
 from itertools import imap
 
@@ -414,6 +415,7 @@ def calc_provincial_part(T, federal_ratio):
     pp = T - calc_federal_part(T, federal_ratio)
     return pp
 
+@memoize_calculation
 def calculate_income_tax_deduction_T_and_ratio(paystub):
     T1 = calc_annual_fed_income_tax_T1(paystub)
     T2 = calc_annual_provincial_income_tax_T2(paystub)
@@ -433,6 +435,7 @@ def calculate_income_tax_deduction_T(paystub):
     T, federal_ratio = calculate_income_tax_deduction_T_and_ratio(paystub)
     return T
 
+@memoize_calculation
 def calc_annual_basic_federal_income_tax_T3(paystub):
     annual_taxable_income_A = paystub.projected_annual_taxable_income_A()
     
@@ -446,11 +449,13 @@ def calc_annual_basic_federal_income_tax_T3(paystub):
 
     return T3
 
+@memoize_calculation
 def calc_annual_fed_income_tax_T1(paystub):
     T3 = calc_annual_basic_federal_income_tax_T3(paystub)
     T1 = neg2zero(T3 - paystub.employee.labour_credit_fed_LCF())
     return T1
 
+@memoize_calculation
 def projected_annual_fed_tax_reduction(paystub):
     """A projection of the annual income tax reduction the employee
     associated with a paystub will recieve. This comes from various
@@ -516,6 +521,7 @@ def calc_canada_employment_credit_K4(paystub):
     return K4
 
 
+@memoize_calculation
 def calc_annual_basic_provincial_tax_T4(paystub):
     province = paystub.employee.province
     annual_taxable_income_A = paystub.projected_annual_taxable_income_A()
@@ -529,6 +535,7 @@ def calc_annual_basic_provincial_tax_T4(paystub):
          projected_annual_prov_tax_reduction(paystub)
     return T4
 
+@memoize_calculation
 def calc_annual_provincial_income_tax_T2(paystub):
     employee = paystub.employee
     province = employee.province
@@ -582,6 +589,7 @@ def calc_other_prov_tax_credits_K3P(paystub):
     K3P = sum( paystub.employee.other_prov_tax_credits.itervalues() )
     return K3P
 
+@memoize_calculation
 def projected_annual_prov_tax_reduction(paystub):
     return sum( function(paystub)
                 for function in 
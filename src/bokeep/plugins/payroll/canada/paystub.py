@@ -30,8 +30,10 @@ from cpp import PaystubCPPDeductionLine, PaystubCPPEmployerContributionLine
 from ei import PaystubEIDeductionLine, PaystubEIEmployerContributionLine
 
 from functions import neg2zero, filter_by_class, filter_by_not_class, \
-    instance_of_one
+    instance_of_one, ZERO
 from decimal import Decimal
+from calculation_context import CalculationContext, memoize_calculation, \
+    memoizing_calculations, invalidate_calculations_for_attribute
 
 from itertools import chain
 
@@ -46,8 +48,11 @@ class Paystub(Persistent):
     employee -- The employee being paid.
     paystub_lines -- PaystubLine objects associated with this paystub
     calculated_lines -- True once the calculated lines have been added
+    frozen -- True once freeze() has been called, the employee's year to
+    date and all time sums include frozen paystubs
     """
     calculated_lines = False
+    frozen = False
 
     def __init__(self, employee, payday):
         self.employee = employee
@@ -60,9 +65,97 @@ class Paystub(Persistent):
         for paystub_line_class in self.employee.auto_add_lines:
             self.add_new_paystub_line_of_class(paystub_line_class)
 
+    def __setattr__(self, name, value):
+        Persistent.__setattr__(self, name, value)
+        if name == 'paystub_lines':
+            self._v_paystub_lines_by_class = None
+        invalidate_calculations_for_attribute(name, value)
+
+    def __get_paystub_lines_by_class(self):
+        """A dictionary from each class of line, and every class it inherits
+        from, to a list of the lines of that class in the order they were
+        added.
+
+        It's kept in a volatile (_v_) attribute, so it's never saved with
+        the paystub, it's built again after the paystub is loaded or a
+        transaction is aborted. It's also built again if paystub_lines gets
+        replaced or changes length without going through add_paystub_line
+        and remove_paystub_line.
+        """
+        paystub_lines_by_class = getattr(
+            self, '_v_paystub_lines_by_class', None)
+        if paystub_lines_by_class == None or \
+                self._v_paystub_lines_indexed != len(self.paystub_lines):
+            paystub_lines_by_class = {}
+            for paystub_line in self.paystub_lines:
+                for paystub_line_class in paystub_line.__class__.__mro__:
+                    paystub_lines_by_class.setdefault(
+                        paystub_line_class, []).append(paystub_line)
+            self._v_paystub_lines_by_class = paystub_lines_by_class
+            self._v_paystub_lines_indexed = len(self.paystub_lines)
+        return paystub_lines_by_class
+
     def add_paystub_line(self, paystub_line):
+        paystub_lines_by_class = self.__get_paystub_lines_by_class()
         self.paystub_lines.append( paystub_line )
+        for paystub_line_class in paystub_line.__class__.__mro__:
+            paystub_lines_by_class.setdefault(
+                paystub_line_class, []).append(paystub_line)
+        self._v_paystub_lines_indexed = len(self.paystub_lines)
+        self._p_changed = True
+        if self.frozen:
+            self.freeze()
+
+    def remove_paystub_line(self, paystub_line):
+        paystub_lines_by_class = self.__get_paystub_lines_by_class()
+        self.paystub_lines.remove( paystub_line )
+        for paystub_line_class in paystub_line.__class__.__mro__:
+            paystub_lines_by_class[paystub_line_class].remove(paystub_line)
+        self._v_paystub_lines_indexed = len(self.paystub_lines)
         self._p_changed = True
+        # take the line back out of the employee's sums
+        if self.frozen:
+            self.employee.accumulate_paystub(self)
+
+    def freeze(self):
+        """Freezes all the calculated lines with thier current values
+        and has the employee add this paystub to its year to date and
+        all time sums, so later paystubs don't have to add it up again.
+        """
+        if memoizing_calculations():
+            # work out all the values in one calculation context before any
+            # are set, setting one forgets everything calculated so far
+            with CalculationContext():
+                values = [ (paystub_line, paystub_line.get_value())
+                           for paystub_line in self.get_calculated_lines() ]
+            for paystub_line, value in values:
+                paystub_line.set_value(value)
+        else:
+            # without memoization, lines that come later use the frozen
+            # values of the ones before instead of working them out again
+            for paystub_line in self.get_calculated_lines():
+                paystub_line.freeze_value()
+        self.frozen = True
+        self.employee.accumulate_paystub(self)
+
+    def calculated_lines_frozen(self):
+        return all( paystub_line.override
+                    for paystub_line in self.get_calculated_lines() )
+
+    def get_sums_by_paystub_line_class(self):
+        """A dictionary of the sum of the lines of each class, only
+        the actual class of each line, not the classes it inherits from
+        """
+        sums = {}
+        for paystub_line in self.paystub_lines:
+            paystub_line_class = paystub_line.__class__
+            sums[paystub_line_class] = \
+                sums.get(paystub_line_class, ZERO) + paystub_line.get_value()
+        return sums
+
+    def get_paydate_year(self):
+        return None if self.payday.paydate == None \
+            else self.payday.paydate.year
 
     def add_new_paystub_line_of_class(self, paystub_line_class):
         return self.add_paystub_line(paystub_line_class(self) )
@@ -70,13 +163,20 @@ class Paystub(Persistent):
     def get_paystub_lines_of_class(self, paystub_line_class):
         """A list of all paystub lines of a certain class
         """
-        return filter_by_class(paystub_line_class, self.paystub_lines)
+        # isinstance style tuples of classes aren't in the index
+        if isinstance(paystub_line_class, tuple):
+            return filter_by_class(paystub_line_class, self.paystub_lines)
+        return iter(self.__get_paystub_lines_by_class().get(
+                paystub_line_class, () ))
 
     def get_paystub_lines_of_classes_not_classes(
         self,
         good_classes, bad_classes):
+        # with one good class only its lines need to be checked
+        lines = ( self.get_paystub_lines_of_class(good_classes[0])
+                  if len(good_classes) == 1 else self.paystub_lines )
         return ( line
-                 for line in self.paystub_lines
+                 for line in lines
                  if instance_of_one(line, good_classes) and \
                      not instance_of_one(line, bad_classes) )
 
@@ -136,41 +236,51 @@ class Paystub(Persistent):
     def get_taxable_income_lines(self):
         return filter_for_taxable_lines(self.get_income_lines())
 
+    @memoize_calculation
     def income_tax_deductions(self):
         return sum_paystub_lines( self.get_income_tax_deduction_lines() )
 
+    @memoize_calculation
     def cpp_deductions(self):
         """The total CPP deductions on this paystub
         """
         return sum_paystub_lines(self.get_cpp_deduction_lines())
 
+    @memoize_calculation
     def ei_deductions(self):
         """The total EI deductions on this paystub
         """
         return sum_paystub_lines(self.get_ei_deduction_lines())
     
+    @memoize_calculation
     def employer_ei_contributions(self):
         """The total EI deductions on this paystub
         """
         return sum_paystub_lines(self.get_ei_contribution_lines())
 
+    @memoize_calculation
     def employer_cpp_contributions(self):
         return sum_paystub_lines(self.get_cpp_contribution_lines())
 
+    @memoize_calculation
     def gross_income(self):
         """The gross income for this pay period
         """
         return sum_paystub_lines(self.get_income_lines())
 
+    @memoize_calculation
     def net_pay(self):
         return sum_paystub_lines_for_net_pay( self.paystub_lines )
 
+    @memoize_calculation
     def deductions(self):
         return sum_paystub_lines(self.get_deduction_lines() )
 
+    @memoize_calculation
     def employer_contributions(self):
         return sum_paystub_lines(self.get_contribution_lines())
 
+    @memoize_calculation
     def taxable_income(self):
         """Income from this payperiod that is taxable. This consists of
         all taxable income minus tax exempt deductions such as RRSP
@@ -180,6 +290,7 @@ class Paystub(Persistent):
             chain(self.get_taxable_income_lines(),
                   self.get_tax_except_deduction_lines() ) )
     
+    @memoize_calculation
     def projected_annual_taxable_income_A(self):
         """A projection of the employee's annual taxable income.
 
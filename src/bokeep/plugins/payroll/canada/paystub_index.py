@@ -0,0 +1,124 @@
+# paystub_index.py
+# Copyright (C) 2011 ParIT Worker Co-operative <paritinfo@parit.ca>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author(s): Mark Jenkins <mark@parit.ca>
+
+from datetime import date
+from sys import maxint
+
+# zopedb
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
+
+def paydate_of_paystub(paystub):
+    # paydays can be created before thier paydate is set, dates and None
+    # can't be compared, so those go first
+    paydate = paystub.payday.paydate
+    return date.min if paydate == None else paydate
+
+class PaystubIndex(Persistent):
+    """The paystubs of an Employee, in order of paydate and then the order
+    they were added in.
+
+    They're kept in a BTree keyed by (paydate, sequence number), so adding a
+    paystub or finding the ones in a date range only touches a few buckets
+    instead of the whole list. Each paystub remembers its key as
+    paystub_index_key.
+
+    The list operations Employee.paystubs has always had, iteration, len,
+    indexing, in and append still work.
+    """
+    def __init__(self, paystubs=()):
+        self.__paystubs = OOBTree()
+        self.__length = Length()
+        self.__next_sequence = 0
+        for paystub in paystubs:
+            self.add(paystub)
+
+    def __new_key(self, paystub):
+        key = (paydate_of_paystub(paystub), self.__next_sequence)
+        self.__next_sequence += 1
+        return key
+
+    def add(self, paystub):
+        key = self.__new_key(paystub)
+        paystub.paystub_index_key = key
+        self.__paystubs[key] = paystub
+        self.__length.change(1)
+
+    append = add
+
+    def remove(self, paystub):
+        if paystub not in self:
+            raise ValueError("paystub isn't in this index")
+        del self.__paystubs[paystub.paystub_index_key]
+        self.__length.change(-1)
+
+    def reindex(self, paystub):
+        """Moves a paystub to where it belongs after its paydate changed,
+        it keeps its place among paystubs with the same paydate if it
+        didn't
+        """
+        if paystub not in self:
+            return
+        if paystub.paystub_index_key[0] == paydate_of_paystub(paystub):
+            return
+        del self.__paystubs[paystub.paystub_index_key]
+        key = self.__new_key(paystub)
+        paystub.paystub_index_key = key
+        self.__paystubs[key] = paystub
+
+    def __contains__(self, paystub):
+        key = getattr(paystub, 'paystub_index_key', None)
+        return key != None and self.__paystubs.get(key) is paystub
+
+    def __len__(self):
+        return self.__length()
+
+    def __iter__(self):
+        return iter(self.__paystubs.values())
+
+    def __reversed__(self):
+        return reversed(list(self.__paystubs.values()))
+
+    def __getitem__(self, i):
+        if i == 0 and len(self) > 0:
+            return self.__paystubs[self.__paystubs.minKey()]
+        elif i == -1 and len(self) > 0:
+            return self.__paystubs[self.__paystubs.maxKey()]
+        return list(self)[i]
+
+    def gen_paystubs_between(self, start_date, end_date):
+        """The paystubs with paydates from start_date to end_date"""
+        return iter(self.__paystubs.values(
+            (start_date,), (end_date, maxint) ))
+
+    def gen_paystubs_after(self, paystub, include_paystub=False):
+        """The paystubs after paystub, which has to be in this index"""
+        assert( paystub in self )
+        return iter(self.__paystubs.values(
+            paystub.paystub_index_key, excludemin=not include_paystub ))
+
+    def get_last_paystub_before(self, a_date):
+        """The latest paystub with a paydate before a_date, None if there
+        isn't one
+        """
+        try:
+            # (a_date,) is before all the keys with paydate a_date
+            return self.__paystubs[self.__paystubs.maxKey( (a_date,) )]
+        except ValueError:
+            return None
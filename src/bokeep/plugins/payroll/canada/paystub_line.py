@@ -20,6 +20,8 @@
 from itertools import ifilter, ifilterfalse, imap
 from decimal import Decimal
 from functions import decimal_round_two_place_using_third_digit, ZERO
+from calculation_context import memoize_calculation, \
+    invalidate_calculations_for_attribute
 
 # zopedb
 from persistent import Persistent
@@ -93,6 +95,10 @@ class PaystubLine(Persistent):
         if len(args)>0 or len(kargs)>0:
             self.set_value(*args, **kargs)
 
+    def __setattr__(self, name, value):
+        Persistent.__setattr__(self, name, value)
+        invalidate_calculations_for_attribute(name, value)
+
     def get_value(self):
         """The value of the line, always a positive number
         """
@@ -190,7 +196,8 @@ class PaystubCalculatedLine(PaystubLine):
     # the paystub is the only argument of interest for calculated lines
     def __init__(self, paystub):
         PaystubLine.__init__(self, paystub)
-    
+
+    @memoize_calculation
     def get_value(self):
         if self.override:
             return PaystubLine.get_value(self)
@@ -25,6 +25,8 @@ from datetime import date
 # cndpayroll
 from bokeep.plugins.payroll.canada.paystub import Paystub
 from bokeep.plugins.payroll.canada.employee import Employee
+from bokeep.plugins.payroll.canada.calculation_context import \
+    invalidate_calculations
 from bokeep.plugins.payroll.canada.paystub_line import \
     PaystubLine, PaystubIncomeLine, PaystubWageLine, PaystubOvertimeWageLine, \
     PaystubCalculatedLine, PaystubDeductionLine, PaystubSimpleDeductionLine, \
@@ -90,7 +92,16 @@ class Payday(BookTransaction):
         
         Three arguments, in that order, each of type datetime.date
         """
+        old_paydate = self.paydate
         (self.paydate, self.period_start, self.period_end) = args
+        # keep the payroll plugin's index of paydays by paydate and the
+        # employees' paystub indexes up to date
+        if self.associated_plugin != None:
+            self.associated_plugin.reindex_payday(self, old_paydate)
+        for paystub in self.paystubs:
+            paystub.employee.reindex_paystub(paystub)
+        # the payroll rules that apply depend on the paydate
+        invalidate_calculations()
 
     def specify_accounting_lines(self, payday_accounting_lines):
         self.payday_accounting_lines = payday_accounting_lines
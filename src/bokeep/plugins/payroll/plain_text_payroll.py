@@ -39,7 +39,8 @@ from bokeep.config import get_bokeep_bookset
 from bokeep.book import BoKeepBookSet
 from bokeep.plugins.payroll.payroll import Payday, Employee, \
     PaystubCalculatedLine, PaystubNetPaySummaryLine
-from bokeep.util import ends_with_commit
+from bokeep.util import \
+    ends_with_commit, runs_as_unit_of_work
 
 
 from datetime import date, datetime
@@ -376,11 +377,10 @@ def setup_paystubs_for_payday_from_dicts(
    
 
     # freeze all calculated paystub lines with current values to avoid
-    # unesessary recalculation
+    # unesessary recalculation, this also adds the paystubs to the
+    # employee's year to date and all time sums
     for paystub in payday.paystubs:
-        for paystub_line in paystub.get_paystub_lines_of_class(
-            PaystubCalculatedLine):
-            paystub_line.freeze_value()
+        paystub.freeze()
 
     #possibility of supporting stuff other than 'name' in futue
     def parse_accounting_line_variables(paystub, scoping):
@@ -480,6 +480,53 @@ def add_new_payroll(book, payroll_module, display_paystubs, paydate,
                     paystub_accounting_line_config,
                     print_paystub_line_config, file_path,
                     overwrite_existing=False, add_missing_employees=False):
+    result, msg, payday_trans_id = setup_new_payroll_for_backend(
+        book, payroll_module, paydate, emp_list, chequenum_start,
+        period_start, period_end, paystub_line_config,
+        paystub_accounting_line_config, print_paystub_line_config,
+        file_path, overwrite_existing, add_missing_employees)
+    if result in (PAYROLL_ALREADY_EXISTS, PAYROLL_ACCOUNTING_LINES_IMBALANCE):
+        return result, msg
+
+    # the unit of work is over by now, flush_backend() commits after it
+    # saves, so what's in the backend and what we recorded about it
+    # can't be rolled back seperately
+    backend_module = book.get_backend_plugin()
+    if result != RUN_PAYROLL_SUCCEEDED:
+        success = payroll_remove_payday(
+            book, payroll_module, backend_module, paydate)
+        if not success:
+            msg = msg + ", and removal failed"
+        return result, msg
+
+    backend_module.flush_backend()
+
+    if not backend_module.transaction_is_clean(payday_trans_id):
+        msg = backend_module.reason_transaction_is_dirty(
+            payday_trans_id)
+        success = payroll_remove_payday(
+            book, payroll_module, backend_module, paydate)
+        if not success:
+            msg = msg + ", and removal failed"
+        return (PAYROLL_BACKEND_COMPLAINT, msg)
+
+    if (display_paystubs):
+        print 'spawning oowriter'
+        os.spawnv(P_NOWAIT, '/usr/bin/oowriter', ['0', 'PaystubPrint.txt'])
+
+    print list(book.trans_tree.iteritems())
+
+    return RUN_PAYROLL_SUCCEEDED, None
+
+# everything from creating the payday to marking it dirty in the backend is
+# commited once, at the end. Returns the payday's trans_id along with the
+# usual result and message
+@runs_as_unit_of_work
+def setup_new_payroll_for_backend(
+    book, payroll_module, paydate, emp_list, chequenum_start,
+    period_start, period_end, paystub_line_config,
+    paystub_accounting_line_config, print_paystub_line_config, file_path,
+    overwrite_existing=False, add_missing_employees=False):
     backend_module = book.get_backend_plugin()
     
     # if a payroll has already been run with the same date, either error out
@@ -487,7 +534,7 @@ def add_new_payroll(book, payroll_module, display_paystubs, paydate,
     payday_trans_id, payday = payroll_module.get_payday(paydate)
     if payday != None:
         if not (overwrite_existing):
-            return PAYROLL_ALREADY_EXISTS, None
+            return PAYROLL_ALREADY_EXISTS, None, payday_trans_id
     # else create the payday
     else: 
         payday = Payday(payroll_module)
@@ -496,52 +543,27 @@ def add_new_payroll(book, payroll_module, display_paystubs, paydate,
         backend_module.mark_transaction_dirty(payday_trans_id,
                                               payday)
         payroll_module.register_transaction(payday_trans_id, payday)
-        # no harm in committing the above two steps early when the payday is
-        # empty, if there was termination right after this, we would be able
-        # to go strait to the the retrival step above
-        transaction.get().commit()
 
     result, msg = setup_paystubs_for_payday_from_dicts(
         payroll_module, payday,
         emp_list, chequenum_start, paystub_line_config,
         paystub_accounting_line_config, add_missing_employees=False)
 
+    # add_new_payroll removes the payday, outside of the unit of work
     if result != RUN_PAYROLL_SUCCEEDED:
-        success = payroll_remove_payday(
-            book, payroll_module, backend_module, paydate)
-        if not success:
-            msg = msg + ", and removal failed"
-        return result, msg
+        return result, msg, payday_trans_id
 
     print_paystubs(payday, print_paystub_line_config, file_path)
         
-    if payday_accounting_lines_balance(payday):
-        backend_module.error_log_file = "bo_keep_backend_error_log"
-        backend_module.mark_transaction_dirty(payday_trans_id,
-                                              payday)
-        backend_module.flush_backend()
-        transaction.get().commit()
-
-        if not backend_module.transaction_is_clean(payday_trans_id):
-            msg = backend_module.reason_transaction_is_dirty(
-                payday_trans_id)
-            success = payroll_remove_payday(
-                book, payroll_module, backend_module, paydate)
-            if not success:
-                msg = msg + ", and removal failed"
-            return (PAYROLL_BACKEND_COMPLAINT, msg)
-
-        if (display_paystubs):
-            print 'spawning oowriter'
-            os.spawnv(P_NOWAIT, '/usr/bin/oowriter', ['0', 'PaystubPrint.txt'])
-    else:
-        # save this inbalanced transaction so we can inspect it
-        transaction.get().commit()
-        return PAYROLL_ACCOUNTING_LINES_IMBALANCE, None
-
-    print list(book.trans_tree.iteritems())
-
-    return RUN_PAYROLL_SUCCEEDED, None    
+    if not payday_accounting_lines_balance(payday):
+        # this inbalanced transaction is still commited at the end of the
+        # unit of work so we can inspect it
+        return PAYROLL_ACCOUNTING_LINES_IMBALANCE, None, payday_trans_id
+
+    backend_module.error_log_file = "bo_keep_backend_error_log"
+    backend_module.mark_transaction_dirty(payday_trans_id,
+                                          payday)
+    return RUN_PAYROLL_SUCCEEDED, None, payday_trans_id
 
 def payroll_init(bookname, bookset=None):
     if (bookset == None):
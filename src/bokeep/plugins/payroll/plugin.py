@@ -17,8 +17,14 @@
 #
 # Author: Mark Jenkins <mark@parit.ca>
 
+# python imports
+from datetime import timedelta
+from itertools import chain
+
 # zodb import
 from persistent.mapping import PersistentMapping
+from BTrees.OOBTree import OOBTree
+from BTrees.IIBTree import IITreeSet
 
 # bokeep imports
 from bokeep.prototype_plugin import PrototypePlugin
@@ -33,6 +39,7 @@ class PayrollPlugin(PrototypePlugin):
         self.employee_database = {}
         self.payday_database = {}
         self.remmit_db = PersistentMapping()
+        self.__init_paydate_index()
         self.set_config_file(self.get_config_file())
 
     def add_employee(self, employee_ident, employee):
@@ -92,6 +99,8 @@ class PayrollPlugin(PrototypePlugin):
             assert( not self.has_payroll_trans(trans_id) )
             self.payday_database[trans_id] = payrollish_trans
             self._p_changed = True
+            self.__init_paydate_index()
+            self.__index_payday(trans_id, payrollish_trans)
         elif isinstance(payrollish_trans, Remittance):
             self.remmit_db = getattr(self, 'remmit_db', PersistentMapping())
             # very important that this check be done after the above
@@ -110,12 +119,7 @@ class PayrollPlugin(PrototypePlugin):
         # perhaps a good argument for being rid of employees referencing
         # thier own paystubs seeing how this was once absent...
         for name, employee in self.get_employees().iteritems():
-            new_paystubs = [
-                paystub
-                for paystub in employee.paystubs
-                if paystub not in payday_to_remove.paystubs
-                ]
-            employee.paystubs = new_paystubs        
+            employee.remove_paystubs(payday_to_remove.paystubs)
 
         # implicit set of payday_to_remove._p_changed = True
         payday_to_remove.paystubs = []
@@ -125,12 +129,26 @@ class PayrollPlugin(PrototypePlugin):
             payday_to_remove = self.payday_database[trans_id]
             del self.payday_database[trans_id]
             self._p_changed = True
+            self.__init_paydate_index()
+            self.__unindex_payday(trans_id, payday_to_remove.paydate)
             self.purge_all_paystubs(payday_to_remove)
         elif self.has_remmit_trans(trans_id):
             del self.remmit_db[trans_id] # no _p_changed needed
         else:
             assert(False)
 
+    def verify_paystub_accumulators(self):
+        """Employee.verify_paystub_accumulators for every employee,
+        returns a dictionary of employee name to the list of mismatches
+        for the employees that have any
+        """
+        results = {}
+        for name, employee in self.get_employees().iteritems():
+            mismatches = employee.verify_paystub_accumulators()
+            if len(mismatches) > 0:
+                results[name] = mismatches
+        return results
+
     def has_payroll_trans(self, trans_id):
         return trans_id in self.payday_database
 
@@ -143,6 +161,82 @@ class PayrollPlugin(PrototypePlugin):
             self.has_remmit_trans(trans_id)
     
 
+    def __init_paydate_index(self):
+        # earlier versions searched through all of payday_database instead
+        if not hasattr(self, 'paydate_index'):
+            self.rebuild_paydate_index()
+
+    def rebuild_paydate_index(self):
+        """Throws away the index of paydays by paydate and builds it again
+        from payday_database.
+
+        paydate_index is a BTree of paydate to the set of trans_ids with
+        that paydate, paydays that don't have a paydate yet are in
+        paydays_without_paydate instead.
+
+        max_days_paydate_after_period_start and
+        max_days_period_end_after_paydate are how far back and forward from
+        the paydates get_paydays has to look for pay periods overlapping
+        its dates, they only go down when this is called.
+        """
+        self.paydate_index = OOBTree()
+        self.paydays_without_paydate = IITreeSet()
+        self.max_days_paydate_after_period_start = 0
+        self.max_days_period_end_after_paydate = 0
+        for trans_id, payday in self.payday_database.iteritems():
+            self.__index_payday(trans_id, payday)
+
+    def __index_payday(self, trans_id, payday):
+        if payday.paydate == None:
+            self.paydays_without_paydate.insert(trans_id)
+            return
+        if payday.paydate not in self.paydate_index:
+            self.paydate_index[payday.paydate] = IITreeSet()
+        self.paydate_index[payday.paydate].insert(trans_id)
+        if payday.period_start != None:
+            self.max_days_paydate_after_period_start = max(
+                self.max_days_paydate_after_period_start,
+                (payday.paydate - payday.period_start).days )
+        if payday.period_end != None:
+            self.max_days_period_end_after_paydate = max(
+                self.max_days_period_end_after_paydate,
+                (payday.period_end - payday.paydate).days )
+
+    def __unindex_payday(self, trans_id, paydate):
+        if paydate == None:
+            trans_ids = self.paydays_without_paydate
+        else:
+            trans_ids = self.paydate_index.get(paydate, ())
+        if trans_id not in trans_ids:
+            return False
+        trans_ids.remove(trans_id)
+        if paydate != None and len(trans_ids) == 0:
+            del self.paydate_index[paydate]
+        return True
+
+    def __gen_trans_ids_with_paydate(self, paydate):
+        self.__init_paydate_index()
+        if paydate == None:
+            return iter(self.paydays_without_paydate)
+        return iter(self.paydate_index.get(paydate, ()))
+
+    def reindex_payday(self, payday, old_paydate):
+        """Payday.set_paydate calls this when a payday's dates change, so
+        it can be found under its new paydate. Does nothing for paydays
+        that haven't been registered yet
+        """
+        for trans_id in list(self.__gen_trans_ids_with_paydate(old_paydate)):
+            if self.payday_database[trans_id] is payday:
+                self.__unindex_payday(trans_id, old_paydate)
+                self.__index_payday(trans_id, payday)
+                return
+
+    def __gen_trans_ids_in_paydate_range(self, start_date, end_date):
+        self.__init_paydate_index()
+        for trans_ids in self.paydate_index.values(start_date, end_date):
+            for trans_id in trans_ids:
+                yield trans_id
+
     #note that there may be information included before start date and after end 
     #date, it is the PERIODS that contain these dates that serve as the bounding
     #points, not the dates themselves.
@@ -152,8 +246,18 @@ class PayrollPlugin(PrototypePlugin):
         else:
             #return bounded info
             bounded_entries = {}
-            # kind of shocked this isn't returned sorted...
-            for trans_id, payday in self.payday_database.iteritems():
+            self.__init_paydate_index()
+            # only paydays with paydates close enough to the range can have
+            # periods overlapping it
+            candidate_trans_ids = chain(
+                self.__gen_trans_ids_in_paydate_range(
+                    start_date - timedelta(
+                        self.max_days_period_end_after_paydate),
+                    end_date + timedelta(
+                        self.max_days_paydate_after_period_start) ),
+                self.paydays_without_paydate )
+            for trans_id in candidate_trans_ids:
+                payday = self.payday_database[trans_id]
                 if end_date < payday.period_start or \
                         start_date > payday.period_end:
                     continue
@@ -163,14 +267,13 @@ class PayrollPlugin(PrototypePlugin):
             return bounded_entries
     
     def gen_paydays_with_paydate_bounds(self, start_date, end_date):
-        # too bad this can't take advantage of some kind of sort or
-        # index to run faster
+        """The paydays with paydates from start_date to end_date, in
+        order of paydate
+        """
         return (
-            payday
-            for payday in self.payday_database.itervalues()
-            if isinstance(payday, Payday) 
-            if start_date <= payday.paydate
-            if end_date >= payday.paydate
+            self.payday_database[trans_id]
+            for trans_id in self.__gen_trans_ids_in_paydate_range(
+                start_date, end_date)
             )
 
     def has_payday(self, payday_date):
@@ -187,11 +290,8 @@ class PayrollPlugin(PrototypePlugin):
 
         Return None if no payday with that payday is found
         """
-        # linear search.., if this grows to big we'll need a index of paydays
-        # by date...
-        for trans_id, payday in self.payday_database.iteritems():
-            if payday.paydate == payday_date:
-                return trans_id, payday
+        for trans_id in self.__gen_trans_ids_with_paydate(payday_date):
+            return trans_id, self.payday_database[trans_id]
         return None, None
 
     def get_config_file(self):
@@ -0,0 +1,89 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors: Mark Jenkins <mark@parit.ca>
+
+"""A shell without any gui that compacts the backend of a book, e.g.
+bo-keep -s bokeep.shells.compact_backend "my book"
+
+Only backend plugins with a compact() method, like the serial file one
+(SerialFilePlugin.compact), can be compacted. Don't run this while another
+bo-keep is using the book.
+"""
+
+# python imports
+from sys import stderr
+
+# zodb imports
+import transaction
+
+# bokeep imports
+from bokeep.util import null_function
+from bokeep.backend_plugins.plugin import BoKeepBackendException
+
+BOOK_NAME_ARGUMENT = 0
+
+def compact_book_backend(book):
+    """Writes out whatever is waiting to go to book's backend plugin and
+    then compacts it. Returns what the backend plugin's compact() does,
+    for the serial file that's how many records were dropped.
+
+    BoKeepBackendException is raised if the backend plugin can't be
+    compacted.
+    """
+    backend_plugin = book.get_backend_plugin()
+    if not hasattr(backend_plugin, 'compact'):
+        raise BoKeepBackendException(
+            "the %s backend plugin can't be compacted" %
+            book.get_backend_plugin_name() )
+    # compact() refuses to run with anything not saved yet
+    backend_plugin.flush_backend()
+    transaction.get().commit()
+    result = backend_plugin.compact()
+    transaction.get().commit()
+    return result
+
+def shell_startup(config_path, config, bookset, startup_callback,
+                  cmdline_options, cmdline_args):
+    if len(cmdline_args) <= BOOK_NAME_ARGUMENT:
+        stderr.write("the name of the book to compact is needed\n")
+        return
+    if ( bookset == None or
+         not startup_callback(config_path, config,
+                              null_function, null_function) ):
+        stderr.write("no bo-keep configuration or database to open\n")
+        return
+    book_name = cmdline_args[BOOK_NAME_ARGUMENT]
+    try:
+        if not bookset.has_book(book_name):
+            stderr.write("there is no book named %s\n" % book_name)
+            return
+        try:
+            result = compact_book_backend(bookset.get_book(book_name))
+        except BoKeepBackendException, e:
+            stderr.write("%s\n" % e)
+        else:
+            print "compacted the backend of %s, %s records dropped" % (
+                book_name, result)
+    finally:
+        bookset.close()
+
+def shell_startup_config_establish(config_path, e, *cbargs):
+    return None, None
+
+def shell_startup_bookset_fetch(config_path, config, e, *cbargs):
+    return None
@@ -20,6 +20,7 @@
 # gtk imports
 import gtk
 from gtk import Window, Label, main_quit, VBox
+from gobject import threads_init
 
 # zodb imports
 from persistent import Persistent
@@ -34,6 +35,7 @@ from bokeep.shells import \
      TRANSACTION_ALL_EDIT_HEADLESS)
 from bokeep.gui.state import \
     instantiate_transaction_class_add_to_book_backend_and_plugin
+from bokeep.backend_plugins.plugin import BackendChangeThread
 
 HEADLESS_STATE_SUB_DB = 'headless_state'
 
@@ -48,6 +50,8 @@ PLUGIN_ARGUMENT, TRANSACTION_TYPE_CODE_POS_ARG = range(2)
 
 def shell_startup(config_path, config, bookset, startup_callback,
                   cmdline_options, cmdline_args):
+    # BackendChangeThread has to be able to run while gtk.main() does
+    threads_init()
     window = Window()
 
     def window_startup_event_handler(*args):
@@ -138,13 +142,24 @@ def shell_startup(config_path, config, bookset, startup_callback,
             display_mode = TRANSACTION_ALL_EDIT_HEADLESS
 
 
+        # a switch to a new backend plugin may of been interrupted, finish
+        # writing the transactions out to it before carrying on
+        book.continue_backend_migration(bulk_load=True)
+
+        # changes are written to the backend as they happen by a thread
+        # of its own, so window_close doesn't have to do that all at once
+        backend_thread = BackendChangeThread(bookset)
+        backend_thread.start()
+
         def change_register_function():
-             book.get_backend_plugin().mark_transaction_dirty(
-                headless_state.current_transaction_id, bokeep_transaction)
+            transaction.get().commit()
+            backend_thread.mark_transaction_dirty(
+                book.book_name, headless_state.current_transaction_id)
 
         def window_close(*args):
-            book.get_backend_plugin().flush_backend()
             transaction.get().commit()
+            backend_thread.request_flush(book.book_name)
+            backend_thread.end_thread_and_join()
             bookset.close()
             # should change guistate (default shell persistent storage)
             # to be on this specific trans id now
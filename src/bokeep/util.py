@@ -20,7 +20,7 @@
 # Author: Andrew Orr <andrew@andreworr.ca>
 
 # python standard library
-from threading import Thread, Condition, Event
+from threading import Thread, Condition, Event, local
 from os.path import abspath, dirname, join, exists, basename
 from datetime import date, timedelta
 from zlib import adler32
@@ -32,11 +32,81 @@ import transaction
 from persistent import Persistent
 from persistent.list import PersistentList
 
+# Units of work
+#
+# Lots of functions commit when they're done (see ends_with_commit), which is
+# what you want when they're called on thier own, but when a bigger operation
+# calls several of them you end up with a commit for each. Inside of a
+# UnitOfWork those commits are put off until the outermost UnitOfWork ends.
+#
+# ZODB transactions are per thread, so how deep we are in units of work is too
+_unit_of_work_state = local()
+
+def get_unit_of_work_depth():
+    return getattr(_unit_of_work_state, 'depth', 0)
+
+def in_unit_of_work():
+    return get_unit_of_work_depth() > 0
+
+def commit_unless_in_unit_of_work():
+    """Does transaction.get().commit() unless we're in a UnitOfWork, in
+    which case the commit is left to the outermost UnitOfWork.
+    """
+    if not in_unit_of_work():
+        transaction.get().commit()
+
+class UnitOfWork(object):
+    """Context manager for a group of changes that should be commited
+    together. Can be nested.
+
+    with UnitOfWork():
+        book.insert_transaction(trans)
+        backend_plugin.mark_transaction_dirty(trans_id, trans)
+
+    Functions decorated with ends_with_commit and calls to
+    commit_unless_in_unit_of_work() inside don't commit, the outermost
+    UnitOfWork commits once when it ends.
+
+    Each UnitOfWork takes a savepoint when it begins. If an exception gets
+    out of it, the changes made inside are rolled back to that savepoint
+    and the exception carries on, nothing is commited, so an enclosing
+    UnitOfWork that catches the exception can go on with what it had.
+    Changes made before the outermost UnitOfWork began are left alone,
+    just as ends_with_commit leaves them uncommited when an exception
+    happens.
+
+    Calling transaction.get().commit() directly inside a UnitOfWork still
+    commits, and makes the savepoints unusable, so don't. Also keep in mind
+    that a rollback doesn't undo anything flush_backend() did to a backend,
+    so call flush_backend() after the UnitOfWork ends, not in it. Its
+    commit after each save is what records that the save happened.
+    """
+    def __enter__(self):
+        self.savepoint = transaction.get().savepoint(optimistic=True)
+        _unit_of_work_state.depth = get_unit_of_work_depth() + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _unit_of_work_state.depth = get_unit_of_work_depth() - 1
+        if exc_type != None:
+            self.savepoint.rollback()
+        elif not in_unit_of_work():
+            transaction.get().commit()
+        return False # let exceptions carry on
+
+def runs_as_unit_of_work(dec_function):
+    """Decorator equivilent of with UnitOfWork(): around the whole function
+    """
+    def ret_func(*args, **kargs):
+        with UnitOfWork():
+            return dec_function(*args, **kargs)
+    return ret_func
+
 # simplifies common usage of transaction.get().commit()
 def ends_with_commit(dec_function):
     def ret_func(*args, **kargs):
         return_value = dec_function(*args, **kargs)
-        transaction.get().commit()
+        commit_unless_in_unit_of_work()
         return return_value
     return ret_func
 
@@ -456,6 +526,9 @@ class StateMachineMinChangeDataStore(object):
     def get_value(self, key):
         return self.__values[key]
 
+    def has_value(self, key):
+        return key in self.__values
+
 def enhance_syspath_for_module_load(path, position=0):
     import sys
     directory = dirname(abspath(path))
@@ -0,0 +1,171 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# Times the first push of a synthetic book of many transactions into a
+# GnuCash file with only top level accounts, chunk by chunk
+# (continue_backend_migration) and in bulk load mode (with bulk_load, what
+# BoKeepBook.set_backend_plugin does), and counts the saves and account
+# lookups each does.
+#
+# Run from the tests directory, e.g.
+# PYTHONPATH=../src python benchmark_gnucash_bulk_load.py [num_transactions]
+#
+# When the gnucash python bindings aren't installed (or --fake is given)
+# the counts come from fake_gnucash_bindings.py and the times mean nothing,
+# a save there doesn't write the book out.
+
+# python
+from sys import argv
+from decimal import Decimal
+from os import remove
+from glob import glob
+from time import time
+
+# zopedb
+import transaction
+
+import fake_gnucash_bindings
+USING_FAKE_BINDINGS = \
+    fake_gnucash_bindings.use_fake_gnucash_bindings_if_needed()
+
+# gnucash
+from gnucash import Session, Account
+from gnucash.gnucash_core_c import ACCT_TYPE_ASSET
+
+# bokeep
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins.gnucash_backend import \
+    call_catch_qofbackend_exception_reraise_important
+
+# bokeep tests
+from test_bokeep_book import \
+    create_tmp_filename, create_tmp_filestorage_filename, \
+    create_filestorage_backed_bookset_from_file, RegistryPlugin
+
+DEFAULT_NUM_TRANSACTIONS = 20000
+GNUCASH_PLUGIN = 'bokeep.backend_plugins.gnucash_backend'
+# only the top level accounts are in the gnucash file, the others are
+# created as needed, with the currency of thier parent
+PARENT_ACCOUNTS = ('Expenses', 'Assets')
+ACCOUNT_SPECS = [ ('Expenses', 'Expense %s' % i) for i in xrange(20) ] + \
+    [ ('Assets', 'Bank %s' % i) for i in xrange(5) ]
+CURRENCY = 'CAD'
+
+class SyntheticTransaction(Transaction):
+    def __init__(self, i):
+        Transaction.__init__(self, None)
+        amount = Decimal(i % 1000 + 1) / 100
+        debit = FinancialTransactionLine(amount)
+        debit.account_spec = ACCOUNT_SPECS[i % 20]
+        credit = FinancialTransactionLine(-amount)
+        credit.account_spec = ACCOUNT_SPECS[20 + i % 5]
+        for line in (debit, credit):
+            line.create_account_if_missing = True
+        self.fin_trans = FinancialTransaction( (debit, credit) )
+        self.fin_trans.currency = CURRENCY
+        self.fin_trans.description = "synthetic transaction %s" % i
+
+    def get_financial_transactions(self):
+        return [self.fin_trans]
+
+def create_gnucash_file():
+    file_name = create_tmp_filename('Gnucash_bench_', '.gnucash')
+    s = Session('xml://' + file_name, is_new=True)
+    book = s.book
+    root = book.get_root_account()
+    currency = book.get_table().lookup('CURRENCY', CURRENCY)
+    for parent_name in PARENT_ACCOUNTS:
+        parent = Account(book)
+        root.append_child(parent)
+        parent.SetName(parent_name)
+        parent.SetType(ACCT_TYPE_ASSET)
+        parent.SetCommodity(currency)
+    call_catch_qofbackend_exception_reraise_important(s.save)
+    s.end()
+    s.destroy()
+    return file_name
+
+def run_push(num_transactions, bulk_load):
+    filestorage_file = create_tmp_filestorage_filename()
+    gnucash_file = create_gnucash_file()
+    books = create_filestorage_backed_bookset_from_file(filestorage_file)
+    try:
+        book = books.add_book('benchmark')
+        book.insert_transactions(
+            ( SyntheticTransaction(i) for i in xrange(num_transactions) ),
+            RegistryPlugin() )
+        book.start_backend_migration(GNUCASH_PLUGIN)
+        # not setattr, that would flush everything right away
+        book.get_backend_plugin().gnucash_file = 'xml://' + gnucash_file
+        transaction.get().commit()
+
+        lookup_counts.clear()
+        fake_gnucash_bindings.session_saves[0] = 0
+        start_time = time()
+        book.continue_backend_migration(bulk_load=bulk_load)
+        elapsed = time() - start_time
+        counts = dict(lookup_counts)
+
+        backend_plugin = book.get_backend_plugin()
+        for trans_id in book.trans_tree.iterkeys():
+            assert( backend_plugin.transaction_is_clean(trans_id) )
+        backend_plugin.close()
+        transaction.get().commit()
+        return elapsed, counts.get('lookup_by_name', 0), \
+            fake_gnucash_bindings.session_saves[0]
+    finally:
+        books.close()
+        for file_name in glob(filestorage_file + '*') + \
+                glob(gnucash_file + '*'):
+            remove(file_name)
+
+# count calls to lookup_by_name by wrapping it
+lookup_counts = {}
+
+def count_calls(cls, function_name):
+    original_function = getattr(cls, function_name)
+    def counting_function(*args, **kargs):
+        lookup_counts[function_name] = lookup_counts.get(function_name, 0) + 1
+        return original_function(*args, **kargs)
+    setattr(cls, function_name, counting_function)
+
+def main():
+    args = [ arg for arg in argv[1:] if arg != '--fake' ]
+    num_transactions = DEFAULT_NUM_TRANSACTIONS if len(args) < 1 \
+        else int(args[0])
+    count_calls(Account, 'lookup_by_name')
+    if USING_FAKE_BINDINGS:
+        print "using a fake gnucash Session and account tree"
+    print "pushing %s transactions into a gnucash file" % num_transactions
+    for label, bulk_load in (('chunk by chunk', False),
+                             ('bulk load', True) ):
+        elapsed, lookups, saves = run_push(num_transactions, bulk_load)
+        if USING_FAKE_BINDINGS:
+            # the saves of real bindings aren't counted, and the time
+            # means nothing with the fake ones
+            print "%s: %s account lookups, %s saves" % (
+                label, lookups, saves)
+        else:
+            print "%s: %s account lookups, %.3f seconds, " \
+                "%.1f transactions per second" % (
+                label, lookups, elapsed, num_transactions / elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# Shows how many account and currency lookups the GnuCash backend plugin
+# does to flush a payday sized batch of transactions, with and without its
+# per-session lookup caches (GnuCash.use_lookup_caches)
+#
+# Run from the tests directory, e.g.
+# PYTHONPATH=../src python benchmark_gnucash_lookups.py
+#
+# The counts only depend on what the plugin asks for, so when the gnucash
+# python bindings aren't installed (or --fake is given) a fake Session
+# and account tree kept in memory stand in for them,
+# (see fake_gnucash_bindings.py) the times are only worth looking at with
+# the real bindings.
+
+# python
+from decimal import Decimal
+from os import remove
+from glob import glob
+from time import time
+
+from fake_gnucash_bindings import use_fake_gnucash_bindings_if_needed
+USING_FAKE_BINDINGS = use_fake_gnucash_bindings_if_needed()
+
+# gnucash
+from gnucash import Session, Account, GncCommodityTable
+from gnucash.gnucash_core_c import ACCT_TYPE_ASSET
+
+# bokeep
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins.gnucash_backend import \
+    GnuCash, call_catch_qofbackend_exception_reraise_important
+
+# bokeep tests
+from test_bokeep_book import create_tmp_filename
+
+# roughly a payday with 40 employees and 12 accounting lines each
+NUM_TRANSACTIONS = 40
+PARENT_ACCOUNTS = ('Payroll Expenses', 'Payroll Liabilities')
+SUB_ACCOUNTS_PER_PARENT = 6
+CURRENCY = 'CAD'
+
+def account_specs():
+    return [ (parent, '%s %s' % (parent, i))
+             for parent in PARENT_ACCOUNTS
+             for i in xrange(SUB_ACCOUNTS_PER_PARENT) ]
+
+class PaystubTransaction(Transaction):
+    def __init__(self, amount):
+        Transaction.__init__(self, None)
+        lines = []
+        for i, spec in enumerate(account_specs()):
+            # the first half of the accounts get debits, the second
+            # half matching credits
+            line = FinancialTransactionLine(
+                amount if i < SUB_ACCOUNTS_PER_PARENT else -amount)
+            line.account_spec = spec
+            lines.append(line)
+        self.fin_trans = FinancialTransaction(lines)
+        self.fin_trans.currency = CURRENCY
+
+    def get_financial_transactions(self):
+        return [self.fin_trans]
+
+def create_gnucash_file():
+    file_name = 'xml://' + create_tmp_filename('Gnucash_bench_', '.gnucash')
+    s = Session(file_name, is_new=True)
+    book = s.book
+    root = book.get_root_account()
+    currency = book.get_table().lookup('CURRENCY', CURRENCY)
+    for parent_name in PARENT_ACCOUNTS:
+        parent = Account(book)
+        root.append_child(parent)
+        parent.SetName(parent_name)
+        parent.SetType(ACCT_TYPE_ASSET)
+        parent.SetCommodity(currency)
+        for parent_name_again, name in account_specs():
+            if parent_name_again != parent_name:
+                continue
+            account = Account(book)
+            parent.append_child(account)
+            account.SetName(name)
+            account.SetType(ACCT_TYPE_ASSET)
+            account.SetCommodity(currency)
+    call_catch_qofbackend_exception_reraise_important(s.save)
+    s.end()
+    s.destroy()
+    return file_name
+
+# count calls to the lookup functions by wrapping them
+lookup_counts = {}
+
+def count_calls(cls, function_name):
+    original_function = getattr(cls, function_name)
+    def counting_function(*args, **kargs):
+        lookup_counts[function_name] = lookup_counts.get(function_name, 0) + 1
+        return original_function(*args, **kargs)
+    setattr(cls, function_name, counting_function)
+
+def run_flush(gnucash_file, use_lookup_caches):
+    backend_plugin = GnuCash()
+    backend_plugin.use_lookup_caches = use_lookup_caches
+    backend_plugin.setattr('gnucash_file', gnucash_file)
+    backend_plugin.mark_transactions_dirty(
+        (i, PaystubTransaction(Decimal(i+1)))
+        for i in xrange(NUM_TRANSACTIONS) )
+    lookup_counts.clear()
+    start_time = time()
+    backend_plugin.flush_backend()
+    elapsed = time() - start_time
+    for i in xrange(NUM_TRANSACTIONS):
+        assert( backend_plugin.transaction_is_clean(i) )
+    backend_plugin.close()
+    return dict(lookup_counts), elapsed
+
+def main():
+    count_calls(Account, 'lookup_by_name')
+    count_calls(GncCommodityTable, 'lookup')
+    if USING_FAKE_BINDINGS:
+        print "using a fake gnucash Session and account tree"
+    print "flushing %s transactions of %s lines each" % (
+        NUM_TRANSACTIONS, len(account_specs()) )
+    for label, use_lookup_caches in (('without caches', False),
+                                     ('with caches', True) ):
+        gnucash_file = create_gnucash_file()
+        try:
+            counts, elapsed = run_flush(gnucash_file, use_lookup_caches)
+        finally:
+            for file_name in glob(gnucash_file[len('xml://'):] + '*'):
+                remove(file_name)
+        print "%s: %s account lookups, %s currency lookups, %.3f seconds" % (
+            label, counts.get('lookup_by_name', 0), counts.get('lookup', 0),
+            elapsed)
+
+if __name__ == "__main__":
+    main()
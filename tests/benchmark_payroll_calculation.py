@@ -0,0 +1,92 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# Times calculating a payday for many employees the way plain_text_payroll
+# does, (check the net pay, then freeze every paystub) with and without
+# memoization of the calculations
+#
+# Run from the tests directory, e.g.
+# PYTHONPATH=../src python benchmark_payroll_calculation.py [num_employees]
+
+# python
+from sys import argv
+from decimal import Decimal
+from datetime import date, timedelta
+from time import time
+
+# bokeep
+from bokeep.plugins.payroll.canada.employee import Employee
+from bokeep.plugins.payroll.canada.paystub import Paystub
+from bokeep.plugins.payroll.canada.paystub_line import \
+    PaystubWageLine, PaystubNetPaySummaryLine
+from bokeep.plugins.payroll.payroll import Payday
+from bokeep.plugins.payroll.canada import calculation_context
+
+DEFAULT_NUM_EMPLOYEES = 100
+FIRST_PAYDATE = date(2011, 1, 7)
+# paydays already run this year, the one being timed comes after
+EARLIER_PAYDAYS = 10
+
+def new_payday(paydate):
+    payday = Payday(None)
+    payday.set_paydate(paydate, paydate - timedelta(13), paydate)
+    return payday
+
+def add_paystub(employee, payday, hours):
+    paystub = Paystub(employee, payday)
+    paystub.add_paystub_line( PaystubNetPaySummaryLine(paystub) )
+    paystub.add_paystub_line(
+        PaystubWageLine(paystub, Decimal(hours), Decimal('15.00')) )
+    return paystub
+
+def run_payday(payday):
+    # what setup_paystubs_for_payday_from_dicts does once the lines are in
+    for paystub in payday.paystubs:
+        assert( paystub.net_pay() >= Decimal(0) )
+    for paystub in payday.paystubs:
+        paystub.freeze()
+
+def time_payday(num_employees):
+    employees = [ Employee("employee %s" % i)
+                  for i in xrange(num_employees) ]
+    for i in xrange(EARLIER_PAYDAYS):
+        payday = new_payday(FIRST_PAYDATE + timedelta(14*i))
+        for j, employee in enumerate(employees):
+            add_paystub(employee, payday, 60 + j % 20)
+        run_payday(payday)
+
+    payday = new_payday(FIRST_PAYDATE + timedelta(14*EARLIER_PAYDAYS))
+    for j, employee in enumerate(employees):
+        add_paystub(employee, payday, 60 + j % 20)
+    start_time = time()
+    run_payday(payday)
+    return time() - start_time
+
+def main():
+    num_employees = DEFAULT_NUM_EMPLOYEES if len(argv) < 2 \
+        else int(argv[1])
+    print "calculating a payday for %s employees" % num_employees
+    for label, memoize in (('not memoized', False), ('memoized', True)):
+        calculation_context.MEMOIZE_CALCULATIONS = memoize
+        elapsed = time_payday(num_employees)
+        print "%s: %.3f seconds, %.1f paystubs per second" % (
+            label, elapsed, num_employees / elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# Times flushing many new transactions into an empty database with the
+# sqlite backend plugin, all in one flush and a slice at a time (what the
+# BackendChangeThread does)
+#
+# Run from the tests directory, e.g.
+# PYTHONPATH=../src python benchmark_sqlite_backend.py [num_transactions]
+
+# python
+from sys import argv
+from decimal import Decimal
+from os import remove
+from glob import glob
+from time import time
+
+# bokeep
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins.sqlite_backend import SQLitePlugin
+
+# bokeep tests
+from test_bokeep_book import create_tmp_filename
+
+DEFAULT_NUM_TRANSACTIONS = 20000
+SLICE_SIZE = 500
+ACCOUNT_SPECS = [ ('Expenses', 'Expense %s' % i) for i in xrange(20) ] + \
+    [ ('Assets', 'Bank %s' % i) for i in xrange(5) ]
+
+class SyntheticTransaction(Transaction):
+    def __init__(self, i):
+        Transaction.__init__(self, None)
+        amount = Decimal(i % 1000 + 1) / 100
+        debit = FinancialTransactionLine(amount)
+        debit.account_spec = ACCOUNT_SPECS[i % 20]
+        credit = FinancialTransactionLine(-amount)
+        credit.account_spec = ACCOUNT_SPECS[20 + i % 5]
+        self.fin_trans = FinancialTransaction( (debit, credit) )
+        self.fin_trans.currency = 'CAD'
+        self.fin_trans.description = "synthetic transaction %s" % i
+
+    def get_financial_transactions(self):
+        return [self.fin_trans]
+
+def run_flush(num_transactions, max_items):
+    sqlite_file = create_tmp_filename('sqlite_bench_', '.sqlite')
+    backend_plugin = SQLitePlugin()
+    backend_plugin.sqlite_file = sqlite_file
+    try:
+        for i in xrange(num_transactions):
+            backend_plugin.mark_transaction_dirty(i, SyntheticTransaction(i))
+
+        start_time = time()
+        while backend_plugin.flush_backend(max_items) > 0:
+            pass
+        elapsed = time() - start_time
+
+        for i in xrange(num_transactions):
+            assert( backend_plugin.transaction_is_clean(i) )
+        backend_plugin.close()
+        return elapsed
+    finally:
+        for file_name in glob(sqlite_file + '*'):
+            remove(file_name)
+
+def main():
+    num_transactions = DEFAULT_NUM_TRANSACTIONS if len(argv) < 2 \
+        else int(argv[1])
+    print "flushing %s transactions into an empty sqlite database" % \
+        num_transactions
+    for label, max_items in (('one flush', None),
+                             ('%s at a time' % SLICE_SIZE, SLICE_SIZE) ):
+        elapsed = run_flush(num_transactions, max_items)
+        print "%s: %.3f seconds, %.1f transactions per second" % (
+            label, elapsed, num_transactions / elapsed)
+
+if __name__ == "__main__":
+    main()
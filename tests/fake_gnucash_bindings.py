@@ -0,0 +1,233 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# An in-memory stand in for the parts of the gnucash python bindings the
+# GnuCash backend plugin uses to create transactions. The benchmarks use it
+# to count what the plugin asks gnucash for when the bindings aren't
+# installed. Nothing is written to disk, so don't bother timing it.
+#
+# Use it before anything imports gnucash, e.g.
+# from fake_gnucash_bindings import use_fake_gnucash_bindings_if_needed
+# USING_FAKE_BINDINGS = use_fake_gnucash_bindings_if_needed()
+
+# python
+import sys
+from types import ModuleType
+
+# how many times a FakeSession has been saved, in a list so it can be reset
+session_saves = [0]
+
+class FakeGnuCashBackendException(Exception):
+    def __init__(self, msg, errors):
+        Exception.__init__(self, msg)
+        self.errors = errors
+
+class FakeGncNumeric(object):
+    def __init__(self, num=0, denom=1):
+        self.__num, self.__denom = num, denom
+
+    def num(self):
+        return self.__num
+
+    def denom(self):
+        return self.__denom
+
+class FakeCommodity(object):
+    def __init__(self, namespace, mnemonic):
+        self.namespace, self.mnemonic = namespace, mnemonic
+
+    def get_namespace(self):
+        return self.namespace
+
+    def get_mnemonic(self):
+        return self.mnemonic
+
+    def get_fraction(self):
+        return 100
+
+class FakeGncCommodityTable(object):
+    def __init__(self):
+        self.commodities = {}
+
+    def lookup(self, namespace, mnemonic):
+        # gnucash calls it CURRENCY, ISO4217 is the old name for it
+        if namespace == 'ISO4217':
+            namespace = 'CURRENCY'
+        key = (namespace, mnemonic)
+        if key not in self.commodities:
+            self.commodities[key] = FakeCommodity(namespace, mnemonic)
+        return self.commodities[key]
+
+class FakeAccount(object):
+    def __init__(self, book=None, instance=True):
+        self.instance = instance
+        self.name = None
+        self.commodity = None
+        self.account_type = None
+        self.parent = None
+        self.children = []
+
+    def get_instance(self):
+        return self if self.instance else None
+
+    def lookup_by_name(self, name):
+        # like gnc_account_lookup_by_name, the children first and then
+        # thier descendants
+        for child in self.children:
+            if child.name == name:
+                return child
+        for child in self.children:
+            account = child.lookup_by_name(name)
+            if account.get_instance() != None:
+                return account
+        return FakeAccount(instance=False)
+
+    def append_child(self, account):
+        account.parent = self
+        self.children.append(account)
+
+    def get_parent(self):
+        return self.parent
+
+    def SetName(self, name):
+        self.name = name
+
+    def GetName(self):
+        return self.name
+
+    def SetCommodity(self, commodity):
+        self.commodity = commodity
+
+    def GetCommodity(self):
+        return self.commodity
+
+    def GetCommoditySCU(self):
+        return 100
+
+    def SetType(self, account_type):
+        self.account_type = account_type
+
+    def GetType(self):
+        return self.account_type
+
+class FakeGUID(object):
+    def __init__(self, guid_string):
+        self.guid_string = guid_string
+
+    def get_instance(self):
+        return self
+
+class FakeSplit(object):
+    def __init__(self, book):
+        self.value = FakeGncNumeric()
+
+    def SetValue(self, value):
+        self.value = value
+
+    def SetParent(self, trans):
+        trans.splits.append(self)
+
+    def SetAmount(self, amount): pass
+    def SetAccount(self, account): pass
+    def SetMemo(self, memo): pass
+
+class FakeTransaction(object):
+    def __init__(self, book):
+        book.transaction_count += 1
+        self.guid = FakeGUID('%032x' % book.transaction_count)
+        self.splits = []
+
+    def GetImbalanceValue(self):
+        return FakeGncNumeric(
+            sum( split.value.num() * 100 / split.value.denom()
+                 for split in self.splits ), 100 )
+
+    def GetGUID(self):
+        return self.guid
+
+    def BeginEdit(self): pass
+    def CommitEdit(self): pass
+    def Destroy(self): pass
+    def SetCurrency(self, currency): pass
+    def SetDescription(self, description): pass
+    def SetNum(self, num): pass
+    def SetDatePostedTS(self, trans_date): pass
+    def SetDateEnteredTS(self, trans_date): pass
+
+class FakeBook(object):
+    def __init__(self):
+        self.root_account = FakeAccount()
+        self.table = FakeGncCommodityTable()
+        self.transaction_count = 0
+
+    def get_root_account(self):
+        return self.root_account
+
+    def get_table(self):
+        return self.table
+
+class FakeSession(object):
+    # books by url, so they're still there when opened again
+    books = {}
+
+    def __init__(self, book_uri=None, ignore_lock=False, is_new=False,
+                 force_new=False):
+        if is_new:
+            self.books[book_uri] = FakeBook()
+        self.book = self.books[book_uri]
+
+    def save(self):
+        session_saves[0] += 1
+
+    def end(self): pass
+    def destroy(self): pass
+    def raise_backend_errors(self, called_function=None): pass
+
+def install_fake_gnucash_bindings():
+    gnucash = ModuleType('gnucash')
+    gnucash.Session = FakeSession
+    gnucash.Split = FakeSplit
+    gnucash.GncNumeric = FakeGncNumeric
+    gnucash.GUID = FakeGUID
+    gnucash.Transaction = FakeTransaction
+    gnucash.GnuCashBackendException = FakeGnuCashBackendException
+    gnucash.Account = FakeAccount
+    gnucash.GncCommodityTable = FakeGncCommodityTable
+    gnucash_core_c = ModuleType('gnucash.gnucash_core_c')
+    gnucash_core_c.ERR_FILEIO_BACKUP_ERROR = 1
+    gnucash_core_c.ERR_BACKEND_LOCKED = 2
+    gnucash_core_c.ACCT_TYPE_ASSET = 2
+    gnucash_core_c.string_to_guid = lambda guid_string, guid: False
+    gnucash_core_c.guid_to_string = lambda guid: guid.guid_string
+    gnucash.gnucash_core_c = gnucash_core_c
+    sys.modules['gnucash'] = gnucash
+    sys.modules['gnucash.gnucash_core_c'] = gnucash_core_c
+
+def use_fake_gnucash_bindings_if_needed():
+    """Installs the fake bindings if the real ones aren't there or --fake
+    was given on the command line, returns True if it did
+    """
+    if '--fake' not in sys.argv:
+        try:
+            import gnucash
+            return False
+        except ImportError:
+            pass
+    install_fake_gnucash_bindings()
+    return True
@@ -0,0 +1,296 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python
+from unittest import main
+from decimal import Decimal
+from threading import Event
+from time import time, sleep
+
+# zopedb
+import transaction
+from ZODB.POSException import ConflictError
+
+# bokeep
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins import plugin
+from bokeep.backend_plugins.plugin import BackendChangeThread
+from bokeep.backend_plugins.robust_backend_plugin import RobustBackendPlugin
+from bokeep.util import in_unit_of_work
+
+from test_bokeep_book import BoKeepWithBookSetup, TESTBOOK
+
+# how long to wait on the backend thread before declaring it stuck
+THREAD_TIMEOUT = 10
+
+# how many more calls to CountingBackendPlugin.mark_transactions_dirty
+# raise ConflictError, kept out of the plugin so it survives rollbacks
+mark_conflicts_left = [0]
+
+class CountingBackendPlugin(RobustBackendPlugin):
+    def __init__(self):
+        RobustBackendPlugin.__init__(self)
+        self.created = 0
+        self.removed = 0
+        self.saves = 0
+        # saves whose commit a unit of work would have put off
+        self.saves_in_unit_of_work = 0
+        self.closes = 0
+        # what seconds_until_retry returns, one after the other
+        self.retry_delays = []
+
+    def can_write(self):
+        return True
+
+    def mark_transactions_dirty(self, trans_id_and_transaction_pairs):
+        if mark_conflicts_left[0] > 0:
+            mark_conflicts_left[0] -= 1
+            raise ConflictError()
+        RobustBackendPlugin.mark_transactions_dirty(
+            self, trans_id_and_transaction_pairs)
+
+    def create_backend_transaction(self, fin_trans):
+        self.created += 1
+        return self.created
+
+    def remove_backend_transaction(self, backend_ident):
+        self.removed += 1
+
+    def save(self):
+        self.saves += 1
+        if in_unit_of_work():
+            self.saves_in_unit_of_work += 1
+
+    def close(self, close_reason='reset because close() was called'):
+        self.closes += 1
+        RobustBackendPlugin.close(self, close_reason)
+
+    def seconds_until_retry(self):
+        if len(self.retry_delays) == 0:
+            return None
+        return self.retry_delays.pop(0)
+
+def get_plugin_class():
+    return CountingBackendPlugin
+
+class BalancedTransaction(Transaction):
+    def __init__(self, amount):
+        Transaction.__init__(self, None)
+        self.amount = amount
+
+    def get_financial_transactions(self):
+        return [ FinancialTransaction( (
+                    FinancialTransactionLine(self.amount),
+                    FinancialTransactionLine(-self.amount),
+                    ) ) ]
+
+class BackendChangeThreadTest(BoKeepWithBookSetup):
+    def setUp(self):
+        BoKeepWithBookSetup.setUp(self)
+        self.book = self.test_book_1
+        self.book.set_backend_plugin('tests.test_backend_change_thread')
+        self.trans_ids = [
+            self.book.insert_transaction(BalancedTransaction(Decimal(i)))
+            for i in xrange(1, 4) ]
+        transaction.get().commit()
+        # set_backend_plugin does a flush of its own
+        self.saves_before = self.book.get_backend_plugin().saves
+
+        self.flushes = []
+        self.flushes_waited_for = 0
+        self.flush_happened = Event()
+        self.backend_thread = BackendChangeThread(
+            self.books, self.status_callback)
+
+    def status_callback(self, book_name, trans_ids):
+        self.flushes.append( (book_name, trans_ids) )
+        self.flush_happened.set()
+
+    def wait_for_flush(self):
+        # counted instead of just waiting on the Event, another flush
+        # (e.g. a retry) can come in before we get around to clearing it
+        give_up_time = time() + THREAD_TIMEOUT
+        while len(self.flushes) <= self.flushes_waited_for and \
+                time() < give_up_time:
+            self.flush_happened.wait(0.1)
+            self.flush_happened.clear()
+        self.assert_(len(self.flushes) > self.flushes_waited_for)
+        self.flushes_waited_for += 1
+        # see what the backend thread commited
+        self.books.get_dbhandle().dbcon.sync()
+
+    def tearDown(self):
+        mark_conflicts_left[0] = 0
+        if self.backend_thread.isAlive():
+            self.backend_thread.end_thread_and_join()
+        BoKeepWithBookSetup.tearDown(self)
+
+    def test_marks_coalesced_and_flushed(self):
+        # these all queue up before the thread starts, so they're
+        # handled in one go
+        for i in xrange(5):
+            for trans_id in self.trans_ids:
+                self.backend_thread.mark_transaction_dirty(TESTBOOK, trans_id)
+        self.backend_thread.start()
+        self.wait_for_flush()
+
+        self.assertEquals(len(self.flushes), 1)
+        book_name, trans_ids = self.flushes[0]
+        self.assertEquals(book_name, TESTBOOK)
+        self.assertEquals(sorted(trans_ids), self.trans_ids)
+
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.created, len(self.trans_ids))
+        self.assertEquals(backend.saves, self.saves_before + 1)
+        for trans_id in self.trans_ids:
+            self.assert_(backend.transaction_is_clean(trans_id))
+
+    def test_saves_not_in_unit_of_work(self):
+        for trans_id in self.trans_ids:
+            self.backend_thread.mark_transaction_dirty(TESTBOOK, trans_id)
+        self.backend_thread.start()
+        self.wait_for_flush()
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.saves, self.saves_before + 1)
+        self.assertEquals(backend.saves_in_unit_of_work, 0)
+
+    def test_change_picked_up(self):
+        self.backend_thread.start()
+        self.book.get_transaction(self.trans_ids[0]).amount = Decimal(10)
+        transaction.get().commit()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.wait_for_flush()
+        self.assertEquals(self.flushes, [(TESTBOOK, self.trans_ids[:1])] )
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.created, 1)
+        self.assert_(backend.transaction_is_clean(self.trans_ids[0]))
+
+    def test_removal(self):
+        self.backend_thread.start()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.wait_for_flush()
+        # the way the default shell removes a transaction, the backend
+        # plugin is left for the thread to take care of
+        self.book.remove_transaction(self.trans_ids[0], False)
+        transaction.get().commit()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.wait_for_flush()
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.removed, 1)
+        self.assert_(self.trans_ids[0] not in backend.dirty_transaction_set)
+
+    def test_removed_transaction_skipped(self):
+        # the backend plugin never heard of this one
+        self.book.trans_tree.pop(self.trans_ids[0])
+        transaction.get().commit()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.backend_thread.start()
+        self.wait_for_flush()
+        self.assertEquals(self.book.get_backend_plugin().created, 0)
+
+    def test_flush_and_close_request(self):
+        self.backend_thread.start()
+        self.backend_thread.request_flush(TESTBOOK, True)
+        self.wait_for_flush()
+        self.assertEquals(self.flushes, [(TESTBOOK, [])] )
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.saves, self.saves_before + 1)
+        self.assertEquals(backend.closes, 1)
+
+    def test_flush_in_slices(self):
+        old_slice = plugin.BACKEND_THREAD_FLUSH_SLICE
+        plugin.BACKEND_THREAD_FLUSH_SLICE = 1
+        try:
+            for trans_id in self.trans_ids:
+                self.backend_thread.mark_transaction_dirty(TESTBOOK, trans_id)
+            self.backend_thread.start()
+            # the first slice runs into the time budget or not depending
+            # on how fast things are, so wait until everything is out
+            backend = self.book.get_backend_plugin()
+            while backend.created < len(self.trans_ids):
+                self.wait_for_flush()
+        finally:
+            plugin.BACKEND_THREAD_FLUSH_SLICE = old_slice
+        book_name, trans_ids = self.flushes[0]
+        self.assertEquals(sorted(trans_ids), self.trans_ids)
+        for trans_id in self.trans_ids:
+            self.assert_(backend.transaction_is_clean(trans_id))
+
+    def test_retry_when_backend_asks(self):
+        self.book.get_backend_plugin().retry_delays = [0]
+        transaction.get().commit()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.backend_thread.start()
+        self.wait_for_flush()
+        # and again when the retry comes around
+        self.wait_for_flush()
+        self.assertEquals(self.flushes, [(TESTBOOK, self.trans_ids[:1]),
+                                         (TESTBOOK, []) ] )
+        self.assertEquals(self.book.get_backend_plugin().saves,
+                          self.saves_before + 2)
+
+    def test_marks_kept_after_conflicts(self):
+        # every try the first time around runs into a conflict
+        mark_conflicts_left[0] = plugin.BACKEND_THREAD_CONFLICT_RETRIES
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.backend_thread.start()
+        self.wait_for_flush()
+        self.wait_for_flush()
+        self.assertEquals(self.flushes, [(TESTBOOK, self.trans_ids[:1])] * 2)
+        backend = self.book.get_backend_plugin()
+        self.assertEquals(backend.created, 1)
+        self.assert_(backend.transaction_is_clean(self.trans_ids[0]))
+
+    def test_pause_with_backend_closed(self):
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[0])
+        self.backend_thread.start()
+        pause = self.backend_thread.pause_with_backend_closed(TESTBOOK)
+        self.books.get_dbhandle().dbcon.sync()
+        backend = self.book.get_backend_plugin()
+        # what was waiting went out before the close
+        self.assertEquals(backend.created, 1)
+        self.assertEquals(backend.closes, 1)
+        # the way the default shell configures a backend plugin
+        backend.retry_delays = []
+        transaction.get().commit()
+        self.backend_thread.mark_transaction_dirty(
+            TESTBOOK, self.trans_ids[1])
+        sleep(0.2)
+        self.assertEquals(len(self.flushes), 1)
+        pause.resume()
+        self.wait_for_flush()
+        self.wait_for_flush()
+        self.assertEquals(backend.created, 2)
+
+    def test_end_thread(self):
+        self.backend_thread.start()
+        self.backend_thread.end_thread_and_join()
+        self.assertFalse(self.backend_thread.isAlive())
+        self.assertEquals(self.flushes, [])
+
+if __name__ == "__main__":
+    main()
@@ -31,10 +31,43 @@ import transaction
 
 
 # bokeep
-from bokeep.book import BoKeepBookSet, BoKeepBook, BOOKS_SUB_DB_KEY
+from bokeep.book import BoKeepBookSet, BoKeepBook, BOOKS_SUB_DB_KEY, \
+    DEFAULT_BACKEND_MODULE
+from bokeep.book_transaction import Transaction
+from bokeep.backend_plugins.plugin import \
+    BoKeepBackendException, BoKeepBackendResetException
+from bokeep.backend_plugins.robust_backend_plugin import RobustBackendPlugin
+from bokeep.util import in_unit_of_work
 
 TESTBOOK = "testbook"
 
+# what BulkLoadRecordingPlugin instances do, kept out of the plugin so
+# it survives rollbacks
+bulk_load_log = []
+
+class BulkLoadRecordingPlugin(RobustBackendPlugin):
+    fail_bulk_load = False
+
+    def can_write(self):
+        return True
+
+    def save(self):
+        if in_unit_of_work():
+            bulk_load_log.append('save in unit of work')
+        else:
+            bulk_load_log.append('save')
+
+    def begin_bulk_load(self, defer_saves=True):
+        bulk_load_log.append('begin')
+
+    def end_bulk_load(self, successful=True):
+        bulk_load_log.append( ('end', successful) )
+        if successful and self.fail_bulk_load:
+            raise BoKeepBackendResetException("bulk load failed")
+
+def get_plugin_class():
+    return BulkLoadRecordingPlugin
+
 def create_tmp_filename(prefix, suffix):
     tmp = NamedTemporaryFile(
             suffix=suffix,
@@ -106,6 +139,144 @@ class TestBoKeepBookWithAdd(BoKeepWithBookSetup):
         #self.books.dbroot = self.books.dbcon.root()
         #self.test_book_enabled_attr()
 
+class RegistryPlugin(object):
+    def __init__(self):
+        self.registry = {}
+
+    def register_transaction(self, trans_id, trans):
+        assert( trans_id not in self.registry )
+        self.registry[trans_id] = trans
+
+class TestBoKeepBookInsertTransactions(BoKeepWithBookSetup):
+    def setUp(self):
+        BoKeepWithBookSetup.setUp(self)
+        self.plugin = RegistryPlugin()
+        self.progress_reports = []
+
+    def record_progress(self, report):
+        self.progress_reports.append(report.get_transaction_count())
+
+    def test_insert_transactions(self):
+        # make sure the bulk insert continues where insert_transaction
+        # left off
+        first_id = self.test_book_1.insert_transaction(Transaction(None))
+        transactions = [ Transaction(self.plugin) for i in xrange(10) ]
+        report = self.test_book_1.insert_transactions(
+            iter(transactions), self.plugin, chunk_size=4,
+            progress_callback=self.record_progress)
+        self.assertEquals(report.trans_ids,
+                          range(first_id+1, first_id+11) )
+        self.assertEquals(report.chunk_count, 3)
+        self.assertEquals(self.progress_reports, [4, 8, 10])
+        self.assertEquals(self.test_book_1.get_transaction_count(), 11)
+        for trans_id, trans in zip(report.trans_ids, transactions):
+            self.assert_(self.test_book_1.get_transaction(trans_id) is trans)
+            self.assert_(self.plugin.registry[trans_id] is trans)
+        self.assert_(isinstance(str(report), str))
+
+    def test_insert_after_bulk_insert(self):
+        report = self.test_book_1.insert_transactions(
+            (Transaction(self.plugin) for i in xrange(3)), self.plugin)
+        self.assertEquals(report.chunk_count, 1)
+        self.assertEquals(
+            self.test_book_1.insert_transaction(Transaction(None)),
+            report.trans_ids[-1] + 1 )
+
+    def test_insert_nothing(self):
+        report = self.test_book_1.insert_transactions((), self.plugin)
+        self.assertEquals(report.trans_ids, [])
+        self.assertEquals(report.chunk_count, 0)
+        self.assertEquals(self.test_book_1.get_transaction_count(), 0)
+
+class TestBoKeepBookBackendMigration(BoKeepWithBookSetup):
+    def setUp(self):
+        BoKeepWithBookSetup.setUp(self)
+        self.trans_ids = [
+            self.test_book_1.insert_transaction(Transaction(None))
+            for i in xrange(5) ]
+        transaction.get().commit()
+        self.progress = []
+
+    def record_progress(self, migration):
+        self.progress.append(migration.migrated_count)
+
+    def test_set_backend_plugin_migrates_everything(self):
+        self.test_book_1.set_backend_plugin(
+            DEFAULT_BACKEND_MODULE, self.record_progress)
+        self.assertFalse(self.test_book_1.backend_migration_in_progress())
+        self.assertEquals(self.progress, [5])
+
+    def test_resume_after_reopen(self):
+        self.test_book_1.start_backend_migration(DEFAULT_BACKEND_MODULE)
+        self.assertFalse(self.test_book_1.continue_backend_migration(
+                chunk_size=2, max_chunks=1) )
+        migration = self.test_book_1.get_backend_migration()
+        self.assertEquals(migration.migrated_count, 2)
+        self.assertEquals(migration.last_trans_id, self.trans_ids[1])
+        self.assertEquals(migration.get_fraction_done(), 0.4)
+
+        # the chunk was commited, so that's where things start up again
+        self.books.close()
+        self.books = create_filestorage_backed_bookset_from_file(
+            self.filestorage_file, False)
+        book = self.books.get_book(TESTBOOK)
+        self.assert_(book.backend_migration_in_progress())
+        self.assert_(book.continue_backend_migration(
+                chunk_size=2, progress_callback=self.record_progress) )
+        self.assertEquals(self.progress, [4, 5])
+        self.assertFalse(book.backend_migration_in_progress())
+
+    def test_bulk_load(self):
+        del bulk_load_log[:]
+        self.test_book_1.start_backend_migration('tests.test_bokeep_book')
+        self.assert_(self.test_book_1.continue_backend_migration(
+                chunk_size=2, bulk_load=True) )
+        self.assertFalse(self.test_book_1.backend_migration_in_progress())
+        # three chunks, each flush saves, all of it commited at the end
+        self.assertEquals(bulk_load_log,
+                          ['begin'] + ['save in unit of work'] * 3 +
+                          [('end', True)] )
+
+    def test_set_backend_plugin_bulk_loads(self):
+        # the first push to a new backend plugin, from the config dialog
+        # or the command line
+        del bulk_load_log[:]
+        self.test_book_1.set_backend_plugin('tests.test_bokeep_book')
+        self.assertFalse(self.test_book_1.backend_migration_in_progress())
+        self.assertEquals(bulk_load_log,
+                          ['begin', 'save in unit of work', ('end', True)] )
+        del bulk_load_log[:]
+        self.test_book_1.set_backend_plugin('tests.test_bokeep_book',
+                                            bulk_load=False)
+        self.assertEquals(bulk_load_log, ['save'])
+
+    def test_chunks_commited_after_save(self):
+        del bulk_load_log[:]
+        self.test_book_1.start_backend_migration('tests.test_bokeep_book')
+        self.assert_(self.test_book_1.continue_backend_migration(
+                chunk_size=2) )
+        # without a bulk load, what each save did is commited right away
+        self.assertEquals(bulk_load_log, ['save'] * 3)
+
+    def test_failed_bulk_load_undone(self):
+        self.test_book_1.start_backend_migration('tests.test_bokeep_book')
+        self.test_book_1.get_backend_plugin().fail_bulk_load = True
+        transaction.get().commit()
+        del bulk_load_log[:]
+        self.assertRaises(
+            BoKeepBackendResetException,
+            self.test_book_1.continue_backend_migration,
+            chunk_size=2, bulk_load=True)
+        self.assertEquals(bulk_load_log[0], 'begin')
+        self.assertEquals(bulk_load_log[-1], ('end', True) )
+        # none of the chunks stuck
+        migration = self.test_book_1.get_backend_migration()
+        self.assertEquals(migration.migrated_count, 0)
+        for trans_id in self.trans_ids:
+            self.assertRaises(
+                BoKeepBackendException,
+                self.test_book_1.get_backend_plugin().transaction_is_clean,
+                trans_id)
 
 if __name__ == "__main__":
     main()
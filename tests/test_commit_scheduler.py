@@ -0,0 +1,151 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python
+from unittest import TestCase, main
+from ConfigParser import ConfigParser
+
+# bokeep
+from bokeep.gui.commit_scheduler import CommitScheduler
+from bokeep.config import \
+    get_commit_interval_from_config, DEFAULT_COMMIT_INTERVAL, \
+    GUI_CONFIG_SECTION, GUI_COMMIT_INTERVAL
+
+INTERVAL = 500
+
+class FakeMainLoop(object):
+    """Stands in for gobject's timeout_add, idle_add and source_remove,
+    with a clock (in milliseconds) that only moves when advance() is called
+    """
+    def __init__(self):
+        self.now = 0
+        self.next_source_id = 1
+        # source id to (when it's due, function)
+        self.sources = {}
+
+    def timeout_add(self, interval, function):
+        source_id = self.next_source_id
+        self.next_source_id += 1
+        self.sources[source_id] = (self.now + interval, function)
+        return source_id
+
+    def idle_add(self, function):
+        return self.timeout_add(0, function)
+
+    def source_remove(self, source_id):
+        del self.sources[source_id]
+
+    def advance(self, milliseconds):
+        self.now += milliseconds
+        for source_id, (due, function) in sorted(self.sources.items()):
+            if due <= self.now and source_id in self.sources:
+                del self.sources[source_id]
+                if function():
+                    self.sources[source_id] = (self.now, function)
+
+class CommitSchedulerTest(TestCase):
+    def setUp(self):
+        self.main_loop = FakeMainLoop()
+        self.commits = 0
+        self.scheduler = self.new_scheduler(INTERVAL)
+
+    def new_scheduler(self, interval):
+        return CommitScheduler(
+            self.commit, interval, self.main_loop.timeout_add,
+            self.main_loop.idle_add, self.main_loop.source_remove)
+
+    def commit(self):
+        self.commits += 1
+
+    def test_burst_commited_once(self):
+        for i in xrange(10):
+            self.scheduler.change_happened()
+            self.main_loop.advance(INTERVAL / 20)
+        self.assertEquals(self.commits, 0)
+        self.assert_(self.scheduler.has_pending())
+        # the wait is from the first change of the burst, not the last
+        self.main_loop.advance(INTERVAL / 2)
+        self.assertEquals(self.commits, 1)
+        self.assertFalse(self.scheduler.has_pending())
+        self.assertEquals(self.main_loop.sources, {})
+
+    def test_next_burst_scheduled_again(self):
+        self.scheduler.change_happened()
+        self.main_loop.advance(INTERVAL)
+        self.scheduler.change_happened()
+        self.main_loop.advance(INTERVAL - 1)
+        self.assertEquals(self.commits, 1)
+        self.main_loop.advance(1)
+        self.assertEquals(self.commits, 2)
+
+    def test_zero_interval_commits_when_idle(self):
+        self.scheduler = self.new_scheduler(0)
+        self.scheduler.change_happened()
+        self.scheduler.change_happened()
+        self.assertEquals(self.commits, 0)
+        self.main_loop.advance(0)
+        self.assertEquals(self.commits, 1)
+
+    def test_flush(self):
+        # what MainWindow does before navigating, changing books and
+        # shutting down
+        self.scheduler.change_happened()
+        self.scheduler.flush()
+        self.assertEquals(self.commits, 1)
+        self.assertEquals(self.main_loop.sources, {})
+        # the timeout was taken away, so no second commit
+        self.main_loop.advance(INTERVAL)
+        self.assertEquals(self.commits, 1)
+
+    def test_flush_with_nothing_pending(self):
+        self.scheduler.flush()
+        self.main_loop.advance(INTERVAL)
+        self.assertEquals(self.commits, 0)
+
+    def test_interval_change(self):
+        # MainWindow sets the interval when the config changes
+        self.scheduler.interval = 100
+        self.scheduler.change_happened()
+        self.main_loop.advance(100)
+        self.assertEquals(self.commits, 1)
+
+class CommitIntervalConfigTest(TestCase):
+    def config_with(self, value):
+        config = ConfigParser()
+        config.add_section(GUI_CONFIG_SECTION)
+        config.set(GUI_CONFIG_SECTION, GUI_COMMIT_INTERVAL, value)
+        return config
+
+    def test_interval(self):
+        self.assertEquals(
+            get_commit_interval_from_config(self.config_with('250')), 250)
+        self.assertEquals(
+            get_commit_interval_from_config(self.config_with('-5')), 0)
+
+    def test_default(self):
+        self.assertEquals(get_commit_interval_from_config(None),
+                          DEFAULT_COMMIT_INTERVAL)
+        self.assertEquals(get_commit_interval_from_config(ConfigParser()),
+                          DEFAULT_COMMIT_INTERVAL)
+        self.assertEquals(
+            get_commit_interval_from_config(self.config_with('soon')),
+            DEFAULT_COMMIT_INTERVAL)
+
+if __name__ == "__main__":
+    main()
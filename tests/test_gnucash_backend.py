@@ -19,7 +19,7 @@
 
 # python
 from unittest import TestCase, main
-from os.path import abspath
+from os.path import abspath, exists
 from os import remove
 from glob import glob
 from decimal import Decimal
@@ -48,7 +48,6 @@ from test_bokeep_book import create_tmp_filename
 
 SQLITE3 = 'sqlite3'
 XML = 'xml'
-SQLITE3 = XML
 
 ASSETS_ACCOUNT = 'Assets'
 BANK_ACCOUNT = 'Bank'
@@ -267,6 +266,27 @@ class GnuCashBasicTest(GnuCashBasicSetup):
         self.backend_plugin.close()
         self.backend_plugin.close()
 
+    def test_lookup_caches(self):
+        test_trans = TestTransaction(
+            Decimal(1), BANK_FULL_SPEC,
+            Decimal(-1), PETTY_CASH_FULL_SPEC )
+        test_trans.set_currency(self.get_currency())
+        self.backend_plugin.mark_transaction_dirty(1, test_trans)
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.transaction_is_clean(1))
+        account_cache = self.backend_plugin._v_account_cache
+        for spec in (ASSETS_FULL_SPEC, BANK_FULL_SPEC, PETTY_CASH_FULL_SPEC):
+            self.assert_(spec in account_cache)
+        self.assertEquals(account_cache[BANK_FULL_SPEC].GetName(),
+                          BANK_ACCOUNT)
+        self.assert_(self.get_currency() in
+                     self.backend_plugin._v_currency_cache)
+
+        # the accounts belong to the session, so they're forgotten with it
+        self.backend_plugin.close()
+        self.assertFalse(hasattr(self.backend_plugin, '_v_account_cache'))
+        self.assertFalse(hasattr(self.backend_plugin, '_v_currency_cache'))
+
     def test_account_creation_when_not_there(self):
         TEST_NEW_ACCOUNT = "test created account"
         TEST_NEW_ACCOUNT_FULL_SPEC = (ASSETS_ACCOUNT, "test created account")
@@ -284,6 +304,9 @@ class GnuCashBasicTest(GnuCashBasicSetup):
                 None, self.backend_plugin.reason_transaction_is_dirty(
                     front_end_id) )
         self.assert_(self.backend_plugin.transaction_is_clean(front_end_id))
+        # the new account is remembered for the rest of the session
+        self.assert_(TEST_NEW_ACCOUNT_FULL_SPEC in
+                     self.backend_plugin._v_account_cache)
         self.backend_plugin.close()
         self.assertFalse(self.backend_plugin.can_write() )
         (s, book, root, accounts) = \
@@ -502,6 +525,35 @@ class GnuCashStartsWithMarkTests(GnuCashStartsWithMarkSetup):
             self.backend_plugin.transaction_is_clean(self.front_end_id))
         self.assert_(self.check_of_test_trans_present())
 
+    def test_consistency_check(self):
+        from bokeep.backend_plugins.robust_backend_plugin import \
+            BackendTransactionMismatch
+        self.test_trans.fin_trans.description = "original"
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.transaction_is_clean(
+                self.front_end_id))
+        self.assertEquals(self.backend_plugin.check_backend_consistency(), {})
+
+        # someone changes the transaction with gnucash
+        self.backend_plugin.close()
+        (s, book, root, accounts) = \
+            self.acquire_gnucash_session_book_root_and_accounts()
+        bank = accounts[1]
+        trans = bank.GetSplitList()[0].GetParent()
+        trans.BeginEdit()
+        trans.SetDescription("changed")
+        trans.CommitEdit()
+        self.gnucash_session_termination(s, True)
+
+        mismatches = self.backend_plugin.check_backend_consistency()
+        self.assertEquals(mismatches.keys(), [self.front_end_id])
+        (backend_ident, trans_mismatches), = mismatches[self.front_end_id]
+        self.assertEquals(trans_mismatches, [
+                BackendTransactionMismatch('description', "original",
+                                           "changed") ] )
+        self.assertFalse(self.backend_plugin.verify_backend_transaction(
+                backend_ident, self.test_trans.fin_trans) )
+
 class GnuCashStartsWithMarkTestsXML(
     GetProtocolXML, GnuCashStartsWithMarkTests):
     pass
@@ -522,6 +574,138 @@ class GnuCashStartsWithMarkTestsAlternativeUSD(
     GetCurrencyUSD, GnuCashStartsWithMarkAlternativeTests):
     pass
 
+class GnuCashLockTest(GetProtocolXML, GnuCashStartsWithMarkSetup):
+    def setUp(self):
+        GnuCashStartsWithMarkSetup.setUp(self)
+        # let go of the session setUp started, then have someone else
+        # take the lock
+        self.backend_plugin.close()
+        self.lock_file_name = self.gnucash_file_name + '.LCK'
+        open(self.lock_file_name, 'w').close()
+
+    def test_wait_for_lock(self):
+        from bokeep.backend_plugins.gnucash_backend import \
+            gnucash_book_is_locked
+        self.assert_(gnucash_book_is_locked(
+                self.get_gnucash_file_name_with_protocol() ))
+        self.backend_plugin.flush_backend()
+        self.assertFalse(self.backend_plugin.can_write())
+        self.assert_(self.backend_plugin.waiting_for_lock())
+        self.assertFalse(self.backend_plugin.transaction_is_clean(
+                self.front_end_id))
+        first_delay = self.backend_plugin.seconds_until_retry()
+        self.assert_(first_delay > 0)
+
+        # lock still there, trying again right away doesn't look
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.waiting_for_lock())
+        self.assert_(self.backend_plugin.seconds_until_retry() <= first_delay)
+
+        # lock gone, and the next try comes around
+        remove(self.lock_file_name)
+        self.backend_plugin._v_next_lock_retry_time = 0
+        self.backend_plugin.flush_backend()
+        self.assertFalse(self.backend_plugin.waiting_for_lock())
+        self.assertEquals(self.backend_plugin.seconds_until_retry(), None)
+        self.assert_(self.backend_plugin.transaction_is_clean(
+                self.front_end_id))
+
+    def test_break_lock(self):
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.waiting_for_lock())
+        # what the config dialog does when asked to, nothing is opened
+        # until the next flush
+        self.backend_plugin.break_lock()
+        self.assert_(self.backend_plugin.lock_break_requested())
+        self.assertFalse(self.backend_plugin.can_write())
+
+        self.backend_plugin.flush_backend()
+        self.assertFalse(self.backend_plugin.waiting_for_lock())
+        self.assertFalse(self.backend_plugin.lock_break_requested())
+        self.assert_(self.backend_plugin.transaction_is_clean(
+                self.front_end_id))
+        # the lock is ours now, and goes with the session
+        self.backend_plugin.close()
+        self.assertFalse(exists(self.lock_file_name))
+
+class GnuCashSQLiteSaveTest(GnuCashStartsWithMarkSetup):
+    def test_flush_doesnt_save_whole_book(self):
+        session = self.backend_plugin._v_session_active
+        saves = []
+        session.save = lambda: saves.append(None)
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.transaction_is_clean(
+                self.front_end_id))
+        # the same session is still in use and never had save() called,
+        # but the transaction made it to the file anyway
+        self.assert_(self.backend_plugin._v_session_active is session)
+        self.assertEquals(saves, [])
+        self.assert_(self.check_of_test_trans_present())
+
+class GnuCashURLTest(TestCase):
+    def test_url_protocol_and_path(self):
+        from bokeep.backend_plugins.gnucash_backend import \
+            gnucash_url_protocol, gnucash_file_path_from_url
+        self.assertEquals(gnucash_url_protocol('xml:///tmp/a.gnucash'), XML)
+        self.assertEquals(gnucash_url_protocol('sqlite3:///tmp/a.gnucash'),
+                          SQLITE3)
+        self.assertEquals(gnucash_url_protocol('/tmp/a.gnucash'), None)
+        self.assertEquals(gnucash_url_protocol(None), None)
+        self.assertEquals(
+            gnucash_file_path_from_url('sqlite3:///tmp/a.gnucash'),
+            '/tmp/a.gnucash')
+        self.assertEquals(
+            gnucash_file_path_from_url('postgres://host/db'), None)
+
+class GnuCashXMLToSQLiteTest(GetProtocolXML, GnuCashFileSetup):
+    def setUp(self):
+        GnuCashFileSetup.setUp(self)
+        self.sqlite3_file_name = create_tmp_filename(
+            'Gnucash_test_converted', '.gnucash' )
+
+    def tearDown(self):
+        GnuCashFileSetup.tearDown(self)
+        for file_name in glob(self.sqlite3_file_name + '*'):
+            remove(file_name)
+
+    def test_url_for_file(self):
+        from bokeep.backend_plugins.gnucash_backend import \
+            gnucash_url_for_file, convert_gnucash_xml_to_sqlite3
+        self.assertEquals(gnucash_url_for_file(self.gnucash_file_name),
+                          XML + '://' + self.gnucash_file_name)
+        convert_gnucash_xml_to_sqlite3(self.gnucash_file_name,
+                                       self.sqlite3_file_name)
+        self.assertEquals(gnucash_url_for_file(self.sqlite3_file_name),
+                          SQLITE3 + '://' + self.sqlite3_file_name)
+
+    def test_convert(self):
+        from bokeep.backend_plugins.gnucash_backend import GnuCash
+        backend_plugin = GnuCash()
+        backend_plugin.setattr('gnucash_file',
+                               self.get_gnucash_file_name_with_protocol() )
+        test_trans = TestTransaction(Decimal(1), BANK_FULL_SPEC,
+                                     Decimal(-1), PETTY_CASH_FULL_SPEC )
+        test_trans.set_currency(self.get_currency())
+        backend_plugin.mark_transaction_dirty(1, test_trans)
+        backend_plugin.flush_backend()
+        self.assert_(backend_plugin.transaction_is_clean(1))
+
+        self.assert_(backend_plugin.convert_to_sqlite3(self.sqlite3_file_name))
+        self.assertEquals(backend_plugin.gnucash_file,
+                          SQLITE3 + '://' + self.sqlite3_file_name)
+        self.assert_(backend_plugin.can_write())
+        # the transaction guid came along, so the transaction is still
+        # there as far as the backend plugin can tell
+        backend_plugin.mark_transaction_for_verification(1)
+        backend_plugin.flush_backend()
+        self.assert_(backend_plugin.transaction_is_clean(1))
+        backend_plugin.close()
+
+        from gnucash import Session
+        s = Session(SQLITE3 + '://' + self.sqlite3_file_name)
+        self.check_account_tree_is_present(s)
+        self.gnucash_session_termination(s)
+
 if __name__ == "__main__":
     main()
 
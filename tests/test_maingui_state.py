@@ -145,5 +145,52 @@ class GuiTestWithFirstNewTransInBrowse(
         self.state.do_action(RESET)
         self.assertEquals(self.state.get_transaction_id(), None)
 
+class GuiTestBackendChangeFunction(GuiTestWithBookAndAvailableTypesSetup):
+    def setUp(self):
+        super(GuiTestBackendChangeFunction, self).setUp()
+        self.book.set_backend_plugin('tests.test_backend_change_thread')
+        self.backend_changes = []
+
+    def backend_change_function(self, book, trans_id):
+        self.backend_changes.append( (book, trans_id) )
+
+    def do_action(self, action, arg=None):
+        self.state.do_action(action, arg, self.backend_change_function)
+
+    def assertBackendUntouched(self):
+        self.assertEquals(
+            len(self.book.get_backend_plugin().dirty_transaction_set), 0)
+
+    def test_new(self):
+        self.do_action(NEW)
+        self.assertEquals(self.backend_changes,
+                          [(self.book, FIRST_TRANS_ID)] )
+        self.assertBackendUntouched()
+
+    def test_delete(self):
+        self.do_action(NEW)
+        self.do_action(DELETE)
+        self.assertFalse(self.book.has_transaction(FIRST_TRANS_ID))
+        self.assertEquals(self.backend_changes,
+                          [(self.book, FIRST_TRANS_ID)]*2 )
+        self.assertBackendUntouched()
+
+    def test_type_change(self):
+        self.do_action(NEW)
+        self.do_action(TYPE_CHANGE, 1)
+        new_trans_id = self.state.get_transaction_id()
+        self.assertEquals(self.backend_changes,
+                          [(self.book, FIRST_TRANS_ID),
+                           (self.book, FIRST_TRANS_ID),
+                           (self.book, new_trans_id)] )
+        self.assertBackendUntouched()
+
+    def test_backend_marked_without_function(self):
+        self.state.do_action(NEW)
+        self.assert_(
+            FIRST_TRANS_ID in self.book.get_backend_plugin().\
+                dirty_transaction_set )
+        self.assertEquals(self.backend_changes, [])
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,234 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python
+from unittest import main
+from decimal import Decimal
+from time import sleep, time
+from glob import glob
+from os import remove
+from sqlite3 import connect
+
+# zopedb
+import transaction
+
+# bokeep
+from bokeep.backend_plugins.plugin import BoKeepBackendException
+from bokeep.util import UnitOfWork
+
+from test_bokeep_book import BoKeepWithBookSetup, create_tmp_filename
+from test_backend_change_thread import \
+    CountingBackendPlugin, BalancedTransaction
+
+MULTIPLEX_PLUGIN = 'bokeep.backend_plugins.multiplex_backend'
+CHILD_PLUGIN = 'tests.test_multiplex_backend'
+SQLITE_PLUGIN = 'bokeep.backend_plugins.sqlite_backend'
+SAVE_DELAY = 0.5
+
+class ChildCountingBackendPlugin(CountingBackendPlugin):
+    save_delay = 0
+    fail_creates = False
+    writable = True
+
+    def can_write(self):
+        return self.writable
+
+    def create_backend_transaction(self, fin_trans):
+        if self.fail_creates:
+            raise BoKeepBackendException("this child can't create anything")
+        return CountingBackendPlugin.create_backend_transaction(
+            self, fin_trans)
+
+    def save(self):
+        sleep(self.save_delay)
+        CountingBackendPlugin.save(self)
+
+def get_plugin_class():
+    return ChildCountingBackendPlugin
+
+class MultiplexBackendTest(BoKeepWithBookSetup):
+    def setUp(self):
+        BoKeepWithBookSetup.setUp(self)
+        self.book = self.test_book_1
+        self.book.set_backend_plugin(MULTIPLEX_PLUGIN)
+        self.multiplexer = self.book.get_backend_plugin()
+        self.children = [ self.multiplexer.add_backend_plugin(CHILD_PLUGIN)
+                          for i in xrange(2) ]
+        self.trans_ids = [
+            self.book.insert_transaction(BalancedTransaction(Decimal(i)))
+            for i in xrange(1, 4) ]
+        transaction.get().commit()
+
+    def tearDown(self):
+        # ends the children's threads
+        self.multiplexer.close()
+        BoKeepWithBookSetup.tearDown(self)
+
+    def mark_and_flush(self):
+        self.multiplexer.mark_transactions_dirty(
+            (trans_id, self.book.get_transaction(trans_id))
+            for trans_id in self.trans_ids )
+        self.multiplexer.flush_backend()
+
+    def test_every_child_written(self):
+        self.mark_and_flush()
+        # the flush commited what the children did
+        transaction.get().abort()
+        for child in self.children:
+            self.assertEquals(child.created, len(self.trans_ids))
+            for trans_id in self.trans_ids:
+                self.assert_(child.transaction_is_clean(trans_id))
+        for trans_id in self.trans_ids:
+            self.assert_(self.multiplexer.transaction_is_clean(trans_id))
+
+    def test_commit_left_to_caller(self):
+        self.multiplexer.mark_transactions_dirty(
+            (trans_id, self.book.get_transaction(trans_id))
+            for trans_id in self.trans_ids )
+        # the children's commits are put off by a UnitOfWork around the
+        # flush, so it rolls all of it back
+        try:
+            with UnitOfWork():
+                self.multiplexer.flush_backend()
+                raise ValueError()
+        except ValueError:
+            pass
+        for child in self.children:
+            self.assertEquals(child.created, 0)
+
+    def test_children_flushed_once(self):
+        self.mark_and_flush()
+        for child in self.children:
+            self.assertEquals(child.saves, 1)
+            self.assertEquals(child.saves_in_unit_of_work, 0)
+
+    def test_children_flushed_concurrently(self):
+        for child in self.children:
+            child.save_delay = SAVE_DELAY
+        start_time = time()
+        self.mark_and_flush()
+        elapsed = time() - start_time
+        self.assert_(elapsed < SAVE_DELAY * len(self.children),
+                     "flush took %s seconds" % elapsed)
+        for child in self.children:
+            self.assertEquals(child.saves, 1)
+
+    def test_one_child_failing(self):
+        self.children[1].fail_creates = True
+        self.mark_and_flush()
+        trans_id = self.trans_ids[0]
+        self.assert_(self.children[0].transaction_is_clean(trans_id))
+        self.assertFalse(self.children[1].transaction_is_clean(trans_id))
+        self.assertFalse(self.multiplexer.transaction_is_clean(trans_id))
+        reason = self.multiplexer.reason_transaction_is_dirty(trans_id)
+        self.assert_(reason.startswith(CHILD_PLUGIN + ': '))
+        self.assertEquals(
+            reason[len(CHILD_PLUGIN) + 2:],
+            self.children[1].reason_transaction_is_dirty(trans_id) )
+
+    def test_child_cant_write(self):
+        self.children[1].writable = False
+        self.multiplexer.mark_transactions_dirty(
+            (trans_id, self.book.get_transaction(trans_id))
+            for trans_id in self.trans_ids )
+        # the other child is done, but this one's still waiting
+        self.assertEquals(self.multiplexer.flush_backend(), None)
+        self.assertEquals(self.children[0].created, len(self.trans_ids))
+        self.children[1].writable = True
+        self.assertEquals(self.multiplexer.flush_backend(), 0)
+        for trans_id in self.trans_ids:
+            self.assert_(self.multiplexer.transaction_is_clean(trans_id))
+
+    def test_mark_refused_by_every_child(self):
+        self.mark_and_flush()
+        # nothing is being held, so there's nothing to force
+        self.assertRaises(
+            BoKeepBackendException,
+            self.multiplexer.mark_transaction_for_forced_remove,
+            self.trans_ids[0] )
+
+    def test_remove(self):
+        self.mark_and_flush()
+        self.assert_(self.multiplexer.remove_trans_flush_check_and_close(
+                self.trans_ids[0]) )
+        for child in self.children:
+            self.assertEquals(child.closes, 1)
+
+    def test_remove_child(self):
+        self.multiplexer.remove_backend_plugin(self.children[0])
+        self.assertEquals(self.multiplexer.get_backend_plugins(),
+                          self.children[1:] )
+        self.assertEquals(self.children[0].closes, 1)
+        self.assertRaises(BoKeepBackendException,
+                          self.multiplexer.remove_backend_plugin,
+                          self.children[0])
+
+class MultiplexSQLiteTest(BoKeepWithBookSetup):
+    """Two sqlite_backend children, whose SQLite connections only work in
+    the thread that opened them and are kept open from one flush to the next
+    """
+    def setUp(self):
+        BoKeepWithBookSetup.setUp(self)
+        self.book = self.test_book_1
+        self.book.set_backend_plugin(MULTIPLEX_PLUGIN)
+        self.multiplexer = self.book.get_backend_plugin()
+        self.sqlite_file_names = []
+        for i in xrange(2):
+            child = self.multiplexer.add_backend_plugin(SQLITE_PLUGIN)
+            child.sqlite_file = create_tmp_filename(
+                'multiplex_sqlite_test', '.sqlite' )
+            self.sqlite_file_names.append(child.sqlite_file)
+        self.trans_ids = [
+            self.book.insert_transaction(BalancedTransaction(Decimal(i)))
+            for i in xrange(1, 4) ]
+        transaction.get().commit()
+
+    def query_amounts(self, sqlite_file_name):
+        con = connect(sqlite_file_name)
+        try:
+            return con.execute(
+                "SELECT amount FROM bokeep_transaction_lines "
+                "WHERE line_num = 0 ORDER BY trans_id").fetchall()
+        finally:
+            con.close()
+
+    def test_several_flushes(self):
+        for flush_num in xrange(1, 5):
+            for trans_id in self.trans_ids:
+                trans = self.book.get_transaction(trans_id)
+                trans.amount = Decimal(trans_id * 10 + flush_num)
+                self.multiplexer.mark_transaction_dirty(trans_id, trans)
+            self.assertEquals(self.multiplexer.flush_backend(), 0)
+            for trans_id in self.trans_ids:
+                self.assert_(self.multiplexer.transaction_is_clean(trans_id))
+            for sqlite_file_name in self.sqlite_file_names:
+                self.assertEquals(
+                    self.query_amounts(sqlite_file_name),
+                    [ (unicode(trans_id * 10 + flush_num),)
+                      for trans_id in self.trans_ids ] )
+
+    def tearDown(self):
+        self.multiplexer.close()
+        BoKeepWithBookSetup.tearDown(self)
+        for sqlite_file_name in self.sqlite_file_names:
+            for file_name in glob(sqlite_file_name + '*'):
+                remove(file_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import main
+from decimal import Decimal
+
+# bo-keep imports
+from bokeep.plugins.payroll.canada.paystub_line import \
+    PaystubSimpleDeductionLine
+from bokeep.plugins.payroll.canada.income_tax import \
+    PaystubCalculatedIncomeTaxDeductionLine
+from bokeep.plugins.payroll.canada import calculation_context
+from bokeep.plugins.payroll.canada.calculation_context import \
+    CalculationContext, memoize_calculation, get_active_calculation_context
+
+# bo-keep test suite
+from test_payroll_employee import PaystubTestCaseSetup
+
+class CalculationContextTest(PaystubTestCaseSetup):
+    def setUp(self):
+        PaystubTestCaseSetup.setUp(self)
+        self.income_tax_line = \
+            self.paystub.get_paystub_lines_of_class(
+            PaystubCalculatedIncomeTaxDeductionLine).next()
+
+    def tearDown(self):
+        calculation_context.MEMOIZE_CALCULATIONS = True
+
+    def get_results(self):
+        return (self.paystub.net_pay(), self.paystub.income_tax_deductions(),
+                self.paystub.cpp_deductions(), self.paystub.ei_deductions(),
+                self.paystub.gross_income() )
+
+    def test_same_as_not_memoized(self):
+        calculation_context.MEMOIZE_CALCULATIONS = False
+        not_memoized = self.get_results()
+        calculation_context.MEMOIZE_CALCULATIONS = True
+        self.assertEquals(self.get_results(), not_memoized)
+        with CalculationContext():
+            self.assertEquals(self.get_results(), not_memoized)
+        self.assertEquals(get_active_calculation_context(), None)
+
+    def test_calculated_once(self):
+        calls = []
+        @memoize_calculation
+        def calculation(paystub):
+            calls.append(paystub)
+            return paystub.net_pay()
+        with CalculationContext():
+            calculation(self.paystub)
+            calculation(self.paystub)
+        self.assertEquals(len(calls), 1)
+        # the context is gone afterwards, so it's worked out again
+        calculation(self.paystub)
+        self.assertEquals(len(calls), 2)
+
+    def test_line_value_changed(self):
+        with CalculationContext():
+            net_pay = self.paystub.net_pay()
+            self.wage_line.set_value(Decimal(40), Decimal('15.00'))
+            self.assert_(self.paystub.net_pay() < net_pay)
+
+    def test_override(self):
+        with CalculationContext():
+            net_pay = self.paystub.net_pay()
+            income_tax = self.income_tax_line.get_value()
+            self.income_tax_line.set_value(income_tax + Decimal(10))
+            self.assertEquals(self.paystub.net_pay(), net_pay - Decimal(10))
+            self.income_tax_line.recalculate_value()
+            self.assertEquals(self.paystub.net_pay(), net_pay)
+
+    def test_employee_changed(self):
+        with CalculationContext():
+            income_tax = self.paystub.income_tax_deductions()
+            self.emp.fed_tax_credits = 0
+            self.assert_(self.paystub.income_tax_deductions() > income_tax)
+
+    def test_line_added(self):
+        with CalculationContext():
+            net_pay = self.paystub.net_pay()
+            self.paystub.add_paystub_line(
+                PaystubSimpleDeductionLine(self.paystub, Decimal(25)) )
+            self.assertEquals(self.paystub.net_pay(), net_pay - Decimal(25))
+
+    def test_freeze(self):
+        values = [ paystub_line.get_value()
+                   for paystub_line in self.paystub.get_calculated_lines() ]
+        with CalculationContext():
+            self.paystub.freeze()
+            self.assert_(self.paystub.calculated_lines_frozen())
+            self.assertEquals(
+                [ paystub_line.get_value()
+                  for paystub_line in self.paystub.get_calculated_lines() ],
+                values )
+            # a frozen line no longer follows the wage
+            net_pay = self.paystub.net_pay()
+            self.wage_line.set_value(Decimal(40), Decimal('15.00'))
+            self.assertEquals(self.paystub.net_pay(),
+                              net_pay - Decimal(600) )
+
+    def test_freeze_not_memoized(self):
+        values = [ paystub_line.get_value()
+                   for paystub_line in self.paystub.get_calculated_lines() ]
+        calculation_context.MEMOIZE_CALCULATIONS = False
+        self.paystub.freeze()
+        self.assertEquals(
+            [ paystub_line.get_value()
+              for paystub_line in self.paystub.get_calculated_lines() ],
+            values )
+        self.assertEquals(self.emp.verify_paystub_accumulators(), [])
+
+if __name__ == "__main__":
+    main()
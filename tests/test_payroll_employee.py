@@ -21,11 +21,18 @@ import unittest
 import os
 import glob
 import filecmp
+from decimal import Decimal
+from datetime import date
 
 #from bokeep.config import get_database_cfg_file
 from bokeep.book import BoKeepBookSet
 from bokeep.plugins.payroll.plain_text_payroll \
     import payroll_add_employee, payroll_get_employees
+from bokeep.plugins.payroll.canada.employee import Employee
+from bokeep.plugins.payroll.canada.paystub import Paystub
+from bokeep.plugins.payroll.canada.paystub_line import \
+    PaystubWageLine, PaystubNetPaySummaryLine
+from bokeep.plugins.payroll.payroll import Payday
 
 
 from test_bokeep_book import BoKeepWithBookSetup, TESTBOOK
@@ -42,6 +49,24 @@ class PayrollTestCaseSetup(BoKeepWithBookSetup):
         payroll_add_employee(TESTBOOK, "george costanza", self.books)
         payroll_add_employee(TESTBOOK, "susie", self.books)
 
+PAYSTUB_PAYDATE = date(2011, 3, 4)
+
+class PaystubTestCaseSetup(unittest.TestCase):
+    """One employee with one paystub of 80 hours at $15.00, on a payday
+    that isn't part of any book
+    """
+    def setUp(self):
+        self.emp = Employee("test employee")
+        payday = Payday(None)
+        payday.set_paydate(PAYSTUB_PAYDATE, date(2011, 2, 19),
+                           PAYSTUB_PAYDATE)
+        self.paystub = Paystub(self.emp, payday)
+        self.paystub.add_paystub_line(
+            PaystubNetPaySummaryLine(self.paystub) )
+        self.wage_line = PaystubWageLine(
+            self.paystub, Decimal(80), Decimal('15.00') )
+        self.paystub.add_paystub_line(self.wage_line)
+
 class empTestCase(PayrollTestCaseSetup):
     def testEmpAddAndGet(self):
         self.assert_( self.books.has_book(TESTBOOK) )
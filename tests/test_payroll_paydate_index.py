@@ -0,0 +1,128 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import main
+from datetime import date, timedelta
+
+# bo-keep imports
+from bokeep.plugins.payroll.payroll import Payday
+
+# bo-keep test imports
+from test_bokeep_book import TESTBOOK
+from test_payroll_employee import PayrollTestCaseSetup
+
+FIRST_PAYDATE = date(2010, 1, 8)
+
+class PaydateIndexTest(PayrollTestCaseSetup):
+    def setUp(self):
+        PayrollTestCaseSetup.setUp(self)
+        self.book = self.books.get_book(TESTBOOK)
+        # bi-weekly paydays, each paid a week after the end of the period
+        self.trans_ids = [
+            self.add_payday(FIRST_PAYDATE + timedelta(14*i),
+                            FIRST_PAYDATE + timedelta(14*i - 20),
+                            FIRST_PAYDATE + timedelta(14*i - 7) )
+            for i in xrange(20) ]
+
+    def add_payday(self, paydate, period_start, period_end):
+        payday = Payday(self.payroll_plugin)
+        payday.set_paydate(paydate, period_start, period_end)
+        trans_id = self.book.insert_transaction(payday)
+        self.payroll_plugin.register_transaction(trans_id, payday)
+        return trans_id
+
+    def get_paydays_by_scan(self, start_date, end_date):
+        return dict(
+            (trans_id, payday)
+            for trans_id, payday in
+            self.payroll_plugin.payday_database.iteritems()
+            if not (end_date < payday.period_start or
+                    start_date > payday.period_end) )
+
+    def test_get_payday(self):
+        trans_id, payday = self.payroll_plugin.get_payday(
+            FIRST_PAYDATE + timedelta(28) )
+        self.assertEquals(trans_id, self.trans_ids[2])
+        self.assertEquals(payday.paydate, FIRST_PAYDATE + timedelta(28))
+        self.assertEquals(
+            self.payroll_plugin.get_payday(FIRST_PAYDATE + timedelta(1)),
+            (None, None) )
+        self.assertFalse(
+            self.payroll_plugin.has_payday(FIRST_PAYDATE - timedelta(14)) )
+
+    def test_paydate_bounds(self):
+        paydates = [
+            payday.paydate
+            for payday in self.payroll_plugin.gen_paydays_with_paydate_bounds(
+                FIRST_PAYDATE + timedelta(10), FIRST_PAYDATE + timedelta(42) )]
+        self.assertEquals(
+            paydates,
+            [ FIRST_PAYDATE + timedelta(days) for days in (14, 28, 42) ] )
+
+    def test_period_bounds(self):
+        for start_date, end_date in (
+            (FIRST_PAYDATE, FIRST_PAYDATE),
+            (FIRST_PAYDATE + timedelta(30), FIRST_PAYDATE + timedelta(60)),
+            (date(2009, 1, 1), date(2011, 1, 1)),
+            (date(2011, 1, 1), date(2012, 1, 1)) ):
+            self.assertEquals(
+                self.payroll_plugin.get_paydays(start_date, end_date),
+                self.get_paydays_by_scan(start_date, end_date) )
+        # a payday paid long after its period still shows up
+        trans_id = self.add_payday(date(2011, 6, 1),
+                                   date(2010, 1, 1), date(2010, 1, 14) )
+        self.assert_(
+            trans_id in self.payroll_plugin.get_paydays(
+                date(2010, 1, 10), date(2010, 1, 10)) )
+
+    def test_paydate_changed_after_register(self):
+        # the payroll editor registers a new payday before it has dates
+        payday = Payday(self.payroll_plugin)
+        trans_id = self.book.insert_transaction(payday)
+        self.payroll_plugin.register_transaction(trans_id, payday)
+        self.assertEquals(self.payroll_plugin.get_payday(None),
+                          (trans_id, payday) )
+        paydate = date(2012, 1, 6)
+        payday.set_paydate(paydate, paydate, paydate)
+        self.assertEquals(self.payroll_plugin.get_payday(paydate),
+                          (trans_id, payday) )
+        self.assertEquals(self.payroll_plugin.get_payday(None),
+                          (None, None) )
+
+    def test_remove(self):
+        self.payroll_plugin.remove_transaction(self.trans_ids[0])
+        self.assertFalse(self.payroll_plugin.has_payday(FIRST_PAYDATE))
+        self.assertFalse(FIRST_PAYDATE in self.payroll_plugin.paydate_index)
+
+    def test_existing_database(self):
+        for attr in ('paydate_index', 'paydays_without_paydate',
+                     'max_days_paydate_after_period_start',
+                     'max_days_period_end_after_paydate'):
+            delattr(self.payroll_plugin, attr)
+        self.assertEquals(
+            self.payroll_plugin.get_payday(FIRST_PAYDATE)[0],
+            self.trans_ids[0] )
+        self.assertEquals(
+            self.payroll_plugin.get_paydays(date(2010, 3, 1),
+                                            date(2010, 4, 1)),
+            self.get_paydays_by_scan(date(2010, 3, 1), date(2010, 4, 1)) )
+
+if __name__ == "__main__":
+    main()
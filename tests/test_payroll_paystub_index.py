@@ -0,0 +1,106 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import TestCase, main
+from datetime import date
+
+# bo-keep imports
+from bokeep.plugins.payroll.canada.employee import Employee
+from bokeep.plugins.payroll.canada.paystub import Paystub
+from bokeep.plugins.payroll.canada.paystub_index import PaystubIndex
+from bokeep.plugins.payroll.payroll import Payday
+
+class PaystubIndexTest(TestCase):
+    def setUp(self):
+        self.emp = Employee("test employee")
+        # added out of order, and two on the same day
+        self.paystubs = dict(
+            (day, self.add_paystub(date(2010, 3, day)))
+            for day in (15, 1, 29) )
+        self.second_on_first = self.add_paystub(date(2010, 3, 1))
+
+    def add_paystub(self, paydate):
+        payday = Payday(None)
+        payday.set_paydate(paydate, paydate, paydate)
+        return Paystub(self.emp, payday)
+
+    def test_date_order(self):
+        self.assertEquals(
+            list(self.emp.paystubs),
+            [self.paystubs[1], self.second_on_first,
+             self.paystubs[15], self.paystubs[29]] )
+        self.assertEquals(len(self.emp.paystubs), 4)
+        self.assertEquals(self.emp.paystubs[0], self.paystubs[1])
+        self.assertEquals(self.emp.paystubs[-1], self.paystubs[29])
+        self.assertEquals(self.emp.first_paydate_by_paystub(),
+                          date(2010, 3, 1))
+
+    def test_bounded(self):
+        self.assertEquals(
+            list(self.emp.get_bounded_paystubs(date(2010, 3, 1),
+                                               date(2010, 3, 15))),
+            [self.paystubs[1], self.second_on_first, self.paystubs[15]] )
+        self.assertEquals(
+            list(self.emp.get_bounded_paystubs(date(2010, 3, 2),
+                                               date(2010, 3, 28))),
+            [self.paystubs[15]] )
+        self.assertEquals(
+            list(self.emp.get_bounded_paystubs(
+                    date(2010, 1, 1), date(2010, 12, 31),
+                    self.paystubs[15], False)),
+            [self.paystubs[1], self.second_on_first] )
+
+    def test_last_before(self):
+        self.assertEquals(
+            self.emp.get_last_paystub_before(date(2010, 3, 15)),
+            self.second_on_first )
+        self.assertEquals(
+            self.emp.get_last_paystub_before(date(2010, 4, 1)),
+            self.paystubs[29] )
+        self.assertEquals(
+            self.emp.get_last_paystub_before(date(2010, 3, 1)), None )
+
+    def test_remove(self):
+        self.emp.remove_paystub(self.paystubs[15])
+        self.assertFalse(self.paystubs[15] in self.emp.paystubs)
+        self.assert_(self.paystubs[29] in self.emp.paystubs)
+        self.assertEquals(len(self.emp.paystubs), 3)
+
+    def test_paydate_changed(self):
+        self.paystubs[1].payday.set_paydate(
+            *(date(2010, 4, 1) for i in xrange(3)) )
+        self.assertEquals(self.emp.paystubs[-1], self.paystubs[1])
+        self.assertEquals(
+            list(self.emp.get_bounded_paystubs(date(2010, 3, 1),
+                                               date(2010, 3, 1))),
+            [self.second_on_first] )
+
+    def test_existing_employee(self):
+        # employees used to keep them in a list, in the order added
+        old_list = [self.paystubs[15], self.paystubs[1]]
+        self.emp.paystubs = old_list
+        self.emp.add_paystub(self.paystubs[29])
+        self.assert_(isinstance(self.emp.paystubs, PaystubIndex))
+        self.assertEquals(list(self.emp.paystubs),
+                          [self.paystubs[1], self.paystubs[15],
+                           self.paystubs[29]] )
+
+if __name__ == "__main__":
+    main()
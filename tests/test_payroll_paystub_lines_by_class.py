@@ -0,0 +1,106 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import main
+from decimal import Decimal
+
+# bo-keep imports
+from bokeep.plugins.payroll.canada.paystub_line import \
+    PaystubLine, PaystubIncomeLine, PaystubWageLine, PaystubCalculatedLine, \
+    PaystubDeductionLine, PaystubSimpleDeductionLine, \
+    PaystubNetPaySummaryLine
+from bokeep.plugins.payroll.canada.functions import filter_by_class
+from bokeep.plugins.payroll.canada.cpp import PaystubCPPDeductionLine
+from bokeep.plugins.payroll.canada.vacation_pay import \
+    PaystubVacpayPayoutLine
+
+# bo-keep test suite
+from test_payroll_employee import PaystubTestCaseSetup
+
+LINE_CLASSES = (PaystubLine, PaystubIncomeLine, PaystubWageLine,
+                PaystubCalculatedLine, PaystubDeductionLine,
+                PaystubSimpleDeductionLine, PaystubCPPDeductionLine,
+                PaystubVacpayPayoutLine, PaystubNetPaySummaryLine)
+
+class PaystubLinesByClassTest(PaystubTestCaseSetup):
+    def setUp(self):
+        PaystubTestCaseSetup.setUp(self)
+        self.deduction_line = PaystubSimpleDeductionLine(
+            self.paystub, Decimal(25) )
+        self.paystub.add_paystub_line(self.deduction_line)
+
+    def assertMatchesScan(self):
+        for line_class in LINE_CLASSES:
+            self.assertEquals(
+                list(self.paystub.get_paystub_lines_of_class(line_class)),
+                list(filter_by_class(line_class,
+                                     self.paystub.paystub_lines)) )
+
+    def test_lookup(self):
+        self.assertMatchesScan()
+        self.assertEquals(
+            list(self.paystub.get_paystub_lines_of_class(PaystubIncomeLine)),
+            [self.wage_line] )
+        self.assertEquals(
+            list(self.paystub.get_paystub_lines_of_class(
+                    PaystubVacpayPayoutLine)), [] )
+        # tuples of classes work like isinstance
+        self.assertEquals(
+            list(self.paystub.get_paystub_lines_of_class(
+                    (PaystubWageLine, PaystubSimpleDeductionLine) )),
+            [self.wage_line, self.deduction_line] )
+
+    def test_add(self):
+        payout_line = PaystubVacpayPayoutLine(self.paystub, Decimal(10))
+        self.paystub.add_paystub_line(payout_line)
+        self.assertMatchesScan()
+        self.assertEquals(
+            list(self.paystub.get_paystub_lines_of_classes_not_classes(
+                    (PaystubIncomeLine,), (PaystubVacpayPayoutLine,) )),
+            [self.wage_line] )
+
+    def test_remove(self):
+        net_pay = self.paystub.net_pay()
+        self.paystub.remove_paystub_line(self.deduction_line)
+        self.assertFalse(self.deduction_line in self.paystub.paystub_lines)
+        self.assertMatchesScan()
+        self.assertEquals(self.paystub.net_pay(), net_pay + Decimal(25))
+
+    def test_remove_frozen(self):
+        self.paystub.freeze()
+        self.paystub.remove_paystub_line(self.deduction_line)
+        self.assertEquals(self.emp.verify_paystub_accumulators(), [])
+
+    def test_lines_changed_directly(self):
+        self.paystub.get_paystub_lines_of_class(PaystubLine)
+        self.paystub.paystub_lines.append(
+            PaystubSimpleDeductionLine(self.paystub, Decimal(5)) )
+        self.assertMatchesScan()
+        self.paystub.paystub_lines = [self.wage_line]
+        self.assertMatchesScan()
+
+    def test_not_persisted(self):
+        self.paystub.get_paystub_lines_of_class(PaystubLine)
+        self.assertFalse(
+            any( attr.startswith('_v_')
+                 for attr in self.paystub.__getstate__() ) )
+
+if __name__ == "__main__":
+    main()
@@ -20,10 +20,19 @@
 # python imports
 from unittest import main
 from decimal import Decimal
+from datetime import date
 
 # bo-keep imports
 from bokeep.plugins.payroll.plain_text_payroll import year_to_date_sum_of_class
-from bokeep.plugins.payroll.payroll import PaystubIncomeLine
+from bokeep.plugins.payroll.payroll import PaystubIncomeLine, Payday
+from bokeep.plugins.payroll.canada.paystub import Paystub
+from bokeep.plugins.payroll.canada.paystub_line import \
+    PaystubLine, PaystubCalculatedLine, sum_paystub_lines
+from bokeep.plugins.payroll.canada.vacation_pay import \
+    PaystubVacpayLine, PaystubVacpayPayoutLine
+from bokeep.plugins.payroll.canada.cpp import PaystubCPPDeductionLine
+from bokeep.plugins.payroll.canada.employee import UNFROZEN_PAYSTUBS
+from bokeep.util import start_of_year
 
 # bo-keep test imports
 from tests.test_payroll_VacPay import ComplexVacationPayoutSetup
@@ -36,5 +45,119 @@ class TestYTD(ComplexVacationPayoutSetup):
                 year_to_date_sum_of_class(cls)(self.paystub_three),
                 Decimal(value_str) )
 
+LINE_CLASSES = (PaystubLine, PaystubIncomeLine, PaystubCalculatedLine,
+                PaystubVacpayLine, PaystubVacpayPayoutLine,
+                PaystubCPPDeductionLine)
+
+class TestYTDAccumulators(ComplexVacationPayoutSetup):
+    def setUp(self):
+        ComplexVacationPayoutSetup.setUp(self)
+        self.paystubs = [self.paystub_one, self.paystub_two,
+                         self.paystub_three, self.paystub_four]
+
+    def add_next_year_paystub(self):
+        payday = Payday(None)
+        payday.set_paydate( *(date(2010, 1, 8) for i in xrange(3)) )
+        paystub = Paystub(self.emp, payday)
+        paystub.add_paystub_line( PaystubIncomeLine(paystub, Decimal(50)) )
+        self.paystubs.append(paystub)
+        return paystub
+
+    def assertSumsMatchRescan(self):
+        for paystub in self.paystubs:
+            paydate = paystub.payday.paydate
+            for cls in LINE_CLASSES:
+                for include_final_paystub in (True, False):
+                    self.assertEquals(
+                        self.emp.get_YTD_sum_of_paystub_line_class(
+                            cls, paystub, include_final_paystub),
+                        self.emp.get_bounded_sum_of_paystub_line_class(
+                            cls, start_of_year(paydate), paydate,
+                            paystub, include_final_paystub) )
+                    self.assertEquals(
+                        self.emp.get_sum_of_all_paystub_line_class(
+                            cls, paystub, include_final_paystub),
+                        sum_paystub_lines(
+                            self.emp.get_all_paystub_lines_of_class(
+                                cls, paystub, include_final_paystub) ) )
+        self.assertEquals(self.emp.verify_paystub_accumulators(), [])
+
+    def test_freeze_in_order(self):
+        self.assertSumsMatchRescan()
+        self.add_next_year_paystub()
+        for paystub in self.paystubs:
+            paystub.freeze()
+            self.assertSumsMatchRescan()
+        self.assertEquals(self.emp.unfrozen_paystubs, [])
+        self.assertEquals(
+            self.emp.get_YTD_sum_of_paystub_line_class(
+                PaystubIncomeLine, self.paystubs[-1], True),
+            Decimal(50) )
+
+    def test_frozen_paystubs_not_rescanned(self):
+        for paystub in self.paystubs[:-1]:
+            paystub.freeze()
+        expected = self.emp.get_sum_of_all_paystub_line_class(
+            PaystubIncomeLine, self.paystub_four, True)
+        for paystub in self.paystubs[:-1]:
+            paystub.get_paystub_lines_of_class = None
+        self.assertEquals(
+            self.emp.get_sum_of_all_paystub_line_class(
+                PaystubIncomeLine, self.paystub_four, True), expected)
+        self.assertEquals(
+            self.emp.get_YTD_sum_of_paystub_line_class(
+                PaystubIncomeLine, self.paystub_four, True), expected)
+
+    def test_remove(self):
+        for paystub in self.paystubs:
+            paystub.freeze()
+        self.emp.remove_paystub(self.paystub_two)
+        self.paystubs.remove(self.paystub_two)
+        self.assertSumsMatchRescan()
+        self.emp.remove_paystub(self.paystub_four)
+        self.paystubs.remove(self.paystub_four)
+        self.assertSumsMatchRescan()
+
+    def test_add_line_to_frozen(self):
+        for paystub in self.paystubs:
+            paystub.freeze()
+        self.paystub_two.add_paystub_line(
+            PaystubIncomeLine(self.paystub_two, Decimal(25)) )
+        self.assertSumsMatchRescan()
+
+    def test_verify_finds_changed_line(self):
+        self.paystub_one.freeze()
+        income_line = tuple(self.paystub_one.get_paystub_lines_of_class(
+                PaystubIncomeLine))[0]
+        income_line.set_value(Decimal(150))
+        self.assertEquals(
+            sorted( (mismatch[1], mismatch[2])
+                    for mismatch in self.emp.verify_paystub_accumulators()
+                    if mismatch[0] in ( PaystubIncomeLine,
+                                        (2009, PaystubIncomeLine) ) ),
+            [ (Decimal(100), Decimal(150)), (Decimal(100), Decimal(150)) ] )
+        self.emp.rebuild_paystub_accumulators()
+        self.assertSumsMatchRescan()
+
+    def test_verify_finds_unfrozen_list_off(self):
+        self.emp.unfrozen_paystubs.remove(self.paystub_one)
+        self.assertEquals(self.emp.verify_paystub_accumulators(),
+                          [ (UNFROZEN_PAYSTUBS, 3, 4) ] )
+
+    def test_legacy_employee(self):
+        # employees from before the sums were kept, with thier calculated
+        # lines frozen like plain_text_payroll has always done
+        for paystub in self.paystubs[:2]:
+            for paystub_line in paystub.get_calculated_lines():
+                paystub_line.freeze_value()
+        for attr in ('paystub_line_class_totals',
+                     'paystub_line_class_year_totals',
+                     'latest_frozen_paydates', 'unfrozen_paystubs'):
+            delattr(self.emp, attr)
+        self.assertSumsMatchRescan()
+        self.assert_(self.paystub_one.frozen)
+        self.assert_(self.paystub_two.frozen)
+        self.assertEquals(self.emp.unfrozen_paystubs, self.paystubs[2:])
+
 if __name__ == '__main__':
     main()
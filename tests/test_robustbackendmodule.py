@@ -28,7 +28,8 @@ from bokeep.backend_plugins.plugin import \
     BoKeepBackendException, BoKeepBackendResetException
 
 from bokeep.backend_plugins.robust_backend_plugin import \
-    RobustBackendPlugin, BackendDataStateMachine
+    RobustBackendPlugin, BackendDataStateMachine, BackendTransactionMismatch, \
+    MISSING_TRANSACTION_MISMATCH, BACKEND_ERROR_MISMATCH
 
 from bokeep.book import BoKeepBookSet
 from bokeep.book_transaction import \
@@ -71,6 +72,13 @@ def create_return_override_function(func, cmd):
             return original_return
     return return_override_function
 
+def create_batch_logging_function(func, cmd):
+    def batch_logging_function(self, batch):
+        batch = list(batch)
+        self.actions_queue.append( (cmd, len(batch)) )
+        return func(self, batch)
+    return batch_logging_function
+
 class TestHackableClass(object):
     def __init__(self, *args, **kargs):
         self.clear_actions_queue()
@@ -116,20 +124,23 @@ class TestTransaction(TestHackableClass, Transaction):
     get_financial_transactions = create_return_override_function(
         get_financial_transactions, 0)
 
-CMDS = (REMOVE, CREATE, VERIFY, SAVE, CLOSE) = range(5)
+CMDS = (REMOVE, CREATE, VERIFY, SAVE, CLOSE, UPDATE,
+        REMOVE_BATCH, CREATE_BATCH, VERIFY_BATCH) = range(9)
 
 FAILURE_TYPES = \
     (REMOVAL_FAIL, REMOVAL_RESET, CREATION_FAIL, CREATION_RESET,
-     SAVE_FAIL, SAVE_RESET, VERIFY_FAIL, VERIFY_RESET) = range(8)
+     SAVE_FAIL, SAVE_RESET, VERIFY_FAIL, VERIFY_RESET,
+     UPDATE_FAIL, UPDATE_RESET) = range(10)
 
 class BackendPluginUnitTest(TestHackableClass, RobustBackendPlugin):
     def __init__(self):
         RobustBackendPlugin.__init__(self)
         TestHackableClass.__init__(self)
         self.counter = 0
+        self.writable = True
         
     def can_write(self):
-        return True
+        return self.writable
     
     remove_backend_transaction = create_logging_function(
         create_failure_function(
@@ -164,6 +175,27 @@ class BackendPluginUnitTest(TestHackableClass, RobustBackendPlugin):
         SAVE)
     close = create_logging_function(RobustBackendPlugin.close, CLOSE)
 
+class UpdatingBackendPluginUnitTest(BackendPluginUnitTest):
+    def can_update_backend_transactions(self):
+        return True
+
+    update_backend_transaction = create_logging_function(
+        create_failure_function(
+            create_failure_function(null_function, UPDATE_FAIL),
+            UPDATE_RESET),
+        UPDATE)
+
+class BatchingBackendPluginUnitTest(BackendPluginUnitTest):
+    def can_batch_backend_transactions(self):
+        return True
+
+    create_backend_transactions = create_batch_logging_function(
+        RobustBackendPlugin.create_backend_transactions, CREATE_BATCH)
+    remove_backend_transactions = create_batch_logging_function(
+        RobustBackendPlugin.remove_backend_transactions, REMOVE_BATCH)
+    verify_backend_transactions = create_batch_logging_function(
+        RobustBackendPlugin.verify_backend_transactions, VERIFY_BATCH)
+
 class BackendPluginBasicSetup(TestCase):
     """This tests that RobustBackendPlugin makes calls to the subclass functions
     create_backend_transaction, remove_backend_transaction,
@@ -174,8 +206,10 @@ class BackendPluginBasicSetup(TestCase):
     transaction_is_clean, reason_transaction_is_dirty, flush_backend, and
     backend_reset_occured
     """
+    backend_plugin_class = BackendPluginUnitTest
+
     def setUp(self):
-        self.backend_plugin = BackendPluginUnitTest()
+        self.backend_plugin = self.backend_plugin_class()
         self.transaction = TestTransaction()
         self.fin_trans = self.transaction.get_financial_transactions()[0]
 
@@ -216,6 +250,16 @@ class BackendPluginBasicSetup(TestCase):
         self.assertEquals(return_val, backend_id)
         self.assertEquals(transaction, fin_trans)
 
+    def look_for_update(self, actions, backend_ident, fin_trans):
+        action = actions.pop()
+        self.assertEquals(len(action), 5)
+        cmd, return_val, backend_ident_from, old_fin_trans, new_fin_trans = \
+            action
+        self.assertEquals(cmd, UPDATE)
+        self.assertEquals(return_val, None)
+        self.assertEquals(backend_ident, backend_ident_from)
+        self.assertEquals(new_fin_trans, fin_trans)
+
     def look_for_empty_actions_queue(self):
         actions = self.backend_plugin.pop_actions_queue()
         self.assertEquals(len(actions), 0)        
@@ -283,6 +327,20 @@ class BasicBackendPluginTest(BackendPluginBasicSetup):
             self.backend_plugin.mark_transaction_for_hold,
             None )
 
+    def test_mark_several_dirty(self):
+        transactions = [ TestTransaction() for i in xrange(3) ]
+        self.backend_plugin.mark_transactions_dirty(enumerate(transactions))
+        for trans_id in xrange(3):
+            self.assertTransactionIsDirty(trans_id)
+        self.backend_plugin.flush_backend()
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 4) # 3 creates, save
+        created = set( actions.pop()[1] for i in xrange(3) )
+        self.assertEquals(created, set( (1, 2, 3) ) )
+        self.look_for_save(actions)
+        for trans_id in xrange(3):
+            self.assertTransactionIsClean(trans_id)
+
 class StartWithInsertSetup(BackendPluginBasicSetup):
     def setUp(self):
         BackendPluginBasicSetup.setUp(self)
@@ -436,6 +494,10 @@ class StartWithTwoInsertAndSetup(StartWithInsertSetup):
         self.assertTransactionIsClean(self.front_end_id)
         self.assertTransactionIsClean(self.front_end_id_2)
         self.backend_plugin.pop_actions_queue()
+        # the financial transactions have to actually change, otherwise
+        # there's nothing to re-create
+        self.fin_trans.description = "changed"
+        self.fin_trans2.description = "changed"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.backend_plugin.mark_transaction_dirty(
@@ -460,6 +522,8 @@ class StartWithTwoInsertAndSetup(StartWithInsertSetup):
         self.backend_plugin.program_failure(
             CREATION_RESET, BoKeepBackendResetException,
             "creation lost to reset", check_for_right_financial_trans)
+        self.fin_trans.description = "changed again"
+        self.fin_trans2.description = "changed again"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.backend_plugin.mark_transaction_dirty(
@@ -591,6 +655,7 @@ class StartWithInsertAndFlushTests(StartWithInsertAndFlushSetup):
         self.test_transaction_hold()
 
     def test_transaction_dirty_refresh(self):
+        self.fin_trans.lines[0].line_memo = "changed"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.assertTransactionIsDirty(self.front_end_id)
@@ -605,6 +670,34 @@ class StartWithInsertAndFlushTests(StartWithInsertAndFlushSetup):
         self.look_for_create(actions, self.SECOND_BACKEND_ID, self.fin_trans)
         self.look_for_save(actions)
 
+    def test_transaction_dirty_unchanged(self):
+        # marked dirty, but get_financial_transactions() gives the
+        # same thing as before, so the backend should just see a save
+        for i in xrange(3):
+            self.backend_plugin.mark_transaction_dirty(
+                self.front_end_id, self.transaction)
+            self.assertTransactionIsDirty(self.front_end_id)
+            self.backend_plugin.flush_backend()
+            self.assertTransactionIsClean(self.front_end_id)
+            self.pop_all_look_for_save()
+
+        # and a real change after that is still picked up
+        self.fin_trans.trans_date = "tomorrow"
+        self.test_transaction_dirty_refresh()
+
+    def test_transaction_dirty_equivilent_fin_trans(self):
+        # a new FinancialTransaction with the same content counts as
+        # unchanged too
+        self.transaction.program_return(0, [ FinancialTransaction( (
+                        FinancialTransactionLine(Decimal(1)),
+                        FinancialTransactionLine(Decimal(-1)),
+                        ) ) ] )
+        self.backend_plugin.mark_transaction_dirty(
+            self.front_end_id, self.transaction)
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
+        self.pop_all_look_for_save()
+
     def test_transaction_remove(self):
         self.run_test_of_transaction_remove()
         self.assertTransactionIsCleanFail(self.front_end_id)
@@ -768,6 +861,7 @@ class StartWithInsertAndFlushTests(StartWithInsertAndFlushSetup):
         self.backend_plugin.program_failure(
             CREATION_FAIL, BoKeepBackendException,
             reason_for_backend_fail, test_for_correct_backend_id)
+        self.fin_trans.description = "changed"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.backend_plugin.flush_backend()
@@ -783,6 +877,325 @@ class StartWithInsertAndFlushTests(StartWithInsertAndFlushSetup):
         self.look_for_create(actions, self.SECOND_BACKEND_ID, self.fin_trans)
         self.look_for_save(actions)
 
+class UpdatingBackendStartWithInsertAndFlushTests(
+    StartWithInsertAndFlushSetup):
+    backend_plugin_class = UpdatingBackendPluginUnitTest
+
+    def mark_changed_and_flush(self):
+        self.fin_trans.description = "changed"
+        self.backend_plugin.mark_transaction_dirty(
+            self.front_end_id, self.transaction)
+        self.assertTransactionIsDirty(self.front_end_id)
+        self.backend_plugin.flush_backend()
+
+    def look_for_verify_update_save(self):
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 3) # verify, update, save
+        self.look_for_verify(actions, self.fin_trans)
+        self.look_for_update(actions, self.FIRST_BACKEND_ID, self.fin_trans)
+        self.look_for_save(actions)
+
+    def test_transaction_update(self):
+        self.mark_changed_and_flush()
+        self.assertTransactionIsClean(self.front_end_id)
+        self.look_for_verify_update_save()
+
+        # the update is remembered, marking dirty again without a change
+        # leaves the backend alone
+        self.backend_plugin.mark_transaction_dirty(
+            self.front_end_id, self.transaction)
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
+        self.pop_all_look_for_save()
+
+    def test_number_of_fin_trans_changed(self):
+        second_fin_trans = FinancialTransaction( (
+                FinancialTransactionLine(Decimal(2)),
+                FinancialTransactionLine(Decimal(-2)),
+                ) )
+        self.transaction.get_financial_transactions = \
+            lambda: [self.fin_trans, second_fin_trans]
+        self.backend_plugin.mark_transaction_dirty(
+            self.front_end_id, self.transaction)
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
+
+        actions = self.backend_plugin.pop_actions_queue()
+        # verify, remove, create, create, save
+        self.assertEquals(len(actions), 5)
+        self.look_for_verify(actions, self.fin_trans)
+        self.look_for_remove(actions, self.FIRST_BACKEND_ID)
+        self.look_for_create(actions, self.SECOND_BACKEND_ID, self.fin_trans)
+        self.look_for_create(actions, self.SECOND_BACKEND_ID+1,
+                             second_fin_trans)
+        self.look_for_save(actions)
+
+    def test_update_fail(self):
+        reason_for_backend_fail = "this is just a test, not a real failure " \
+            "on update"
+        def test_for_correct_backend_id(backend_mod_self, backend_id,
+                                        old_fin_trans, new_fin_trans):
+            return backend_id == self.FIRST_BACKEND_ID
+        self.backend_plugin.program_failure(
+            UPDATE_FAIL, BoKeepBackendException,
+            reason_for_backend_fail, test_for_correct_backend_id)
+
+        self.mark_changed_and_flush()
+        self.assertTransactionIsDirty(self.front_end_id)
+        self.assert_(self.backend_plugin.reason_transaction_is_dirty(
+                self.front_end_id).endswith(reason_for_backend_fail) )
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 3) # verify, update, save
+        self.look_for_verify(actions, self.fin_trans)
+        self.assertEquals(actions.pop()[:2], (UPDATE, None) )
+        self.look_for_save(actions)
+
+        # check that it works next time around
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
+        self.look_for_verify_update_save()
+
+    def test_update_lost_by_reset(self):
+        def test_for_correct_backend_id(backend_mod_self, backend_id,
+                                        old_fin_trans, new_fin_trans):
+            return backend_id == self.FIRST_BACKEND_ID
+        self.backend_plugin.program_failure(
+            UPDATE_RESET, BoKeepBackendResetException,
+            "this is just a test, not a real reset on update",
+            test_for_correct_backend_id)
+
+        self.mark_changed_and_flush()
+        self.assertTransactionIsDirty(self.front_end_id)
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 2) # verify, update
+        self.look_for_verify(actions, self.fin_trans)
+        self.assertEquals(actions.pop()[:2], (UPDATE, None) )
+
+        # the lost update is done over again
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
+        self.look_for_verify_update_save()
+
+class BatchedFlushTest(BackendPluginBasicSetup):
+    backend_plugin_class = BatchingBackendPluginUnitTest
+    NUM_TRANSACTIONS = 3
+
+    def setUp(self):
+        BackendPluginBasicSetup.setUp(self)
+        self.transactions = []
+        for i in xrange(self.NUM_TRANSACTIONS):
+            trans = TestTransaction()
+            trans.fin_trans.description = "transaction %s" % i
+            self.transactions.append(trans)
+        self.backend_plugin.mark_transactions_dirty(
+            enumerate(self.transactions) )
+
+    def look_for_batch(self, actions, cmd, batch_size):
+        self.assertEquals(actions.pop(), (cmd, batch_size) )
+
+    def look_for_batched_create(self, actions, transactions, first_id):
+        self.look_for_batch(actions, CREATE_BATCH, len(transactions))
+        for i, trans in enumerate(transactions):
+            self.look_for_create(actions, first_id+i, trans.fin_trans)
+
+    def assertAllClean(self):
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsClean(trans_id)
+
+    def test_batched_create(self):
+        self.backend_plugin.flush_backend()
+        self.assertAllClean()
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS + 2)
+        self.look_for_batched_create(actions, self.transactions, 1)
+        self.look_for_save(actions)
+
+    def test_batched_refresh(self):
+        self.test_batched_create()
+        for trans in self.transactions:
+            trans.fin_trans.description += " changed"
+        self.backend_plugin.mark_transactions_dirty(
+            enumerate(self.transactions) )
+        self.backend_plugin.flush_backend()
+        self.assertAllClean()
+
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS*3 + 4)
+        self.look_for_batch(actions, VERIFY_BATCH, self.NUM_TRANSACTIONS)
+        for i, trans in enumerate(self.transactions):
+            self.look_for_verify(actions, trans.fin_trans,
+                                 backend_ident_from=i+1)
+        self.look_for_batch(actions, REMOVE_BATCH, self.NUM_TRANSACTIONS)
+        for i in xrange(self.NUM_TRANSACTIONS):
+            self.look_for_remove(actions, i+1)
+        self.look_for_batched_create(actions, self.transactions,
+                                     self.NUM_TRANSACTIONS+1)
+        self.look_for_save(actions)
+
+    def test_batched_create_fail(self):
+        failing_trans = self.transactions[1]
+        self.backend_plugin.program_failure(
+            CREATION_FAIL, BoKeepBackendException, "creation fail",
+            lambda backend_mod_self, fin_trans:
+                fin_trans == failing_trans.fin_trans )
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(0)
+        self.assertTransactionIsDirty(1)
+        self.assert_(self.backend_plugin.reason_transaction_is_dirty(1).
+                     endswith("creation fail") )
+        self.assertTransactionIsClean(2)
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS + 2)
+        self.look_for_batch(actions, CREATE_BATCH, self.NUM_TRANSACTIONS)
+        self.look_for_create(actions, 1, self.transactions[0].fin_trans)
+        self.look_for_create(actions, None, failing_trans.fin_trans)
+        self.look_for_create(actions, 2, self.transactions[2].fin_trans)
+        self.look_for_save(actions)
+
+        # only the failed one is tried again
+        self.backend_plugin.flush_backend()
+        self.assertAllClean()
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 3)
+        self.look_for_batched_create(actions, [failing_trans], 3)
+        self.look_for_save(actions)
+
+    def test_batched_create_lost_by_reset(self):
+        self.backend_plugin.program_failure(
+            CREATION_RESET, BoKeepBackendResetException, "creation reset",
+            lambda backend_mod_self, fin_trans:
+                fin_trans == self.transactions[1].fin_trans )
+        self.backend_plugin.flush_backend()
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsDirty(trans_id)
+        actions = self.backend_plugin.pop_actions_queue()
+        # the batch stops at the reset, and there's no save
+        self.assertEquals(len(actions), 3)
+        self.look_for_batch(actions, CREATE_BATCH, self.NUM_TRANSACTIONS)
+        self.look_for_create(actions, 1, self.transactions[0].fin_trans)
+        self.look_for_create(actions, None, self.transactions[1].fin_trans)
+
+        self.backend_plugin.flush_backend()
+        self.assertAllClean()
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS + 2)
+        self.look_for_batched_create(actions, self.transactions, 2)
+        self.look_for_save(actions)
+
+class SeveralTransactionsSetup(BackendPluginBasicSetup):
+    NUM_TRANSACTIONS = 5
+
+    def setUp(self):
+        BackendPluginBasicSetup.setUp(self)
+        self.transactions = []
+        for i in xrange(self.NUM_TRANSACTIONS):
+            trans = TestTransaction()
+            trans.fin_trans.description = "transaction %s" % i
+            self.transactions.append(trans)
+        self.backend_plugin.mark_transactions_dirty(
+            enumerate(self.transactions) )
+
+class IncrementalFlushTest(SeveralTransactionsSetup):
+    def look_for_slice(self, first_trans_id, first_backend_id, slice_size):
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), slice_size + 1)
+        for i in xrange(slice_size):
+            self.look_for_create(
+                actions, first_backend_id + i,
+                self.transactions[first_trans_id + i].fin_trans)
+        self.look_for_save(actions)
+
+    def test_slices_in_order(self):
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2), 3)
+        self.look_for_slice(0, 1, 2)
+        self.assertTransactionIsClean(0)
+        self.assertTransactionIsClean(1)
+        self.assertTransactionIsDirty(2)
+
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2), 1)
+        self.look_for_slice(2, 3, 2)
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2), 0)
+        self.look_for_slice(4, 5, 1)
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsClean(trans_id)
+
+    def test_time_budget_runs_all_slices(self):
+        # with a budget this big, slices keep going until everything is done
+        self.assertEquals(
+            self.backend_plugin.flush_backend(max_items=2, time_budget=3600),
+            0 )
+        actions = self.backend_plugin.pop_actions_queue()
+        # a create for each transaction and a save for each slice
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS + 3)
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsClean(trans_id)
+
+    def test_failed_transaction_not_retried_in_same_pass(self):
+        self.backend_plugin.program_failure(
+            CREATION_FAIL, BoKeepBackendException, "creation fail",
+            lambda backend_mod_self, fin_trans:
+                fin_trans == self.transactions[0].fin_trans )
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2), 3)
+        self.backend_plugin.pop_actions_queue()
+        self.assertTransactionIsDirty(0)
+        # the cursor moves past the failure instead of starting over with it
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2), 1)
+        self.look_for_slice(2, 2, 2)
+
+    def test_cant_write(self):
+        self.backend_plugin.writable = False
+        # not the same as everything having been gotten to
+        self.assertEquals(self.backend_plugin.flush_backend(), None)
+        self.assertEquals(self.backend_plugin.flush_backend(max_items=2),
+                          None)
+        self.assertEquals(self.backend_plugin.pop_actions_queue(), [])
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsDirty(trans_id)
+        self.backend_plugin.writable = True
+        self.assertEquals(self.backend_plugin.flush_backend(), 0)
+
+class ConsistencyCheckTest(SeveralTransactionsSetup):
+    def setUp(self):
+        SeveralTransactionsSetup.setUp(self)
+        self.backend_plugin.flush_backend()
+        self.backend_plugin.pop_actions_queue()
+
+    def test_all_consistent(self):
+        self.assertEquals(self.backend_plugin.check_backend_consistency(), {})
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), self.NUM_TRANSACTIONS)
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.look_for_verify(actions, self.transactions[trans_id].fin_trans,
+                                 True, trans_id+1)
+        # just a check, everything stays clean
+        for trans_id in xrange(self.NUM_TRANSACTIONS):
+            self.assertTransactionIsClean(trans_id)
+
+    def test_mismatches_reported(self):
+        for verify_result in (True, False, True, True, True):
+            self.backend_plugin.program_return(VERIFY, verify_result)
+        self.backend_plugin.program_failure(
+            VERIFY_FAIL, BoKeepBackendException, "verify fail",
+            lambda backend_mod_self, backend_ident, fin_trans:
+                backend_ident == 3 )
+        self.assertEquals(
+            self.backend_plugin.check_backend_consistency(),
+            { 1: [ (2, [BackendTransactionMismatch(
+                            MISSING_TRANSACTION_MISMATCH, 2, None)] ) ],
+              2: [ (3, [BackendTransactionMismatch(
+                            BACKEND_ERROR_MISMATCH, None, "verify fail")] ) ],
+              } )
+
+    def test_only_clean_transactions_checked(self):
+        self.backend_plugin.mark_transaction_for_hold(0)
+        self.backend_plugin.flush_backend()
+        self.backend_plugin.pop_actions_queue()
+        self.assertEquals(
+            self.backend_plugin.check_backend_consistency((0, 1, 99)), {})
+        actions = self.backend_plugin.pop_actions_queue()
+        self.assertEquals(len(actions), 1)
+        self.look_for_verify(actions, self.transactions[1].fin_trans, True, 2)
+
 class StartWithInsertFlushAndHoldSetup(StartWithInsertAndFlushSetup):
     def setUp(self):
         StartWithInsertAndFlushSetup.setUp(self)
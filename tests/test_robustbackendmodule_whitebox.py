@@ -21,6 +21,9 @@ from unittest import TestCase, main
 from decimal import Decimal
 from itertools import chain
 
+from BTrees.IOBTree import IOBTree
+from BTrees.IIBTree import IIBTree, IITreeSet
+
 from bokeep.backend_plugins.plugin import \
     BoKeepBackendException, BoKeepBackendResetException
 from bokeep.backend_plugins.robust_backend_plugin import \
@@ -264,7 +267,8 @@ class BackendPluginWhiteboxInsertTests(
             True)
         self.assertEquals(state_machine.state,
                           BackendDataStateMachine.BACKEND_CREATION_TRIED)
-        dirty_set_copy = self.backend_plugin.dirty_transaction_set.copy()
+        dirty_set_copy = dict(
+            self.backend_plugin.dirty_transaction_set.iteritems())
         self.backend_plugin.save()
         for dirty_trans_id in \
                 self.backend_plugin.dirty_transaction_set.iterkeys():
@@ -302,6 +306,10 @@ class StartWithTwoInsertAndSetup(BackendPluginWhiteboxStartWithInsertSetup):
         self.assertTransactionIsClean(self.front_end_id)
         self.assertTransactionIsClean(self.front_end_id_2)
         self.backend_plugin.pop_actions_queue()
+        # the financial transactions have to actually change, otherwise
+        # there's nothing to re-create
+        self.fin_trans.description = "changed"
+        self.fin_trans2.description = "changed"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.backend_plugin.mark_transaction_dirty(
@@ -338,6 +346,8 @@ class StartWithTwoInsertAndSetup(BackendPluginWhiteboxStartWithInsertSetup):
         self.backend_plugin.program_failure(
             CREATION_RESET, BoKeepBackendResetException,
             "creation lost to reset", check_for_right_financial_trans)
+        self.fin_trans.description = "changed again"
+        self.fin_trans2.description = "changed again"
         self.backend_plugin.mark_transaction_dirty(
             self.front_end_id, self.transaction)
         self.backend_plugin.mark_transaction_dirty(
@@ -486,8 +496,38 @@ class BackendPluginWhiteboxInsertAndFlushTests(
             self.assertEquals(len(actions), 0)
         else:
             self.assert_(False)
-        
-  
+
+class BackendPluginWhiteboxContainerUpgradeTests(
+    BackendPluginWhiteboxStartWithInsertAndFlushSetup):
+    def test_upgrade_of_pre_btree_containers(self):
+        # put things back the way a book from before the switch to BTrees
+        # would have them
+        front_end_to_back = dict(
+            self.backend_plugin._RobustBackendPlugin__front_end_to_back.\
+                iteritems() )
+        self.backend_plugin._RobustBackendPlugin__front_end_to_back = \
+            front_end_to_back
+        self.backend_plugin.dirty_transaction_set = {}
+        self.backend_plugin.held_transaction_set = set()
+
+        self.assertTransactionIsClean(self.front_end_id)
+        self.assert_(isinstance(
+                self.backend_plugin._RobustBackendPlugin__front_end_to_back,
+                IOBTree) )
+        self.assert_(isinstance(
+                self.backend_plugin.dirty_transaction_set, IIBTree) )
+        self.assert_(isinstance(
+                self.backend_plugin.held_transaction_set, IITreeSet) )
+        self.assert_(
+            self.backend_plugin._RobustBackendPlugin__front_end_to_back[
+                self.front_end_id] is front_end_to_back[self.front_end_id] )
+
+        # and everything should still work after
+        self.backend_plugin.mark_transaction_dirty(
+            self.front_end_id, self.transaction)
+        self.assertTransactionIsDirty(self.front_end_id)
+        self.backend_plugin.flush_backend()
+        self.assertTransactionIsClean(self.front_end_id)
 
 if __name__ == "__main__":
     main()
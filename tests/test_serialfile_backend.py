@@ -19,18 +19,33 @@
 
 # python imports
 from unittest import TestCase, main
-from os.path import abspath
+from os.path import abspath, exists
 from os import remove
+from glob import glob
 from decimal import Decimal
 from itertools import izip
 
+# zopedb
+import transaction
+
 # bokeep
 from bokeep.book_transaction import \
     Transaction, FinancialTransaction, FinancialTransactionLine
-from bokeep.backend_plugins.serialfile import SerialFilePlugin
+from bokeep.backend_plugins import serialfile, serialfile_records
+from bokeep.backend_plugins.serialfile import \
+    SerialFilePlugin, last_created_identifier, \
+    FSYNC_EVERY_SAVE, FSYNC_EVERY_N_RECORDS, FSYNC_NEVER, \
+    RECORD_FORMAT_TEXT
+from bokeep.backend_plugins.plugin import BoKeepBackendException
+from bokeep.backend_plugins.serialfile_records import \
+    INDEX_SUFFIX, RECORD_CREATE, RECORD_UPDATE, RECORD_REMOVE, \
+    SerialRecordIndex, decode_record
+from bokeep.shells.compact_backend import compact_book_backend
 
 # bokeep test suite
-from test_bokeep_book import create_tmp_filename
+from test_bokeep_book import \
+    create_tmp_filename, create_tmp_filestorage_filename, \
+    create_filestorage_backed_bookset_from_file, TESTBOOK
 
 class TestTransaction(Transaction):
     def __init__(self, value1, account1, value2, account2):
@@ -43,6 +58,17 @@ class TestTransaction(Transaction):
     def get_financial_transactions(self):
        return [self.fin_trans]
 
+def remove_serial_file(file_name):
+    for remove_file_name in (file_name, file_name + INDEX_SUFFIX):
+        if exists(remove_file_name):
+            remove(remove_file_name)
+
+def serial_file_records(file_name):
+    f = open(file_name)
+    records = [ decode_record(line) for line in f ]
+    f.close()
+    return records
+
 def do_logger_function(original_func):
     def logger_function(self, *args, **kargs):
         self.log.append(None)
@@ -99,10 +125,11 @@ class SerialFileTest(TestCase):
 
     def test_log_has_right_number_of_ops(self):
         log = self.backend_plugin.get_log()
-        self.assertEquals( len(log), 4 )
+        # the file stays open after save
+        self.assertEquals( len(log), 3 )
 
         for i, (prefix, log_entry) in enumerate(izip(
-        ("open_session", "write_to_file", "save", "open_session"),
+        ("open_session", "write_to_file", "save"),
         log )):
             log_entry_start = log_entry[ :len(prefix) ]
             self.assertEquals(log_entry_start, prefix)
@@ -118,10 +145,283 @@ class SerialFileTest(TestCase):
         self.backend_plugin.flush_backend()
         self.do_clean_and_can_write_test()
 
+    def test_written_on_save(self):
+        records = serial_file_records(self.serial_file_name)
+        self.assertEquals(len(records), 1)
+        self.assertEquals(records[0]['op'], RECORD_CREATE)
+        self.assertEquals(records[0]['id'], 0)
+        self.assertEquals( [ line['amount'] for line in records[0]['lines'] ],
+                           ['2', '-2'] )
+
+    def test_unsaved_records_dropped_on_close(self):
+        self.backend_plugin.write_to_file("never saved\n")
+        self.backend_plugin.close()
+        f = open(self.serial_file_name)
+        contents = f.read()
+        f.close()
+        self.assertFalse("never saved" in contents)
+
+    def tearDown(self):
+        self.backend_plugin.close()
+        remove_serial_file(self.serial_file_name)
+
+class SerialFileFsyncTest(SerialFileTest):
+    def setUp(self):
+        self.fsyncs = []
+        self.original_fsync = serialfile.fsync
+        serialfile.fsync = serialfile_records.fsync = self.fsyncs.append
+        SerialFileTest.setUp(self)
+
+    def tearDown(self):
+        serialfile.fsync = serialfile_records.fsync = self.original_fsync
+        SerialFileTest.tearDown(self)
+
+    def add_and_flush(self, front_end_id):
+        self.backend_plugin.mark_transaction_dirty(
+            front_end_id, TestTransaction(Decimal(1), None, Decimal(-1), None))
+        self.backend_plugin.flush_backend()
+
+    def test_fsync_every_save(self):
+        # the save done by setUp
+        # (the serial file and its index)
+        self.assertEquals(len(self.fsyncs), 2)
+        self.add_and_flush(2)
+        self.assertEquals(len(self.fsyncs), 4)
+        # nothing written, nothing to sync
+        self.backend_plugin.flush_backend()
+        self.assertEquals(len(self.fsyncs), 4)
+
+    def test_fsync_every_n_records(self):
+        self.backend_plugin.setattr('fsync_policy', FSYNC_EVERY_N_RECORDS)
+        self.backend_plugin.setattr('fsync_record_interval', 2)
+        del self.fsyncs[:]
+        self.add_and_flush(2)
+        self.assertEquals(len(self.fsyncs), 0)
+        self.add_and_flush(3)
+        self.assertEquals(len(self.fsyncs), 2)
+
+    def test_fsync_never(self):
+        self.backend_plugin.setattr('fsync_policy', FSYNC_NEVER)
+        del self.fsyncs[:]
+        self.add_and_flush(2)
+        self.assertEquals(self.fsyncs, [])
+
+class SerialFileCrashRecoveryTest(TestCase):
+    def setUp(self):
+        self.serial_file_name = create_tmp_filename(
+            'serialfile_test', '.txt' )
+        # a file that got further along than the database did
+        f = open(self.serial_file_name, 'w')
+        f.write("transaction with identifier 6\n\n"
+                "transaction with identifier 7\n\n"
+                "remove transaction with identifier 6\n\n"
+                "transaction with ident")
+        f.close()
+
+    def test_last_created_identifier(self):
+        self.assertEquals(last_created_identifier(self.serial_file_name), 7)
+        self.assertEquals(last_created_identifier(
+                self.serial_file_name + 'not there'), None)
+
+    def test_identifiers_not_reused(self):
+        backend_plugin = SerialFilePlugin()
+        backend_plugin.record_format = RECORD_FORMAT_TEXT
+        backend_plugin.accounting_file = self.serial_file_name
+        backend_plugin.mark_transaction_dirty(
+            1, TestTransaction(Decimal(1), None, Decimal(-1), None))
+        backend_plugin.flush_backend()
+        self.assert_(backend_plugin.transaction_is_clean(1))
+        self.assertEquals(backend_plugin.count, 9)
+        backend_plugin.close()
+        self.assertEquals(last_created_identifier(self.serial_file_name), 8)
+
+    def tearDown(self):
+        remove_serial_file(self.serial_file_name)
+
+class SerialFileRecordIndexTest(TestCase):
+    def setUp(self):
+        self.serial_file_name = create_tmp_filename(
+            'serialfile_test', '.txt' )
+        self.backend_plugin = SerialFilePlugin()
+        self.backend_plugin.accounting_file = self.serial_file_name
+        self.transactions = dict(
+            (front_end_id,
+             TestTransaction(Decimal(front_end_id), ('Assets', 'Bank'),
+                             Decimal(-front_end_id), ('Income',) ) )
+            for front_end_id in xrange(1, 4) )
+        for front_end_id, trans in self.transactions.iteritems():
+            self.backend_plugin.mark_transaction_dirty(front_end_id, trans)
+        self.backend_plugin.flush_backend()
+
+    def reopen(self):
+        self.backend_plugin.close()
+        self.backend_plugin.flush_backend()
+
+    def verify(self, front_end_id):
+        self.backend_plugin.mark_transaction_for_verification(front_end_id)
+        self.backend_plugin.flush_backend()
+        return self.backend_plugin.transaction_is_clean(front_end_id)
+
+    def test_index_has_every_record(self):
+        index = SerialRecordIndex(self.serial_file_name)
+        self.assertEquals(sorted(index.entries.keys()), [0, 1, 2])
+        records = serial_file_records(self.serial_file_name)
+        self.assertEquals(
+            [ index.live_offset(record['id']) for record in records ],
+            [ 0, len(open(self.serial_file_name).readline()),
+              index.entries[2][1] ] )
+
+    def test_verify(self):
+        for front_end_id in self.transactions:
+            self.assert_(self.verify(front_end_id))
+        self.reopen()
+        self.assert_(self.verify(1))
+
+    def test_verify_mismatch(self):
+        self.transactions[2].fin_trans.lines[0].amount = Decimal(20)
+        self.assertFalse(self.verify(2))
+        # a verify failure puts a hold on the transaction until it's
+        # gotten rid of and written again
+        self.backend_plugin.mark_transaction_for_forced_remove(2)
+        self.backend_plugin.flush_backend()
+        self.backend_plugin.mark_transaction_dirty(2, self.transactions[2])
+        self.backend_plugin.flush_backend()
+        self.assert_(self.verify(2))
+        self.assertEquals(
+            [ (record['op'], record['id'])
+              for record in serial_file_records(self.serial_file_name)[3:] ],
+            [ (RECORD_REMOVE, 1), (RECORD_CREATE, 3) ] )
+
+    def test_remove_is_tombstone(self):
+        # transactions are flushed in trans_id order
+        backend_ident = 0
+        self.backend_plugin.mark_transaction_for_removal(1)
+        self.backend_plugin.flush_backend()
+        last_record = serial_file_records(self.serial_file_name)[-1]
+        self.assertEquals( (last_record['op'], last_record['id']),
+                           (RECORD_REMOVE, backend_ident) )
+        self.reopen()
+        self.assert_(self.backend_plugin._v_record_index.is_removed(
+                backend_ident))
+        self.assertFalse(self.backend_plugin.verify_backend_transaction(
+                backend_ident, self.transactions[1].fin_trans) )
+
+    def test_compact(self):
+        self.transactions[2].fin_trans = TestTransaction(
+            Decimal(20), ('Assets', 'Bank'), Decimal(-20), ('Income',)
+            ).fin_trans
+        self.backend_plugin.mark_transaction_dirty(2, self.transactions[2])
+        self.backend_plugin.mark_transaction_for_removal(3)
+        self.backend_plugin.flush_backend()
+        self.assertEquals(len(serial_file_records(self.serial_file_name)), 5)
+
+        self.assertEquals(self.backend_plugin.compact(), 3)
+        records = serial_file_records(self.serial_file_name)
+        self.assertEquals( [ (record['op'], record['id'])
+                             for record in records ],
+                           [ (RECORD_CREATE, 0), (RECORD_CREATE, 1) ] )
+        self.assertEquals(records[1]['lines'][0]['amount'], '20')
+        self.assert_(self.verify(1))
+        self.assert_(self.verify(2))
+        # identifiers aren't re-used after compacting
+        self.backend_plugin.mark_transaction_dirty(
+            4, TestTransaction(Decimal(4), None, Decimal(-4), None) )
+        self.backend_plugin.flush_backend()
+        self.assertEquals(
+            serial_file_records(self.serial_file_name)[-1]['id'], 3)
+
+    def test_compact_refused_with_unsaved_records(self):
+        self.backend_plugin.write_to_file("never saved\n")
+        self.assertRaises(BoKeepBackendException, self.backend_plugin.compact)
+
+    def test_index_catches_up(self):
+        self.backend_plugin.close()
+        # lose the last index entry, like a crash between writing the
+        # serial file and the index would
+        index_file_name = self.serial_file_name + INDEX_SUFFIX
+        index_lines = open(index_file_name).readlines()
+        f = open(index_file_name, 'w')
+        f.write(''.join(index_lines[:-1]))
+        f.close()
+        self.assertEquals(
+            sorted(SerialRecordIndex(self.serial_file_name).entries.keys()),
+            [0, 1, 2])
+        self.assertEquals(len(open(index_file_name).readlines()), 3)
+        # and a missing one is rebuilt
+        remove(index_file_name)
+        self.backend_plugin.flush_backend()
+        self.assert_(self.verify(3))
+
+    def test_partial_record_after_crash(self):
+        self.backend_plugin.close()
+        f = open(self.serial_file_name, 'a')
+        f.write('{"id": 3, "op": "cre')
+        f.close()
+        self.backend_plugin.mark_transaction_dirty(
+            4, TestTransaction(Decimal(4), None, Decimal(-4), None) )
+        self.backend_plugin.flush_backend()
+        self.assert_(self.verify(4))
+        self.assert_(self.verify(1))
+
     def tearDown(self):
         self.backend_plugin.close()
-        remove(self.serial_file_name)
-            
+        remove_serial_file(self.serial_file_name)
+
+class SerialFileCompactBookTest(TestCase):
+    """compact_book_backend, what bo-keep -s bokeep.shells.compact_backend
+    runs
+    """
+    def setUp(self):
+        self.filestorage_file = create_tmp_filestorage_filename()
+        self.books = create_filestorage_backed_bookset_from_file(
+            self.filestorage_file)
+        self.book = self.books.add_book(TESTBOOK)
+        self.book.set_backend_plugin('bokeep.backend_plugins.serialfile')
+        self.serial_file_name = create_tmp_filename(
+            'serialfile_test', '.txt' )
+        self.backend_plugin = self.book.get_backend_plugin()
+        self.backend_plugin.accounting_file = self.serial_file_name
+        self.trans_ids = [
+            self.book.insert_transaction(
+                TestTransaction(Decimal(i), ('Assets', 'Bank'),
+                                Decimal(-i), ('Income',) ) )
+            for i in xrange(1, 4) ]
+        for trans_id in self.trans_ids:
+            self.backend_plugin.mark_transaction_dirty(
+                trans_id, self.book.get_transaction(trans_id) )
+        self.backend_plugin.flush_backend()
+        transaction.get().commit()
+
+    def test_compact_book_backend(self):
+        # one removed and one changed but not flushed yet, which gets
+        # written out first
+        self.backend_plugin.mark_transaction_for_removal(self.trans_ids[0])
+        self.backend_plugin.flush_backend()
+        trans = self.book.get_transaction(self.trans_ids[1])
+        trans.fin_trans = TestTransaction(
+            Decimal(20), ('Assets', 'Bank'), Decimal(-20), ('Income',)
+            ).fin_trans
+        self.backend_plugin.mark_transaction_dirty(self.trans_ids[1], trans)
+        self.assertEquals(compact_book_backend(self.book), 3)
+        records = serial_file_records(self.serial_file_name)
+        self.assertEquals( [ (record['op'], record['id'])
+                             for record in records ],
+                           [ (RECORD_CREATE, 1), (RECORD_CREATE, 2) ] )
+        self.assertEquals(records[0]['lines'][0]['amount'], '20')
+        for trans_id in self.trans_ids[1:]:
+            self.assert_(self.backend_plugin.transaction_is_clean(trans_id))
+
+    def test_not_compactable(self):
+        self.book.set_backend_plugin('bokeep.backend_plugins.null')
+        self.assertRaises(BoKeepBackendException,
+                          compact_book_backend, self.book)
+
+    def tearDown(self):
+        self.books.close()
+        for file_name in glob(self.filestorage_file + '*'):
+            remove(file_name)
+        remove_serial_file(self.serial_file_name)
+
 if __name__ == "__main__":
     main()
 
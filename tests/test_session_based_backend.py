@@ -0,0 +1,195 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import TestCase, main
+from decimal import Decimal
+
+# zopedb imports
+from ZODB import DB
+from ZODB.MappingStorage import MappingStorage
+import transaction
+
+# bokeep imports
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins.session_based_robust_backend_plugin import \
+    SessionBasedRobustBackendPlugin
+
+class BalancedTransaction(Transaction):
+    def __init__(self, amount):
+        Transaction.__init__(self, None)
+        self.amount = amount
+
+    def get_financial_transactions(self):
+        return [ FinancialTransaction( (
+                    FinancialTransactionLine(self.amount),
+                    FinancialTransactionLine(-self.amount),
+                    ) ) ]
+
+# sessions SessionCountingPlugin instances have ended, kept out of them so
+# it's still there after they've become ghosts
+ended_sessions = []
+
+class SessionCountingPlugin(SessionBasedRobustBackendPlugin):
+    def __init__(self):
+        SessionBasedRobustBackendPlugin.__init__(self)
+        self.opens = 0
+        self.saves = 0
+        self.created = 0
+        self.signature = 1
+        self.available = True
+
+    def open_session(self):
+        if not self.available:
+            return None
+        self.opens += 1
+        return self.opens
+
+    def end_session(self, session):
+        ended_sessions.append(session)
+
+    def create_backend_transaction(self, fin_trans):
+        self.created += 1
+        return self.created
+
+    def remove_backend_transaction(self, backend_ident):
+        pass
+
+    def save(self):
+        self.saves += 1
+
+    def session_resource_signature(self):
+        return self.signature
+
+class SessionRetentionTest(TestCase):
+    def setUp(self):
+        self.backend_plugin = SessionCountingPlugin()
+        self.next_trans_id = 1
+
+    def mark_and_flush(self):
+        trans_id = self.next_trans_id
+        self.next_trans_id += 1
+        self.backend_plugin.mark_transaction_dirty(
+            trans_id, BalancedTransaction(Decimal(trans_id)) )
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.transaction_is_clean(trans_id))
+
+    def test_session_kept_across_flushes(self):
+        for i in xrange(3):
+            self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 1)
+        self.assertEquals(self.backend_plugin.saves, 3)
+
+    def test_no_idle_timeout(self):
+        self.mark_and_flush()
+        self.assertFalse(self.backend_plugin.release_backend_if_idle())
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 1)
+
+    def test_released_when_idle(self):
+        self.backend_plugin.session_idle_timeout = 0
+        self.mark_and_flush()
+        self.assert_(self.backend_plugin.release_backend_if_idle())
+        # nothing left to let go of
+        self.assertFalse(self.backend_plugin.release_backend_if_idle())
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 2)
+
+    def test_reopened_after_max_hold_time(self):
+        self.backend_plugin.session_max_hold_time = 0
+        self.mark_and_flush()
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 2)
+
+    def test_reopened_after_outside_change(self):
+        self.mark_and_flush()
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 1)
+        self.backend_plugin.signature += 1
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 2)
+
+    def test_close_releases_session(self):
+        del ended_sessions[:]
+        self.mark_and_flush()
+        self.backend_plugin.close()
+        self.assertEquals(ended_sessions, [1])
+        self.mark_and_flush()
+        self.assertEquals(self.backend_plugin.opens, 2)
+
+    def test_unavailable(self):
+        self.backend_plugin.available = False
+        self.backend_plugin.mark_transaction_dirty(
+            1, BalancedTransaction(Decimal(1)) )
+        # not the same as having nothing left to do
+        self.assertEquals(self.backend_plugin.flush_backend(), None)
+        self.assertFalse(self.backend_plugin.transaction_is_clean(1))
+        self.backend_plugin.available = True
+        self.assertEquals(self.backend_plugin.flush_backend(), 0)
+        self.assert_(self.backend_plugin.transaction_is_clean(1))
+
+class SessionEndedWithGhostTest(TestCase):
+    def setUp(self):
+        del ended_sessions[:]
+        self.db = DB(MappingStorage())
+        self.dbcon = self.db.open()
+        self.dbcon.root()['backend_plugin'] = SessionCountingPlugin()
+        transaction.get().commit()
+        self.backend_plugin = self.dbcon.root()['backend_plugin']
+        self.backend_plugin.mark_transaction_dirty(
+            1, BalancedTransaction(Decimal(1)) )
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.can_write())
+
+    def tearDown(self):
+        transaction.get().abort()
+        self.dbcon.close()
+        self.db.close()
+
+    def test_ghosted(self):
+        # what the zopedb cache does to objects it hasn't needed lately
+        self.backend_plugin._p_deactivate()
+        self.assertEquals(ended_sessions, [1])
+        self.assertFalse(self.backend_plugin.can_write())
+
+    def test_changed_not_ghosted(self):
+        self.backend_plugin.session_idle_timeout = 60
+        self.backend_plugin._p_deactivate()
+        self.assertEquals(ended_sessions, [])
+        self.assert_(self.backend_plugin.can_write())
+
+    def test_changed_by_other_connection(self):
+        other_transaction_manager = transaction.TransactionManager()
+        other_dbcon = self.db.open(other_transaction_manager)
+        other_dbcon.root()['backend_plugin'].session_idle_timeout = 60
+        other_transaction_manager.commit()
+        other_dbcon.close()
+        self.assertEquals(ended_sessions, [])
+        # pick up the change, our copy is invalidated
+        self.dbcon.sync()
+        self.assertEquals(ended_sessions, [1])
+        self.assertEquals(self.backend_plugin.session_idle_timeout, 60)
+        self.backend_plugin.mark_transaction_dirty(
+            2, BalancedTransaction(Decimal(2)) )
+        self.backend_plugin.flush_backend()
+        self.assertEquals(self.backend_plugin.opens, 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Copyright (C) 2011  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python imports
+from unittest import TestCase, main
+from decimal import Decimal
+from datetime import date
+from glob import glob
+from os import remove
+from sqlite3 import connect
+
+# bokeep
+from bokeep.book_transaction import \
+    Transaction, FinancialTransaction, FinancialTransactionLine
+from bokeep.backend_plugins.robust_backend_plugin import \
+    MISSING_TRANSACTION_MISMATCH
+from bokeep.backend_plugins.sqlite_backend import SQLitePlugin
+
+# bokeep test suite
+from test_bokeep_book import create_tmp_filename
+
+class TestTransaction(Transaction):
+    def __init__(self, amount, debit_account, credit_account):
+        Transaction.__init__(self, None)
+        debit = FinancialTransactionLine(amount)
+        debit.line_memo = u"d\xe9bit"
+        debit.account_spec = debit_account
+        credit = FinancialTransactionLine(-amount)
+        credit.account_spec = credit_account
+        self.fin_trans = FinancialTransaction( (debit, credit) )
+        self.fin_trans.description = "test transaction %s" % amount
+        self.fin_trans.trans_date = date(2011, 1, 1)
+        self.fin_trans.currency = 'CAD'
+
+    def get_financial_transactions(self):
+        return [self.fin_trans]
+
+class SQLiteBackendTest(TestCase):
+    def setUp(self):
+        self.sqlite_file_name = create_tmp_filename(
+            'sqlite_backend_test', '.sqlite' )
+        self.backend_plugin = SQLitePlugin()
+        self.backend_plugin.sqlite_file = self.sqlite_file_name
+        self.transactions = dict(
+            (front_end_id,
+             TestTransaction(Decimal(front_end_id),
+                             ('Expenses', 'Supplies'), ('Assets', 'Bank') ) )
+            for front_end_id in xrange(1, 4) )
+        for front_end_id, trans in self.transactions.iteritems():
+            self.backend_plugin.mark_transaction_dirty(front_end_id, trans)
+        self.backend_plugin.flush_backend()
+
+    def query(self, sql, *args):
+        con = connect(self.sqlite_file_name)
+        try:
+            return con.execute(sql, args).fetchall()
+        finally:
+            con.close()
+
+    def verify(self, front_end_id):
+        self.backend_plugin.mark_transaction_for_verification(front_end_id)
+        self.backend_plugin.flush_backend()
+        return self.backend_plugin.transaction_is_clean(front_end_id)
+
+    def test_written(self):
+        for front_end_id in self.transactions:
+            self.assert_(
+                self.backend_plugin.transaction_is_clean(front_end_id))
+        self.assertEquals(
+            self.query("SELECT id, trans_date, description, currency "
+                       "FROM bokeep_transactions ORDER BY id"),
+            [ (i, u'2011-01-01', u'test transaction %s' % i, u'CAD')
+              for i in xrange(1, 4) ] )
+        self.assertEquals(
+            self.query("SELECT amount, memo, account "
+                       "FROM bokeep_transaction_lines WHERE trans_id = 2 "
+                       "ORDER BY line_num"),
+            [ (u'2', u"d\xe9bit", u'Expenses:Supplies'),
+              (u'-2', u'', u'Assets:Bank') ] )
+
+    def test_wal_mode(self):
+        self.assertEquals(self.query("PRAGMA journal_mode"), [(u'wal',)] )
+
+    def test_verify(self):
+        for front_end_id in self.transactions:
+            self.assert_(self.verify(front_end_id))
+        self.backend_plugin.close()
+        self.assert_(self.verify(1))
+
+    def test_verify_finds_outside_change(self):
+        con = connect(self.sqlite_file_name)
+        con.execute("UPDATE bokeep_transaction_lines SET amount = '20' "
+                    "WHERE trans_id = 2 AND line_num = 0")
+        con.commit()
+        con.close()
+        self.assertEquals(
+            [ mismatch.attribute
+              for backend_ident, mismatches in
+              self.backend_plugin.check_backend_consistency()[2]
+              for mismatch in mismatches ],
+            ['lines'] )
+        self.assertFalse(self.verify(2))
+        self.assert_(self.verify(1))
+
+    def test_remove(self):
+        self.backend_plugin.mark_transaction_for_removal(3)
+        self.backend_plugin.flush_backend()
+        self.assertEquals(
+            self.query("SELECT id FROM bokeep_transactions ORDER BY id"),
+            [(1,), (2,)] )
+        self.assertEquals(
+            self.query("SELECT COUNT(*) FROM bokeep_transaction_lines "
+                       "WHERE trans_id = 3"), [(0,)] )
+        self.assertEquals(
+            self.backend_plugin.find_backend_transaction_mismatches(
+                3, self.transactions[3].fin_trans)[0].attribute,
+            MISSING_TRANSACTION_MISMATCH)
+        # identifiers aren't re-used, even when the last one is removed
+        self.backend_plugin.mark_transaction_dirty(
+            4, TestTransaction(Decimal(4), ('Income',), ('Assets', 'Bank')) )
+        self.backend_plugin.flush_backend()
+        self.assertEquals(
+            self.query("SELECT MAX(id) FROM bokeep_transactions"), [(4,)] )
+
+    def test_unsaved_work_rolled_back_on_close(self):
+        self.backend_plugin.create_backend_transactions(
+            [ self.transactions[1].fin_trans ] )
+        self.backend_plugin.close()
+        self.assertEquals(
+            self.query("SELECT COUNT(*) FROM bokeep_transactions"), [(3,)] )
+
+    def test_many_in_one_flush(self):
+        for front_end_id in xrange(4, 1004):
+            self.backend_plugin.mark_transaction_dirty(
+                front_end_id,
+                TestTransaction(Decimal(front_end_id),
+                                ('Expenses', 'Supplies'), ('Assets', 'Bank') ))
+        self.backend_plugin.flush_backend()
+        self.assert_(self.backend_plugin.transaction_is_clean(1003))
+        self.assertEquals(
+            self.query("SELECT COUNT(*) FROM bokeep_transaction_lines"),
+            [(2006,)] )
+        self.assertEquals(
+            self.backend_plugin.check_backend_consistency(), {} )
+
+    def tearDown(self):
+        self.backend_plugin.close()
+        for file_name in glob(self.sqlite_file_name + '*'):
+            remove(file_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Copyright (C) 2010  ParIT Worker Co-operative, Ltd <paritinfo@parit.ca>
+#
+# This file is part of Bo-Keep.
+#
+# Bo-Keep is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Mark Jenkins <mark@parit.ca>
+
+# python
+from unittest import main
+
+# zopedb
+import transaction
+from persistent.mapping import PersistentMapping
+
+# bokeep
+from bokeep.util import \
+    ends_with_commit, UnitOfWork, runs_as_unit_of_work, in_unit_of_work
+
+from test_bokeep_book import BoKeepBasicTestSetup
+
+TEST_SUB_DB = 'unit_of_work_test'
+
+class UnitOfWorkTest(BoKeepBasicTestSetup):
+    def setUp(self):
+        BoKeepBasicTestSetup.setUp(self)
+        self.books.get_dbhandle().set_sub_database(
+            TEST_SUB_DB, PersistentMapping() )
+        transaction.get().commit()
+        self.mapping = self.books.get_dbhandle().get_sub_database(TEST_SUB_DB)
+
+    def tearDown(self):
+        transaction.get().abort()
+        BoKeepBasicTestSetup.tearDown(self)
+
+    # a commit ends the current transaction and starts a new one, so
+    # that's how we tell if one happened
+    def assertCommited(self, txn):
+        self.assertFalse(txn is transaction.get())
+
+    def assertNotCommited(self, txn):
+        self.assert_(txn is transaction.get())
+
+    @ends_with_commit
+    def set_value(self, key, value):
+        self.mapping[key] = value
+
+    def fail_after_setting(self, key, value):
+        self.mapping[key] = value
+        raise ValueError()
+
+    def test_ends_with_commit_outside(self):
+        txn = transaction.get()
+        self.set_value('a', 1)
+        self.assertCommited(txn)
+
+    def test_commit_deferred_to_outermost(self):
+        txn = transaction.get()
+        with UnitOfWork():
+            self.set_value('a', 1)
+            with UnitOfWork():
+                self.set_value('b', 2)
+                self.assert_(in_unit_of_work())
+            self.set_value('c', 3)
+            self.assertNotCommited(txn)
+        self.assertCommited(txn)
+        self.assertFalse(in_unit_of_work())
+        self.assertEquals(sorted(self.mapping.items()),
+                          [('a', 1), ('b', 2), ('c', 3)] )
+
+    def test_inner_failure_rolled_back(self):
+        txn = transaction.get()
+        with UnitOfWork():
+            self.set_value('a', 1)
+            try:
+                with UnitOfWork():
+                    self.set_value('b', 2)
+                    self.fail_after_setting('c', 3)
+            except ValueError:
+                pass
+        self.assertCommited(txn)
+        self.assertEquals(self.mapping.items(), [('a', 1)] )
+
+    def test_outer_failure_commits_nothing(self):
+        self.mapping['before'] = 0
+        txn = transaction.get()
+        try:
+            with UnitOfWork():
+                self.set_value('a', 1)
+                self.fail_after_setting('b', 2)
+        except ValueError:
+            pass
+        self.assertNotCommited(txn)
+        self.assertFalse(in_unit_of_work())
+        # changes from before the unit of work are left alone
+        self.assertEquals(self.mapping.items(), [('before', 0)] )
+
+    def test_decorator(self):
+        txn = transaction.get()
+        @runs_as_unit_of_work
+        def set_two():
+            self.set_value('a', 1)
+            self.assertNotCommited(txn)
+            self.set_value('b', 2)
+            return 'done'
+        self.assertEquals(set_two(), 'done')
+        self.assertCommited(txn)
+        self.assertEquals(len(self.mapping), 2)
+
+if __name__ == "__main__":
+    main()